@@ -3,7 +3,7 @@
 # Exit immediately if a command exits with a non-zero status
 set -e
 
-# Directory containing the HTML file, provided as the first argument
+# Directory containing the HTML files, provided as the first argument
 DIR="$1"
 
 # Ensure the directory exists
@@ -12,26 +12,28 @@ if [ -z "$DIR" ] || [ ! -d "$DIR" ]; then
   exit 1
 fi
 
-# Find the first HTML file in the directory
-HTML_FILE=$(find "$DIR" -name '*.html' | head -n 1)
+SRC_DIR="$(cd "$(dirname "$0")/../src" && pwd)"
 
-# Check if the HTML file was found
-if [ -z "$HTML_FILE" ]; then
+# Use the virtual environment the workflow installed the dependencies into, if any
+PYTHON="python3"
+if [ -x "$SRC_DIR/venv/bin/python" ]; then
+  PYTHON="$SRC_DIR/venv/bin/python"
+fi
+
+# Check that there is something to convert
+if [ -z "$(find "$DIR" -name '*.html' | head -n 1)" ]; then
   echo "HTML file not found in directory: $DIR"
   exit 1
 fi
 
-echo "Found HTML file: $HTML_FILE"
-
-# Define the output PDF file path by replacing .html with .pdf
-PDF_FILE="${HTML_FILE%.html}.pdf"
-echo "Output PDF file will be: $PDF_FILE"
+echo "HTML files to convert:"
+find "$DIR" -name '*.html'
 
-# Run the wkhtmltopdf command to convert the HTML file to PDF
-echo "Running wkhtmltopdf to convert HTML to PDF..."
-# The --enable-local-file-access flag is crucial for allowing wkhtmltopdf
-# to load local CSS and image files referenced in the HTML.
-if wkhtmltopdf --enable-local-file-access "$HTML_FILE" "$PDF_FILE"; then
+# Convert every page in the directory; each PDF is written next to its HTML file.
+# Given a directory, the converter runs the pages concurrently within the
+# memory available (see pdf_batch.py).
+echo "Running step_2_convert_html_to_pdf.py to convert HTML to PDF..."
+if "$PYTHON" "$SRC_DIR/step_2_convert_html_to_pdf.py" "$DIR"; then
   echo "HTML to PDF conversion completed successfully"
 else
   echo "HTML to PDF conversion failed"
@@ -0,0 +1,218 @@
+"""
+Persistent, content-addressed cache for remote assets (images and stylesheets).
+
+Every stage directory (cs01, cs02, os, csd01, ...) references the same OASIS logo
+and stylesheets. :class:`AssetCache` keeps one copy of each download under a
+shared cache directory so that new stage directories are filled from disk:
+
+- blobs are stored by the SHA-256 of their content (``objects/ab/abcdef...``),
+  so identical files downloaded from different URLs are stored once;
+- one small JSON entry per URL (``entries/<sha256(url)>.json``) records the
+  blob digest together with the ``ETag`` and ``Last-Modified`` response headers;
+- cached URLs are revalidated with ``If-None-Match`` / ``If-Modified-Since`` so
+  a stale copy is refreshed while an unchanged one costs a ``304`` round trip;
+- once the blobs exceed ``max_bytes`` the least recently used ones are evicted;
+- in offline mode no request is made and only cached content is served.
+
+Entries are written atomically and independently, so several converters (threads
+or processes) can share one cache directory.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from typing import Dict, Optional
+
+import requests
+from requests.exceptions import RequestException
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 100 * 1024 * 1024
+
+
+def default_cache_dir(git_repo_basedir: Optional[str] = None) -> str:
+    """Return ``$ASSET_CACHE_DIR``, else ``<repo>/.asset-cache``, else a per-user cache dir."""
+    env = os.getenv("ASSET_CACHE_DIR")
+    if env:
+        return env
+    if git_repo_basedir:
+        return os.path.join(git_repo_basedir, ".asset-cache")
+    return os.path.join(os.path.expanduser("~"), ".cache", "oasis-asset-cache")
+
+
+def _atomic_write(path: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+class AssetCache:
+    """URL- and content-keyed download cache with conditional revalidation and LRU eviction."""
+
+    def __init__(self, root: str, max_bytes: int = DEFAULT_MAX_BYTES, offline: bool = False) -> None:
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.objects_dir = os.path.join(self.root, "objects")
+        self.entries_dir = os.path.join(self.root, "entries")
+        self._lock = threading.Lock()
+        self.stats: Dict[str, int] = {"fetched": 0, "revalidated": 0, "offline": 0, "stale": 0, "failed": 0}
+
+    # -------------------- entries and blobs --------------------
+
+    def _entry_path(self, url: str) -> str:
+        return os.path.join(self.entries_dir, hashlib.sha256(url.encode("utf-8")).hexdigest() + ".json")
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.objects_dir, digest[:2], digest)
+
+    def _load_entry(self, url: str) -> Optional[dict]:
+        try:
+            with open(self._entry_path(url), "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get("url") != url:
+            return None
+        blob = self._blob_path(entry.get("sha256", ""))
+        try:
+            with open(blob, "rb") as f:
+                digest = hashlib.sha256(f.read()).hexdigest()
+        except OSError:
+            return None
+        if digest != entry["sha256"]:
+            # Materialized files are hardlinks, so an in-place edit of one of them
+            # reaches the blob; drop it so that the asset is downloaded again.
+            logger.warning("Asset cache: blob for %s was modified; discarding it", url)
+            os.remove(blob)
+            return None
+        return entry
+
+    def _save_entry(self, entry: dict) -> None:
+        _atomic_write(self._entry_path(entry["url"]), json.dumps(entry, sort_keys=True).encode("utf-8"))
+
+    def _touch(self, entry: dict) -> None:
+        entry["last_used"] = time.time()
+        self._save_entry(entry)
+
+    def _bump(self, key: str) -> None:
+        with self._lock:
+            self.stats[key] += 1
+
+    # -------------------- public API --------------------
+
+    def get(self, url: str, session: requests.Session, timeout: float = 10) -> Optional[str]:
+        """
+        Return the path of the cached blob for ``url``, downloading or revalidating it.
+
+        Returns None when the asset is neither cached nor downloadable. A cached copy
+        is served (and logged as stale) when revalidation fails with a network error.
+        """
+        entry = self._load_entry(url)
+        if self.offline:
+            self._bump("offline")
+            if entry is None:
+                logger.warning("Offline: %s is not in the asset cache", url)
+                return None
+            self._touch(entry)
+            return self._blob_path(entry["sha256"])
+
+        headers = {}
+        if entry is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        try:
+            r = session.get(url, headers=headers, timeout=timeout)
+            if r.status_code == 304 and entry is not None:
+                logger.debug("Asset cache: %s not modified", url)
+                self._bump("revalidated")
+                self._touch(entry)
+                return self._blob_path(entry["sha256"])
+            r.raise_for_status()
+        except RequestException:
+            if entry is not None:
+                logger.warning("Could not revalidate %s; using cached copy", url, exc_info=True)
+                self._bump("stale")
+                return self._blob_path(entry["sha256"])
+            self._bump("failed")
+            raise
+
+        data = r.content
+        digest = hashlib.sha256(data).hexdigest()
+        blob = self._blob_path(digest)
+        if not os.path.exists(blob):
+            _atomic_write(blob, data)
+        self._save_entry({
+            "url": url,
+            "sha256": digest,
+            "size": len(data),
+            "etag": r.headers.get("ETag"),
+            "last_modified": r.headers.get("Last-Modified"),
+            "last_used": time.time(),
+        })
+        self._bump("fetched")
+        return blob
+
+    @staticmethod
+    def materialize(blob: str, dest: str) -> None:
+        """Place the blob at ``dest``, hardlinked when possible and copied otherwise."""
+        if os.path.exists(dest):
+            if os.path.samefile(blob, dest):
+                return
+            os.remove(dest)
+        os.makedirs(os.path.dirname(dest) or ".", exist_ok=True)
+        try:
+            os.link(blob, dest)
+        except OSError:
+            shutil.copyfile(blob, dest)
+
+    def evict(self) -> int:
+        """Drop least recently used blobs until the cache fits ``max_bytes``. Returns bytes freed."""
+        if not os.path.isdir(self.entries_dir):
+            return 0
+        with self._lock:
+            by_blob: Dict[str, dict] = {}
+            for name in os.listdir(self.entries_dir):
+                path = os.path.join(self.entries_dir, name)
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        entry = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                info = by_blob.setdefault(entry.get("sha256", ""), {"size": 0, "last_used": 0.0, "entries": []})
+                info["size"] = entry.get("size", 0)
+                info["last_used"] = max(info["last_used"], entry.get("last_used", 0.0))
+                info["entries"].append(path)
+            total = sum(info["size"] for info in by_blob.values())
+            freed = 0
+            for digest, info in sorted(by_blob.items(), key=lambda item: item[1]["last_used"]):
+                if total <= self.max_bytes:
+                    break
+                for path in info["entries"]:
+                    if os.path.exists(path):
+                        os.remove(path)
+                blob = self._blob_path(digest)
+                if digest and os.path.exists(blob):
+                    os.remove(blob)
+                total -= info["size"]
+                freed += info["size"]
+            if freed:
+                logger.info("Asset cache: evicted %s bytes (limit %s)", freed, self.max_bytes)
+            return freed
@@ -0,0 +1,292 @@
+"""
+Build every specification stage of the repository in one run.
+
+The single-stage workflow converts one ``sync_path`` per dispatch. This entry
+point discovers the stage directories (every directory holding a specification
+Markdown file, e.g. ``csaf/v2.0/cs01`` or ``csaf/v2.1/csd01``) and runs the
+Prettier -> pandoc -> post-process -> PDF chain for each of them in a process
+pool. The pool is sized to the CPU count and to the memory available for the
+jobs, since wkhtmltopdf and large BeautifulSoup trees dominate the footprint.
+
+All stages share the asset cache and the build manifests, so stages whose
+inputs did not change are reported as up to date without running pandoc. With
+``--canonical-html`` the pages are byte-stable (see html_canonical), and a
+PDF is only rendered again when :func:`build_manifest.pdf_node`, the PDF
+step of :mod:`build_graph`, finds it stale: the content digest of its page,
+the page's stylesheets, the PDF options or the converter sources changed.
+The run ends with a per-document status and timing table and exits non-zero
+when any stage failed.
+"""
+
+from __future__ import annotations
+
+import argparse
+import fnmatch
+import logging
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Optional
+
+import pdf_backends
+from asset_cache import AssetCache, default_cache_dir
+from build_manifest import build_node, pdf_node
+from build_trace import NULL_TRACER, Tracer, add_trace_arguments, tracer_from_args
+from step_1_markdown_to_html_converter_V3_0 import MarkdownToHtmlConverter, sanitize_file_path
+
+logger = logging.getLogger(__name__)
+
+# Markdown files that live next to a specification but are not one.
+DEFAULT_EXCLUDES = ("README.md", "*-comment-resolution-log.md")
+
+# Rough peak memory of one stage job (pandoc, BeautifulSoup tree, wkhtmltopdf).
+DEFAULT_JOB_MEMORY_MB = 768
+
+_LOG_FORMAT = "%(asctime)s - %(processName)s - %(levelname)s - %(message)s"
+
+
+def discover_stages(git_repo_basedir: str, roots: Optional[List[str]] = None,
+                    excludes: tuple = DEFAULT_EXCLUDES) -> List[dict]:
+    """
+    Return one job per specification Markdown file below ``roots``.
+
+    ``roots`` are paths relative to the repository (default: all of it); hidden
+    directories such as ``.github`` are never searched. Symlinked files are the
+    "latest version" aliases (``csaf/v2.1/csaf-v2.1.md -> csd01/...``) of a stage
+    that is built on its own, and are skipped.
+    """
+    jobs = []
+    for root in roots or ["."]:
+        top = os.path.join(git_repo_basedir, root)
+        for dirpath, dirnames, filenames in os.walk(top):
+            dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+            for name in sorted(filenames):
+                if not name.endswith(".md") or any(fnmatch.fnmatch(name, pattern) for pattern in excludes):
+                    continue
+                if os.path.islink(os.path.join(dirpath, name)):
+                    continue
+                md_dir = sanitize_file_path(dirpath)
+                jobs.append({
+                    "md_file": os.path.join(md_dir, name),
+                    "md_dir": md_dir,
+                    "output_file": os.path.join(md_dir, name[:-len(".md")] + ".html"),
+                    "name": os.path.relpath(os.path.join(md_dir, name), git_repo_basedir),
+                })
+    return jobs
+
+
+def available_memory() -> Optional[int]:
+    """Bytes of memory available for new processes, or None when unknown."""
+    try:
+        with open("/proc/meminfo", "r", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def pool_size(jobs: int, job_memory: int = DEFAULT_JOB_MEMORY_MB * 1024 * 1024,
+              max_workers: Optional[int] = None) -> int:
+    """Workers for ``jobs`` stages: bounded by CPUs, available memory and ``max_workers``."""
+    workers = max_workers or os.cpu_count() or 1
+    memory = available_memory()
+    if memory is not None and job_memory > 0:
+        workers = min(workers, max(1, memory // job_memory))
+    return max(1, min(workers, jobs))
+
+
+def _init_worker(level: int) -> None:
+    logging.basicConfig(level=level, format=_LOG_FORMAT, force=True)
+
+
+def build_stage(job: dict, git_repo_basedir: str, options: dict) -> dict:
+    """
+    Run the enabled steps for one stage and return its status and step timings.
+
+    Runs in a pool worker; errors are reported in the result instead of raised.
+    With ``options["trace"]`` the stage's trace events are returned under
+    ``"trace_events"``.
+    """
+    result = {"name": job["name"], "status": "ok", "error": "", "timings": {}}
+    started = time.perf_counter()
+    tracer = Tracer(options.get("profile"), options.get("profile_dir")) if options.get("trace") else None
+
+    def timed(step: str, fn):
+        t0 = time.perf_counter()
+        try:
+            return fn()
+        finally:
+            result["timings"][step] = time.perf_counter() - t0
+
+    # One span per document, so the merged trace shows a bar per stage.
+    with (tracer or NULL_TRACER).span(job["name"], cat="document") as span:
+        try:
+            asset_cache = AssetCache(options.get("asset_cache") or default_cache_dir(git_repo_basedir),
+                                     offline=options.get("offline", False))
+            converter = MarkdownToHtmlConverter(
+                job["md_file"], job["output_file"], git_repo_basedir, job["md_dir"],
+                html_parser=options.get("html_parser"), asset_cache=asset_cache,
+                pandoc_shards=options.get("pandoc_shards"), ast_pipeline=options.get("ast_pipeline", False),
+                tracer=tracer, css_bundle=options.get("css_bundle", False),
+                canonical=options.get("canonical_html", False),
+            )
+            if options.get("md_format"):
+                timed("format", converter.run_prettier)
+            if not timed("html", lambda: converter.convert(force=options.get("force", False))):
+                result["status"] = "up to date"
+            if options.get("pdf"):
+                from step_2_convert_html_to_pdf import PDFConverter
+                pdf_file = job["output_file"][:-len(".html")] + ".pdf"
+                # The pool already keeps every CPU busy; one wkhtmltopdf process per stage.
+                pdf = PDFConverter(job["output_file"], pdf_file, tracer=tracer, workers=1, asset_cache=asset_cache,
+                                   build_cache_dir=converter.manifest_dir, optimize=options.get("optimize_pdf", False),
+                                   backend=options.get("pdf_backend") or pdf_backends.DEFAULT_BACKEND,
+                                   render_cache=options.get("pdf_render_cache", False),
+                                   bundle_css=options.get("css_bundle", False))
+                if not options.get("canonical_html"):
+                    timed("pdf", pdf.convert)
+                else:
+                    # The same up-to-date check as the PDF node of a build_graph run.
+                    node = pdf_node(job["name"], converter.output_file, pdf_file, options, pdf.convert)
+                    built = timed("pdf", lambda: build_node(node, converter.manifest_dir,
+                                                            force=options.get("force", False)))
+                    if built["status"] == "failed":
+                        raise RuntimeError(built["reason"])
+                    if built["status"] == "up to date":
+                        logger.info("%s: PDF up to date (%s)", job["name"], built["reason"])
+                    elif result["status"] == "up to date":
+                        result["status"] = "ok"
+        except Exception as e:
+            logger.error("Stage %s failed", job["name"], exc_info=True)
+            result["status"] = "failed"
+            result["error"] = "%s: %s" % (type(e).__name__, e)
+        span["status"] = result["status"]
+    result["timings"]["total"] = time.perf_counter() - started
+    if tracer is not None:
+        result["trace_events"] = tracer.events
+    return result
+
+
+def run_batch(jobs: List[dict], git_repo_basedir: str, options: dict, workers: int) -> List[dict]:
+    """Build ``jobs`` in a pool of ``workers`` processes; results are returned in job order."""
+    order = {job["name"]: n for n, job in enumerate(jobs)}
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(logging.getLogger().getEffectiveLevel(),)) as pool:
+        futures = [pool.submit(build_stage, job, git_repo_basedir, options) for job in jobs]
+        for future in as_completed(futures):
+            result = future.result()
+            logger.info("%s: %s (%.1fs)", result["name"], result["status"], result["timings"]["total"])
+            results.append(result)
+    return sorted(results, key=lambda r: order[r["name"]])
+
+
+def format_table(results: List[dict], wall_time: float) -> str:
+    """Plain-text status table with one row per document and per-step seconds."""
+    steps = [s for s in ("format", "html", "pdf") if any(s in r["timings"] for r in results)] + ["total"]
+    header = ["Document", "Status"] + steps
+    rows = [[r["name"], r["status"]] + ["%.2f" % r["timings"][s] if s in r["timings"] else "-" for s in steps]
+            for r in results]
+    widths = [max(len(str(row[i])) for row in [header] + rows) for i in range(len(header))]
+
+    def line(cells):
+        return "  ".join(str(c).ljust(w) if i < 2 else str(c).rjust(w) for i, (c, w) in enumerate(zip(cells, widths)))
+
+    out = [line(header), "  ".join("-" * w for w in widths)] + [line(row) for row in rows]
+    failed = [r for r in results if r["status"] == "failed"]
+    out.append("%d documents, %d failed, wall time %.2fs" % (len(results), len(failed), wall_time))
+    out += ["  %s: %s" % (r["name"], r["error"]) for r in failed]
+    return "\n".join(out)
+
+
+# -------------------- CLI --------------------
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Convert every specification stage of the repository")
+    parser.add_argument("git_repo_basedir", type=str, help="Base directory of git repository")
+    parser.add_argument("roots", nargs="*", help="Directories to search, relative to the repository (default: all)")
+    parser.add_argument("--exclude", action="append", default=None, metavar="GLOB",
+                        help="Markdown file names to skip (default: %s)" % ", ".join(DEFAULT_EXCLUDES))
+    parser.add_argument("--md-format", action="store_true", help="Run Prettier on each markdown file first")
+    parser.add_argument("--pdf", action="store_true", help="Also convert each HTML file to PDF")
+    parser.add_argument("--pdf-backend", choices=sorted(pdf_backends.BACKENDS),
+                        default=pdf_backends.DEFAULT_BACKEND,
+                        help="Engine that renders the PDFs (default: %(default)s)")
+    parser.add_argument("--pdf-render-cache", action="store_true",
+                        help="Reuse the PDFs of unchanged chapters from the build cache")
+    parser.add_argument("--optimize-pdf", action="store_true",
+                        help="Shrink each PDF after converting it (see pdf_optimize.py)")
+    parser.add_argument("--force", action="store_true", help="Regenerate HTML even if the build manifest is current")
+    parser.add_argument("--offline", action="store_true", help="Serve images and CSS only from the asset cache")
+    parser.add_argument("--asset-cache", type=str, default=None, help="Asset cache directory")
+    parser.add_argument("--html-parser", choices=["html.parser", "lxml"], default="html.parser",
+                        help="BeautifulSoup parser used for post-processing (lxml must be installed)")
+    parser.add_argument("--pandoc-shards", type=int, default=None, metavar="WORKERS",
+                        help="Convert the sections of each document with this many pandoc processes")
+    parser.add_argument("--ast-pipeline", action="store_true",
+                        help="Apply the structural fixes to the pandoc JSON AST instead of re-parsing the HTML")
+    parser.add_argument("--css-bundle", action="store_true",
+                        help="Give each page (and PDF) one minified stylesheet holding only the rules it uses")
+    parser.add_argument("--canonical-html", action="store_true",
+                        help="Write byte-stable HTML and only render a PDF again when its page changed")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="Maximum parallel stages (default: CPU count, limited by available memory)")
+    parser.add_argument("--job-memory-mb", type=int, default=DEFAULT_JOB_MEMORY_MB,
+                        help="Memory to reserve per parallel stage when sizing the pool")
+    add_trace_arguments(parser)
+    args = parser.parse_args()
+    tracer = tracer_from_args(parser, args)
+
+    git_repo_basedir = sanitize_file_path(os.path.abspath(args.git_repo_basedir))
+    jobs = discover_stages(git_repo_basedir, args.roots, tuple(args.exclude or DEFAULT_EXCLUDES))
+    if not jobs:
+        logger.error("No Markdown files found below %s", ", ".join(args.roots or [git_repo_basedir]))
+        sys.exit(1)
+    if args.md_format and not shutil.which("prettier"):
+        logger.error("--md-format needs prettier on PATH")
+        sys.exit(1)
+
+    workers = pool_size(len(jobs), args.job_memory_mb * 1024 * 1024, args.jobs)
+    logger.info("Building %d documents with %d workers", len(jobs), workers)
+    options = {
+        "md_format": args.md_format,
+        "pdf": args.pdf,
+        "optimize_pdf": args.optimize_pdf,
+        "pdf_backend": args.pdf_backend,
+        "pdf_render_cache": args.pdf_render_cache,
+        "force": args.force,
+        "offline": args.offline,
+        "asset_cache": args.asset_cache,
+        "html_parser": args.html_parser,
+        "pandoc_shards": args.pandoc_shards,
+        "ast_pipeline": args.ast_pipeline,
+        "css_bundle": args.css_bundle,
+        "canonical_html": args.canonical_html,
+        "trace": tracer is not None,
+        "profile": args.profile,
+        "profile_dir": tracer.profile_dir if tracer is not None else None,
+    }
+    started = time.perf_counter()
+    results = run_batch(jobs, git_repo_basedir, options, workers)
+    if tracer is not None:
+        for result in results:
+            tracer.extend(result.pop("trace_events", []))
+        tracer.write(args.trace)
+    print(format_table(results, time.perf_counter() - started))
+    if any(r["status"] == "failed" for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper(), logging.INFO),
+        format=_LOG_FORMAT,
+    )
+    main()
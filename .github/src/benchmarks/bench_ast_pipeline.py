@@ -0,0 +1,110 @@
+"""
+Benchmark the pandoc JSON-AST pipeline against BeautifulSoup post-processing.
+
+Renders one specification (default: csaf/v2.1/csd01/csaf-v2.1-csd01.md) with
+both pipelines through :meth:`MarkdownToHtmlConverter.render`, reports the best
+and median wall time of each, and checks that the pages agree on everything
+the post-processing decides: title, meta description, stylesheets, heading ids,
+link targets and image sources. Exits non-zero when they differ.
+
+    python3 .github/src/benchmarks/bench_ast_pipeline.py "$(pwd)" --repeat 5 --offline
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from bs4 import BeautifulSoup  # noqa: E402
+
+from asset_cache import AssetCache, default_cache_dir  # noqa: E402
+from step_1_markdown_to_html_converter_V3_0 import MarkdownToHtmlConverter  # noqa: E402
+
+DEFAULT_SPEC = os.path.join("csaf", "v2.1", "csd01", "csaf-v2.1-csd01.md")
+
+
+def page_facts(page: str) -> dict:
+    """The parts of a page that the structural fixes and URL rules decide."""
+    soup = BeautifulSoup(page, "html.parser")
+    description = soup.find("meta", attrs={"name": "description"})
+    return {
+        "title": soup.title.get_text() if soup.title else None,
+        "description": description.get("content") if description else None,
+        "stylesheets": [link.get("href") for link in soup.find_all("link", rel="stylesheet")],
+        "headings": [(h.name, h.get("id")) for h in soup.find_all(["h1big", "h1", "h2", "h3", "h4", "h5", "h6"])],
+        "links": [a.get("href") for a in soup.find_all("a") if a.has_attr("href")],
+        "images": [img.get("src") for img in soup.find_all("img")],
+        "nav": len(soup.find_all(["nav", "header"])),
+    }
+
+
+def compare(expected: dict, actual: dict) -> list:
+    """Human-readable differences between two :func:`page_facts` results."""
+    problems = []
+    for key, want in expected.items():
+        got = actual[key]
+        if want == got:
+            continue
+        if isinstance(want, list):
+            first = next((i for i, (a, b) in enumerate(zip(want, got)) if a != b), min(len(want), len(got)))
+            problems.append("%s: %d vs %d entries, first difference at %d: %r vs %r" % (
+                key, len(want), len(got), first,
+                want[first] if first < len(want) else None, got[first] if first < len(got) else None))
+        else:
+            problems.append("%s: %r vs %r" % (key, want, got))
+    return problems
+
+
+def time_render(converter: MarkdownToHtmlConverter, repeat: int) -> tuple:
+    timings, page = [], ""
+    for _ in range(repeat):
+        started = time.perf_counter()
+        page = converter.render()
+        timings.append(time.perf_counter() - started)
+    return timings, page
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the pandoc AST pipeline against BeautifulSoup")
+    parser.add_argument("git_repo_basedir", type=str, help="Base directory of git repository")
+    parser.add_argument("md_file", nargs="?", default=DEFAULT_SPEC, help="Specification, relative to the repository")
+    parser.add_argument("--repeat", type=int, default=3, help="Renders per pipeline")
+    parser.add_argument("--offline", action="store_true", help="Serve images and CSS only from the asset cache")
+    args = parser.parse_args()
+
+    repo = os.path.abspath(args.git_repo_basedir)
+    md_file = os.path.join(repo, args.md_file)
+    md_dir = os.path.dirname(md_file)
+    output_file = md_file[:-len(".md")] + ".html"
+    asset_cache = AssetCache(default_cache_dir(repo), offline=args.offline)
+
+    results = {}
+    for name, ast_pipeline in (("beautifulsoup", False), ("pandoc-ast", True)):
+        converter = MarkdownToHtmlConverter(md_file, output_file, repo, md_dir, asset_cache=asset_cache,
+                                            ast_pipeline=ast_pipeline)
+        results[name] = time_render(converter, args.repeat)
+
+    print("%-14s %8s %8s" % ("pipeline", "best", "median"))
+    for name, (timings, _) in results.items():
+        print("%-14s %7.2fs %7.2fs" % (name, min(timings), statistics.median(timings)))
+    base, ast = min(results["beautifulsoup"][0]), min(results["pandoc-ast"][0])
+    print("speedup (best): %.2fx" % (base / ast))
+
+    problems = compare(page_facts(results["beautifulsoup"][1]), page_facts(results["pandoc-ast"][1]))
+    for problem in problems:
+        print("DIFFERENCE " + problem)
+    if problems:
+        sys.exit(1)
+    print("pages are equivalent")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s - %(message)s")
+    main()
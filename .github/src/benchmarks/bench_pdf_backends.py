@@ -0,0 +1,136 @@
+"""
+Benchmark the PDF render backends against each other.
+
+Renders one HTML page (default: csaf/v2.1/csd01/csaf-v2.1-csd01.html) through
+every available backend (or those given with ``--backend``), ``--repeat``
+times each, into a temporary directory. Each render runs in a fresh process,
+so that its peak memory (the renderer process, or the Python process for an
+in-process engine, whichever is larger) is its own. Reports the best wall
+time, the largest peak RSS, the page count and the output size per backend,
+and with ``--json`` writes the measurements for later comparison.
+
+Bookmarks and stamping are off, so the numbers are those of the engines.
+The page count needs pypdf.
+
+    python3 .github/src/benchmarks/bench_pdf_backends.py "$(pwd)" --repeat 3
+    python3 .github/src/benchmarks/bench_pdf_backends.py "$(pwd)" csaf/v2.0/os/csaf-v2.0-os.html --backend weasyprint
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import pdf_backends  # noqa: E402
+import pdf_chapters  # noqa: E402
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+DEFAULT_PAGE = os.path.join("csaf", "v2.1", "csd01", "csaf-v2.1-csd01.html")
+
+
+def render_once(html_file: str, output_pdf: str, backend: str, workers: int) -> dict:
+    """Render in this process and measure it; called in the child process."""
+    from step_2_convert_html_to_pdf import PDFConverter
+
+    converter = PDFConverter(html_file, output_pdf, workers=workers, outline_levels=0, backend=backend)
+    started = time.perf_counter()
+    converter.convert()
+    wall = time.perf_counter() - started
+    peak_kb = None
+    if resource is not None:
+        scale = 1024 if sys.platform == "darwin" else 1  # ru_maxrss is bytes on macOS, KiB elsewhere
+        peak_kb = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                      resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) // scale
+    return {
+        "wall": wall,
+        "peak_rss_kb": peak_kb,
+        "pages": pdf_chapters.page_count(output_pdf) if pdf_chapters.available() else None,
+        "bytes": os.path.getsize(output_pdf),
+        "mode": converter.report.get("mode"),
+    }
+
+
+def measure(html_file: str, output_pdf: str, backend: str, workers: int) -> dict:
+    """One render in a fresh process."""
+    cmd = [sys.executable, __file__, "--child", backend, "--workers", str(workers), "_", html_file, output_pdf]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"{backend} failed: {result.stderr.strip().splitlines()[-1:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the PDF render backends")
+    parser.add_argument("git_repo_basedir", type=str, help="Base directory of git repository")
+    parser.add_argument("html_file", nargs="?", default=DEFAULT_PAGE, help="HTML page, relative to the repository")
+    parser.add_argument("output_pdf", nargs="?", help=argparse.SUPPRESS)
+    parser.add_argument("--backend", action="append", choices=sorted(pdf_backends.BACKENDS),
+                        help="Backend to measure; repeat for several (default: every available one)")
+    parser.add_argument("--repeat", type=int, default=3, help="Renders per backend")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="wkhtmltopdf processes for chapter-parallel rendering (default: 1)")
+    parser.add_argument("--json", help="Also write the measurements to this file")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        logging.basicConfig(level=logging.WARNING, format="%(levelname)s - %(message)s")
+        print(json.dumps(render_once(args.html_file, args.output_pdf, args.child, args.workers)))
+        return
+
+    html_file = os.path.join(os.path.abspath(args.git_repo_basedir), args.html_file)
+    backends = args.backend or pdf_backends.available_backends()
+    missing = [name for name in backends if not pdf_backends.get_backend(name).available()]
+    if missing or not backends:
+        sys.exit("not installed: %s" % (", ".join(missing) or "any PDF backend"))
+
+    results, failed = {}, []
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in backends:
+            try:
+                runs = [measure(html_file, os.path.join(tmp, name + ".pdf"), name, args.workers)
+                        for _ in range(args.repeat)]
+            except RuntimeError as e:
+                print(e, file=sys.stderr)
+                failed.append(name)
+                continue
+            results[name] = {
+                "wall": min(r["wall"] for r in runs),
+                "peak_rss_kb": max((r["peak_rss_kb"] or 0) for r in runs) or None,
+                "pages": runs[-1]["pages"],
+                "bytes": runs[-1]["bytes"],
+                "mode": runs[-1]["mode"],
+                "runs": [r["wall"] for r in runs],
+            }
+
+    print("%-12s %8s %10s %6s %12s" % ("backend", "wall", "peak RSS", "pages", "size"))
+    for name, r in results.items():
+        print("%-12s %7.1fs %8s MB %6s %12s" % (
+            name, r["wall"], "%.0f" % (r["peak_rss_kb"] / 1024) if r["peak_rss_kb"] else "?",
+            r["pages"] if r["pages"] is not None else "?", "{:,}".format(r["bytes"])))
+    if len(results) > 1:
+        fastest = min(results, key=lambda n: results[n]["wall"])
+        smallest = min(results, key=lambda n: results[n]["bytes"])
+        print("fastest: %s, smallest: %s" % (fastest, smallest))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"html_file": args.html_file, "backends": results}, f, indent=2)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
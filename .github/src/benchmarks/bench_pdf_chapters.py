@@ -0,0 +1,72 @@
+"""
+Benchmark chapter-parallel PDF rendering against one wkhtmltopdf process.
+
+Converts one HTML page (default: csaf/v2.1/csd01/csaf-v2.1-csd01.html) with
+``--workers 1`` and with the given number of workers, into a temporary
+directory, and reports the wall time of each, the parallel speedup, the page
+counts and the cross-chapter links that were resolved. Exits non-zero when the
+page counts differ by more than one page per chapter group (each group starts
+on a new page) or links were left unresolved.
+
+Needs wkhtmltopdf on the PATH and pypdf.
+
+    python3 .github/src/benchmarks/bench_pdf_chapters.py "$(pwd)" --workers 4
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import pdf_chapters  # noqa: E402
+from step_2_convert_html_to_pdf import PDFConverter  # noqa: E402
+
+DEFAULT_PAGE = os.path.join("csaf", "v2.1", "csd01", "csaf-v2.1-csd01.html")
+
+
+def time_convert(html_file: str, output_pdf: str, workers: int) -> tuple:
+    converter = PDFConverter(html_file, output_pdf, workers=workers, parallel_threshold=0)
+    started = time.perf_counter()
+    converter.convert()
+    return time.perf_counter() - started, converter.report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark chapter-parallel PDF rendering")
+    parser.add_argument("git_repo_basedir", type=str, help="Base directory of git repository")
+    parser.add_argument("html_file", nargs="?", default=DEFAULT_PAGE, help="HTML page, relative to the repository")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="Processes for the parallel run")
+    args = parser.parse_args()
+
+    if not pdf_chapters.available():
+        sys.exit("pypdf is not installed")
+    html_file = os.path.join(os.path.abspath(args.git_repo_basedir), args.html_file)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        single_seconds, _ = time_convert(html_file, os.path.join(tmp, "single.pdf"), 1)
+        single_pages = pdf_chapters.page_count(os.path.join(tmp, "single.pdf"))
+        parallel_seconds, report = time_convert(html_file, os.path.join(tmp, "chapters.pdf"), args.workers)
+
+    print("%-10s %8s %6s" % ("mode", "wall", "pages"))
+    print("%-10s %7.1fs %6d" % ("single", single_seconds, single_pages))
+    if report.get("mode") != "chapters":
+        sys.exit("the page was not rendered by chapters (fewer than two top-level <hr> page breaks?)")
+    print("%-10s %7.1fs %6d" % ("chapters", parallel_seconds, report["pages"]))
+    print("parts: %d, part renders: %s" % (report["parts"], ", ".join("%.1fs" % s for s in report["part_seconds"])))
+    print("speedup: %.2fx, cross-chapter links: %d resolved, %d unresolved"
+          % (single_seconds / parallel_seconds, report["links"], report["unresolved"]))
+
+    if abs(report["pages"] - single_pages) > report["parts"] or report["unresolved"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s - %(message)s")
+    main()
@@ -0,0 +1,75 @@
+"""
+Benchmark stamped headers and footers against wkhtmltopdf's header rendering.
+
+Converts one HTML page (default: csaf/v2.1/csd01/csaf-v2.1-csd01.html) in one
+wkhtmltopdf process, once with the ``--header-*``/``--footer-*`` options and
+once with ``--stamp-headers``, into a temporary directory. Reports the best
+wall time of each over ``--repeat`` runs, the time of the stamping pass, and
+the page counts, and exits non-zero when the page counts differ.
+
+Needs wkhtmltopdf on the PATH and pypdf.
+
+    python3 .github/src/benchmarks/bench_pdf_stamp.py "$(pwd)" --repeat 3
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import pdf_chapters  # noqa: E402
+from build_trace import Tracer  # noqa: E402
+from step_2_convert_html_to_pdf import PDFConverter  # noqa: E402
+
+DEFAULT_PAGE = os.path.join("csaf", "v2.1", "csd01", "csaf-v2.1-csd01.html")
+
+
+def time_convert(html_file: str, output_pdf: str, stamp_headers: bool, repeat: int) -> tuple:
+    """Best wall time, best post-processing time and the page count."""
+    walls, posts = [], []
+    for _ in range(repeat):
+        tracer = Tracer()
+        converter = PDFConverter(html_file, output_pdf, tracer=tracer, workers=1, outline_levels=0,
+                                 stamp_headers=stamp_headers)
+        started = time.perf_counter()
+        converter.convert()
+        walls.append(time.perf_counter() - started)
+        posts.append(sum(e["dur"] for e in tracer.events if e.get("name") == "pdf post-process") / 1e6)
+    return min(walls), min(posts), pdf_chapters.page_count(output_pdf)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark stamped headers and footers")
+    parser.add_argument("git_repo_basedir", type=str, help="Base directory of git repository")
+    parser.add_argument("html_file", nargs="?", default=DEFAULT_PAGE, help="HTML page, relative to the repository")
+    parser.add_argument("--repeat", type=int, default=3, help="Renders per mode")
+    args = parser.parse_args()
+
+    if not pdf_chapters.available():
+        sys.exit("pypdf is not installed")
+    html_file = os.path.join(os.path.abspath(args.git_repo_basedir), args.html_file)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {
+            "wkhtmltopdf": time_convert(html_file, os.path.join(tmp, "headers.pdf"), False, args.repeat),
+            "stamped": time_convert(html_file, os.path.join(tmp, "stamped.pdf"), True, args.repeat),
+        }
+
+    print("%-12s %8s %8s %6s" % ("headers", "wall", "stamp", "pages"))
+    for name, (wall, post, pages) in results.items():
+        print("%-12s %7.2fs %7.2fs %6d" % (name, wall, post, pages))
+    print("speedup (best): %.2fx" % (results["wkhtmltopdf"][0] / results["stamped"][0]))
+    if results["wkhtmltopdf"][2] != results["stamped"][2]:
+        sys.exit("page counts differ")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s - %(message)s")
+    main()
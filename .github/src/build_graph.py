@@ -0,0 +1,305 @@
+"""
+Build graph over the pipeline steps of every specification stage.
+
+The workflows run one step for one directory at a time. This entry point
+links the steps of each stage into a graph and builds it in one run:
+
+    <spec>.md -> <spec>.html -> <spec>.pdf -> <stage>.zip -> <stage>-manifest.txt
+
+Each :class:`Node` is one step for one file: it names its dependencies, a
+fingerprint of its inputs and the outputs it writes. The nodes call the
+existing entry points (:meth:`MarkdownToHtmlConverter.convert`,
+:meth:`PDFConverter.convert`, :func:`zip_package.package_stage` and
+:func:`stage_manifest.write_manifest`).
+
+A node is fresh when its fingerprint and the content of its outputs are
+those recorded in its build manifest (see :mod:`build_manifest`) after its
+last run. Fingerprints are content hashes, never modification times: the
+hooks in ``.githooks`` set file times on purpose. A node whose dependency ran
+is checked the same way, so an HTML page rebuilt with the same bytes (see
+``--canonical-html``) does not render its PDF again.
+
+:class:`BuildGraph` runs ready nodes of all stages in a thread pool; the
+steps spend most of their time in pandoc, wkhtmltopdf and zlib. Every node
+ends with a status and the reason for it: why it ran (no manifest, which
+input changed, which output was modified, forced) or why it did not (up to
+date, a dependency failed). The run ends with that table and exits non-zero
+when a node failed.
+"""
+
+from __future__ import annotations
+
+import argparse
+import datetime
+import logging
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, List, Optional
+
+import pdf_backends
+import stage_manifest
+import zip_package
+from asset_cache import AssetCache, default_cache_dir
+from batch_build import DEFAULT_EXCLUDES, discover_stages
+from build_manifest import Node, build_node, default_manifest_dir, file_digest, pdf_node
+from step_1_markdown_to_html_converter_V3_0 import MarkdownToHtmlConverter, sanitize_file_path
+
+logger = logging.getLogger(__name__)
+
+STEPS = ("html", "pdf", "zip", "manifest")
+
+
+class BuildGraph:
+    """Nodes by name, built in dependency order; see the module docstring."""
+
+    def __init__(self, manifest_dir: str, workers: Optional[int] = None) -> None:
+        self.manifest_dir = manifest_dir
+        self.workers = workers or os.cpu_count() or 1
+        self.nodes: Dict[str, Node] = {}
+
+    def add(self, node: Node) -> Node:
+        if node.name in self.nodes:
+            raise ValueError("duplicate node: %s" % node.name)
+        self.nodes[node.name] = node
+        return node
+
+    def order(self) -> List[str]:
+        """Node names, dependencies first; raises ValueError on unknown dependencies and cycles."""
+        ordered: List[str] = []
+        state: Dict[str, str] = {}
+
+        def visit(name: str, path: List[str]) -> None:
+            if state.get(name) == "done":
+                return
+            if state.get(name) == "visiting":
+                raise ValueError("dependency cycle: %s" % " -> ".join(path + [name]))
+            if name not in self.nodes:
+                raise ValueError("%s depends on unknown node %s" % (path[-1], name))
+            state[name] = "visiting"
+            for dep in self.nodes[name].deps:
+                visit(dep, path + [name])
+            state[name] = "done"
+            ordered.append(name)
+
+        for name in self.nodes:
+            visit(name, [])
+        return ordered
+
+    def build(self, node: Node, force: bool = False, dry_run: bool = False) -> dict:
+        """Check and, if stale, run one node whose dependencies succeeded; see :func:`build_manifest.build_node`."""
+        return build_node(node, self.manifest_dir, force, dry_run)
+
+    def run(self, force: bool = False, dry_run: bool = False) -> List[dict]:
+        """
+        Build every node; results are returned in dependency order.
+
+        A node starts as soon as all of its dependencies succeeded; the
+        dependents of a failed node are reported as ``"blocked"``. With
+        ``dry_run`` nothing is run: a stale node is reported as ``"would
+        run"``, and its dependents as ``"pending"`` since whether they are
+        stale depends on what it writes.
+        """
+        order = self.order()
+        results: Dict[str, dict] = {}
+        waiting = list(order)
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while waiting or running:
+                for name in list(waiting):
+                    node = self.nodes[name]
+                    dep_results = [results.get(dep) for dep in node.deps]
+                    if any(r is None for r in dep_results):
+                        continue
+                    waiting.remove(name)
+                    unfinished = [r for r in dep_results if r["status"] in ("failed", "blocked", "would run", "pending")]
+                    if unfinished:
+                        dep = unfinished[0]
+                        blocked = dep["status"] in ("failed", "blocked")
+                        results[name] = {"node": name, "step": node.step, "status": "blocked" if blocked else "pending",
+                                         "reason": "%s %s" % (dep["node"], dep["status"]), "seconds": 0.0}
+                        continue
+                    running[pool.submit(self.build, node, force, dry_run)] = name
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    results[name] = future.result()
+                    logger.info("%s: %s (%s)", name, results[name]["status"], results[name]["reason"])
+        return [results[name] for name in order]
+
+
+# -------------------- stages --------------------
+
+def add_stage_nodes(graph: BuildGraph, git_repo_basedir: str, stage_dir: str, jobs: List[dict], options: dict) -> None:
+    """
+    Add the nodes of one stage directory: HTML and PDF per specification
+    Markdown file in ``jobs``, then the stage's ZIP package and manifest.
+    Only the steps in ``options["steps"]`` are added; each depends on the
+    nearest earlier step that is.
+    """
+    steps = options.get("steps", STEPS)
+
+    def rel(path: str) -> str:
+        return os.path.relpath(path, git_repo_basedir).replace(os.sep, "/")
+
+    html_nodes: List[str] = []
+    pdf_nodes: List[str] = []
+    for job in jobs:
+        converter_cache = {}
+
+        def converter(job=job, cache=converter_cache) -> MarkdownToHtmlConverter:
+            if "converter" not in cache:
+                asset_cache = AssetCache(options.get("asset_cache") or default_cache_dir(git_repo_basedir),
+                                         offline=options.get("offline", False))
+                cache["converter"] = MarkdownToHtmlConverter(
+                    job["md_file"], job["output_file"], git_repo_basedir, job["md_dir"], asset_cache=asset_cache,
+                    css_bundle=options.get("css_bundle", False), canonical=options.get("canonical_html", False))
+            return cache["converter"]
+
+        def convert_html(converter=converter) -> List[str]:
+            html = converter()
+            html.convert(force=True)
+            return html.localized_assets
+
+        pdf_file = job["output_file"][:-len(".html")] + ".pdf"
+
+        def convert_pdf(job=job, pdf_file=pdf_file) -> None:
+            from step_2_convert_html_to_pdf import PDFConverter
+            PDFConverter(job["output_file"], pdf_file, workers=1, build_cache_dir=default_manifest_dir(git_repo_basedir),
+                         backend=options.get("pdf_backend") or pdf_backends.DEFAULT_BACKEND,
+                         bundle_css=options.get("css_bundle", False)).convert()
+
+        if "html" in steps:
+            html_nodes.append(graph.add(Node(rel(job["output_file"]), "html", [job["output_file"]],
+                                             lambda converter=converter: converter()._build_inputs(),
+                                             convert_html)).name)
+        if "pdf" in steps:
+            pdf_nodes.append(graph.add(pdf_node(rel(pdf_file), job["output_file"], pdf_file, options, convert_pdf,
+                                                html_nodes[-1:])).name)
+    last = pdf_nodes or html_nodes
+
+    if "zip" in steps:
+        date = options["date"]
+        zip_path = os.path.join(stage_dir, zip_package.package_name(stage_dir))
+
+        def zip_inputs() -> dict:
+            return {"content": zip_package.content_digest(zip_package.collect_entries(stage_dir), date)}
+
+        def package() -> None:
+            zip_package.package_stage(stage_dir, date, zip_path)
+
+        last = [graph.add(Node(rel(zip_path), "zip", [zip_path], zip_inputs, package, last)).name]
+
+    if "manifest" in steps:
+        manifest = stage_manifest.manifest_path(stage_dir)
+        manifest_options = {"sha256": options.get("sha256", False), "sizes": options.get("sizes", False)}
+
+        def manifest_inputs() -> dict:
+            files = stage_manifest.release_files(stage_dir, manifest)
+            return {"files": {name: file_digest(os.path.join(stage_dir, name)) for name in files},
+                    "options": manifest_options}
+
+        def write() -> None:
+            # No digest cache: its entries are keyed by modification time.
+            stage_manifest.write_manifest(stage_dir, stage_manifest.DigestCache(None), repo_dir=git_repo_basedir,
+                                          **manifest_options)
+
+        graph.add(Node(rel(manifest), "manifest", [manifest], manifest_inputs, write, last))
+
+
+def build_graph(git_repo_basedir: str, roots: Optional[List[str]], options: dict,
+                workers: Optional[int] = None) -> BuildGraph:
+    """The graph of every stage below ``roots`` (see :func:`batch_build.discover_stages`)."""
+    graph = BuildGraph(default_manifest_dir(git_repo_basedir), workers)
+    stages: Dict[str, List[dict]] = {}
+    for job in discover_stages(git_repo_basedir, roots, tuple(options.get("excludes") or DEFAULT_EXCLUDES)):
+        stages.setdefault(job["md_dir"], []).append(job)
+    for stage_dir, jobs in stages.items():
+        add_stage_nodes(graph, git_repo_basedir, stage_dir, jobs, options)
+    return graph
+
+
+def format_results(results: List[dict], wall_time: float) -> str:
+    """Plain-text table with one row per node: status, seconds and the reason."""
+    header = ["Node", "Status", "Seconds", "Reason"]
+    rows = [[r["node"], r["status"], "%.2f" % r["seconds"], r["reason"]] for r in results]
+    widths = [max(len(row[i]) for row in [header] + rows) for i in range(3)]
+
+    def line(cells):
+        return "  ".join([cells[0].ljust(widths[0]), cells[1].ljust(widths[1]), cells[2].rjust(widths[2]), cells[3]])
+
+    out = [line(header), "  ".join("-" * w for w in widths + [6])] + [line(row) for row in rows]
+    counts = {}
+    for r in results:
+        counts[r["status"]] = counts.get(r["status"], 0) + 1
+    out.append("%d nodes: %s; wall time %.2fs" % (
+        len(results), ", ".join("%d %s" % (n, status) for status, n in sorted(counts.items())), wall_time))
+    return "\n".join(out)
+
+
+# -------------------- CLI --------------------
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build the md -> html -> pdf -> zip -> manifest graph of every stage")
+    parser.add_argument("git_repo_basedir", type=str, help="Base directory of git repository")
+    parser.add_argument("roots", nargs="*", help="Directories to search, relative to the repository (default: all)")
+    parser.add_argument("--steps", default=",".join(STEPS),
+                        help="Comma-separated steps to build (default: %(default)s)")
+    parser.add_argument("--date", type=datetime.date.fromisoformat,
+                        help="Modification date of the packaged files, yyyy-mm-dd (required for the zip step)")
+    parser.add_argument("--exclude", action="append", default=None, metavar="GLOB",
+                        help="Markdown file names to skip (default: %s)" % ", ".join(DEFAULT_EXCLUDES))
+    parser.add_argument("--canonical-html", action="store_true",
+                        help="Write byte-stable HTML, so a page rebuilt with the same content leaves its PDF alone")
+    parser.add_argument("--css-bundle", action="store_true",
+                        help="Give each page (and PDF) one minified stylesheet holding only the rules it uses")
+    parser.add_argument("--pdf-backend", choices=sorted(pdf_backends.BACKENDS), default=pdf_backends.DEFAULT_BACKEND,
+                        help="Engine that renders the PDFs (default: %(default)s)")
+    parser.add_argument("--sha256", action="store_true", help="Add a SHA-256 section to the manifests")
+    parser.add_argument("--offline", action="store_true", help="Serve images and CSS only from the asset cache")
+    parser.add_argument("--asset-cache", type=str, default=None, help="Asset cache directory")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Nodes built at once (default: CPU count)")
+    parser.add_argument("--force", action="store_true", help="Run every node, fresh or not")
+    parser.add_argument("-n", "--dry-run", action="store_true", help="Only report which nodes are stale, and why")
+    args = parser.parse_args()
+
+    steps = [step.strip() for step in args.steps.split(",") if step.strip()]
+    unknown = [step for step in steps if step not in STEPS]
+    if unknown:
+        parser.error("unknown steps: %s (choose from %s)" % (", ".join(unknown), ", ".join(STEPS)))
+    if "zip" in steps and args.date is None:
+        parser.error("the zip step needs --date")
+
+    git_repo_basedir = sanitize_file_path(os.path.abspath(args.git_repo_basedir))
+    options = {
+        "steps": steps,
+        "date": args.date,
+        "excludes": args.exclude,
+        "canonical_html": args.canonical_html,
+        "css_bundle": args.css_bundle,
+        "pdf_backend": args.pdf_backend,
+        "sha256": args.sha256,
+        "offline": args.offline,
+        "asset_cache": args.asset_cache,
+    }
+    graph = build_graph(git_repo_basedir, args.roots, options, args.jobs)
+    if not graph.nodes:
+        logger.error("No Markdown files found below %s", ", ".join(args.roots or [git_repo_basedir]))
+        sys.exit(1)
+
+    started = time.perf_counter()
+    results = graph.run(force=args.force, dry_run=args.dry_run)
+    print(format_results(results, time.perf_counter() - started))
+    if any(r["status"] in ("failed", "blocked") for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper(), logging.INFO),
+        format="%(asctime)s - %(threadName)s - %(levelname)s - %(message)s",
+    )
+    main()
@@ -0,0 +1,232 @@
+"""
+Build manifests for skipping conversions whose inputs have not changed.
+
+A :class:`BuildManifest` records the fingerprint of a build's inputs (file
+digests, tool versions, arguments) together with the digests of the files it
+produced. A later build with the same inputs is up to date as long as every
+recorded output still exists with the recorded content.
+
+A :class:`Node` is one such build step; :func:`build_node` checks it against
+its manifest and runs it when stale. :mod:`build_graph` schedules nodes for
+every stage, and :mod:`batch_build` checks its PDFs with the same
+:func:`pdf_node`, so the two entry points cannot disagree about them.
+"""
+
+from __future__ import annotations
+
+import glob
+import hashlib
+import json
+import logging
+import os
+import re
+import subprocess
+import time
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import unquote, urlparse
+
+import pdf_backends
+from html_canonical import content_digest
+
+logger = logging.getLogger(__name__)
+
+_LINK = re.compile(r"<link\b[^>]*>", re.I)
+_HREF = re.compile(r"""\bhref\s*=\s*(["'])(.*?)\1""", re.I | re.S)
+
+
+def default_manifest_dir(git_repo_basedir: Optional[str] = None) -> str:
+    """Return ``$BUILD_CACHE_DIR``, else ``<repo>/.build-cache``, else a per-user cache dir."""
+    env = os.getenv("BUILD_CACHE_DIR")
+    if env:
+        return env
+    if git_repo_basedir:
+        return os.path.join(git_repo_basedir, ".build-cache")
+    return os.path.join(os.path.expanduser("~"), ".cache", "oasis-build-cache")
+
+
+def repo_basedir(path: str) -> Optional[str]:
+    """The git working tree containing ``path`` (nearest directory with a ``.git`` entry), or None."""
+    current = os.path.abspath(path)
+    if not os.path.isdir(current):
+        current = os.path.dirname(current)
+    while not os.path.exists(os.path.join(current, ".git")):
+        parent = os.path.dirname(current)
+        if parent == current:
+            return None
+        current = parent
+    return current
+
+
+def file_digest(path: str) -> Optional[str]:
+    """SHA-256 of the file at ``path``, or None when it cannot be read."""
+    h = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+    except OSError:
+        return None
+    return h.hexdigest()
+
+
+@lru_cache(maxsize=None)
+def tool_version(*cmd: str) -> Optional[str]:
+    """First line printed by ``cmd`` (e.g. ``pandoc --version``), or None when it is not installed."""
+    try:
+        out = subprocess.run(cmd, capture_output=True, text=True, check=True, timeout=30).stdout
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.strip().splitlines()[0] if out.strip() else ""
+
+
+class BuildManifest:
+    """Input fingerprint and output digests of the last successful build of one target."""
+
+    def __init__(self, manifest_dir: str, target: str) -> None:
+        target = os.path.abspath(target)
+        key = hashlib.sha256(target.encode("utf-8")).hexdigest()[:12]
+        self.path = os.path.join(manifest_dir, "%s-%s.json" % (os.path.basename(target), key))
+
+    def _load(self) -> Optional[dict]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def check(self, inputs: Dict[str, object]) -> Tuple[bool, str]:
+        """Return ``(up_to_date, reason)`` for a build with ``inputs``."""
+        recorded = self._load()
+        if recorded is None:
+            return False, "no manifest"
+        old = recorded.get("inputs", {})
+        changed = sorted(k for k in set(old) | set(inputs) if old.get(k) != inputs.get(k))
+        if changed:
+            return False, "changed: " + ", ".join(changed)
+        for path, digest in recorded.get("outputs", {}).items():
+            if file_digest(path) != digest:
+                return False, "output missing or modified: " + path
+        return True, "inputs and outputs unchanged"
+
+    def record(self, inputs: Dict[str, object], outputs: Iterable[str]) -> None:
+        """Store ``inputs`` and the current digests of ``outputs``."""
+        data = {"inputs": inputs, "outputs": {path: file_digest(path) for path in outputs}}
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.path)
+
+    def invalidate(self) -> None:
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def sources_digest(paths: List[str]) -> str:
+    """Combined digest of several source files, used as a code version."""
+    h = hashlib.sha256()
+    for path in paths:
+        h.update((file_digest(path) or "-").encode("ascii"))
+    return h.hexdigest()
+
+
+def stylesheet_digests(html: str, base_dir: str) -> List[str]:
+    """Digest of every local stylesheet that ``html`` links to, in order; remote ones by URL."""
+    digests = []
+    for link in _LINK.findall(html):
+        href = _HREF.search(link)
+        if not href or "stylesheet" not in link.lower():
+            continue
+        url = urlparse(href.group(2))
+        if url.scheme in ("", "file"):
+            path = unquote(url.path)
+            digests.append(file_digest(path if os.path.isabs(path) else os.path.join(base_dir, path)) or "missing")
+        else:
+            digests.append(href.group(2))
+    return digests
+
+
+# -------------------- build steps --------------------
+
+class Node:
+    """
+    One step for one output file.
+
+    ``fingerprint()`` returns the content hashes and options the outputs are
+    built from; it is called once the dependencies are done. ``run()`` does
+    the work and may return more output files (e.g. localized images).
+    """
+
+    def __init__(self, name: str, step: str, outputs: List[str], fingerprint: Callable[[], dict],
+                 run: Callable[[], Optional[List[str]]], deps: Optional[List[str]] = None) -> None:
+        self.name = name
+        self.step = step
+        self.outputs = outputs
+        self.fingerprint = fingerprint
+        self.run = run
+        self.deps = deps or []
+
+
+def node_manifest_dir(manifest_dir: str) -> str:
+    """Where the manifests of :class:`Node` steps live below the build cache ``manifest_dir``."""
+    return os.path.join(manifest_dir, "graph")
+
+
+def build_node(node: Node, manifest_dir: str, force: bool = False, dry_run: bool = False) -> dict:
+    """
+    Check ``node`` against its manifest in :func:`node_manifest_dir` and, if
+    stale, run it. Returns its status (``"up to date"``, ``"would run"``,
+    ``"ran"`` or ``"failed"``), the reason and the seconds taken; errors are
+    reported in the result instead of raised.
+    """
+    result = {"node": node.name, "step": node.step, "status": "up to date", "reason": "", "seconds": 0.0}
+    started = time.perf_counter()
+    try:
+        manifest = BuildManifest(node_manifest_dir(manifest_dir), node.outputs[0])
+        inputs = node.fingerprint()
+        fresh, reason = manifest.check(inputs)
+        if force:
+            fresh, reason = False, "forced"
+        result["reason"] = reason
+        if fresh:
+            return result
+        if dry_run:
+            result["status"] = "would run"
+            return result
+        logger.info("%s: running (%s)", node.name, reason)
+        manifest.invalidate()
+        extra = node.run() or []
+        manifest.record(inputs, node.outputs + [path for path in extra if path not in node.outputs])
+        result["status"] = "ran"
+    except Exception as e:
+        logger.error("%s failed", node.name, exc_info=True)
+        result["status"] = "failed"
+        result["reason"] = "%s: %s" % (type(e).__name__, e)
+    finally:
+        result["seconds"] = time.perf_counter() - started
+    return result
+
+
+def pdf_inputs(html_file: str, options: dict) -> dict:
+    """Everything the PDF of ``html_file`` is built from, for its build manifest."""
+    with open(html_file, "r", encoding="utf-8") as f:
+        html = f.read()
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    return {
+        "html": content_digest(html),
+        "stylesheets": stylesheet_digests(html, os.path.dirname(os.path.abspath(html_file))),
+        "converter": sources_digest(sorted(glob.glob(os.path.join(src_dir, "*.py")))),
+        "options": {
+            "optimize_pdf": bool(options.get("optimize_pdf")),
+            "pdf_backend": options.get("pdf_backend") or pdf_backends.DEFAULT_BACKEND,
+            "pdf_render_cache": bool(options.get("pdf_render_cache")),
+            "css_bundle": bool(options.get("css_bundle")),
+        },
+    }
+
+
+def pdf_node(name: str, html_file: str, pdf_file: str, options: dict, convert: Callable[[], None],
+             deps: Optional[List[str]] = None) -> Node:
+    """The step rendering ``pdf_file`` from ``html_file`` with ``convert``."""
+    return Node(name, "pdf", [pdf_file], lambda: pdf_inputs(html_file, options), convert, deps)
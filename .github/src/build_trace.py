@@ -0,0 +1,253 @@
+"""
+Stage tracing for the HTML and PDF builds.
+
+:class:`Tracer` records spans as Chrome trace events (``"ph": "X"`` complete
+events) that chrome://tracing, Perfetto and speedscope load directly. Every
+span carries its wall time, the CPU time of its thread, the CPU time of child
+processes that finished inside it (pandoc, Prettier, wkhtmltopdf), the peak RSS
+of the process and of its largest child when the span raised them, and, when
+the caller passes them, input and output sizes. Size arguments may be given as ``str`` or
+``bytes``; they are measured when the span closes, and only when tracing is on.
+
+Spans opened with ``profile=True`` mark a stage. With ``profile="cpu"`` such a
+stage runs under cProfile and its stats are written next to the trace (open
+them with ``python -m pstats`` or snakeviz); with ``profile="memory"``
+tracemalloc records the stage's peak Python allocation and its top allocation
+sites in the span. Stages do not nest their profiles: a stage inside a
+profiled stage is only timed.
+
+Code paths take a tracer unconditionally; :data:`NULL_TRACER` is the default
+and its spans do nothing.
+"""
+
+from __future__ import annotations
+
+import cProfile
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+PROFILE_MODES = ("cpu", "memory")
+
+# Allocation sites reported per stage with profile="memory".
+_TOP_ALLOCATIONS = 10
+
+
+def _rusage() -> tuple:
+    """(children CPU seconds, peak RSS KiB of this process, peak RSS KiB of the largest child)."""
+    if resource is None:
+        return 0.0, None, None
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    scale = 1024 if sys.platform == "darwin" else 1  # ru_maxrss is bytes on macOS, KiB elsewhere
+    return children.ru_utime + children.ru_stime, own.ru_maxrss // scale, children.ru_maxrss // scale
+
+
+def _size(value) -> int:
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    return int(value)
+
+
+class Tracer:
+    """Collects trace events for one process; see the module docstring."""
+
+    enabled = True
+
+    def __init__(self, profile: Optional[str] = None, profile_dir: Optional[str] = None) -> None:
+        if profile not in (None,) + PROFILE_MODES:
+            raise ValueError("profile must be one of %s" % ", ".join(PROFILE_MODES))
+        self.profile = profile
+        self.profile_dir = profile_dir or os.getcwd()
+        self.events: List[dict] = []
+        self._lock = threading.Lock()
+        self._profiling = False
+        self._profile_ids = itertools.count(1)
+        self._named_threads: set = set()
+
+    def _emit(self, event: dict) -> None:
+        pid, tid = os.getpid(), threading.get_ident()
+        event["pid"], event["tid"] = pid, tid
+        with self._lock:
+            if pid not in self._named_threads:
+                self._named_threads.add(pid)
+                self.events.append({"name": "process_name", "ph": "M", "pid": pid, "tid": tid,
+                                    "args": {"name": multiprocessing.current_process().name}})
+            if (pid, tid) not in self._named_threads:
+                self._named_threads.add((pid, tid))
+                self.events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                                    "args": {"name": threading.current_thread().name}})
+            self.events.append(event)
+
+    def _claim_profiler(self, profile: bool) -> bool:
+        if not (profile and self.profile):
+            return False
+        with self._lock:
+            if self._profiling:
+                return False
+            self._profiling = True
+            return True
+
+    @contextmanager
+    def span(self, name: str, cat: str = "stage", profile: bool = False, **args) -> Iterator[dict]:
+        """
+        Record the enclosed block as one event; yields the event arguments.
+
+        Callers may add arguments (e.g. ``args["bytes_out"] = html``) before the
+        block ends. ``bytes_*`` arguments are converted to sizes on exit.
+        """
+        profiler = None
+        started_tracemalloc = False
+        profiling = self._claim_profiler(profile)
+        if profiling and self.profile == "cpu":
+            profiler = cProfile.Profile()
+        elif profiling:
+            started_tracemalloc = not tracemalloc.is_tracing()
+            if started_tracemalloc:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+
+        children_cpu, peak_rss_start, child_peak_rss_start = _rusage()
+        ts = time.time()
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield args
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            wall = time.perf_counter() - wall
+            cpu = time.thread_time() - cpu
+            children_cpu_end, peak_rss, child_peak_rss = _rusage()
+            for key, value in list(args.items()):
+                if key.startswith("bytes_") and value is not None:
+                    args[key] = _size(value)
+            args["cpu_ms"] = round(cpu * 1000, 3)
+            if children_cpu_end > children_cpu:
+                args["children_cpu_ms"] = round((children_cpu_end - children_cpu) * 1000, 3)
+            # ru_maxrss is a high-water mark over the process lifetime; a span
+            # only reports it when it rose while the span ran.
+            if peak_rss is not None and peak_rss > peak_rss_start:
+                args["peak_rss_kb"] = peak_rss
+            if child_peak_rss is not None and child_peak_rss > child_peak_rss_start:
+                args["child_peak_rss_kb"] = child_peak_rss
+            if profiler is not None:
+                args["cprofile"] = self._dump_profile(profiler, name)
+            elif profiling:
+                args.update(self._memory_profile(started_tracemalloc))
+            if profiling:
+                with self._lock:
+                    self._profiling = False
+            self._emit({"name": name, "cat": cat, "ph": "X", "ts": round(ts * 1e6, 1),
+                        "dur": round(wall * 1e6, 1), "args": args})
+
+    def _dump_profile(self, profiler: cProfile.Profile, name: str) -> str:
+        slug = re.sub(r"[^A-Za-z0-9]+", "-", name).strip("-").lower() or "stage"
+        path = os.path.join(self.profile_dir, "%s-%d-%d.prof" % (slug, os.getpid(), next(self._profile_ids)))
+        os.makedirs(self.profile_dir, exist_ok=True)
+        profiler.dump_stats(path)
+        return path
+
+    @staticmethod
+    def _memory_profile(stop: bool) -> dict:
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        if stop:
+            tracemalloc.stop()
+        top = snapshot.statistics("lineno")[:_TOP_ALLOCATIONS]
+        return {
+            "py_peak_kb": peak // 1024,
+            "top_allocations": ["%s:%d %d KiB" % (s.traceback[0].filename, s.traceback[0].lineno, s.size // 1024)
+                                for s in top],
+        }
+
+    def counter(self, name: str, **values) -> None:
+        """Record a counter sample (``"ph": "C"``), e.g. cache hits."""
+        self._emit({"name": name, "ph": "C", "ts": round(time.time() * 1e6, 1), "args": values})
+
+    def extend(self, events: List[dict]) -> None:
+        """Add events recorded elsewhere, e.g. by a batch worker process."""
+        with self._lock:
+            self.events.extend(events)
+
+    def summary(self) -> List[tuple]:
+        """``(name, calls, total seconds)`` per span name, slowest first."""
+        totals: dict = {}
+        for event in self.events:
+            if event.get("ph") == "X":
+                calls, total = totals.get(event["name"], (0, 0.0))
+                totals[event["name"]] = (calls + 1, total + event["dur"] / 1e6)
+        return sorted(((name, calls, total) for name, (calls, total) in totals.items()), key=lambda r: -r[2])
+
+    def write(self, path: str) -> None:
+        """Write the trace as Chrome trace-event JSON."""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
+        logger.info("Wrote %d trace events to %s", len(self.events), path)
+        for name, calls, total in self.summary()[:10]:
+            logger.info("  %-28s %5d x %8.3fs", name, calls, total)
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> dict:
+        return {}
+
+    def __exit__(self, *exc) -> bool:
+        return False
+
+
+class NullTracer:
+    """A tracer that records nothing; the default of every converter."""
+
+    enabled = False
+    events: List[dict] = []
+
+    def span(self, name: str, cat: str = "stage", profile: bool = False, **args) -> _NullSpan:
+        return _NULL_SPAN
+
+    def counter(self, name: str, **values) -> None:
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+NULL_TRACER = NullTracer()
+
+
+def add_trace_arguments(parser) -> None:
+    """The ``--trace``/``--profile`` options shared by the command-line tools."""
+    parser.add_argument("--trace", type=str, default=None, metavar="FILE",
+                        help="Write Chrome trace-event JSON of every build stage to FILE")
+    parser.add_argument("--profile", choices=PROFILE_MODES, default=None,
+                        help="With --trace, also run each stage under cProfile (cpu) or tracemalloc (memory)")
+
+
+def tracer_from_args(parser, args) -> Optional[Tracer]:
+    """A :class:`Tracer` for ``--trace``, or None; profiles go next to the trace file."""
+    if args.profile and not args.trace:
+        parser.error("--profile needs --trace")
+    if not args.trace:
+        return None
+    return Tracer(args.profile, os.path.dirname(os.path.abspath(args.trace)))
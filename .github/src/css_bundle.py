@@ -0,0 +1,452 @@
+"""
+One trimmed, minified stylesheet per document.
+
+A page carries the selected ``markdown-styles-*.css`` (or a local
+``styles.css``), pandoc's default ``<style>`` block and, in the PDF stage, the
+code block CSS of :class:`~step_2_convert_html_to_pdf.PDFConverter`. Many of
+their rules target elements that a given page does not have (language classes,
+striped tables, ...) or repeat each other, and wkhtmltopdf tests every
+selector against every element of pages with hundreds of code blocks and
+thousands of table cells. :func:`bundle_css` turns the stylesheets of a page
+into one stylesheet that:
+
+- keeps only the selectors that match something in the page
+  (:class:`SelectorMatcher`); rules left without selectors, and ``@media``
+  blocks left without rules, are dropped;
+- keeps one copy of repeated declarations and of rules repeated later in the
+  same block, and merges adjacent rules with the same selectors or the same
+  declarations;
+- has no comments and no whitespace that does not separate tokens.
+
+Matching is conservative: pseudo-elements and user-action pseudo-classes
+(``:hover``, ``::before``, ...) are matched on the element they belong to,
+and selectors that cannot be evaluated are kept. ``@page``, ``@font-face``
+and other at-rules are kept as they are, minified.
+
+:func:`inline_bundle` replaces a page's ``<style>`` blocks by the bundle (the
+PDF stage, where stylesheets are already inlined by the resource preloader);
+the HTML stage writes the bundle to a file and links it instead.
+"""
+
+from __future__ import annotations
+
+import logging
+import re
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from bs4 import BeautifulSoup, Tag
+
+logger = logging.getLogger(__name__)
+
+# At-rules whose block holds rules, pruned like the top level.
+_GROUPING = {"media", "supports", "document", "-moz-document"}
+
+# Pseudo-classes and pseudo-elements that depend on user action or layout; the
+# selector is matched without them.
+_DYNAMIC_PSEUDO = {
+    "hover", "active", "focus", "focus-visible", "focus-within", "visited", "link", "any-link", "target",
+    "before", "after", "first-line", "first-letter", "selection", "marker", "placeholder", "backdrop",
+    "-webkit-scrollbar", "-webkit-scrollbar-thumb", "-webkit-scrollbar-track", "-moz-selection",
+}
+_PSEUDO = re.compile(r"::?([\w-]+)(?:\([^()]*\))?")
+_ATTRIBUTE = re.compile(r"\[\s*([\w-]+)[^\]]*\]")
+_COMPOUND_SPLIT = re.compile(r"\s*[\s>+~]\s*")
+_TYPE = re.compile(r"^([a-zA-Z][\w-]*)")
+_CLASS_OR_ID = re.compile(r"([.#])([\w-]+)")
+
+
+class BundleUnsupported(RuntimeError):
+    """The stylesheets cannot be combined into one without changing their meaning."""
+
+
+# -------------------- parsing and minifying --------------------
+
+def _strip_comments(css: str) -> str:
+    out = []
+    i, n, quote = 0, len(css), None
+    while i < n:
+        c = css[i]
+        if quote:
+            out.append(c)
+            if c == "\\" and i + 1 < n:
+                out.append(css[i + 1])
+                i += 1
+            elif c == quote:
+                quote = None
+        elif c in "\"'":
+            quote = c
+            out.append(c)
+        elif css.startswith("/*", i):
+            end = css.find("*/", i + 2)
+            i = n if end < 0 else end + 2
+            out.append(" ")
+            continue
+        else:
+            out.append(c)
+        i += 1
+    return "".join(out)
+
+
+def _split_top(text: str, sep: str) -> List[str]:
+    """``text`` split at ``sep`` outside strings, brackets and parentheses."""
+    parts, start, depth, quote = [], 0, 0, None
+    i = 0
+    while i < len(text):
+        c = text[i]
+        if quote:
+            if c == "\\":
+                i += 1
+            elif c == quote:
+                quote = None
+        elif c in "\"'":
+            quote = c
+        elif c in "([{":
+            depth += 1
+        elif c in ")]}":
+            depth -= 1
+        elif c == sep and depth == 0:
+            parts.append(text[start:i])
+            start = i + 1
+        i += 1
+    parts.append(text[start:])
+    return parts
+
+
+def squeeze(text: str, tight: str = ",;:{}") -> str:
+    """
+    ``text`` with whitespace runs outside strings collapsed to one space, and
+    removed next to the characters in ``tight``.
+    """
+    out: List[str] = []
+    pending = False
+    i, n, quote = 0, len(text), None
+    while i < n:
+        c = text[i]
+        if quote:
+            out.append(c)
+            if c == "\\" and i + 1 < n:
+                out.append(text[i + 1])
+                i += 1
+            elif c == quote:
+                quote = None
+        elif c.isspace():
+            pending = True
+        else:
+            if pending and out and out[-1] not in tight and c not in tight:
+                out.append(" ")
+            pending = False
+            if c in "\"'":
+                quote = c
+            out.append(c)
+        i += 1
+    return "".join(out)
+
+
+def _blocks(css: str) -> List[Tuple[str, Optional[str]]]:
+    """Top-level statements of ``css`` as (prelude, block body or None)."""
+    items = []
+    start, depth, quote, body_start = 0, 0, None, 0
+    i, n = 0, len(css)
+    while i < n:
+        c = css[i]
+        if quote:
+            if c == "\\":
+                i += 1
+            elif c == quote:
+                quote = None
+        elif c in "\"'":
+            quote = c
+        elif c == "{":
+            if depth == 0:
+                body_start = i
+            depth += 1
+        elif c == "}":
+            depth -= 1
+            if depth == 0:
+                items.append((css[start:body_start].strip(), css[body_start + 1:i]))
+                start = i + 1
+            depth = max(depth, 0)
+        elif c == ";" and depth == 0:
+            if css[start:i].strip():
+                items.append((css[start:i].strip(), None))
+            start = i + 1
+        i += 1
+    if depth == 0 and css[start:].strip():
+        items.append((css[start:].strip(), None))
+    return items
+
+
+def _declarations(body: str) -> List[str]:
+    decls = []
+    for decl in _split_top(body, ";"):
+        name, colon, value = decl.partition(":")
+        if not colon or not name.strip():
+            continue
+        value = squeeze(value, tight=",").strip().replace("! important", "!important")
+        decls.append("%s:%s" % (name.strip().lower(), value.replace(" !important", "!important")))
+    return decls
+
+
+def parse_css(css: str) -> list:
+    """
+    The rules of ``css``: ``["rule", selectors, declarations]`` for style rules,
+    ``["group", prelude, rules]`` for ``@media`` and the like, and
+    ``["at", prelude, body or None]`` for every other at-rule.
+    """
+    rules: list = []
+    for prelude, body in _blocks(_strip_comments(css)):
+        if prelude.startswith("@"):
+            name = prelude[1:].split(None, 1)[0].split("(", 1)[0].lower() if len(prelude) > 1 else ""
+            if body is not None and name in _GROUPING:
+                rules.append(["group", squeeze(prelude, tight=","), parse_css(body)])
+            else:
+                rules.append(["at", squeeze(prelude, tight=","),
+                              None if body is None else squeeze(body).strip()])
+        elif body is not None:
+            selectors = [squeeze(s, tight=",>+~").strip() for s in _split_top(prelude, ",")]
+            rules.append(["rule", [s for s in selectors if s], _declarations(body)])
+    return rules
+
+
+def serialize(rules: list) -> str:
+    """The minified text of parsed ``rules``."""
+    out = []
+    for rule in rules:
+        kind, head, body = rule
+        if kind == "rule":
+            out.append("%s{%s}" % (",".join(head), ";".join(body)))
+        elif kind == "group":
+            out.append("%s{%s}" % (head, serialize(body)))
+        elif body is None:
+            out.append(head + ";")
+        else:
+            out.append("%s{%s}" % (head, body))
+    return "".join(out)
+
+
+# -------------------- pruning --------------------
+
+class SelectorMatcher:
+    """
+    Whether a selector matches anything in a page.
+
+    The class names, ids, element and attribute names of the page are indexed
+    once; a selector that needs one the page does not have is rejected without
+    a search, and the rest are checked with ``soup.select_one``.
+    """
+
+    def __init__(self, soup: BeautifulSoup) -> None:
+        self.soup = soup
+        self.names = set()
+        self.classes = set()
+        self.ids = set()
+        self.attributes = set()
+        for tag in soup.find_all(True):
+            self.names.add(tag.name.lower())
+            self.attributes.update(a.lower() for a in tag.attrs)
+            self.classes.update(tag.get("class") or [])
+            if tag.get("id"):
+                self.ids.add(tag["id"])
+        self._cache: Dict[str, bool] = {}
+
+    @staticmethod
+    def _static(selector: str) -> str:
+        """``selector`` without the dynamic pseudo-classes and pseudo-elements."""
+        def drop(match: re.Match) -> str:
+            return "" if match.group(1).lower() in _DYNAMIC_PSEUDO else match.group(0)
+
+        static = _PSEUDO.sub(drop, selector).strip()
+        # A compound that was only a pseudo-class: "a > :hover" -> "a > *"
+        if not static or static[0] in ">+~":
+            static = "*" + static
+        if static[-1] in ">+~":
+            static += "*"
+        return static
+
+    def _possible(self, selector: str) -> bool:
+        """False when ``selector`` requires a name, class, id or attribute the page lacks."""
+        plain = _ATTRIBUTE.sub(lambda m: "" if m.group(1).lower() in self.attributes else "\0", selector)
+        if "\0" in plain:
+            return False
+        # Anything inside :not(), :is(), ... may or may not be required.
+        plain = re.sub(r"\([^()]*\)", "", _PSEUDO.sub("", plain))
+        for compound in _COMPOUND_SPLIT.split(plain.strip()):
+            name = _TYPE.match(compound)
+            if name and name.group(1).lower() not in self.names:
+                return False
+            for kind, token in _CLASS_OR_ID.findall(compound):
+                if token not in (self.classes if kind == "." else self.ids):
+                    return False
+        return True
+
+    def matches(self, selector: str) -> bool:
+        if selector not in self._cache:
+            self._cache[selector] = self._match(selector)
+        return self._cache[selector]
+
+    def _match(self, selector: str) -> bool:
+        if "\\" in selector:
+            return True  # escaped identifiers: not worth a parser of their own
+        static = self._static(selector)
+        if not self._possible(static):
+            return False
+        try:
+            return self.soup.select_one(static) is not None
+        except Exception:  # soupsieve cannot evaluate it (unknown pseudo-class, syntax): keep it
+            return True
+
+
+def prune(rules: list, matcher: SelectorMatcher) -> list:
+    """``rules`` with the selectors that match nothing removed, and what that leaves empty."""
+    kept = []
+    for kind, head, body in rules:
+        if kind == "rule":
+            selectors = [s for s in head if matcher.matches(s)]
+            if selectors and body:
+                kept.append([kind, selectors, body])
+        elif kind == "group":
+            body = prune(body, matcher)
+            if body:
+                kept.append([kind, head, body])
+        else:
+            kept.append([kind, head, body])
+    return kept
+
+
+# -------------------- merging --------------------
+
+def _unique_last(items: Sequence[str]) -> List[str]:
+    """``items`` keeping only the last of equal entries, which is the one that counts."""
+    seen = set()
+    out = []
+    for item in reversed(items):
+        if item not in seen:
+            seen.add(item)
+            out.append(item)
+    return out[::-1]
+
+
+def merge(rules: list) -> list:
+    """
+    Remove repeated declarations and rules and merge adjacent rules, without
+    changing which declaration wins for any element.
+
+    A rule that is repeated later in the same block is dropped: its later copy
+    comes after everything it could override. Adjacent rules with the same
+    selectors, or with the same declarations, are combined.
+    """
+    rules = [[kind, _unique_last(head) if kind == "rule" else head,
+              _unique_last(body) if kind == "rule" else merge(body) if kind == "group" else body]
+             for kind, head, body in rules]
+
+    last_copy: Dict[str, int] = {}
+    for n, rule in enumerate(rules):
+        last_copy[serialize([rule])] = n
+    rules = [rule for n, rule in enumerate(rules)
+             if rule[0] == "at" and rule[2] is None or last_copy[serialize([rule])] == n]
+
+    merged: list = []
+    for rule in rules:
+        prev = merged[-1] if merged else None
+        if prev and prev[0] == rule[0] == "rule":
+            if prev[1] == rule[1]:
+                prev[2] = _unique_last(prev[2] + rule[2])
+                continue
+            if prev[2] == rule[2]:
+                prev[1] = _unique_last(prev[1] + rule[1])
+                continue
+        merged.append(rule)
+    return merged
+
+
+def _count(rules: list) -> Tuple[int, int]:
+    """Style rules and selectors in ``rules``, nested ones included."""
+    n_rules = n_selectors = 0
+    for kind, head, body in rules:
+        if kind == "rule":
+            n_rules += 1
+            n_selectors += len(head)
+        elif kind == "group":
+            r, s = _count(body)
+            n_rules += r
+            n_selectors += s
+    return n_rules, n_selectors
+
+
+def bundle_css(sources: Sequence[Tuple[str, Optional[str]]], soup: BeautifulSoup) -> Tuple[str, dict]:
+    """
+    Combine ``sources``, (stylesheet text, media or None) in cascade order,
+    into one stylesheet trimmed to the page ``soup``; see the module docstring.
+
+    Returns the stylesheet and statistics: rules, selectors and bytes before
+    and after. Raises :class:`BundleUnsupported` for an ``@import`` that would
+    no longer come first.
+    """
+    rules: list = []
+    for text, media in sources:
+        parsed = [rule for rule in parse_css(text) if not (rule[0] == "at" and rule[1].lower().startswith("@charset"))]
+        if media and media.strip().lower() not in ("all", ""):
+            parsed = [["group", "@media " + squeeze(media, tight=","), parsed]]
+        for rule in parsed:
+            if rule[0] == "at" and rule[1].lower().startswith("@import") and any(r[0] != "at" or not r[1].lower().startswith("@import") for r in rules):
+                raise BundleUnsupported("@import after other rules: %s" % rule[1])
+            rules.append(rule)
+
+    rules_in, selectors_in = _count(rules)
+    bundled = merge(prune(rules, SelectorMatcher(soup)))
+    css = serialize(bundled)
+    rules_out, selectors_out = _count(bundled)
+    stats = {
+        "rules_in": rules_in,
+        "rules_out": rules_out,
+        "selectors_in": selectors_in,
+        "selectors_out": selectors_out,
+        "bytes_in": sum(len(text.encode("utf-8")) for text, _ in sources),
+        "bytes_out": len(css.encode("utf-8")),
+    }
+    return css, stats
+
+
+def format_stats(stats: dict) -> str:
+    return "CSS bundle: %d -> %d rules, %d -> %d selectors, %s -> %s bytes" % (
+        stats["rules_in"], stats["rules_out"], stats["selectors_in"], stats["selectors_out"],
+        "{:,}".format(stats["bytes_in"]), "{:,}".format(stats["bytes_out"]))
+
+
+# -------------------- pages --------------------
+
+def is_stylesheet_link(tag: Tag) -> bool:
+    return tag.name == "link" and "stylesheet" in [r.lower() for r in (tag.get("rel") or [])]
+
+
+def stylesheet_elements(soup: BeautifulSoup) -> List[Tag]:
+    """The ``<style>`` and ``<link rel="stylesheet">`` elements of ``soup``, in cascade order."""
+    return [tag for tag in soup.find_all(("style", "link")) if tag.name == "style" or is_stylesheet_link(tag)]
+
+
+def replace_stylesheets(soup: BeautifulSoup, elements: List[Tag], new: Tag) -> None:
+    """Put ``new`` where the first of ``elements`` is and remove them all."""
+    elements[0].insert_before(new)
+    for tag in elements:
+        tag.decompose()
+
+
+def inline_bundle(soup: BeautifulSoup) -> Optional[dict]:
+    """
+    Replace the ``<style>`` blocks of ``soup`` by one bundled ``<style>`` in the
+    ``<head>``. Returns the statistics of :func:`bundle_css`, or None when the
+    page has no styles. Raises :class:`BundleUnsupported` while the page still
+    links stylesheets, whose rules would have to be bundled too.
+    """
+    elements = stylesheet_elements(soup)
+    if any(tag.name == "link" for tag in elements):
+        raise BundleUnsupported("the page links stylesheets that are not inlined")
+    if not elements:
+        return None
+    css, stats = bundle_css([(tag.string or "", tag.get("media")) for tag in elements], soup)
+    style = soup.new_tag("style")
+    style.string = css
+    replace_stylesheets(soup, elements, style)
+    if soup.head is not None and style.parent is not soup.head:
+        soup.head.append(style.extract())
+    return stats
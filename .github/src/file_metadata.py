@@ -0,0 +1,191 @@
+"""
+Record and restore the modification times of tracked files (``.file-metadata``).
+
+Git does not keep file times, so the hooks in ``.githooks`` do it: ``pre-commit``
+records ``<mtime> <path>`` for every tracked file, and ``post-checkout``,
+``post-merge`` and ``post-rewrite`` set the times back. The format is the one
+the shell hooks have always written: one line per file, the mtime in whole
+seconds since the epoch, one space, the path relative to the repository root.
+
+The shell versions forked ``stat``, ``git ls-files``, ``git check-ignore``,
+``date`` and ``touch`` once per file. Here every command runs once:
+
+- the tracked set comes from a single ``git ls-files -z``;
+- ignored paths are found by one ``git check-ignore --stdin -z``;
+- times are read with ``os.lstat`` and set with ``os.utime``, and only for
+  files whose time differs;
+- ``.file-metadata`` is only rewritten when an entry changed, so a commit or
+  checkout that touches nothing leaves it (and the index) alone.
+
+    python3 .github/src/file_metadata.py record    # pre-commit
+    python3 .github/src/file_metadata.py restore   # post-checkout, post-merge, post-rewrite
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+import os
+import subprocess
+import sys
+import time
+from typing import List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+METADATA_FILE = ".file-metadata"
+
+
+def repo_root(path: str = ".") -> str:
+    return subprocess.run(["git", "rev-parse", "--show-toplevel"], cwd=path, capture_output=True, text=True,
+                          check=True).stdout.strip()
+
+
+def tracked_files(root: str) -> List[str]:
+    """Paths of the tracked files, relative to ``root``, in ``git ls-files`` order."""
+    out = subprocess.run(["git", "ls-files", "-z"], cwd=root, capture_output=True, check=True).stdout
+    return [os.fsdecode(path) for path in out.split(b"\0") if path]
+
+
+def ignored_files(root: str, paths: List[str]) -> Set[str]:
+    """The ``paths`` that ``.gitignore`` excludes, from one ``git check-ignore`` call."""
+    if not paths:
+        return set()
+    data = b"".join(os.fsencode(path) + b"\0" for path in paths)
+    result = subprocess.run(["git", "check-ignore", "--stdin", "-z"], cwd=root, input=data, capture_output=True)
+    # Exit status 1 means that no path is ignored.
+    if result.returncode not in (0, 1):
+        raise subprocess.CalledProcessError(result.returncode, result.args, result.stdout, result.stderr)
+    return {os.fsdecode(path) for path in result.stdout.split(b"\0") if path}
+
+
+def read_metadata(path: str) -> List[Tuple[str, str]]:
+    """``(epoch, path)`` entries of a metadata file; an absent file has none."""
+    try:
+        with open(path, "r", encoding="utf-8", newline="\n") as f:
+            lines = f.read().split("\n")
+    except FileNotFoundError:
+        return []
+    entries = []
+    for line in lines:
+        if not line:
+            continue
+        epoch, _, rel = line.partition(" ")
+        if not epoch.isdigit() or not rel:
+            logger.warning("%s: skipping malformed line %r", path, line)
+            continue
+        entries.append((epoch, rel))
+    return entries
+
+
+def format_metadata(entries: List[Tuple[str, str]]) -> str:
+    return "".join("%s %s\n" % entry for entry in entries)
+
+
+def _write_if_changed(path: str, text: str) -> bool:
+    try:
+        with open(path, "r", encoding="utf-8", newline="\n") as f:
+            if f.read() == text:
+                return False
+    except FileNotFoundError:
+        pass
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8", newline="\n") as f:
+        f.write(text)
+    os.replace(tmp, path)
+    return True
+
+
+def record(root: str) -> bool:
+    """
+    Write the mtime of every tracked file to ``.file-metadata``; returns True
+    when the file changed.
+
+    The entry of ``.file-metadata`` itself is its time of writing, so it only
+    changes along with another entry.
+    """
+    metadata_file = os.path.join(root, METADATA_FILE)
+    old = read_metadata(metadata_file)
+    recorded = {rel: epoch for epoch, rel in old}
+    entries = []
+    for rel in tracked_files(root):
+        if "\n" in rel:
+            logger.warning("%r: file names with a line break cannot be recorded", rel)
+            continue
+        if rel == METADATA_FILE:
+            entries.append((recorded.get(rel, ""), rel))
+            continue
+        try:
+            st = os.lstat(os.path.join(root, rel))
+        except FileNotFoundError:
+            # Deleted in the working tree, not yet staged.
+            continue
+        entries.append(("%d" % int(st.st_mtime), rel))
+
+    if entries == old:
+        return False
+    now = "%d" % int(time.time())
+    entries = [(now if rel == METADATA_FILE else epoch, rel) for epoch, rel in entries]
+    return _write_if_changed(metadata_file, format_metadata(entries))
+
+
+def restore(root: str) -> dict:
+    """
+    Set the mtime of every tracked, not ignored file listed in
+    ``.file-metadata`` and drop the other entries from it; the file is removed
+    when no entry is left.
+
+    Returns the counts of entries ``"kept"``, ``"dropped"`` and files ``"touched"``.
+    """
+    metadata_file = os.path.join(root, METADATA_FILE)
+    stats = {"kept": 0, "dropped": 0, "touched": 0}
+    if not os.path.exists(metadata_file):
+        return stats
+    entries = read_metadata(metadata_file)
+    tracked = set(tracked_files(root))
+    candidates = [rel for _, rel in entries if rel in tracked]
+    ignored = ignored_files(root, candidates)
+
+    kept = []
+    for epoch, rel in entries:
+        path = os.path.join(root, rel)
+        if rel not in tracked or rel in ignored or not os.path.isfile(path):
+            stats["dropped"] += 1
+            continue
+        kept.append((epoch, rel))
+        if rel != METADATA_FILE and int(os.stat(path).st_mtime) != int(epoch):
+            os.utime(path, (int(epoch), int(epoch)))
+            stats["touched"] += 1
+    stats["kept"] = len(kept)
+
+    if kept:
+        _write_if_changed(metadata_file, format_metadata(kept))
+    else:
+        os.remove(metadata_file)
+    return stats
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Record or restore the modification times of tracked files")
+    parser.add_argument("command", choices=["record", "restore"])
+    parser.add_argument("--repo", default=".", help="Any directory inside the repository (default: .)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Report what was done")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format="%(asctime)s - %(levelname)s - %(message)s", stream=sys.stderr)
+
+    started = time.perf_counter()
+    root = repo_root(args.repo)
+    if args.command == "record":
+        written = record(root)
+        logger.info("%s %s in %.3fs", METADATA_FILE, "written" if written else "unchanged",
+                    time.perf_counter() - started)
+    else:
+        stats = restore(root)
+        logger.info("%d files touched, %d entries kept, %d dropped in %.3fs", stats["touched"], stats["kept"],
+                    stats["dropped"], time.perf_counter() - started)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,72 @@
+"""
+Canonical serialization of the generated HTML pages.
+
+Rebuilding a stage should not change its HTML when the content did not
+change: a churned page forces a new PDF, ZIP package, manifest and commit.
+:func:`canonical_html` rewrites a page into a form that depends only on its
+content:
+
+- void elements are closed (html.parser keeps a ``<meta>`` without a slash
+  open around what follows it when the page also has ``<meta />`` tags);
+- the attributes of every element are sorted by name, so the order in which
+  pandoc, BeautifulSoup or a post-processing rule set them does not matter;
+- in text outside ``<pre>``, ``<code>``, ``<textarea>``, ``<script>`` and
+  ``<style>``, line endings become ``\\n``, and a whitespace run that contains
+  a line break becomes a single ``\\n`` (HTML renders both the same);
+- the page ends with exactly one line break.
+
+The result is a fixed point (canonicalizing it again gives the same bytes),
+so :func:`content_digest` of two builds is equal exactly when their pages
+are, and a later stage can compare it with the digest it last built from.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import re
+from typing import Optional
+
+from bs4 import BeautifulSoup, NavigableString, Tag
+
+from html_visitor import VOID_ELEMENTS, parse_html
+
+# Elements whose text is rendered (or executed) as written.
+PRESERVE_WHITESPACE = frozenset({"pre", "code", "textarea", "script", "style", "listing", "plaintext", "xmp"})
+
+_LINE_BREAK_RUN = re.compile(r"[ \t\r\n\f]*[\r\n][ \t\r\n\f]*")
+
+
+def _preserved(node) -> bool:
+    return any(parent.name in PRESERVE_WHITESPACE for parent in node.parents if isinstance(parent, Tag))
+
+
+def canonicalize(soup: BeautifulSoup) -> BeautifulSoup:
+    """Sort the attributes and normalize the whitespace of ``soup`` in place."""
+    for tag in soup.find_all(True):
+        if tag.contents and tag.name in VOID_ELEMENTS:
+            # html.parser leaves a void element open when a page mixes <meta> and
+            # <meta />; move what it swallowed back behind it.
+            tag.insert_after(*tag.contents)
+        if len(tag.attrs) > 1:
+            tag.attrs = dict(sorted(tag.attrs.items()))
+    for text in soup.find_all(string=True):
+        # Comments, the doctype and script/style/template content have their own string types.
+        if type(text) is not NavigableString or _preserved(text):
+            continue
+        normalized = _LINE_BREAK_RUN.sub("\n", text)
+        if normalized != text:
+            text.replace_with(NavigableString(normalized))
+    return soup
+
+
+def canonical_html(html: str, parser: Optional[str] = None) -> str:
+    """The canonical form of the page ``html``; see the module docstring."""
+    html = html.replace("\r\n", "\n").replace("\r", "\n")
+    soup = canonicalize(parse_html(html, parser))
+    return str(soup).rstrip("\n") + "\n"
+
+
+def content_digest(html: str) -> str:
+    """SHA-256 of the page as written to disk; equal to ``build_manifest.file_digest`` of the file."""
+    return hashlib.sha256(html.encode("utf-8")).hexdigest()
+
@@ -0,0 +1,166 @@
+"""
+Single-pass tree visitor for BeautifulSoup documents.
+
+The HTML post-processing stages used to run one ``find_all`` scan per fix.
+:class:`HtmlVisitor` lets each fix register itself as a rule for the tag names
+it cares about and then walks the parsed tree exactly once, in document order,
+dispatching every element to its rules.
+
+Rules are plain callables that receive the element. Enter rules run before the
+element's children are visited, exit rules run after them. A rule may mutate or
+remove the element it is given; when the element is detached from the tree the
+visitor skips its remaining rules and its subtree. Given a ``timings`` dict, the
+visitor also accumulates ``[calls, seconds]`` per rule name, since rules are
+interleaved in one walk and have no span of their own.
+"""
+
+from __future__ import annotations
+
+import logging
+import time
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, List, Optional, Union
+
+from bs4 import BeautifulSoup, NavigableString, Tag
+from bs4.element import PreformattedString
+
+logger = logging.getLogger(__name__)
+
+Rule = Callable[[Tag], None]
+
+# Parser used when none is requested; byte-for-byte output is only guaranteed
+# against this one because it is what the workflows have always used.
+DEFAULT_PARSER = "html.parser"
+
+# Whitespace that BeautifulSoup collapses when a text run contains nothing else.
+_ASCII_SPACES = "\x20\x0a\x09\x0c\x0d"
+_PRESERVE_WHITESPACE_TAGS = ("pre", "textarea")
+
+# HTML void elements, which never have content. html.parser still nests what
+# follows an unclosed one inside it when the page also writes it as ``<x />``.
+VOID_ELEMENTS = frozenset({
+    "area", "base", "basefont", "bgsound", "br", "col", "command", "embed", "frame", "hr", "image", "img",
+    "input", "isindex", "keygen", "link", "menuitem", "meta", "nextid", "param", "source", "spacer", "track",
+    "wbr",
+})
+
+
+def parse_html(html: Union[str, bytes], parser: Optional[str] = None) -> BeautifulSoup:
+    """Parse ``html`` with ``parser``, falling back to html.parser when lxml is unavailable."""
+    features = parser or DEFAULT_PARSER
+    if features != DEFAULT_PARSER:
+        try:
+            return BeautifulSoup(html, features)
+        except Exception:  # bs4.FeatureNotFound when the optional parser is not installed
+            logger.warning("HTML parser '%s' is not available; using %s", features, DEFAULT_PARSER)
+    return BeautifulSoup(html, DEFAULT_PARSER)
+
+
+def is_decomposed(node) -> bool:
+    """True when ``node`` was destroyed by ``decompose()``."""
+    # Read the flag directly: on a live Tag, a missing attribute falls through
+    # to Tag.__getattr__, which searches the whole subtree for a child tag.
+    return bool(node.__dict__.get("_decomposed", False))
+
+
+def is_detached(node: Tag, parent: Optional[Tag]) -> bool:
+    """True when ``node`` was decomposed or moved away from ``parent``."""
+    return is_decomposed(node) or node.parent is not parent
+
+
+def in_tree(node: Tag, root: Tag) -> bool:
+    """True when ``node`` is still reachable from ``root`` by parent links."""
+    if is_decomposed(node):
+        return False
+    cur = node
+    while cur is not None:
+        if cur is root:
+            return True
+        cur = cur.parent
+    return False
+
+
+def normalize_text_runs(tag: Tag) -> None:
+    """
+    Collapse whitespace-only text between the children of ``tag``.
+
+    Removing an element leaves the text on either side of it adjacent. When the
+    document is parsed, BeautifulSoup turns a whitespace-only run into a single
+    newline (or space), so this gives the tree the shape a serialize/re-parse
+    round trip would, without paying for one.
+    """
+    cur = tag
+    while cur is not None:
+        if cur.name in _PRESERVE_WHITESPACE_TAGS:
+            return
+        cur = cur.parent
+    run: List[NavigableString] = []
+    for child in list(tag.contents) + [None]:
+        if isinstance(child, NavigableString) and not isinstance(child, PreformattedString):
+            run.append(child)
+            continue
+        if run:
+            text = "".join(run)
+            if text and not text.strip(_ASCII_SPACES) and (len(run) > 1 or text not in ("\n", " ")):
+                run[0].replace_with(type(run[0])("\n" if "\n" in text else " "))
+                for extra in run[1:]:
+                    extra.extract()
+            run = []
+
+
+class HtmlVisitor:
+    """Dispatch every element of a tree to the rules registered for its tag name."""
+
+    def __init__(self, timings: Optional[Dict[str, list]] = None) -> None:
+        self._enter: Dict[str, List[Rule]] = defaultdict(list)
+        self._exit: Dict[str, List[Rule]] = defaultdict(list)
+        self.timings = timings
+
+    def on_enter(self, names: Union[str, Iterable[str]], rule: Rule) -> None:
+        """Run ``rule`` when an element named ``names`` is reached, before its children."""
+        for name in ([names] if isinstance(names, str) else names):
+            self._enter[name].append(rule)
+
+    def on_exit(self, names: Union[str, Iterable[str]], rule: Rule) -> None:
+        """Run ``rule`` after the children of an element named ``names`` were visited."""
+        for name in ([names] if isinstance(names, str) else names):
+            self._exit[name].append(rule)
+
+    def walk(self, root: Tag) -> None:
+        """Visit the descendants of ``root`` once, in document order."""
+        # Children are snapshotted per element; a rule that removes an element
+        # (or one of its ancestors) ends the iteration over what is left of it.
+        stack = [(root, iter(list(root.contents)))]
+        while stack:
+            parent, children = stack[-1]
+            if is_decomposed(parent):
+                stack.pop()
+                continue
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+                if parent is not root:
+                    self._run(self._exit, parent)
+                continue
+            if not isinstance(child, Tag) or child.parent is not parent:
+                continue
+            if self._run(self._enter, child):
+                stack.append((child, iter(list(child.contents))))
+
+    def _run(self, table: Dict[str, List[Rule]], node: Tag) -> bool:
+        rules = table.get(node.name)
+        if not rules:
+            return True
+        parent = node.parent
+        for rule in rules:
+            if self.timings is None:
+                rule(node)
+            else:
+                started = time.perf_counter()
+                rule(node)
+                entry = self.timings.setdefault(getattr(rule, "__name__", repr(rule)), [0, 0.0])
+                entry[0] += 1
+                entry[1] += time.perf_counter() - started
+            if is_detached(node, parent):
+                return False
+        return True
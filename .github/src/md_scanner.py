@@ -0,0 +1,172 @@
+"""
+Metadata scanner for Markdown specifications.
+
+The converter needs a few facts from the Markdown source before pandoc runs:
+the meta description, the HTML title (first level-1 heading), where the
+bullet-link table of contents starts and whether it already has a "Table of
+Contents" heading. :func:`scan_markdown` memory-maps the file and finds each of
+them with one regular expression search over the mapped bytes, so every search
+stops at its first match and the file is neither decoded nor split into lines.
+Only the lines that matched are decoded.
+
+The heading list is computed on first access of :attr:`MarkdownScan.headings`,
+because, unlike the other fields, it needs every heading and fence line of the
+file (to skip fenced code blocks); the scan itself stays as cheap as before.
+"""
+
+from __future__ import annotations
+
+import mmap
+import re
+from typing import List, Optional, Tuple, Union
+
+_TITLE_RE = re.compile(rb"^# ", re.MULTILINE)
+# Both description forms, "<!-- ... description: ... -->" and "description: ...", contain this.
+_DESCRIPTION = b"description:"
+# Case-insensitive searches lower-case the buffer in windows of this size; a
+# re.IGNORECASE search is several times slower than bytes.find on the result.
+_WINDOW = 1 << 20
+_TOC_ENTRY_RE = re.compile(rb"^- \[.*\]\(.*\)", re.MULTILINE)
+_TOC_TITLE_RE = re.compile(rb"^\s*#+\s*Table of Contents\s*$", re.IGNORECASE | re.MULTILINE)
+# Lines that open or close a fenced code block, or may be ATX headings.
+_FENCE_OR_HEADING_RE = re.compile(rb"^(?: {0,3}(?:`{3,}|~{3,})|#{1,6}(?![^ \t\r\n#])).*$", re.MULTILINE)
+_FENCE_RE = re.compile(rb"^ {0,3}(`{3,}|~{3,})")
+_ATX_RE = re.compile(rb"^(#{1,6})(?:[ \t]+(.*?))?[ \t#]*$")
+
+TOC_TITLE = b"\n# Table of Contents\n"
+
+Buffer = Union[bytes, mmap.mmap]
+
+
+class MarkdownScan:
+    """Facts about one Markdown source; fields are None when not present."""
+
+    def __init__(self, source: Union[Buffer, str] = b"") -> None:
+        self.description: Optional[str] = None
+        self.title: Optional[str] = None
+        self.toc_line: Optional[int] = None          # 0-based line of the first "- [..](..)" entry
+        self.toc_offset: Optional[int] = None        # byte offset of that line
+        self.toc_title_present = False
+        self._source = source                        # the scanned buffer, or the path of the scanned file
+        self._headings: Optional[List[Tuple[int, int, str]]] = None
+
+    @property
+    def headings(self) -> List[Tuple[int, int, str]]:
+        """(line, level, text) of every ATX heading outside fenced code, in order."""
+        if self._headings is None:
+            if isinstance(self._source, str):
+                self._headings = _map(self._source, _headings)
+            else:
+                self._headings = _headings(self._source)
+        return self._headings
+
+    @property
+    def needs_toc_title(self) -> bool:
+        return self.toc_offset is not None and not self.toc_title_present
+
+
+def _line_at(data: Buffer, start: int) -> str:
+    """The line starting at ``start`` as text-mode reading returns it (with its newline)."""
+    end = data.find(b"\n", start)
+    line = bytes(data[start:end + 1 if end >= 0 else len(data)]).decode("utf-8", errors="replace")
+    return line[:-2] + "\n" if line.endswith("\r\n") else line
+
+
+def _find_lower(data: Buffer, needle: bytes, pos: int) -> int:
+    """Offset of lower-case ``needle`` in ``data`` ignoring ASCII case, or -1."""
+    while pos < len(data):
+        window = data[pos:pos + _WINDOW + len(needle) - 1].lower()
+        at = window.find(needle)
+        if at >= 0:
+            return pos + at
+        pos += _WINDOW
+    return -1
+
+
+def _description(data: Buffer) -> Optional[str]:
+    pos = 0
+    while True:
+        at = _find_lower(data, _DESCRIPTION, pos)
+        if at < 0:
+            return None
+        start = data.rfind(b"\n", 0, at) + 1
+        line = _line_at(data, start)
+        end = data.find(b"\n", at)
+        pos = end + 1 if end >= 0 else len(data)
+        stripped = line.strip()
+        if stripped.startswith("<!--") and "description:" in line.lower():
+            desc_start = line.lower().find("description:") + len("description:")
+            desc_end = line.find("-->")
+            if desc_end > desc_start:
+                return line[desc_start:desc_end].strip()
+        elif stripped.startswith("description:"):
+            return line.split(":", 1)[1].strip().strip('"\'')
+
+
+def _headings(data: Buffer) -> List[Tuple[int, int, str]]:
+    headings = []
+    fence = None
+    line = pos = 0
+    for m in _FENCE_OR_HEADING_RE.finditer(data):
+        line += data[pos:m.start()].count(b"\n")
+        pos = m.start()
+        raw = m.group(0)
+        fm = _FENCE_RE.match(raw)
+        if fm:
+            if fence is None:
+                fence = fm.group(1)
+            elif fm.group(1)[0] == fence[0] and len(fm.group(1)) >= len(fence):
+                fence = None
+            continue
+        if fence is None:
+            hm = _ATX_RE.match(raw.rstrip(b"\r"))
+            if hm:
+                headings.append((line, len(hm.group(1)), (hm.group(2) or b"").decode("utf-8", errors="replace")))
+    return headings
+
+
+def scan_buffer(data: Buffer) -> MarkdownScan:
+    """
+    Scan Markdown held in ``data`` (bytes or an mmap); an mmap must stay open
+    until :attr:`MarkdownScan.headings` has been read.
+    """
+    scan = MarkdownScan(data)
+    scan.description = _description(data)
+    m = _TITLE_RE.search(data)
+    if m:
+        scan.title = _line_at(data, m.start()).strip("# ").strip()
+    m = _TOC_ENTRY_RE.search(data)
+    if m:
+        scan.toc_offset = m.start()
+        scan.toc_line = data[:m.start()].count(b"\n")
+    scan.toc_title_present = _TOC_TITLE_RE.search(data) is not None
+    return scan
+
+
+def _map(path: str, read):
+    """``read(data)`` on the file at ``path``, memory-mapped."""
+    with open(path, "rb") as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file
+            return read(b"")
+        with data:
+            return read(data)
+
+
+def scan_markdown(path: str) -> MarkdownScan:
+    """
+    Scan the Markdown file at ``path``, memory-mapped; raises OSError when it cannot be read.
+    :attr:`MarkdownScan.headings` maps the file again when it is first read.
+    """
+    scan = _map(path, scan_buffer)
+    scan._source = path
+    return scan
+
+
+def with_toc_title(data: bytes, scan: Optional[MarkdownScan] = None) -> Optional[bytes]:
+    """``data`` with a "Table of Contents" heading before a TOC that lacks one, else None."""
+    scan = scan or scan_buffer(data)
+    if not scan.needs_toc_title:
+        return None
+    return data[:scan.toc_offset] + TOC_TITLE + data[scan.toc_offset:]
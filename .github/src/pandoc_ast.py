@@ -0,0 +1,380 @@
+"""
+Pandoc JSON-AST pipeline for the structural HTML fixes.
+
+The BeautifulSoup post-processing parses the page pandoc just wrote and undoes
+part of it: it drops the ``--toc`` navigation and the title block, strips
+heading anchors that repeat the heading id, removes logo figures, and rewrites
+link and image URLs. :class:`AstPipeline` applies the same rules to the
+document pandoc parsed (``pandoc -t json``) and renders HTML once
+(``pandoc -f json``), without a TOC and without a title block, so no HTML is
+parsed at all.
+
+The URL rules are the converter's own methods, run on detached tags built from
+AST link and image targets (and from ``<a>``, ``<img>``, ``<link>`` and
+``<script>`` tags in raw HTML), so both pipelines make the same decisions.
+Documents whose raw HTML holds elements these rules cannot see from the AST
+(paragraphs, headings, figures, logo images, ...) raise :class:`AstUnsupported`
+and go through the BeautifulSoup pipeline instead.
+
+The page is equivalent to the BeautifulSoup result, not byte-identical:
+pandoc serializes the markup, not BeautifulSoup.
+"""
+
+from __future__ import annotations
+
+import html
+import json
+import logging
+import os
+import re
+import subprocess
+from typing import Iterator, List, Optional, Tuple
+
+from bs4 import BeautifulSoup, Tag
+
+from html_visitor import is_decomposed
+
+logger = logging.getLogger(__name__)
+
+# Raw HTML tags whose URLs are rewritten, and raw HTML the AST rules cannot handle.
+_RAW_URL_TAG_RE = re.compile(r"<(a|img|link|script)\b[^>]*>", re.IGNORECASE)
+_RAW_UNSUPPORTED_RE = re.compile(r"<(?:p|figure|nav|header|base|h[1-6]|h1big)[\s>/]", re.IGNORECASE)
+_RAW_LOGO_RE = re.compile(r"<img\b[^>]*(?:OASISLogo|OASIS Logo)", re.IGNORECASE)
+_RAW_ANCHOR_RE = re.compile(r"<a\b[^>]*>$", re.IGNORECASE)
+_RAW_ATTR_RE = re.compile(r"""([^\s"'>/=]+)(?:\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+)))?""")
+# The <title> of the rendered page.
+_TITLE_RE = re.compile(r"(<title>)(.*?)(</title>)", re.DOTALL)
+_TEXT_NODES = {"Str", "Space", "SoftBreak"}
+# Nodes without children, and nodes whose only children sit at one index of their content.
+_LEAVES = {"Str", "Space", "SoftBreak", "LineBreak", "Code", "Math", "RawInline", "RawBlock",
+           "CodeBlock", "HorizontalRule"}
+_CONTENT_AT = {"Header": 2, "Link": 1, "Image": 1, "Span": 1, "Div": 1}
+
+BANNER_HR = '<hr style="page-break-before: avoid" />'
+
+
+class AstUnsupported(RuntimeError):
+    """The document needs the BeautifulSoup pipeline."""
+
+
+# -------------------- AST helpers --------------------
+
+def _is_node_list(value) -> bool:
+    # Quoted, Cite and ordered-list attributes mix tag dicts with other values at one end.
+    return (isinstance(value, list) and bool(value) and isinstance(value[0], dict) and "t" in value[0]
+            and isinstance(value[-1], dict))
+
+
+def iter_nodes(root) -> Iterator[dict]:
+    """Every AST node below ``root``, in document order."""
+    stack = [root]
+    while stack:
+        cur = stack.pop()
+        if isinstance(cur, dict):
+            if "t" in cur:
+                yield cur
+            c = cur.get("c")
+            if isinstance(c, (list, dict)):
+                stack.append(c)
+        elif isinstance(cur, list):
+            stack.extend(reversed([e for e in cur if isinstance(e, (list, dict))]))
+
+
+def stringify(inlines: list) -> str:
+    """Plain text of ``inlines``, as it appears in an alt attribute."""
+    out = []
+    for node in iter_nodes(inlines):
+        t = node["t"]
+        if t == "Str":
+            out.append(node["c"])
+        elif t in ("Code", "Math"):
+            out.append(node["c"][1])
+        elif t in ("Space", "SoftBreak"):
+            out.append(" ")
+        elif t == "LineBreak":
+            out.append("\n")
+    return "".join(out)
+
+
+def _raw_html(node: dict) -> Optional[str]:
+    if node["t"] in ("RawInline", "RawBlock") and node["c"][0].lower() == "html":
+        return node["c"][1]
+    return None
+
+
+def parse_start_tag(raw: str) -> Tuple[str, dict]:
+    """Name and attributes of the HTML start tag ``raw`` (multi-valued ``class``/``rel`` as lists)."""
+    name, _, rest = raw[1:].rstrip(">").rstrip("/").partition(" ")
+    attrs = {}
+    for m in _RAW_ATTR_RE.finditer(rest):
+        value = next((v for v in m.group(2, 3, 4) if v is not None), "")
+        key = m.group(1).lower()
+        attrs.setdefault(key, html.unescape(value).split() if key in ("class", "rel") else html.unescape(value))
+    return name.lower(), attrs
+
+
+def _attr_html(name: str, attrs: dict, self_closing: bool = False) -> str:
+    parts = [name]
+    for key, value in attrs.items():
+        if isinstance(value, list):
+            value = " ".join(value)
+        parts.append('%s="%s"' % (key, html.escape(value, quote=True)))
+    return "<%s%s>" % (" ".join(parts), " /" if self_closing else "")
+
+
+# -------------------- pipeline --------------------
+
+class AstPipeline:
+    """Render one converter's Markdown through the pandoc AST; see the module docstring."""
+
+    def __init__(self, converter) -> None:
+        self.converter = converter
+        self.output_basename = os.path.basename(converter.output_file)
+        self._factory = BeautifulSoup("", "html.parser")
+        self._canonical: Optional[dict] = None
+        self._images: List[Tuple[dict, Tag]] = []   # AST images and their detached <img> tags
+        self._raw: List[dict] = []                   # raw HTML nodes with URL-bearing tags
+        self._autolinks: set = set()                 # ids of links created by _autolink
+
+    def _pandoc(self, args: List[str], text: str) -> str:
+        cmd = ["pandoc"] + args
+        logger.debug("Pandoc command: %s", " ".join(cmd))
+        with self.converter.tracer.span("pandoc %s -> %s" % (args[1].split("+")[0], args[3]), profile=True, bytes_in=text) as span:
+            result = subprocess.run(cmd, input=text, capture_output=True, text=True, encoding="utf-8")
+            span["bytes_out"] = result.stdout
+        if result.returncode != 0:
+            raise subprocess.CalledProcessError(result.returncode, cmd, result.stdout, result.stderr)
+        if result.stderr:
+            logger.warning("pandoc: %s", result.stderr.strip())
+        return result.stdout
+
+    def _tag(self, name: str, attrs: dict) -> Tag:
+        return self._factory.new_tag(name, attrs=attrs)
+
+    def render(self, markdown: str, step: int) -> str:
+        """Return the finished page; raises AstUnsupported before any asset is localized."""
+        conv = self.converter
+        logger.info("Step %s: Running pandoc through the JSON AST.", step)
+        doc = json.loads(self._pandoc(["-f", conv.pandoc_reader, "-t", "json"], markdown))
+        blocks = doc["blocks"]
+
+        logger.info("Step %s: Applying structural fixes to the AST.", step + 1)
+        with conv.tracer.span("ast fixes", profile=True):
+            self._canonical = self._canonical_logo(blocks)
+            self._walk(blocks)
+            if self._canonical is None:
+                self._insert_canonical_logo(blocks)
+            self._fix_top_banner(blocks)
+        with conv.tracer.span("localize assets", cat="post-process"):
+            css_ref = self._localize()
+
+        # The BeautifulSoup pipeline drops the title block; without a title
+        # pandoc does not write one, and pagetitle still fills <title>.
+        doc["meta"].pop("title", None)
+        page = self._pandoc(["-f", "json", "-t", "html", "-s", "-c", css_ref,
+                             "--metadata", f"pagetitle={conv.html_title}"], json.dumps(doc))
+        # pandoc line-wraps pagetitle like body text; the default pipeline's <title> is one line.
+        page = _TITLE_RE.sub(lambda m: m.group(1) + re.sub(r"\s*\n\s*", " ", m.group(2)) + m.group(3),
+                             page, count=1)
+        meta = '<meta name="description" content="%s"/>' % html.escape(conv.meta_description, quote=True)
+        return page.replace("<head>\n", "<head>\n" + meta, 1)
+
+    def _walk(self, value) -> None:
+        """One pass over the tree: fix every node list, then descend into what is kept."""
+        if isinstance(value, dict):
+            t = value.get("t")
+            if t in _CONTENT_AT:
+                self._walk(value["c"][_CONTENT_AT[t]])
+            elif isinstance(value.get("c"), list):
+                self._walk(value["c"])
+            return
+        if _is_node_list(value):
+            value[:] = self._fix_list(value)
+        for e in value:
+            if isinstance(e, list) or (isinstance(e, dict) and e.get("t") not in _LEAVES):
+                self._walk(e)
+
+    # -------------------- structural rules --------------------
+
+    def _canonical_logo(self, blocks: list) -> Optional[dict]:
+        """The image of a logo paragraph that already opens the body, if any."""
+        if blocks and blocks[0]["t"] == "Para":
+            for node in blocks[0]["c"]:
+                if node["t"] == "Image" and self._is_good_logo(node):
+                    return node
+        return None
+
+    def _is_good_logo(self, image: dict) -> bool:
+        return self.converter._looks_like_logo_src(image["c"][2][0]) and stringify(image["c"][1]) == "OASIS Logo"
+
+    def _is_stray_logo(self, image: dict) -> bool:
+        if image is self._canonical:
+            return False
+        return "OASISLogo" in image["c"][2][0] or stringify(image["c"][1]).strip() == "OASIS Logo"
+
+    def _fix_list(self, nodes: list) -> list:
+        out = []
+        for node in nodes:
+            t = node["t"]
+            if t == "Figure":
+                image = next((n for n in iter_nodes(node["c"][2]) if n["t"] == "Image"), None)
+                if image is not None and self.converter._looks_like_logo_src(image["c"][2][0]):
+                    continue
+            elif t in ("Para", "Plain"):
+                inlines = node["c"]
+                if any(n["t"] == "Image" and self._is_stray_logo(n) for n in inlines):
+                    if all(n["t"] in ("Image", "Space", "SoftBreak") for n in inlines):
+                        continue
+                    node["c"] = inlines = [n for n in inlines if n["t"] != "Image" or not self._is_stray_logo(n)]
+                if t == "Para":
+                    node["c"] = self._autolink(inlines)
+            elif t == "Image":
+                if self._is_stray_logo(node):
+                    continue
+                img = self._tag("img", dict(node["c"][0][2], src=node["c"][2][0]))
+                self._images.append((node, img))
+            elif t == "Link":
+                if id(node) not in self._autolinks:
+                    self._fix_link(node)
+            elif t == "Header":
+                self._dedupe_heading_anchors(node)
+            elif t in ("RawInline", "RawBlock"):
+                raw = _raw_html(node)
+                if raw and (_RAW_UNSUPPORTED_RE.search(raw) or _RAW_LOGO_RE.search(raw)):
+                    raise AstUnsupported("raw HTML %r" % raw[:60])
+                if raw and _RAW_URL_TAG_RE.search(raw):
+                    self._raw.append(node)
+            out.append(node)
+        return out
+
+    def _dedupe_heading_anchors(self, header: dict) -> None:
+        """Drop anchors that repeat the heading id, keeping their text (``_remove_duplicate_heading_anchors``)."""
+        heading_id = header["c"][1][0]
+        if not heading_id:
+            return
+        inlines = header["c"][2]
+        out, i = [], 0
+        while i < len(inlines):
+            node = inlines[i]
+            raw = _raw_html(node)
+            if raw and _RAW_ANCHOR_RE.match(raw) and parse_start_tag(raw)[1].get("id") == heading_id:
+                close = next((j for j in range(i + 1, len(inlines)) if (_raw_html(inlines[j]) or "").lower() == "</a>"), None)
+                if close is not None:
+                    out += self._anchor_text(inlines[i + 1:close])
+                    i = close + 1
+                    continue
+            if node["t"] == "Link" and node["c"][0][0] == heading_id:
+                out += self._anchor_text(node["c"][1])
+                i += 1
+                continue
+            out.append(node)
+            i += 1
+        header["c"][2] = out
+
+    @staticmethod
+    def _anchor_text(inlines: list) -> list:
+        # BeautifulSoup keeps the text of an anchor holding a single string, and drops anything richer.
+        return inlines if all(n["t"] in _TEXT_NODES for n in inlines) else []
+
+    def _autolink(self, inlines: list) -> list:
+        """Link bare URLs in a paragraph of plain text (``_convert_plain_urls_to_links``)."""
+        if not all(n["t"] in _TEXT_NODES for n in inlines):
+            return inlines
+        if not any("http" in n["c"] for n in inlines if n["t"] == "Str"):
+            return inlines
+        out = []
+        for node in inlines:
+            if node["t"] != "Str" or "http" not in node["c"]:
+                out.append(node)
+                continue
+            for i, part in enumerate(self.converter._url_re.split(node["c"])):
+                if i % 2:
+                    a = self._tag("a", {"href": part})
+                    self.converter._relativize_same_scope_link(a)
+                    link = {"t": "Link", "c": [["", [], []], [{"t": "Str", "c": part}], [a["href"], ""]]}
+                    self._autolinks.add(id(link))
+                    out.append(link)
+                elif part:
+                    out.append({"t": "Str", "c": part})
+        return out
+
+    def _insert_canonical_logo(self, blocks: list) -> None:
+        alt = [{"t": "Str", "c": "OASIS"}, {"t": "Space"}, {"t": "Str", "c": "Logo"}]
+        image = {"t": "Image", "c": [["", [], []], alt, [self.converter.logo_canonical_remote, ""]]}
+        blocks.insert(0, {"t": "Para", "c": [image]})
+        self._images.insert(0, (image, self._tag("img", {"src": image["c"][2][0]})))
+
+    def _fix_top_banner(self, blocks: list) -> None:
+        """``_fix_top_banner_block``: no rules between logo and title, one styled rule, <h1big> title."""
+        first_heading = next((n for n, b in enumerate(blocks[1:], start=1) if b["t"] == "Header"), None)
+        if first_heading is None:
+            logger.warning("Could not find a heading after the OASIS logo. Skipping banner fix.")
+            return
+        blocks[1:first_heading] = [b for b in blocks[1:first_heading] if b["t"] != "HorizontalRule"]
+        if blocks[1]["t"] != "Header" and (_raw_html(blocks[1]) or "").strip() != BANNER_HR:
+            blocks.insert(1, {"t": "RawBlock", "c": ["html", BANNER_HR]})
+        first_heading = next(n for n, b in enumerate(blocks[1:], start=1) if b["t"] == "Header")
+        level, (ident, classes, kvs), inlines = blocks[first_heading]["c"]
+        if level == 1:
+            attrs = {}
+            if ident:
+                attrs["id"] = ident
+            if classes:
+                attrs["class"] = classes
+            attrs.update(kvs)
+            blocks[first_heading] = {"t": "Plain", "c": [{"t": "RawInline", "c": ["html", _attr_html("h1big", attrs)]}]
+                                     + inlines + [{"t": "RawInline", "c": ["html", "</h1big>"]}]}
+
+    # -------------------- URLs and assets --------------------
+
+    def _fix_link(self, node: dict) -> None:
+        a = self._tag("a", dict(node["c"][0][2], href=node["c"][2][0]))
+        self.converter._normalize_same_doc_anchor_for_web(a, self.output_basename)
+        self.converter._relativize_same_scope_link(a)
+        node["c"][2][0] = a["href"]
+        node["c"][0][2] = [[k, v] for k, v in a.attrs.items() if k != "href"]
+
+    def _localize(self) -> str:
+        """Apply the link rules to raw HTML and localize assets; returns the stylesheet reference."""
+        conv = self.converter
+        css_link = self._tag("link", {"rel": "stylesheet", "href": conv.css_ref_for_pandoc})
+        links, imgs = [css_link], [img for _, img in self._images]
+        raw_parts = []
+        for node in self._raw:
+            parts = []
+            for m in _RAW_URL_TAG_RE.finditer(node["c"][1]):
+                name, attrs = parse_start_tag(m.group(0))
+                tag = self._tag(name, attrs)
+                if name == "a" and tag.has_attr("href"):
+                    conv._normalize_same_doc_anchor_for_web(tag, self.output_basename)
+                    conv._relativize_same_scope_link(tag)
+                elif name == "img" and tag.has_attr("src"):
+                    imgs.append(tag)
+                elif name == "link" and tag.has_attr("href"):
+                    links.append(tag)
+                elif name == "script":
+                    conv._relativize_same_scope_link(tag)
+                parts.append((m, tag))
+            raw_parts.append((node, parts))
+
+        conv._localize_assets(links if conv.localize_css else None, imgs)
+        for tag in links + imgs:
+            if not is_decomposed(tag):
+                conv._relativize_same_scope_link(tag)
+
+        for node, img in self._images:
+            if is_decomposed(img):
+                node["t"], node["c"] = "Str", ""
+            else:
+                node["c"][2][0] = img["src"]
+                node["c"][0][2] = [[k, v] for k, v in img.attrs.items() if k != "src"]
+        for node, parts in raw_parts:
+            raw = node["c"][1]
+            out, last = [], 0
+            for m, tag in parts:
+                out.append(raw[last:m.start()])
+                if not is_decomposed(tag):
+                    out.append(_attr_html(tag.name, tag.attrs, m.group(0).endswith("/>")))
+                last = m.end()
+            node["c"][1] = "".join(out) + raw[last:]
+        return css_link["href"]
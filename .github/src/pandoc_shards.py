@@ -0,0 +1,498 @@
+"""
+Section-sharded pandoc conversion.
+
+:class:`ShardedPandoc` splits a Markdown document at its top-level headings,
+converts the shards concurrently and stitches the HTML fragments into the
+standalone page a single ``pandoc -s --toc`` run would produce:
+
+- reference link definitions, footnote definitions and implicit heading
+  references are copied into every shard, so they resolve across shards;
+- heading identifiers (including the ``-1``, ``-2`` suffixes pandoc adds to
+  duplicates) are taken from one pandoc run over the headings alone and pinned
+  in each shard with ``{#id}`` attributes; the same run provides the page
+  template and table of contents;
+- footnote and highlighted code block numbering is continued across shards
+  by prefixing a shard with padding notes and code blocks that are dropped
+  again after rendering, so that pandoc's own line wrapping of the numbered
+  links is preserved; the padding is estimated from the Markdown and checked
+  against a probe block rendered at the end of each shard;
+- every rendered shard is cached by the hash of its pandoc input, so editing
+  one section re-renders only that section.
+
+When a document cannot be sharded faithfully (for instance because it uses
+headings the splitter does not recognize) :class:`ShardingError` is raised and
+the caller runs pandoc on the whole document instead.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import html
+import logging
+import os
+import re
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_FENCE_RE = re.compile(r"^ {0,3}(`{3,}|~{3,})")
+_DASHES_RE = re.compile(r"^-{3,}[ \t]*$")
+_DIV_OPEN_RE = re.compile(r"^(?::{3,}[ \t]*[^:\s]|<div[\s>])")
+_DIV_CLOSE_RE = re.compile(r"^(?::{3,}[ \t]*$|</div>)")
+_ATX_RE = re.compile(r"^(#{1,6})(?:[ \t]+|$)")
+_REFDEF_RE = re.compile(r"^ {0,3}\[(?!\^)([^\]]+)\]:")
+_NOTEDEF_RE = re.compile(r"^ {0,3}\[\^([^\]\s]+)\]:")
+_ATTR_RE = re.compile(r"[ \t]*\{([^{}]*)\}[ \t]*$")
+_CLOSING_HASHES_RE = re.compile(r"[ \t]+#+[ \t]*$")
+_HEADING_ID_RE = re.compile(r'<h[1-6](?=[\s>])[^>]*?\sid="([^"]*)"')
+_NOTES_SECTION_RE = re.compile(r'<(?:section|div)\b[^>]*\bfootnotes\b[^>]*>\s*<hr />\s*<ol>\n')
+_NOTE_ITEM_RE = re.compile(r'^<li id="fn\d+"', re.MULTILINE)
+_NOTE_REF_RE = re.compile(r'class="footnote-ref"')
+_NOTE_ID_RE = re.compile(r'<li id="fn(\d+)"')
+_NOTE_USE_RE = re.compile(r"\[\^[^\]\s]+\](?!:)|\^\[")
+_CODE_ID_RE = re.compile(r'<div class="sourceCode" id="cb(\d+)"')
+
+# Scaffolding around each shard: padding that continues the footnote and code
+# block numbering of earlier shards, and a probe code block whose number tells
+# how many code block numbers the shard consumed. Both are removed after rendering.
+_PAD_LABEL = "shardpad%d"
+_PAD_CODE = "```\nshardpad\n```"
+_PAD_END = "SHARDPADEND"
+_PROBE_START, _PROBE_END = "SHARDPROBESTART", "SHARDPROBEEND"
+_PROBE = "%s\n\n```yaml\nshardprobe\n```\n\n%s" % (_PROBE_START, _PROBE_END)
+
+# Rendered shards that were not used for this long are removed from the cache.
+SHARD_CACHE_MAX_AGE = 30 * 24 * 3600
+
+
+class ShardingError(RuntimeError):
+    """The document cannot be converted shard by shard without changing the output."""
+
+
+def _is_attr_block(inner: str) -> bool:
+    tokens = inner.split()
+    return bool(tokens) and all(t[0] in "#." or "=" in t or t == "-" for t in tokens)
+
+
+def _heading_label(line: str) -> str:
+    """Source text of an ATX heading, without markers, closing hashes and attributes."""
+    text = _ATX_RE.sub("", line.rstrip("\r\n"), count=1)
+    m = _ATTR_RE.search(text)
+    if m and _is_attr_block(m.group(1)):
+        text = text[:m.start()]
+    return _CLOSING_HASHES_RE.sub("", text).strip()
+
+
+def _normalize_label(text: str) -> str:
+    return " ".join(text.split()).casefold()
+
+
+def _pin_heading_id(line: str, ident: str) -> str:
+    """Return the heading ``line`` with an explicit ``{#ident}`` unless it already has an id."""
+    body = line.rstrip("\r\n")
+    ending = line[len(body):]
+    m = _ATTR_RE.search(body)
+    if m and _is_attr_block(m.group(1)):
+        if any(t.startswith("#") for t in m.group(1).split()):
+            return line
+        start = m.start(1)
+        return body[:start] + "#" + ident + " " + body[start:] + ending
+    return body + " {#" + ident + "}" + ending
+
+
+class MarkdownLayout:
+    """Block structure of a Markdown document that matters for sharding."""
+
+    def __init__(self, text: str) -> None:
+        self.lines = text.splitlines(keepends=True)
+        self.front_matter_end = self._front_matter_end()
+        self.headings: List[Tuple[int, int]] = []       # (line index, level)
+        self.split_points: List[int] = []                # top-level headings outside of divs
+        self.fences: List[Tuple[int, str]] = []          # (line index, info string) of fenced code
+        self.definitions: List[Tuple[int, int, str, str]] = []  # (start, end, "ref" | "note", label)
+        self._scan()
+
+    def _front_matter_end(self) -> int:
+        lines = self.lines
+        if lines and lines[0].rstrip() == "---":
+            for i in range(1, len(lines)):
+                if lines[i].rstrip() in ("---", "..."):
+                    return i + 1
+            return 0
+        i = 0
+        while i < len(lines) and (lines[i].startswith("%") or (i and lines[i][:1] in (" ", "\t") and lines[i].strip())):
+            i += 1
+        return i
+
+    def _note_end(self, start: int) -> int:
+        lines, j = self.lines, start + 1
+        while j < len(lines):
+            line = lines[j]
+            if not line.strip():
+                k = j
+                while k < len(lines) and not lines[k].strip():
+                    k += 1
+                if k < len(lines) and (lines[k].startswith("    ") or lines[k].startswith("\t")):
+                    j = k
+                    continue
+                break
+            if line.startswith("    ") or line.startswith("\t"):
+                j += 1
+                continue
+            if _ATX_RE.match(line) or _REFDEF_RE.match(line) or _NOTEDEF_RE.match(line) or _FENCE_RE.match(line):
+                break
+            j += 1  # lazy continuation of the first paragraph
+        return j
+
+    def _ref_end(self, start: int) -> int:
+        lines, j = self.lines, start + 1
+        rest = lines[start][_REFDEF_RE.match(lines[start]).end():].strip()
+        if not rest and j < len(lines) and lines[j].strip():
+            j += 1  # URL on the next line
+        if j < len(lines) and lines[j][:1] in (" ", "\t") and lines[j].strip()[:1] in ("\"", "'", "("):
+            j += 1  # title on the next line
+        return j
+
+    def _scan(self) -> None:
+        lines = self.lines
+        fence: Optional[str] = None
+        in_comment = comment_is_block = in_table = False
+        can_start = True  # a block may begin on this line
+        div_depth = 0
+        i = self.front_matter_end
+        while i < len(lines):
+            line = lines[i].rstrip("\r\n")
+            next_blank = i + 1 >= len(lines) or not lines[i + 1].strip()
+            if in_table:
+                # A multiline table ends with a row of dashes followed by a blank line.
+                in_table = not (_DASHES_RE.match(line) and next_blank)
+                i += 1
+                continue
+            if fence:
+                m = _FENCE_RE.match(line)
+                if m and m.group(1)[0] == fence[0] and len(m.group(1)) >= len(fence) and not line[m.end():].strip():
+                    fence = None
+                    can_start = True
+                i += 1
+                continue
+            if in_comment:
+                # A comment that opened a block is a raw HTML block; another block may follow it.
+                in_comment = "-->" not in line
+                can_start = not in_comment and comment_is_block
+                i += 1
+                continue
+            if not line.strip():
+                can_start = True
+                i += 1
+                continue
+            m = _FENCE_RE.match(line)
+            if m:
+                fence = m.group(1)
+                self.fences.append((i, line[m.end():].strip()))
+                i += 1
+                continue
+            if _DIV_OPEN_RE.match(line):
+                div_depth += 1
+            elif _DIV_CLOSE_RE.match(line):
+                div_depth = max(0, div_depth - 1)
+            if can_start:
+                h = _ATX_RE.match(line)
+                if h:
+                    self.headings.append((i, len(h.group(1))))
+                    if len(h.group(1)) == 1 and not div_depth:
+                        self.split_points.append(i)
+                    i += 1
+                    continue
+                if _DASHES_RE.match(line) and not next_blank:
+                    in_table = True
+                    i += 1
+                    continue
+                d = _NOTEDEF_RE.match(line)
+                if d:
+                    end = self._note_end(i)
+                    self.definitions.append((i, end, "note", d.group(1)))
+                    i = end
+                    continue
+                d = _REFDEF_RE.match(line)
+                if d:
+                    end = self._ref_end(i)
+                    self.definitions.append((i, end, "ref", d.group(1)))
+                    i = end
+                    continue
+            if line.rfind("<!--") > line.rfind("-->"):
+                in_comment = True
+                comment_is_block = can_start and line.lstrip().startswith("<!--")
+            can_start = False
+            i += 1
+
+    def text(self, start: int, end: int) -> str:
+        return "".join(self.lines[start:end])
+
+
+class ShardedPandoc:
+    """Convert Markdown with one pandoc process per top-level section."""
+
+    def __init__(
+        self,
+        reader: str,
+        standalone_args: List[str],
+        cache_dir: Optional[str] = None,
+        workers: Optional[int] = None,
+        pandoc: str = "pandoc",
+    ) -> None:
+        self.reader = reader
+        self.standalone_args = list(standalone_args)
+        self.cache_dir = cache_dir
+        self.workers = workers or os.cpu_count() or 1
+        self.pandoc = pandoc
+        self.stats: Dict[str, int] = {"rendered": 0, "cached": 0}
+        self._lock = threading.Lock()
+        self._version: Optional[str] = None
+
+    # -------------------- pandoc and cache --------------------
+
+    def _pandoc_version(self) -> str:
+        if self._version is None:
+            out = subprocess.run([self.pandoc, "--version"], capture_output=True, text=True, check=True).stdout
+            self._version = out.splitlines()[0] if out else ""
+        return self._version
+
+    def _render(self, text: str, standalone: bool = False) -> str:
+        args = [self.pandoc, "-f", self.reader, "-t", "html"] + (self.standalone_args if standalone else [])
+        key = hashlib.sha256("\0".join([self._pandoc_version()] + args + [text]).encode("utf-8")).hexdigest()
+        path = os.path.join(self.cache_dir, key[:2], key + ".html") if self.cache_dir else None
+        if path and os.path.exists(path):
+            os.utime(path)
+            with self._lock:
+                self.stats["cached"] += 1
+            with open(path, "r", encoding="utf-8") as f:
+                return f.read()
+        result = subprocess.run(args, input=text, capture_output=True, text=True, encoding="utf-8")
+        if result.returncode != 0:
+            raise subprocess.CalledProcessError(result.returncode, args, result.stdout, result.stderr)
+        with self._lock:
+            self.stats["rendered"] += 1
+        if path:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(result.stdout)
+            os.replace(tmp, path)
+        return result.stdout
+
+    def prune_cache(self, max_age: float = SHARD_CACHE_MAX_AGE) -> None:
+        """Delete rendered shards that were not used within ``max_age`` seconds."""
+        if not self.cache_dir or not os.path.isdir(self.cache_dir):
+            return
+        cutoff = time.time() - max_age
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+
+    # -------------------- sharding --------------------
+
+    @staticmethod
+    def _split(layout: MarkdownLayout) -> Tuple[List[List[int]], List[Tuple[str, str]]]:
+        """Return the line numbers of each shard and ``(key, text)`` of the shared definitions."""
+        in_definition = [False] * len(layout.lines)
+        shared = []
+        for start, end, kind, label in layout.definitions:
+            key = ("[^%s]" if kind == "note" else "[%s]") % _normalize_label(label)
+            shared.append((key, layout.text(start, end).rstrip("\r\n") + "\n"))
+            for i in range(start, end):
+                in_definition[i] = True
+        bounds = layout.split_points
+        starts, ends = [0] + bounds, bounds + [len(layout.lines)]
+        shards = [[i for i in range(start, end) if not in_definition[i]] for start, end in zip(starts, ends)]
+        return shards, shared
+
+    @staticmethod
+    def _implicit_references(layout: MarkdownLayout, ids: List[str]) -> List[Tuple[str, str]]:
+        """Reference definitions standing in for pandoc's implicit heading references."""
+        seen = {"[%s]" % _normalize_label(label) for _, _, kind, label in layout.definitions if kind == "ref"}
+        refs = []
+        for (i, _), ident in zip(layout.headings, ids):
+            label = _heading_label(layout.lines[i])
+            key = "[%s]" % _normalize_label(label)
+            # Like pandoc, the first of several headings with the same text wins.
+            if label and "]" not in label and key not in seen:
+                seen.add(key)
+                refs.append((key, "[%s]: #%s\n" % (label, ident)))
+        return refs
+
+    @staticmethod
+    def _definitions_for(text: str, definitions: List[Tuple[str, str]]) -> str:
+        """
+        The definitions whose label occurs in ``text`` (or in a definition already chosen).
+
+        Unused definitions render nothing, but pandoc pays for parsing every one of
+        them, so each shard only carries the ones it can refer to.
+        """
+        haystack = _normalize_label(text)
+        chosen = [False] * len(definitions)
+        found = True
+        while found:
+            found = False
+            for n, (key, block) in enumerate(definitions):
+                if not chosen[n] and key in haystack:
+                    chosen[n] = found = True
+                    haystack += " " + _normalize_label(block)
+        return "\n".join(block for (_, block), use in zip(definitions, chosen) if use)
+
+    def _source(self, text: str, definitions: str, notes: int = 0, code_blocks: int = 0) -> str:
+        """Pandoc input for one shard, numbered after ``notes`` footnotes and ``code_blocks`` code blocks."""
+        pad = []
+        if notes:
+            pad.append("".join("[^%s]" % (_PAD_LABEL % k) for k in range(notes)))
+        pad += [_PAD_CODE] * code_blocks
+        head = "\n\n".join(pad + [_PAD_END]) + "\n\n" if pad else ""
+        tail = "".join("[^%s]: -\n" % (_PAD_LABEL % k) for k in range(notes))
+        return head + text + "\n\n" + _PROBE + "\n\n" + definitions + "\n" + tail
+
+    @staticmethod
+    def _unwrap(fragment: str, padded: bool, notes: int = 0) -> Tuple[str, int]:
+        """Strip the scaffolding from a rendered shard; returns the body and the probe's code block number."""
+        if padded:
+            marker = "<p>%s</p>\n" % _PAD_END
+            fragment = fragment[fragment.index(marker) + len(marker):]
+        start = fragment.index("<p>%s</p>\n" % _PROBE_START)
+        marker = "<p>%s</p>\n" % _PROBE_END
+        end = fragment.index(marker, start) + len(marker)
+        probe = _CODE_ID_RE.search(fragment, start, end)
+        fragment = fragment[:start] + fragment[end:]
+        if notes:
+            # The notes section closes the fragment; drop it when only padding notes are in it.
+            m = _NOTES_SECTION_RE.search(fragment)
+            items = list(_NOTE_ITEM_RE.finditer(fragment, m.end()))
+            if len(items) > notes:
+                fragment = fragment[:m.end()] + fragment[items[notes].start():]
+            else:
+                fragment = fragment[:m.start()]
+        return fragment, int(probe.group(1)) if probe else 1
+
+    @staticmethod
+    def _estimate(layout: MarkdownLayout, shard: List[int], text: str) -> Tuple[int, int, bool]:
+        """Guess the footnotes and code blocks of a shard, and whether their numbers show in the HTML."""
+        lines = set(shard)
+        fences = [info for i, info in layout.fences if i in lines and "#" not in info]
+        notes = len(_NOTE_USE_RE.findall(text))
+        return notes, len(fences), bool(notes) or any(fences)
+
+    @staticmethod
+    def _offsets(counts: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+        """Footnotes and code blocks that precede each shard."""
+        offsets, notes, code_blocks = [], 0, 0
+        for n, c in counts:
+            offsets.append((notes, code_blocks))
+            notes, code_blocks = notes + n, code_blocks + c
+        return offsets
+
+    def convert(self, markdown: str) -> str:
+        """Return the standalone HTML for ``markdown``; raises :class:`ShardingError` when unsupported."""
+        layout = MarkdownLayout(markdown)
+        if len(layout.split_points) < 2:
+            raise ShardingError("fewer than two top-level sections")
+        shards, shared = self._split(layout)
+        headings = "".join(layout.lines[i].rstrip("\r\n") + "\n\n" for i, _ in layout.headings)
+        heading_definitions = self._definitions_for(headings, shared)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            ids = [html.unescape(i) for i in _HEADING_ID_RE.findall(self._render(headings + heading_definitions))]
+            if len(ids) != len(layout.headings):
+                raise ShardingError("heading identifiers do not line up (%d vs %d)" % (len(ids), len(layout.headings)))
+
+            pinned = {i: _pin_heading_id(layout.lines[i], ident) for (i, _), ident in zip(layout.headings, ids)}
+            definitions = shared + self._implicit_references(layout, ids)
+            texts, shard_definitions = [], []
+            for shard in shards:
+                texts.append("".join(pinned.get(i, layout.lines[i]) for i in shard))
+                shard_definitions.append(self._definitions_for(texts[-1], definitions))
+
+            def submit(n: int, offset: Optional[Tuple[int, int]]):
+                source = self._source(texts[n], shard_definitions[n], *offset) if offset else \
+                    self._source(texts[n], shard_definitions[n])
+                return pool.submit(self._render, source), offset
+
+            # Footnotes and code blocks are numbered across the whole document. Each
+            # shard is rendered behind padding for the numbers its predecessors are
+            # estimated to use; the probes then give the exact counts, and shards
+            # whose visible numbers were offset wrongly are rendered once more.
+            estimates = [self._estimate(layout, shard, texts[n]) for n, shard in enumerate(shards)]
+            guessed = self._offsets([(notes, code) for notes, code, _ in estimates])
+            jobs = [submit(n, guessed[n] if estimates[n][2] and any(guessed[n]) else None) for n in range(len(shards))]
+            fragments, counts, used = [], [], []
+            for future, offset in jobs:
+                notes_offset, code_offset = offset or (0, 0)
+                fragment, probe = self._unwrap(future.result(), offset is not None, notes_offset)
+                fragments.append(fragment)
+                counts.append((len(_NOTE_REF_RE.findall(fragment)), probe - 1 - code_offset))
+                used.append((notes_offset, code_offset))
+            exact = self._offsets(counts)
+            jobs = {}
+            for n, fragment in enumerate(fragments):
+                wrong_notes = counts[n][0] and used[n][0] != exact[n][0]
+                wrong_code = _CODE_ID_RE.search(fragment) and used[n][1] != exact[n][1]
+                if wrong_notes or wrong_code:
+                    jobs[n] = submit(n, exact[n])
+
+            # The page template must see the features that add styles to <head>.
+            features = ""
+            if any('class="sourceCode' in fragment for fragment in fragments):
+                features += "```yaml\nx\n```\n\n"
+            if any('class="math' in fragment for fragment in fragments):
+                features += "$x$\n\n"
+            template = layout.text(0, layout.front_matter_end) + "\n" + headings + features + heading_definitions
+            page = pool.submit(self._render, template, True)
+            template_body = pool.submit(self._render, template)
+
+            for n, (future, offset) in jobs.items():
+                fragments[n], _ = self._unwrap(future.result(), True, offset[0])
+            page, template_body = page.result(), template_body.result()
+
+        stitched = self._stitch(fragments)
+        self._verify(stitched, ids)
+        body = template_body[:-1] if template_body.endswith("\n") else template_body
+        at = page.rfind(body)
+        if not body or at < 0:
+            raise ShardingError("cannot locate the body in the page template")
+        logger.info("Sharded pandoc: %d shards, %d rendered, %d re-numbered, %d from cache",
+                    len(shards), self.stats["rendered"], len(jobs), self.stats["cached"])
+        return page[:at] + stitched + page[at + len(body):]
+
+    @staticmethod
+    def _verify(stitched: str, ids: List[str]) -> None:
+        """Check the numbering that spans shards: heading ids, footnotes and code blocks."""
+        if [html.unescape(i) for i in _HEADING_ID_RE.findall(stitched)] != ids:
+            raise ShardingError("stitched headings differ from the document headings")
+        note_ids = [int(n) for n in _NOTE_ID_RE.findall(stitched)]
+        if note_ids != list(range(1, len(note_ids) + 1)):
+            raise ShardingError("footnotes are not numbered consecutively")
+        code_ids = [int(n) for n in _CODE_ID_RE.findall(stitched)]
+        if any(b <= a for a, b in zip(code_ids, code_ids[1:])):
+            raise ShardingError("code blocks are not numbered in order")
+
+    @staticmethod
+    def _stitch(fragments: List[str]) -> str:
+        """Join shard bodies and merge their footnote sections into one at the end."""
+        bodies, notes, header, footer = [], [], None, None
+        for fragment in fragments:
+            sections = list(_NOTES_SECTION_RE.finditer(fragment))
+            if sections:
+                m = sections[-1]
+                close = fragment.rindex("</ol>")
+                header, footer = fragment[m.start():m.end()], fragment[close:].rstrip("\n")
+                notes.append(fragment[m.end():close].rstrip("\n"))
+                fragment = fragment[:m.start()]
+            fragment = fragment.rstrip("\n")
+            if fragment:
+                bodies.append(fragment)
+        if notes:
+            bodies.append(header + "\n".join(notes) + "\n" + footer)
+        return "\n".join(bodies)
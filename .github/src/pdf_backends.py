@@ -0,0 +1,144 @@
+"""
+PDF render backends.
+
+:class:`~step_2_convert_html_to_pdf.PDFConverter` prepares a page and hands
+it to a backend, which writes the PDF. Bookmarks, stamped headers and size
+optimization run on that PDF afterwards, whichever backend made it.
+
+- ``wkhtmltopdf`` (default): the Qt WebKit renderer, piped the page on
+  stdin, with headers and footers from its ``--header-*``/``--footer-*``
+  options. Only this backend renders chapters in parallel.
+- ``weasyprint``: a pure-Python CSS paged-media engine. It honors the
+  ``@page`` rules, margin boxes and ``string-set`` of the code block CSS;
+  the header and footer texts become margin boxes (:func:`page_css`).
+
+Every backend reports whether it can run here (:meth:`PdfBackend.available`);
+:data:`BACKENDS` maps the names accepted by ``--backend`` to the classes.
+"""
+
+from __future__ import annotations
+
+import abc
+import importlib
+import importlib.util
+import logging
+import os
+import shutil
+from typing import Dict, List, Type
+
+logger = logging.getLogger(__name__)
+
+
+class PdfBackend(abc.ABC):
+    """Turns a prepared page into a PDF file."""
+
+    name = ""
+    # Chapter-parallel rendering with a separate page-number pass (pdf_chapters).
+    supports_chapters = False
+
+    @abc.abstractmethod
+    def available(self) -> bool:
+        """Whether the engine is installed here."""
+
+    @abc.abstractmethod
+    def render(self, converter, html: str, output_pdf: str) -> None:
+        """Write ``html``, prepared by ``converter``, to ``output_pdf``."""
+
+    def options(self, converter) -> List[str]:
+        """Everything besides the page that the PDF depends on, for the render cache."""
+        return [self.name]
+
+
+class WkhtmltopdfBackend(PdfBackend):
+    name = "wkhtmltopdf"
+    supports_chapters = True
+
+    def available(self) -> bool:
+        return shutil.which("wkhtmltopdf") is not None
+
+    def render(self, converter, html: str, output_pdf: str) -> None:
+        converter._run_wkhtmltopdf(converter._wkhtmltopdf_cmd('-', output_pdf), html)
+
+    def options(self, converter) -> List[str]:
+        return converter._cmd_options(converter._wkhtmltopdf_cmd('-', ''))
+
+
+def _css_string(text: str) -> str:
+    return '"%s"' % text.replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+def page_css(converter) -> str:
+    """
+    Page size, margins and the header and footer margin boxes of ``converter``'s
+    page, matching the wkhtmltopdf options. In ``stamp_headers`` mode the margin
+    boxes are left empty.
+    """
+    meta = converter.metadata
+    date = meta.get("date")
+    boxes = {
+        "top-center": _css_string(meta["title"]) if meta["title"] else "none",
+        "bottom-left": _css_string(converter.html_file.name),
+        "bottom-center": _css_string(f"Copyright © OASIS Open {meta['year']}. All Rights Reserved."),
+        "bottom-right": (_css_string(f"{date} - Page ") if date else '"Page "')
+        + ' counter(page) " of " counter(pages)',
+    }
+    rules = []
+    for box, content in boxes.items():
+        if converter.stamp_headers:
+            content = "none"
+        size = "10pt" if box.startswith("top") else "8pt"
+        border = "border-top: 0.5pt solid #000;" if box.startswith("bottom") and content != "none" else ""
+        rules.append(f"@{box} {{ content: {content}; font-family: Times, serif; font-size: {size}; "
+                     f"color: #000; {border} }}")
+    return "@page { size: A4 portrait; margin: 25mm 20mm 25mm 20mm; %s }\n" % " ".join(rules)
+
+
+class WeasyPrintBackend(PdfBackend):
+    name = "weasyprint"
+
+    def available(self) -> bool:
+        if importlib.util.find_spec("weasyprint") is None:
+            return False
+        try:
+            # Loads the Pango libraries, which find_spec cannot check.
+            importlib.import_module("weasyprint")
+        except (ImportError, OSError):  # OSError: the Pango libraries are missing
+            return False
+        return True
+
+    def render(self, converter, html: str, output_pdf: str) -> None:
+        from weasyprint import CSS, HTML, default_url_fetcher
+
+        def fetch(url: str, *args, **kwargs):
+            # Same rule as wkhtmltopdf's offline proxy: preloaded pages read local files only.
+            if converter.preload_resources and not url.startswith(("file:", "data:")):
+                raise ValueError(f"network access is disabled for preloaded pages: {url}")
+            return default_url_fetcher(url, *args, **kwargs)
+
+        with converter.tracer.span("weasyprint", profile=True, bytes_in=html) as span:
+            document = HTML(string=html, base_url=converter.base_dir.as_uri() + '/', url_fetcher=fetch)
+            document.write_pdf(output_pdf, stylesheets=[CSS(string=page_css(converter))])
+            span["bytes_out"] = os.path.getsize(output_pdf)
+
+    def options(self, converter) -> List[str]:
+        import weasyprint
+        return [self.name, weasyprint.__version__, page_css(converter), str(converter.preload_resources)]
+
+
+BACKENDS: Dict[str, Type[PdfBackend]] = {
+    WkhtmltopdfBackend.name: WkhtmltopdfBackend,
+    WeasyPrintBackend.name: WeasyPrintBackend,
+}
+
+DEFAULT_BACKEND = WkhtmltopdfBackend.name
+
+
+def get_backend(name: str) -> PdfBackend:
+    try:
+        return BACKENDS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown PDF backend {name!r}; choose from {', '.join(BACKENDS)}") from None
+
+
+def available_backends() -> List[str]:
+    return [name for name, backend in BACKENDS.items() if backend().available()]
@@ -0,0 +1,229 @@
+"""
+Batch PDF conversion with a memory-aware scheduler.
+
+``step_2_convert_html_to_pdf.py`` converts a single page. Given several HTML
+files or directories, it hands them to :func:`run_pdf_batch`, which runs one
+:class:`~step_2_convert_html_to_pdf.PDFConverter` per page, each in its own
+process:
+
+- jobs are started largest page first, so the long renders do not end up
+  last on an otherwise idle machine;
+- at most ``max_jobs`` (default: CPU count) run at a time, and a job starts
+  only while the estimated memory of the running jobs stays within
+  ``memory_budget`` (default: the memory available at start). A large job
+  that does not fit waits for memory while smaller ones that fit go ahead;
+  a job larger than the whole budget runs alone;
+- a job that exceeds ``timeout`` seconds is killed together with its
+  wkhtmltopdf processes and reported as timed out.
+
+wkhtmltopdf's footprint grows with the page, so a job's memory is estimated
+from its HTML size (:func:`estimate_memory`). The peak RSS each job actually
+reached is measured and shown in the summary (:func:`format_summary`), next
+to its duration and sizes.
+"""
+
+from __future__ import annotations
+
+import fnmatch
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import time
+from multiprocessing.connection import wait
+from typing import Dict, List, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from batch_build import available_memory
+
+logger = logging.getLogger(__name__)
+
+# HTML pages that live next to a specification but get no PDF of their own.
+DEFAULT_EXCLUDES = ("*-public-review-metadata.html",)
+
+# Estimated peak memory of one job: the Python process plus wkhtmltopdf, which
+# needs several hundred bytes per byte of HTML for layout.
+JOB_BASE_MEMORY = 200 * 1024 * 1024
+JOB_MEMORY_PER_HTML_BYTE = 400
+
+_LOG_FORMAT = "%(asctime)s - %(processName)s - %(levelname)s - %(message)s"
+
+
+def discover_html(paths: List[str], excludes: tuple = DEFAULT_EXCLUDES) -> List[str]:
+    """
+    The HTML pages named by ``paths``: files as given, directories searched recursively.
+
+    Hidden directories, symlinked "latest version" aliases and pages matching
+    ``excludes`` are skipped when searching directories.
+    """
+    pages = []
+    for path in paths:
+        if not os.path.isdir(path):
+            pages.append(path)
+            continue
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+            for name in sorted(filenames):
+                full = os.path.join(dirpath, name)
+                if (name.endswith(".html") and not os.path.islink(full)
+                        and not any(fnmatch.fnmatch(name, pattern) for pattern in excludes)):
+                    pages.append(full)
+    return pages
+
+
+def estimate_memory(html_bytes: int) -> int:
+    return JOB_BASE_MEMORY + JOB_MEMORY_PER_HTML_BYTE * html_bytes
+
+
+def _peak_rss_kb() -> Optional[int]:
+    """Peak RSS of this process or of its largest child (wkhtmltopdf)."""
+    if resource is None:
+        return None
+    scale = 1024 if sys.platform == "darwin" else 1  # ru_maxrss is bytes on macOS, KiB elsewhere
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) // scale
+
+
+def _convert(html_file: str, output_pdf: str, options: dict, conn, level: int) -> None:
+    """Job process: convert one page and send back its result."""
+    if hasattr(os, "setsid"):
+        os.setsid()  # own process group, so that a timeout also stops wkhtmltopdf
+    logging.basicConfig(level=level, format=_LOG_FORMAT, force=True)
+    from asset_cache import AssetCache, default_cache_dir
+    from build_manifest import repo_basedir
+    from step_2_convert_html_to_pdf import PDFConverter
+
+    result = {"status": "ok", "error": ""}
+    try:
+        options = dict(options)
+        asset_cache = AssetCache(options.pop("asset_cache_dir", None) or default_cache_dir(repo_basedir(html_file)),
+                                 offline=options.pop("offline", False))
+        PDFConverter(html_file, output_pdf, asset_cache=asset_cache, **options).convert()
+    except Exception as e:
+        logger.error("%s failed", html_file, exc_info=True)
+        result = {"status": "failed", "error": "%s: %s" % (type(e).__name__, e)}
+    result["peak_rss_kb"] = _peak_rss_kb()
+    conn.send(result)
+    conn.close()
+
+
+def _kill(process: multiprocessing.Process) -> None:
+    try:
+        if hasattr(os, "killpg"):
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except ProcessLookupError:
+        pass
+    process.join()
+
+
+def run_pdf_batch(html_files: List[str], options: dict, max_jobs: Optional[int] = None,
+                  memory_budget: Optional[int] = None, timeout: Optional[float] = None) -> List[dict]:
+    """
+    Convert ``html_files`` to PDFs next to them; see the module docstring.
+
+    ``options`` are :class:`PDFConverter` keyword arguments, except that the
+    asset cache is given as ``asset_cache_dir`` and ``offline``. Returns one
+    result per page, in the order given.
+    """
+    max_jobs = max(1, max_jobs or os.cpu_count() or 1)
+    if memory_budget is None:
+        memory_budget = available_memory()
+    level = logging.getLogger().getEffectiveLevel()
+
+    jobs = []
+    for n, html_file in enumerate(html_files):
+        size = os.path.getsize(html_file) if os.path.isfile(html_file) else 0
+        jobs.append({"order": n, "html": html_file, "pdf": os.path.splitext(html_file)[0] + ".pdf",
+                     "html_bytes": size, "memory": estimate_memory(size)})
+    pending = sorted(jobs, key=lambda job: job["html_bytes"], reverse=True)
+    running: Dict[object, dict] = {}  # process sentinel -> job
+    results = []
+
+    def fits(job: dict) -> bool:
+        if not running:
+            return True
+        reserved = sum(j["memory"] for j in running.values())
+        return memory_budget is None or reserved + job["memory"] <= memory_budget
+
+    def finish(job: dict, result: dict) -> None:
+        if "process" in job:
+            job["process"].join()
+        result.update({
+            "name": job["html"],
+            "order": job["order"],
+            "seconds": time.perf_counter() - job["started"],
+            "html_bytes": job["html_bytes"],
+            "pdf_bytes": os.path.getsize(job["pdf"]) if result["status"] == "ok" and os.path.exists(job["pdf"]) else 0,
+        })
+        logger.info("%s: %s (%.1fs)", job["html"], result["status"], result["seconds"])
+        results.append(result)
+
+    while pending or running:
+        for job in list(pending):
+            if len(running) >= max_jobs:
+                break
+            if not os.path.isfile(job["html"]):
+                pending.remove(job)
+                job["started"] = time.perf_counter()
+                finish(job, {"status": "failed", "error": "HTML file not found", "peak_rss_kb": None})
+                continue
+            if not fits(job):
+                continue
+            pending.remove(job)
+            receiver, sender = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(target=_convert, args=(job["html"], job["pdf"], options, sender, level),
+                                              name="pdf-%d" % job["order"])
+            job.update(started=time.perf_counter(), process=process, conn=receiver)
+            process.start()
+            sender.close()
+            running[process.sentinel] = job
+
+        if not running:
+            continue
+        deadlines = [j["started"] + timeout for j in running.values()] if timeout else []
+        wait_for = max(0.0, min(deadlines) - time.perf_counter()) if deadlines else None
+        for sentinel in wait(list(running), timeout=wait_for):
+            job = running.pop(sentinel)
+            try:
+                result = job["conn"].recv()
+            except EOFError:
+                result = {"status": "failed", "error": "job exited with code %s" % job["process"].exitcode,
+                          "peak_rss_kb": None}
+            finish(job, result)
+        if timeout:
+            now = time.perf_counter()
+            for sentinel, job in list(running.items()):
+                if now - job["started"] >= timeout:
+                    running.pop(sentinel)
+                    _kill(job["process"])
+                    finish(job, {"status": "timeout", "error": "killed after %.0fs" % timeout, "peak_rss_kb": None})
+
+    return sorted(results, key=lambda r: r["order"])
+
+
+def format_summary(results: List[dict], wall_time: float) -> str:
+    """One row per page with status, duration, HTML and PDF size and peak memory, and totals."""
+    header = ["Document", "Status", "Seconds", "HTML KB", "PDF KB", "Peak MB"]
+    rows = [[r["name"], r["status"], "%.1f" % r["seconds"], "%d" % (r["html_bytes"] // 1024),
+             "%d" % (r["pdf_bytes"] // 1024) if r["pdf_bytes"] else "-",
+             "%d" % (r["peak_rss_kb"] // 1024) if r.get("peak_rss_kb") else "-"] for r in results]
+    widths = [max(len(str(row[i])) for row in [header] + rows) for i in range(len(header))]
+
+    def line(cells):
+        return "  ".join(str(c).ljust(w) if i < 2 else str(c).rjust(w) for i, (c, w) in enumerate(zip(cells, widths)))
+
+    out = [line(header), "  ".join("-" * w for w in widths)] + [line(row) for row in rows]
+    failed = [r for r in results if r["status"] != "ok"]
+    busy = sum(r["seconds"] for r in results)
+    out.append("%d documents, %d failed, %s of PDF, wall time %.1fs (%.1fs of jobs, %.1fx)" % (
+        len(results), len(failed), "{:,} bytes".format(sum(r["pdf_bytes"] for r in results)), wall_time,
+        busy, busy / wall_time if wall_time else 0.0))
+    out += ["  %s: %s" % (r["name"], r["error"]) for r in failed]
+    return "\n".join(out)
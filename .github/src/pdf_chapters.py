@@ -0,0 +1,240 @@
+"""
+Chapter-parallel PDF rendering.
+
+wkhtmltopdf lays a document out on one core. :func:`split_document` cuts the
+page at its top-level ``<hr>`` elements, where the stylesheets start a new
+page (before each chapter), into a few parts of similar size, each a complete
+HTML page with the original ``<head>``. Since every part starts where the
+page breaks anyway, the merged PDF is paginated like a render in one process.
+A top-level heading without an ``<hr>`` before it stays on its page and in
+its part. The parts are rendered by separate wkhtmltopdf processes, and
+:func:`merge_parts` joins the PDFs with pypdf. With a render cache
+(:mod:`pdf_render_cache`) every chapter is its own part, so that unchanged
+chapters can be reused.
+
+Two things would break in a plain concatenation, and both are handled here.
+
+* Page numbers. The parts are rendered without the ``[page] of [topage]``
+  footer. Once the part PDFs exist, the total page count is known, and one
+  more wkhtmltopdf run renders a document of that many empty pages carrying
+  only that footer. That run takes seconds because there is nothing to lay
+  out. Each of its pages is overlaid on the matching merged page, so the
+  numbers run continuously.
+  With stamped headers (:mod:`pdf_stamp`) that extra render is skipped.
+* Cross-part links. A link whose target lives in another part is rewritten to
+  a marker URL (:data:`XREF_URL`), and every such target gets a tiny marker
+  link (:data:`pdf_outline.ANCHOR_URL`) at its position. wkhtmltopdf turns both
+  into URI annotations with page rectangles. After merging, the anchor
+  annotations give each target's page and position, and are removed. The xref
+  annotations then become internal ``GoTo`` destinations, and the same
+  positions place the bookmarks of :mod:`pdf_outline`.
+
+pypdf is optional. :func:`available` tells the caller whether the merge can
+run at all. When the parts cannot be merged faithfully :class:`ChapterError`
+is raised and the caller renders the page in one process instead.
+"""
+
+from __future__ import annotations
+
+import html as html_lib
+import importlib.util
+import itertools
+import logging
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import quote, unquote
+
+from bs4 import BeautifulSoup, Tag
+
+from pdf_outline import add_outline, collect_anchors, insert_anchor, link_uri, named_destinations
+from pdf_stamp import Stamp
+
+logger = logging.getLogger(__name__)
+
+XREF_URL = "http://pdf-xref.invalid/"
+
+# Chapter boundaries: the page breaks of the stylesheets (hr{page-break-before: always})
+# that are direct children of <body>.
+PAGE_BREAK_TAGS = ("hr",)
+
+
+class ChapterError(RuntimeError):
+    """The rendered parts cannot be merged into the document a single render would give."""
+
+
+def available() -> bool:
+    """True when pypdf, needed by :func:`merge_parts`, is installed."""
+    return importlib.util.find_spec("pypdf") is not None
+
+
+def _partition(sizes: List[int], parts: int) -> List[Tuple[int, int]]:
+    """Split ``sizes`` into at most ``parts`` contiguous ranges of similar total size."""
+    parts = max(1, min(parts, len(sizes)))
+    cumulative = list(itertools.accumulate(sizes))
+    total = cumulative[-1] if cumulative else 0
+    cuts = [0]
+    for k in range(1, parts):
+        # The boundary whose running total is nearest k/parts of the whole, leaving
+        # at least one item for each of the ranges still to come.
+        lowest, highest = cuts[-1] + 1, len(sizes) - (parts - k)
+        cuts.append(min(range(lowest, highest + 1), key=lambda i: abs(cumulative[i - 1] - total * k / parts)))
+    cuts.append(len(sizes))
+    return list(zip(cuts, cuts[1:]))
+
+
+def _attrs(tag: Tag) -> str:
+    return "".join(' %s="%s"' % (k, html_lib.escape(" ".join(v) if isinstance(v, list) else v, quote=True))
+                   for k, v in tag.attrs.items())
+
+
+def split_document(html: str, parts: Optional[int]) -> List[str]:
+    """
+    Return up to ``parts`` standalone pages that together hold the body of ``html``;
+    ``None`` gives one page per chapter.
+
+    A chapter starts at a top-level ``<hr>``; a run of several ``<hr>`` starts
+    one chapter. Everything before the first chapter (logo, title) stays with
+    it. Returns a single-element list when the page has fewer than two chapters.
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    body = soup.body
+    if body is None:
+        return [html]
+    nodes = list(body.contents)
+    tags = [(i, node) for i, node in enumerate(nodes) if isinstance(node, Tag)]
+    starts = [i for n, (i, node) in enumerate(tags)
+              if node.name in PAGE_BREAK_TAGS and (n == 0 or tags[n - 1][1].name not in PAGE_BREAK_TAGS)]
+    if parts is None:
+        parts = len(starts)
+    if len(starts) < 2 or parts < 2:
+        return [html]
+    starts[0] = 0
+    chapters = [nodes[a:b] for a, b in zip(starts, starts[1:] + [len(nodes)])]
+    ranges = _partition([sum(len(str(n)) for n in chapter) for chapter in chapters], parts)
+    groups = [[n for chapter in chapters[a:b] for n in chapter] for a, b in ranges]
+    if len(groups) < 2:
+        return [html]
+
+    # Which part every id lives in, and its element.
+    owner: Dict[str, int] = {}
+    elements: Dict[str, Tag] = {}
+    for index, group in enumerate(groups):
+        for node in group:
+            if not isinstance(node, Tag):
+                continue
+            for el in [node] + node.find_all(True):
+                for key in ("id", "name") if el.name == "a" else ("id",):
+                    value = el.get(key)
+                    if value and value not in owner:
+                        owner[value] = index
+                        elements[value] = el
+
+    targets = set()
+    for index, group in enumerate(groups):
+        for node in group:
+            if not isinstance(node, Tag):
+                continue
+            links = ([node] if node.name == "a" else []) + node.find_all("a", href=True)
+            for a in links:
+                href = a.get("href", "")
+                if not href.startswith("#") or len(href) < 2:
+                    continue
+                target = unquote(href[1:])
+                if owner.get(target, index) != index:
+                    a["href"] = XREF_URL + quote(target, safe="")
+                    targets.add(target)
+
+    for target in sorted(targets):
+        insert_anchor(soup, elements[target], target)
+
+    head = str(soup.head) if soup.head else ""
+    body_open = "<body%s>" % _attrs(body)
+    doctype = "<!DOCTYPE html>\n" if html.lstrip().lower().startswith("<!doctype") else ""
+    html_attrs = _attrs(soup.html) if soup.html else ""
+    return ["%s<html%s>\n%s\n%s\n%s\n</body>\n</html>\n" % (doctype, html_attrs, head, body_open,
+                                                             "".join(str(n) for n in group))
+            for group in groups]
+
+
+def stamp_document(pages: int) -> str:
+    """An HTML page that wkhtmltopdf renders as ``pages`` empty pages."""
+    blank = '<div style="page-break-before: always">&#160;</div>'
+    return ("<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\" /></head><body>"
+            "<div>&#160;</div>%s</body></html>\n" % (blank * (pages - 1)))
+
+
+def page_count(pdf_path: str) -> int:
+    from pypdf import PdfReader
+    return len(PdfReader(pdf_path).pages)
+
+
+def merge_parts(part_pdfs: List[str], stamp_pdf: Optional[str], output_pdf: str,
+                headings: Optional[List[dict]] = None, stamp: Optional[Stamp] = None,
+                info: Optional[Dict[str, str]] = None) -> dict:
+    """
+    Concatenate ``part_pdfs`` into ``output_pdf``, overlay the footer pages of
+    ``stamp_pdf``, turn cross-part marker links into internal links, add
+    bookmarks for ``headings``, draw the headers and footers of ``stamp`` and
+    set the document ``info`` (``/Title``, ``/Subject``).
+
+    This is also the post-processing pass of a document rendered in one part.
+    Returns counts for the report: pages, resolved and unresolved links, bookmarks.
+    Raises :class:`ChapterError` when the footer pages do not match the parts.
+    """
+    from pypdf import PdfReader, PdfWriter
+    from pypdf.generic import ArrayObject, FloatObject, NameObject, NullObject
+
+    writer = PdfWriter()
+    destinations: Dict[str, tuple] = {}
+    for path in part_pdfs:
+        reader = PdfReader(path)
+        offset = len(writer.pages)
+        if headings:
+            for name, (number, left, top) in named_destinations(reader).items():
+                destinations.setdefault(name, (number + offset, left, top))
+        writer.append(reader, import_outline=False)
+
+    if stamp_pdf is not None:
+        footers = PdfReader(stamp_pdf)
+        if len(footers.pages) != len(writer.pages):
+            raise ChapterError("footer document has %d pages, merged document %d"
+                             % (len(footers.pages), len(writer.pages)))
+        for page, footer in zip(writer.pages, footers.pages):
+            page.merge_page(footer)
+
+    # First pass: where each marked target landed; drop the marker annotations.
+    anchors = collect_anchors(writer)
+
+    # Second pass: point the cross-part links at those positions; drop the rest.
+    resolved = unresolved = 0
+    for page in writer.pages:
+        if "/Annots" not in page:
+            continue
+        kept = ArrayObject()
+        for ref in page["/Annots"].get_object():
+            annot = ref.get_object()
+            uri = link_uri(annot)
+            if uri and uri.startswith(XREF_URL):
+                target = unquote(uri[len(XREF_URL):])
+                if target not in anchors:
+                    unresolved += 1
+                    continue
+                number, left, top = anchors[target]
+                del annot["/A"]
+                annot[NameObject("/Dest")] = ArrayObject([
+                    writer.pages[number].indirect_reference, NameObject("/XYZ"),
+                    FloatObject(left), FloatObject(top), NullObject(),
+                ])
+                resolved += 1
+            kept.append(ref)
+        page[NameObject("/Annots")] = kept
+    if unresolved:
+        logger.warning("%d cross-chapter links could not be resolved and were removed", unresolved)
+    bookmarks = add_outline(writer, headings, {**destinations, **anchors})[0] if headings else 0
+    if stamp is not None:
+        stamp.apply(writer)
+    if info:
+        writer.add_metadata(info)
+
+    with open(output_pdf, "wb") as f:
+        writer.write(f)
+    return {"pages": len(writer.pages), "links": resolved, "unresolved": unresolved, "bookmarks": bookmarks}
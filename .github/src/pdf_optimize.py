@@ -0,0 +1,421 @@
+#!/usr/bin/env python3
+"""
+Size optimization of finished PDFs.
+
+The generated PDFs are committed under ``csaf/`` and zipped again for every
+stage, so each byte is paid for several times. :func:`optimize_pdf` rewrites
+a PDF in one pass over its objects:
+
+- images with more pixels than ``target_dpi`` needs on the page they are
+  drawn on are downsampled (needs Pillow); JPEGs are re-encoded as JPEGs,
+  other images are resampled and stay lossless;
+- identical image streams and font programs are stored once (the logo of
+  every chapter-parallel part, the same font embedded by several parts);
+- content streams and other uncompressed streams are Flate-compressed, and
+  objects nothing refers to any more are dropped.
+
+When qpdf is on the PATH, the result is then packed into object streams and
+linearized, so a viewer shows the first page before the rest has arrived.
+Fonts need no subsetting pass: wkhtmltopdf embeds only the glyphs a document
+uses (the font names carry the ``ABCDEF+`` subset tag). Fonts embedded whole
+are counted in the report.
+
+The optimized file replaces the original only when it is not larger. Needs
+pypdf.
+
+    python3 .github/src/pdf_optimize.py csaf/ --target-dpi 150
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import io
+import logging
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import zlib
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import pdf_chapters
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TARGET_DPI = 150
+DEFAULT_JPEG_QUALITY = 85
+
+# Images are resampled only when that drops at least a tenth of their width.
+_MIN_GAIN = 0.9
+_SUBSET_TAG = re.compile(r"^/?[A-Z]{6}\+")
+_FONT_FILES = ("/FontFile", "/FontFile2", "/FontFile3")
+_CHANNELS = {"/DeviceGray": ("L", 1), "/DeviceRGB": ("RGB", 3)}
+
+
+def qpdf_available() -> bool:
+    return shutil.which("qpdf") is not None
+
+
+def scale_factor(pixels: Tuple[int, int], page: Tuple[float, float], target_dpi: int) -> float:
+    """
+    Resampling factor for an image of ``pixels`` drawn on a page of ``page`` points.
+
+    An image drawn as large as the page can be still has ``target_dpi`` after
+    resampling; 1.0 when it has no pixels to spare.
+    """
+    width, height = pixels
+    dpi = 72 * max(width / page[0], height / page[1])
+    return min(1.0, target_dpi / dpi) if dpi else 1.0
+
+
+# -------------------- objects --------------------
+
+def _filters(obj) -> List[str]:
+    value = obj.get("/Filter")
+    if value is None:
+        return []
+    value = value.get_object()
+    return [str(f) for f in value] if isinstance(value, list) else [str(value)]
+
+
+def _stream_key(obj, depth: int = 0) -> str:
+    """Digest of a stream's encoded bytes and its dictionary, with referenced streams by content."""
+    from pypdf.generic import IndirectObject, StreamObject
+
+    digest = hashlib.sha256(obj._data)
+    for key in sorted(k for k in obj if k != "/Length"):
+        value = obj.raw_get(key)
+        if isinstance(value, IndirectObject):
+            value = value.get_object()
+            if isinstance(value, StreamObject):
+                value = _stream_key(value, depth + 1) if depth < 2 else id(value)
+        digest.update(("%s=%r;" % (key, value)).encode("utf-8", "replace"))
+    return digest.hexdigest()
+
+
+def _resources(writer) -> Iterator[Tuple[object, Tuple[float, float]]]:
+    """Every resource dictionary, forms included, with the size of a page that uses it."""
+    from pypdf.generic import IndirectObject
+
+    for page in writer.pages:
+        size = (float(page.mediabox.width), float(page.mediabox.height))
+        stack, seen = [page.get("/Resources")], set()
+        while stack:
+            resources = stack.pop()
+            if resources is None:
+                continue
+            resources = resources.get_object()
+            yield resources, size
+            xobjects = resources.get("/XObject")
+            for ref in (xobjects.get_object().values() if xobjects is not None else []):
+                if not isinstance(ref, IndirectObject) or ref.idnum in seen:
+                    continue
+                seen.add(ref.idnum)
+                xobj = ref.get_object()
+                if xobj.get("/Subtype") == "/Form":
+                    stack.append(xobj.get("/Resources"))
+
+
+def _font_descriptors(font) -> Iterator[object]:
+    font = font.get_object()
+    if "/FontDescriptor" in font:
+        yield font["/FontDescriptor"].get_object()
+    descendants = font.get("/DescendantFonts")
+    for descendant in (descendants.get_object() if descendants is not None else []):
+        yield from _font_descriptors(descendant)
+
+
+# -------------------- images --------------------
+
+def _resample(obj, factor: float, image_module, jpeg_quality: int) -> bool:
+    """Resample the image stream ``obj`` in place by ``factor``; False for kinds left alone."""
+    from pypdf.generic import EncodedStreamObject, NameObject, NumberObject
+
+    if getattr(obj.get("/ImageMask"), "value", False) or obj.get("/BitsPerComponent") != 8:
+        return False
+    width, height = int(obj["/Width"]), int(obj["/Height"])
+    size = (max(1, round(width * factor)), max(1, round(height * factor)))
+    filters = _filters(obj)
+
+    if filters == ["/DCTDecode"]:
+        image = image_module.open(io.BytesIO(obj._data))
+        if image.mode not in ("L", "RGB"):
+            return False
+        out = io.BytesIO()
+        image.resize(size, image_module.LANCZOS).save(out, "JPEG", quality=jpeg_quality, optimize=True)
+        data, filter_name = out.getvalue(), "/DCTDecode"
+    elif filters in ([], ["/FlateDecode"]):
+        space = obj.get("/ColorSpace")
+        space = space.get_object() if space is not None else None
+        if isinstance(space, list) and len(space) == 2 and space[0] == "/ICCBased":
+            channels = int(space[1].get_object().get("/N", 0))
+            mode = {1: "L", 3: "RGB"}.get(channels)
+        else:
+            mode, channels = _CHANNELS.get(str(space), (None, 0))
+        pixels = obj.get_data()
+        if mode is None or len(pixels) != width * height * channels:
+            return False
+        image = image_module.frombytes(mode, (width, height), pixels)
+        data, filter_name = zlib.compress(image.resize(size, image_module.LANCZOS).tobytes(), 9), "/FlateDecode"
+    else:
+        return False
+
+    obj._data = data
+    obj[NameObject("/Filter")] = NameObject(filter_name)
+    obj[NameObject("/Width")] = NumberObject(size[0])
+    obj[NameObject("/Height")] = NumberObject(size[1])
+    obj.pop("/DecodeParms", None)
+    if isinstance(obj, EncodedStreamObject):
+        obj.decoded_self = None
+    return True
+
+
+def downsample_images(writer, target_dpi: int, jpeg_quality: int = DEFAULT_JPEG_QUALITY) -> int:
+    """Resample the images that have more pixels than ``target_dpi`` needs; returns the count."""
+    from pypdf.generic import IndirectObject
+
+    try:
+        from PIL import Image
+    except ImportError:
+        logger.info("Pillow is not installed; images are not downsampled")
+        return 0
+
+    # The largest page each image is drawn on.
+    pages: Dict[int, Tuple[object, Tuple[float, float]]] = {}
+    for resources, size in _resources(writer):
+        xobjects = resources.get("/XObject")
+        for ref in (xobjects.get_object().values() if xobjects is not None else []):
+            if isinstance(ref, IndirectObject) and ref.get_object().get("/Subtype") == "/Image":
+                known = pages.get(ref.idnum)
+                if known is None or size[0] * size[1] > known[1][0] * known[1][1]:
+                    pages[ref.idnum] = (ref.get_object(), size)
+
+    resampled = 0
+    for obj, size in pages.values():
+        factor = scale_factor((int(obj["/Width"]), int(obj["/Height"])), size, target_dpi)
+        if factor > _MIN_GAIN:
+            continue
+        try:
+            if not _resample(obj, factor, Image, jpeg_quality):
+                continue
+            mask = obj.get("/SMask")
+            if mask is not None:
+                _resample(mask.get_object(), factor, Image, jpeg_quality)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not downsample an image: {e}")
+            continue
+        resampled += 1
+    return resampled
+
+
+# -------------------- streams --------------------
+
+def deduplicate(writer) -> int:
+    """Point every reference to a duplicate image or font program at one copy; returns the duplicates."""
+    from pypdf.generic import IndirectObject, NameObject
+
+    canonical: Dict[str, IndirectObject] = {}
+    duplicates = set()
+
+    def same(ref):
+        if not isinstance(ref, IndirectObject):
+            return ref
+        key = _stream_key(ref.get_object())
+        first = canonical.setdefault(key, ref)
+        if first.idnum != ref.idnum:
+            duplicates.add(ref.idnum)
+        return first
+
+    for resources, _ in _resources(writer):
+        xobjects = resources.get("/XObject")
+        if xobjects is not None:
+            xobjects = xobjects.get_object()
+            for name, ref in list(xobjects.items()):
+                if isinstance(ref, IndirectObject) and ref.get_object().get("/Subtype") == "/Image":
+                    xobjects[NameObject(name)] = same(ref)
+        fonts = resources.get("/Font")
+        for font in (fonts.get_object().values() if fonts is not None else []):
+            for descriptor in _font_descriptors(font):
+                for key in _FONT_FILES:
+                    if key in descriptor:
+                        descriptor[NameObject(key)] = same(descriptor.raw_get(key))
+    return len(duplicates)
+
+
+def font_report(writer) -> Tuple[int, List[str]]:
+    """Embedded font programs, and the names of those embedded without subsetting."""
+    fonts, whole = set(), set()
+    for resources, _ in _resources(writer):
+        group = resources.get("/Font")
+        for font in (group.get_object().values() if group is not None else []):
+            for descriptor in _font_descriptors(font):
+                if any(key in descriptor for key in _FONT_FILES):
+                    name = str(descriptor.get("/FontName", ""))
+                    fonts.add(name)
+                    if not _SUBSET_TAG.match(name):
+                        whole.add(name.lstrip("/"))
+    return len(fonts), sorted(whole)
+
+
+def compress_streams(writer) -> None:
+    """
+    Flate-compress the page contents. Images keep their filters, and the
+    other streams of wkhtmltopdf and :mod:`pdf_stamp` are compressed already.
+    """
+    for page in writer.pages:
+        page.compress_content_streams()
+
+
+def drop_unreachable(writer):
+    """
+    A copy of ``writer`` with only the objects the document refers to.
+
+    pypdf writes every object it holds, also those that :func:`deduplicate`
+    left without references. A document cloned from the written file copies
+    only what its root and information dictionary reach.
+    """
+    from pypdf import PdfReader, PdfWriter
+
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    buffer.seek(0)
+    return PdfWriter(clone_from=PdfReader(buffer))
+
+
+def _qpdf(source: str, target: str, linearize: bool) -> bool:
+    """Pack ``source`` into object streams (and linearize it) as ``target``."""
+    cmd = ["qpdf", "--object-streams=generate", "--compress-streams=y", "--recompress-flate",
+           "--compression-level=9"]
+    if linearize:
+        cmd.append("--linearize")
+    result = subprocess.run(cmd + [source, target], capture_output=True, text=True)
+    # Exit status 3: written, with warnings.
+    if result.returncode not in (0, 3):
+        logger.warning(f"qpdf failed with exit code {result.returncode}: {result.stderr.strip()}")
+        return False
+    return True
+
+
+# -------------------- files --------------------
+
+def optimize_pdf(input_pdf: str, output_pdf: Optional[str] = None, target_dpi: int = DEFAULT_TARGET_DPI,
+                 jpeg_quality: int = DEFAULT_JPEG_QUALITY, linearize: bool = True) -> dict:
+    """
+    Write a smaller version of ``input_pdf`` to ``output_pdf`` (default: in place).
+
+    Returns the report: sizes before and after, resampled images, duplicate
+    streams, embedded and unsubsetted fonts, and whether the file was packed
+    and linearized by qpdf and written at all.
+    """
+    from pypdf import PdfReader, PdfWriter
+
+    output_pdf = output_pdf or input_pdf
+    before = os.path.getsize(input_pdf)
+    report = {"file": output_pdf, "before": before, "after": before, "images": 0, "duplicates": 0,
+              "fonts": 0, "fonts_not_subset": [], "linearized": False, "replaced": False}
+
+    reader = PdfReader(input_pdf)
+    if reader.is_encrypted:
+        logger.warning(f"{input_pdf} is encrypted; left as it is")
+        return _keep(input_pdf, output_pdf, report)
+    writer = PdfWriter(clone_from=reader)
+
+    report["images"] = downsample_images(writer, target_dpi, jpeg_quality)
+    report["duplicates"] = deduplicate(writer)
+    report["fonts"], report["fonts_not_subset"] = font_report(writer)
+    if report["fonts_not_subset"]:
+        logger.warning(f"Fonts embedded without subsetting: {', '.join(report['fonts_not_subset'])}")
+    compress_streams(writer)
+    writer = drop_unreachable(writer)
+
+    with tempfile.TemporaryDirectory(prefix=".pdf-optimize-", dir=os.path.dirname(os.path.abspath(output_pdf))) as work:
+        result = os.path.join(work, "rewritten.pdf")
+        with open(result, "wb") as f:
+            writer.write(f)
+        if qpdf_available():
+            packed = os.path.join(work, "packed.pdf")
+            if _qpdf(result, packed, linearize):
+                result, report["linearized"] = packed, linearize
+        else:
+            logger.info("qpdf is not on the PATH; the PDF is neither packed into object streams nor linearized")
+
+        after = os.path.getsize(result)
+        if after > before:
+            logger.info(f"Optimized {input_pdf} is larger ({after:,} > {before:,} bytes); keeping the original")
+            return _keep(input_pdf, output_pdf, report)
+        os.replace(result, output_pdf)
+    report["after"], report["replaced"] = after, True
+    return report
+
+
+def _keep(input_pdf: str, output_pdf: str, report: dict) -> dict:
+    if os.path.abspath(input_pdf) != os.path.abspath(output_pdf):
+        shutil.copyfile(input_pdf, output_pdf)
+    report["linearized"] = False
+    return report
+
+
+def format_report(reports: List[dict]) -> str:
+    """The before/after size table of ``reports``, with a total line for several files."""
+    lines = ["%10s %10s %7s %6s %5s  %s" % ("before", "after", "saved", "images", "dups", "file")]
+    for r in reports:
+        lines.append("%10s %10s %6.1f%% %6d %5d  %s" % (
+            "{:,}".format(r["before"]), "{:,}".format(r["after"]), _saved(r["before"], r["after"]),
+            r["images"], r["duplicates"], r["file"]))
+    if len(reports) > 1:
+        before, after = sum(r["before"] for r in reports), sum(r["after"] for r in reports)
+        lines.append("%10s %10s %6.1f%%  %s" % ("{:,}".format(before), "{:,}".format(after),
+                                                 _saved(before, after), "total (%d files)" % len(reports)))
+    return "\n".join(lines)
+
+
+def _saved(before: int, after: int) -> float:
+    return 100.0 * (before - after) / before if before else 0.0
+
+
+def _pdf_files(paths: List[str]) -> List[str]:
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+                files.extend(os.path.join(root, n) for n in sorted(names) if n.lower().endswith(".pdf"))
+        else:
+            files.append(path)
+    return files
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Shrink PDFs in place and report the sizes before and after")
+    parser.add_argument("paths", nargs="+", help="PDF files, or directories to search for them")
+    parser.add_argument("--target-dpi", type=int, default=DEFAULT_TARGET_DPI,
+                        help="Downsample images to this resolution at full-page size (default: %(default)s)")
+    parser.add_argument("--jpeg-quality", type=int, default=DEFAULT_JPEG_QUALITY,
+                        help="Quality of re-encoded JPEG images (default: %(default)s)")
+    parser.add_argument("--no-linearize", action="store_true", help="Do not linearize (qpdf)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Enable verbose logging")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING,
+                        format="%(levelname)s - %(message)s")
+    if not pdf_chapters.available():
+        sys.exit("pypdf is not installed")
+
+    files, reports = _pdf_files(args.paths), []
+    for path in files:
+        try:
+            reports.append(optimize_pdf(path, target_dpi=args.target_dpi, jpeg_quality=args.jpeg_quality,
+                                        linearize=not args.no_linearize))
+        except Exception as e:
+            logger.error(f"Could not optimize {path}: {e}")
+    if reports:
+        print(format_report(reports))
+    if len(reports) < len(files):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
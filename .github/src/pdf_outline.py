@@ -0,0 +1,199 @@
+"""
+PDF bookmarks from a heading index.
+
+wkhtmltopdf can build an outline itself, but its outline pass lays the page
+out again and is slow on large specifications, so PDFs are rendered with
+``--no-outline``. Instead:
+
+1. The HTML stage writes a heading index (order, level, id, title) for each
+   page it produces into the build cache, keyed by the SHA-256 of the HTML
+   (:func:`write_index`). The PDF stage loads it, or extracts it from the page
+   when the cache has none (:func:`heading_index`).
+2. While the PDF stage prepares the page, every indexed heading gets a named
+   anchor: a tiny transparent link to :data:`ANCHOR_URL` + id
+   (:func:`mark_headings`). wkhtmltopdf turns it into a URI annotation whose
+   rectangle is the heading's position.
+3. After rendering, :func:`collect_anchors` reads those positions and removes
+   the marker annotations, and :func:`add_outline` adds the bookmark tree.
+   Headings without a marker fall back to the PDF's own named destinations.
+
+Both run in :func:`pdf_chapters.merge_parts`, the one post-processing pass of
+every PDF, where the same anchors also resolve cross-chapter links. The
+post-processing steps need pypdf; the index itself does not.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import html as html_lib
+import json
+import logging
+import os
+import re
+import tempfile
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import quote, unquote
+
+from bs4 import BeautifulSoup, Tag
+
+logger = logging.getLogger(__name__)
+
+ANCHOR_URL = "http://pdf-anchor.invalid/"
+
+# Bookmark levels kept by default: chapters, sections and subsections.
+DEFAULT_OUTLINE_LEVELS = 3
+
+_ANCHOR_STYLE = "font-size:1px;line-height:1px;color:transparent;text-decoration:none"
+_HEADING = re.compile(r"<(h1big|h[1-6])\b([^>]*)>(.*?)</\1\s*>", re.S | re.I)
+_ID = re.compile(r"""\bid\s*=\s*(["'])(.*?)\1""", re.S)
+_TAG = re.compile(r"<[^>]+>")
+
+# (page index, left, top) of a destination.
+Position = Tuple[int, float, float]
+
+
+# -------------------- heading index --------------------
+
+def extract_headings(html: str) -> List[dict]:
+    """The headings with an id, in document order; ``<h1big>`` counts as level 1."""
+    headings = []
+    for match in _HEADING.finditer(html):
+        ident = _ID.search(match.group(2))
+        if not ident:
+            continue
+        name = match.group(1).lower()
+        title = " ".join(html_lib.unescape(_TAG.sub("", match.group(3))).split())
+        headings.append({
+            "order": len(headings),
+            "level": 1 if name == "h1big" else int(name[1]),
+            "id": html_lib.unescape(ident.group(2)),
+            "title": title,
+        })
+    return headings
+
+
+def index_path(cache_dir: str, html: str) -> str:
+    digest = hashlib.sha256(html.encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, "headings", digest + ".json")
+
+
+def write_index(cache_dir: str, html: str) -> str:
+    """Store the heading index of ``html`` in the build cache; returns its path."""
+    path = index_path(cache_dir, html)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(extract_headings(html), f)
+    os.replace(tmp, path)
+    return path
+
+
+def heading_index(cache_dir: Optional[str], html: str) -> List[dict]:
+    """The stored index of ``html``, or one extracted from it."""
+    if cache_dir:
+        try:
+            with open(index_path(cache_dir, html), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            pass
+    logger.debug("No stored heading index; extracting it from the page")
+    return extract_headings(html)
+
+
+# -------------------- anchors --------------------
+
+def insert_anchor(soup: BeautifulSoup, el: Tag, name: str) -> None:
+    """Mark the position of ``el`` as the named anchor ``name`` (once)."""
+    href = ANCHOR_URL + quote(name, safe="")
+    first = el.contents[0] if el.contents else None
+    if isinstance(first, Tag) and first.name == "a" and first.get("href") == href:
+        return
+    marker = soup.new_tag("a", href=href, style=_ANCHOR_STYLE)
+    marker.string = "."
+    if el.name in ("img", "br", "hr", "input"):
+        el.insert_before(marker)
+    else:
+        el.insert(0, marker)
+
+
+def mark_headings(soup: BeautifulSoup, headings: List[dict]) -> int:
+    """Insert a named anchor into every indexed heading found in ``soup``; returns the count."""
+    wanted = {h["id"] for h in headings}
+    marked = 0
+    for el in soup.find_all(["h1big", "h1", "h2", "h3", "h4", "h5", "h6"], id=True):
+        if el["id"] in wanted:
+            insert_anchor(soup, el, el["id"])
+            wanted.discard(el["id"])
+            marked += 1
+    return marked
+
+
+def link_uri(annot) -> Optional[str]:
+    """The URI of a link annotation, or None for other annotations."""
+    action = annot.get("/A")
+    if action is None:
+        return None
+    action = action.get_object()
+    if action.get("/S") != "/URI":
+        return None
+    return str(action.get("/URI"))
+
+
+def collect_anchors(writer) -> Dict[str, Position]:
+    """Positions of the named anchors in ``writer``'s pages; removes their annotations."""
+    from pypdf.generic import ArrayObject, NameObject
+
+    anchors: Dict[str, Position] = {}
+    for number, page in enumerate(writer.pages):
+        if "/Annots" not in page:
+            continue
+        kept = ArrayObject()
+        for ref in page["/Annots"].get_object():
+            annot = ref.get_object()
+            uri = link_uri(annot)
+            if uri and uri.startswith(ANCHOR_URL):
+                rect = [float(v) for v in annot.get("/Rect", [0, 0, 0, 0])]
+                anchors.setdefault(unquote(uri[len(ANCHOR_URL):]), (number, rect[0], max(rect[1], rect[3])))
+            else:
+                kept.append(ref)
+        page[NameObject("/Annots")] = kept
+    return anchors
+
+
+def named_destinations(reader) -> Dict[str, Position]:
+    """The PDF's own named destinations, for headings that have no anchor."""
+    positions: Dict[str, Position] = {}
+    for name, dest in reader.named_destinations.items():
+        try:
+            number = reader.get_destination_page_number(dest)
+        except Exception:  # malformed destination
+            continue
+        positions[str(name)] = (number, float(dest.left or 0), float(dest.top or 0))
+    return positions
+
+
+# -------------------- outline --------------------
+
+def add_outline(writer, headings: List[dict], anchors: Dict[str, Position]) -> Tuple[int, int]:
+    """Add a bookmark per heading, nested by level. Returns (added, missing)."""
+    from pypdf.generic import Fit
+
+    parents: List[tuple] = []  # (level, outline item)
+    added = missing = 0
+    for heading in sorted(headings, key=lambda h: h["order"]):
+        position = anchors.get(heading["id"])
+        if position is None:
+            missing += 1
+            continue
+        number, left, top = position
+        while parents and parents[-1][0] >= heading["level"]:
+            parents.pop()
+        item = writer.add_outline_item(heading["title"] or heading["id"], number,
+                                       parent=parents[-1][1] if parents else None,
+                                       fit=Fit.xyz(left=left, top=top), is_open=heading["level"] < 2)
+        parents.append((heading["level"], item))
+        added += 1
+    if missing:
+        logger.warning("%d headings have no position in the PDF and were left out of the outline", missing)
+    return added, missing
+
@@ -0,0 +1,123 @@
+"""
+Cache of rendered PDF parts for repeat builds.
+
+Rendering is by far the slowest part of a PDF build, and fixing a typo in one
+chapter changes only that chapter. With a :class:`RenderCache`, the PDF
+converter splits the page into one part per top-level chapter (see
+:mod:`pdf_chapters`) and keys each part's PDF by the SHA-256 of:
+
+- the part's HTML, which carries the page's ``<head>`` (inlined stylesheets
+  included) and the cross-chapter link markers of :mod:`pdf_chapters`;
+- the content of linked local stylesheets, for pages that are not preloaded;
+- the render options and the renderer version.
+
+Unchanged chapters are copied from the cache and only the others are
+rendered. Page numbers, bookmarks and cross-chapter links are computed when
+the parts are merged, so they stay right when a chapter's page count changes.
+
+Entries are files ``<key[:2]>/<key>.pdf`` whose modification time is their
+last use; :meth:`RenderCache.evict` removes the least recently used ones once
+the cache exceeds ``max_bytes``. Entries are written atomically, so several
+builds can share one cache directory.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+class RenderCache:
+    """Rendered PDFs by the hash of their page and render options; see the module docstring."""
+
+    def __init__(self, cache_dir: str, max_bytes: int = DEFAULT_MAX_BYTES) -> None:
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_bytes
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0, "evicted": 0}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(html: str, options: List[str]) -> str:
+        return hashlib.sha256("\0".join(options + [html]).encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key + ".pdf")
+
+    def _bump(self, stat: str, n: int = 1) -> None:
+        with self._lock:
+            self.stats[stat] += n
+
+    def get(self, key: str, dest: str) -> bool:
+        """Copy the cached PDF for ``key`` to ``dest``; False when there is none."""
+        path = self._path(key)
+        try:
+            os.utime(path)
+            shutil.copyfile(path, dest)
+        except OSError:
+            self._bump("misses")
+            return False
+        self._bump("hits")
+        return True
+
+    def put(self, key: str, pdf: str) -> None:
+        """Store the rendered ``pdf`` under ``key``."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        os.close(fd)
+        try:
+            shutil.copyfile(pdf, tmp)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def evict(self) -> int:
+        """Remove least recently used entries until the cache fits ``max_bytes``. Returns bytes freed."""
+        if not os.path.isdir(self.cache_dir):
+            return 0
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        freed = removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            freed += size
+            removed += 1
+        if removed:
+            self._bump("evicted", removed)
+            logger.info("Render cache: evicted %d parts, %s bytes (limit %s)", removed, freed, self.max_bytes)
+        return freed
+
+    def summary(self) -> str:
+        """One line of hit statistics for the CLI."""
+        hits, misses = self.stats["hits"], self.stats["misses"]
+        total = hits + misses
+        rate = 100.0 * hits / total if total else 0.0
+        line = "Render cache: %d of %d parts from cache (%.0f%%), %d rendered" % (hits, total, rate, misses)
+        if self.stats["evicted"]:
+            line += ", %d evicted" % self.stats["evicted"]
+        return line
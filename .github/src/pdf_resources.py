@@ -0,0 +1,165 @@
+"""
+Offline resource preloading for the PDF stage.
+
+wkhtmltopdf fetches remote stylesheets and images while it lays the page out,
+and ``--load-error-handling ignore`` turns a slow or unreachable server into a
+stalled render instead of an error. :class:`ResourcePreloader` resolves every
+reference before the render so that wkhtmltopdf only reads local files:
+
+- ``<link rel="stylesheet">`` is replaced by a ``<style>`` holding the
+  stylesheet, with its ``@import`` rules inlined recursively;
+- ``url()`` references in stylesheets, ``<style>`` blocks and ``style``
+  attributes, and ``<img>``/``<script>`` sources, point at local files;
+- remote files come from the shared :class:`~asset_cache.AssetCache` (so
+  ``--offline`` renders use only what step 1 or an earlier run downloaded),
+  local ones are checked under the page's base directory.
+
+References that cannot be resolved keep their (absolute) URL and are listed
+in :attr:`ResourcePreloader.unresolved`; the PDF converter reports them and
+renders with network access disabled, so they fail at once.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import re
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import unquote, urljoin, urlparse
+from urllib.request import url2pathname
+
+import requests
+from bs4 import BeautifulSoup
+from requests.exceptions import RequestException
+
+from asset_cache import AssetCache
+
+logger = logging.getLogger(__name__)
+
+_IMPORT = re.compile(r'@import\s+(?:url\(\s*)?(["\']?)([^"\')\s;]+)\1\s*\)?\s*([^;]*);', re.I)
+_URL = re.compile(r'url\(\s*(["\']?)(.*?)\1\s*\)', re.I)
+_CHARSET = re.compile(r'@charset\s+["\'][^"\']*["\']\s*;', re.I)
+
+# Nested @import levels followed before giving up (and guarding against cycles).
+_MAX_IMPORT_DEPTH = 8
+
+
+class ResourcePreloader:
+    """Point every stylesheet, image and CSS reference of a page at a local file."""
+
+    def __init__(self, asset_cache: AssetCache, base_url: str, timeout: float = 10) -> None:
+        self.asset_cache = asset_cache
+        self.base_url = base_url
+        self.timeout = timeout
+        self.unresolved: List[str] = []
+        self.resolved = 0
+        self._local: Dict[str, Optional[str]] = {}
+        self._session: Optional[requests.Session] = None
+
+    # -------------------- single references --------------------
+
+    def _local_path(self, url: str) -> Optional[str]:
+        """The local file holding ``url`` (downloading it into the cache if needed), or None."""
+        if url in self._local:
+            return self._local[url]
+        parsed = urlparse(url)
+        path = None
+        if parsed.scheme == "file":
+            candidate = url2pathname(unquote(parsed.path))
+            path = candidate if os.path.isfile(candidate) else None
+        elif parsed.scheme in ("http", "https"):
+            if self._session is None:
+                self._session = requests.Session()
+            try:
+                path = self.asset_cache.get(url.split("#", 1)[0], self._session, timeout=self.timeout)
+            except RequestException as e:
+                logger.warning("Could not fetch %s for the PDF: %s", url, e)
+        self._local[url] = path
+        return path
+
+    def _missing(self, url: str) -> None:
+        if url not in self.unresolved:
+            self.unresolved.append(url)
+
+    def _resolve(self, ref: str, base: str) -> Optional[str]:
+        """A ``file://`` URI for ``ref``, resolved against ``base``; None when unavailable."""
+        ref = ref.strip()
+        if not ref or ref.startswith(("#", "data:", "about:")):
+            return ref
+        url = urljoin(base, ref)
+        path = self._local_path(url)
+        if path is None:
+            self._missing(url)
+            return None
+        self.resolved += 1
+        fragment = "#" + url.split("#", 1)[1] if "#" in url else ""
+        return Path(path).resolve().as_uri() + fragment
+
+    # -------------------- stylesheets --------------------
+
+    def _stylesheet(self, url: str, depth: int) -> Optional[str]:
+        """The stylesheet at ``url`` with its own references resolved, or None."""
+        path = self._local_path(url)
+        if path is None:
+            return None
+        with open(path, "rb") as f:
+            text = f.read().decode("utf-8", errors="replace")
+        return self.css(_CHARSET.sub("", text), url, depth + 1)
+
+    def css(self, text: str, base: str, depth: int = 0) -> str:
+        """Inline the ``@import`` rules of ``text`` and point its ``url()`` references at local files."""
+
+        def inline_import(match: re.Match) -> str:
+            ref, media = match.group(2), match.group(3).strip()
+            url = urljoin(base, ref)
+            imported = self._stylesheet(url, depth) if depth < _MAX_IMPORT_DEPTH else None
+            if imported is None:
+                self._missing(url)
+                return '@import url("%s") %s;' % (url, media) if media else '@import url("%s");' % url
+            self.resolved += 1
+            return "@media %s {\n%s\n}" % (media, imported) if media else imported
+
+        def local_url(match: re.Match) -> str:
+            # Unresolved references stay absolute, since the inlined text loses its own location.
+            resolved = self._resolve(match.group(2), base)
+            return 'url("%s")' % (urljoin(base, match.group(2).strip()) if resolved is None else resolved)
+
+        return _URL.sub(local_url, _IMPORT.sub(inline_import, text))
+
+    # -------------------- pages --------------------
+
+    def preload(self, soup: BeautifulSoup) -> None:
+        """Rewrite the references of ``soup`` in place; see the module docstring."""
+        try:
+            styles = soup.find_all("style")
+            for link in soup.find_all("link", href=True):
+                if "stylesheet" not in [r.lower() for r in (link.get("rel") or [])]:
+                    continue
+                url = urljoin(self.base_url, link["href"])
+                text = self._stylesheet(url, 0)
+                if text is None:
+                    self._missing(url)
+                    continue
+                self.resolved += 1
+                style = soup.new_tag("style")
+                if link.get("media"):
+                    style["media"] = link["media"]
+                style.string = text
+                link.replace_with(style)
+
+            for style in styles:
+                if style.string and ("url(" in style.string or "@import" in style.string):
+                    style.string = self.css(style.string, self.base_url)
+            for tag in soup.find_all(style=True):
+                if "url(" in tag["style"]:
+                    tag["style"] = self.css(tag["style"], self.base_url)
+
+            for tag in soup.find_all(["img", "script"], src=True):
+                resolved = self._resolve(tag["src"], self.base_url)
+                if resolved is not None:
+                    tag["src"] = resolved
+        finally:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
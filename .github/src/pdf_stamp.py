@@ -0,0 +1,208 @@
+"""
+Running headers and footers stamped onto a finished PDF.
+
+wkhtmltopdf renders ``--header-*``/``--footer-*`` text by laying out a small
+HTML page for every page of the document. :class:`Stamp` draws the same
+header, footer line and footer texts directly into the PDF instead, in one
+pass over the pages:
+
+- the parts that are the same on every page (header, footer line, left and
+  center footer) are one form XObject, shared by all pages;
+- each page gets one short content stream that draws the XObject and its
+  ``Page N of M`` text, set in the standard Times-Roman font, which PDF
+  viewers provide, so nothing is embedded.
+
+The texts come from the page itself (:func:`document_metadata`): the title,
+the stage and date lines under the title banner, and the copyright year of
+that date. Needs pypdf.
+"""
+
+from __future__ import annotations
+
+import datetime
+import html as html_lib
+import re
+from typing import Dict
+
+_TITLE = re.compile(r"<title>(.*?)</title>", re.S | re.I)
+_BANNER = re.compile(r"<h1big\b[^>]*>(.*?)</h1big\s*>", re.S | re.I)
+_H2 = re.compile(r"<h2\b[^>]*>(.*?)</h2\s*>", re.S | re.I)
+_TAG = re.compile(r"<[^>]+>")
+_DATE = re.compile(r"^\d{1,2} [A-Z][a-z]+ (\d{4})$")
+
+MM = 72 / 25.4
+
+# Times-Roman advance widths (1/1000 em) for the printable ASCII range, from its AFM metrics.
+_TIMES_WIDTHS = [
+    250, 333, 408, 500, 500, 833, 778, 333, 333, 333, 500, 564, 250, 333, 250, 278,
+    500, 500, 500, 500, 500, 500, 500, 500, 500, 500, 278, 278, 564, 564, 564, 444,
+    921, 722, 667, 667, 722, 611, 556, 722, 722, 333, 389, 722, 611, 889, 722, 722,
+    556, 722, 667, 556, 611, 722, 722, 944, 722, 722, 611, 333, 278, 333, 469, 500,
+    333, 444, 500, 444, 500, 444, 333, 500, 500, 278, 278, 500, 278, 778, 500, 500,
+    500, 500, 333, 389, 278, 500, 500, 722, 500, 500, 444, 480, 200, 480, 541,
+]
+_WIDE = {"©": 760}
+
+
+def _text(fragment: str) -> str:
+    return " ".join(html_lib.unescape(_TAG.sub("", fragment)).split())
+
+
+def document_metadata(html: str) -> Dict[str, str]:
+    """
+    Title, stage and date of a specification page, plus the copyright year.
+
+    The stage and date are the two ``<h2>`` lines after the ``<h1big>``
+    title banner ("Committee Specification Draft 01", "28 May 2025"); missing
+    values are empty strings and the year falls back to the current one.
+    """
+    title = _TITLE.search(html)
+    banner = _BANNER.search(html)
+    meta = {"title": _text(title.group(1)) if title else "", "stage": "", "date": "",
+            "year": str(datetime.date.today().year)}
+    if not meta["title"] and banner:
+        meta["title"] = _text(banner.group(1))
+    if banner:
+        lines = [_text(m.group(1)) for _, m in zip(range(2), _H2.finditer(html, banner.end()))]
+        for line in lines:
+            date = _DATE.match(line)
+            if date:
+                meta["date"], meta["year"] = line, date.group(1)
+            elif not meta["stage"] and not meta["date"]:
+                meta["stage"] = line
+    return meta
+
+
+def text_width(text: str, size: float) -> float:
+    """Width of ``text`` set in Times-Roman at ``size`` points."""
+    total = 0
+    for ch in text:
+        code = ord(ch)
+        total += _TIMES_WIDTHS[code - 32] if 32 <= code < 127 else _WIDE.get(ch, 500)
+    return total * size / 1000
+
+
+def _pdf_string(text: str) -> str:
+    raw = text.encode("cp1252", errors="replace").decode("latin-1")
+    return "(%s)" % raw.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+class Stamp:
+    """Header and footer texts, placed like wkhtmltopdf's header and footer options."""
+
+    def __init__(self, header: str, footer_left: str, footer_center: str,
+                 footer_right: str = "Page {page} of {pages}", header_size: float = 10, footer_size: float = 8,
+                 margin_top: float = 25 * MM, margin_bottom: float = 25 * MM, margin_left: float = 20 * MM,
+                 margin_right: float = 20 * MM, header_spacing: float = 6 * MM,
+                 footer_spacing: float = 4 * MM, footer_line: bool = True) -> None:
+        self.header = header
+        self.footer_left = footer_left
+        self.footer_center = footer_center
+        # ``{page}`` and ``{pages}`` are replaced per page.
+        self.footer_right = footer_right
+        self.header_size = header_size
+        self.footer_size = footer_size
+        self.margin_top, self.margin_bottom = margin_top, margin_bottom
+        self.margin_left, self.margin_right = margin_left, margin_right
+        self.header_spacing, self.footer_spacing = header_spacing, footer_spacing
+        self.footer_line = footer_line
+
+    def _footer_y(self) -> float:
+        # Text baseline, one line below the footer line.
+        return self.margin_bottom - self.footer_spacing - self.footer_size
+
+    def _static_content(self, width: float, height: float) -> str:
+        ops = []
+        if self.header:
+            x = (width - text_width(self.header, self.header_size)) / 2
+            y = height - self.margin_top + self.header_spacing
+            ops.append("BT /FStamp %g Tf %.2f %.2f Td %s Tj ET" % (self.header_size, x, y, _pdf_string(self.header)))
+        if self.footer_line:
+            y = self.margin_bottom - self.footer_spacing + 2
+            ops.append("0.5 w %.2f %.2f m %.2f %.2f l S" % (self.margin_left, y, width - self.margin_right, y))
+        y = self._footer_y()
+        if self.footer_left:
+            ops.append("BT /FStamp %g Tf %.2f %.2f Td %s Tj ET"
+                       % (self.footer_size, self.margin_left, y, _pdf_string(self.footer_left)))
+        if self.footer_center:
+            x = (width - text_width(self.footer_center, self.footer_size)) / 2
+            ops.append("BT /FStamp %g Tf %.2f %.2f Td %s Tj ET" % (self.footer_size, x, y, _pdf_string(self.footer_center)))
+        return "\n".join(ops)
+
+    def apply(self, writer) -> int:
+        """Stamp every page of ``writer`` (a pypdf ``PdfWriter``); returns the page count."""
+        from pypdf.generic import (ArrayObject, DecodedStreamObject, DictionaryObject, FloatObject,
+                                   NameObject)
+
+        font = _indirect(writer, DictionaryObject({
+            NameObject("/Type"): NameObject("/Font"),
+            NameObject("/Subtype"): NameObject("/Type1"),
+            NameObject("/BaseFont"): NameObject("/Times-Roman"),
+            NameObject("/Encoding"): NameObject("/WinAnsiEncoding"),
+        }))
+        save = DecodedStreamObject()
+        save.set_data(b"q\n")
+        save = _indirect(writer, save)
+        forms: Dict[tuple, object] = {}
+        pages = len(writer.pages)
+
+        for number, page in enumerate(writer.pages, start=1):
+            box = page.mediabox
+            size = (float(box.width), float(box.height))
+            form = forms.get(size)
+            if form is None:
+                form = DecodedStreamObject()
+                form.set_data(self._static_content(*size).encode("latin-1"))
+                form.update({
+                    NameObject("/Type"): NameObject("/XObject"),
+                    NameObject("/Subtype"): NameObject("/Form"),
+                    NameObject("/BBox"): ArrayObject([FloatObject(0), FloatObject(0),
+                                                      FloatObject(size[0]), FloatObject(size[1])]),
+                    NameObject("/Resources"): DictionaryObject({
+                        NameObject("/Font"): DictionaryObject({NameObject("/FStamp"): font}),
+                    }),
+                })
+                form = forms[size] = _indirect(writer, form.flate_encode())
+
+            right = self.footer_right.format(page=number, pages=pages)
+            x = size[0] - self.margin_right - text_width(right, self.footer_size)
+            stream = DecodedStreamObject()
+            # Restore the page's graphics state, then draw in box coordinates.
+            stream.set_data(("Q q\n1 0 0 1 %.2f %.2f cm\n/XStamp Do\nBT /FStamp %g Tf %.2f %.2f Td %s Tj ET Q\n" % (
+                float(box.left), float(box.bottom), self.footer_size, x, self._footer_y(),
+                _pdf_string(right))).encode("latin-1"))
+
+            resources = page.get("/Resources")
+            resources = resources.get_object() if resources is not None else DictionaryObject()
+            for kind, name, ref in (("/Font", "/FStamp", font), ("/XObject", "/XStamp", form)):
+                group = resources.get(kind)
+                group = group.get_object() if group is not None else DictionaryObject()
+                group[NameObject(name)] = ref
+                resources[NameObject(kind)] = group
+            page[NameObject("/Resources")] = resources
+
+            contents = page.get("/Contents")
+            existing = [] if contents is None else (list(contents.get_object()) if isinstance(
+                contents.get_object(), ArrayObject) else [contents])
+            page[NameObject("/Contents")] = ArrayObject([save] + existing + [_indirect(writer, stream)])
+        return pages
+
+
+def _indirect(writer, obj):
+    """Add ``obj`` to ``writer`` as an indirect object and return the reference."""
+    # pypdf has no public call for this; PdfWriter._add_object is the same from 3.9 to 6.
+    return writer._add_object(obj)
+
+
+def stamp_from_metadata(meta: Dict[str, str], file_name: str) -> Stamp:
+    """The stamp matching the wkhtmltopdf header and footer of a specification."""
+    right = "Page {page} of {pages}"
+    if meta.get("date"):
+        right = meta["date"] + " - " + right
+    return Stamp(
+        header=meta.get("title", ""),
+        footer_left=file_name,
+        footer_center="Copyright © OASIS Open %s. All Rights Reserved." % meta.get("year", ""),
+        footer_right=right,
+    )
+
@@ -0,0 +1,396 @@
+"""
+Work Product manifest files (``<spec>-<version>-<stage>-manifest.txt``).
+
+Every stage directory ships a manifest listing its ZIP package and the MD5 and
+SHA-1 digests of the files in the directory. :func:`write_manifest` produces
+it in the layout OASIS uses:
+
+- the explanatory text and the bibliographic information are kept from the
+  existing manifest; a new one gets the standard text and the title, stage
+  and date of the stage's HTML page;
+- "ZIP archive contents" is the ``unzip -v`` listing of the stage's package;
+- the digest sections list every file of the directory except the manifest,
+  in case-insensitive path order. ``sha256`` adds a SHA-256 section, and
+  ``sizes`` a byte count column to every digest line.
+
+Files are hashed by a thread pool; each file is read once for all digests,
+files of at least :data:`MMAP_THRESHOLD` bytes through ``mmap`` in
+:data:`CHUNK_SIZE` windows, so large PDFs and ZIPs do not take up memory.
+A :class:`DigestCache` in the build cache keeps the digests of every file by
+path together with its size, modification time and inode; a file for which
+all three are unchanged is not read again. The manifest file is only
+rewritten when its text changes.
+
+    python3 .github/src/stage_manifest.py csaf/v2.1/csd01
+    python3 .github/src/stage_manifest.py csaf --sha256   # every stage that has a manifest
+"""
+
+from __future__ import annotations
+
+import argparse
+import datetime
+import fnmatch
+import hashlib
+import json
+import logging
+import mmap
+import os
+import re
+import sys
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional
+
+from build_manifest import default_manifest_dir
+from pdf_stamp import document_metadata
+from zip_package import MANIFEST_SUFFIX, package_name
+
+logger = logging.getLogger(__name__)
+
+# Files this large are hashed through mmap, CHUNK_SIZE bytes at a time.
+MMAP_THRESHOLD = 1024 * 1024
+CHUNK_SIZE = 1024 * 1024
+
+RELEASE_HOST = "https://docs.oasis-open.org"
+
+_ALGORITHMS = ("md5", "sha1", "sha256")
+_SECTION_TITLES = {
+    "md5": "MD5 digest/hash values for files in the OASIS Library release directory",
+    "sha1": "SHA-1 digest/hash values for files in the OASIS Library release directory",
+    "sha256": "SHA-256 digest/hash values for files in the OASIS Library release directory",
+}
+_GENERATED = re.compile(r"^=+\n(?:ZIP archive contents|MD5 digest/hash values)", re.M)
+_ZIP_SECTION = re.compile(r"^=+\nZIP archive contents\n=+\n.*?(?=^=+\n|\Z)", re.M | re.S)
+
+PREAMBLE = """Work Product Manifest File
+
+This manifest file is an administrative metadata document produced
+by OASIS Staff as part of the approved Work Product publication
+process.  It provides detailed information about the artifacts
+which constitute the Work Product in any published release, viz.,
+for each specific level of approval (csd01, csd02, cs01, cos, etc).
+
+Users may find the manifest file useful in the following situations,
+or similar situations, to help answer basic questions:
+
+1) "Can I examine the extent/content/structure of the published Work
+   Product without having to download the distribution package from
+   the OASIS Library and then UNzip the entire canonical release
+   package from the ZIP format?"  Yes: scan the manifest file
+   published in any release directory (e.g. in /csd01/, /csprd02/)
+   and inspect the section "ZIP archive contents"
+
+2) "Someone sent me an XML schema file for the level CS01 instance
+   of an OASIS specification: how can I determine whether this
+   schema file is identical to the one published by OASIS?"
+   Compute the MD5 or SHA-1 digest for the file you have, and
+   compare it to the value(s) presented in the manifest file.
+
+===============================
+Contents of this manifest file
+===============================
+
+  - Essential bibliographic information
+  - ZIP archive listing for contents and storage hierarchy
+  - Digest/hash values (MD5, SHA-1) for files in the release directory
+
+* Note that the digest/hash values are not intended to support
+security per se: they are provided simply for casual checking
+of a local file's hash value against the published file to
+detect disk corruption or other non-malicious alteration.
+
+* Note that the MD5/SHA-1 digest/hash values for primary ".html" format
+files in the OASIS Library release directory, as displayed below, are
+computed for OASIS server function, whereas the same ".html" files
+included in the ZIP package file, as prepared for local use, vary by a
+few bytes. The ZIP archive contents listing includes the digest/hash
+(CRC-32) and byte count for these ".html" files in the ZIP package.
+
+"""
+
+
+# -------------------- hashing --------------------
+
+def hash_file(path: str, algorithms: Iterable[str] = ("md5", "sha1")) -> Dict[str, str]:
+    """Hex digests of the file at ``path``, all computed in one read."""
+    hashes = {name: hashlib.new(name) for name in algorithms}
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size >= MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+                for start in range(0, size, CHUNK_SIZE):
+                    chunk = view[start:start + CHUNK_SIZE]
+                    for h in hashes.values():
+                        h.update(chunk)
+                    chunk.release()
+        else:
+            data = f.read()
+            for h in hashes.values():
+                h.update(data)
+    return {name: h.hexdigest() for name, h in hashes.items()}
+
+
+class DigestCache:
+    """
+    Digests of files by absolute path, valid while the file's size,
+    modification time and inode are unchanged. Stored as one JSON file.
+    """
+
+    def __init__(self, path: Optional[str]) -> None:
+        self.path = path
+        self.entries: Dict[str, dict] = {}
+        self.stats = {"cached": 0, "hashed": 0}
+        self._lock = threading.Lock()
+        self._dirty = False
+        if path:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                self.entries = {}
+
+    @staticmethod
+    def _signature(st: os.stat_result) -> list:
+        return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+    def digests(self, path: str, algorithms: List[str]) -> Dict[str, str]:
+        """The ``algorithms`` digests of ``path``, from the cache when the file is unchanged."""
+        path = os.path.abspath(path)
+        signature = self._signature(os.stat(path))
+        with self._lock:
+            entry = self.entries.get(path)
+        if entry and entry["stat"] == signature and all(a in entry["digests"] for a in algorithms):
+            with self._lock:
+                self.stats["cached"] += 1
+            return entry["digests"]
+        digests = hash_file(path, algorithms)
+        with self._lock:
+            self.stats["hashed"] += 1
+            self.entries[path] = {"stat": signature, "digests": digests}
+            self._dirty = True
+        return digests
+
+    def save(self) -> None:
+        if not self.path or not self._dirty:
+            return
+        # Forget files that are gone, so the cache does not grow forever.
+        entries = {path: entry for path, entry in self.entries.items() if os.path.exists(path)}
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = "%s.%d.tmp" % (self.path, os.getpid())
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(entries, f, sort_keys=True)
+        os.replace(tmp, self.path)
+        self._dirty = False
+
+
+# -------------------- sections --------------------
+
+def manifest_path(stage_dir: str) -> str:
+    """The stage's manifest: the existing one, else named after its ZIP package."""
+    names = sorted(os.listdir(stage_dir))
+    for name in names:
+        if name.endswith(MANIFEST_SUFFIX):
+            return os.path.join(stage_dir, name)
+    zips = [name for name in names if name.lower().endswith(".zip")]
+    stem = zips[0][:-len(".zip")] if len(zips) == 1 else package_name(stage_dir)[:-len(".zip")]
+    return os.path.join(stage_dir, stem + MANIFEST_SUFFIX)
+
+
+def release_files(stage_dir: str, manifest: str, excludes: Iterable[str] = ()) -> List[str]:
+    """Paths, relative and with ``/``, of the files listed in the digest sections."""
+    files = []
+    manifest = os.path.abspath(manifest)
+    for dirpath, dirnames, filenames in os.walk(stage_dir):
+        dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            if (name.startswith(".") or os.path.abspath(path) == manifest or not os.path.isfile(path)
+                    or any(fnmatch.fnmatch(name, pattern) for pattern in excludes)):
+                continue
+            files.append(os.path.relpath(path, stage_dir).replace(os.sep, "/"))
+    return sorted(files, key=lambda rel: (rel.lower(), rel))
+
+
+def _ratio(size: int, compressed: int) -> int:
+    """Space saved in percent, rounded as ``unzip -v`` does: to per mille first, then to percent."""
+    if not size:
+        return 0
+    saved = size - compressed
+    per_mille = (abs(saved) * 1000 + size // 2) // size
+    return (per_mille + 5) // 10 * (1 if saved >= 0 else -1)
+
+
+def _method(info: zipfile.ZipInfo) -> str:
+    if info.compress_type == zipfile.ZIP_STORED:
+        return "Stored"
+    if info.compress_type == zipfile.ZIP_DEFLATED:
+        return "Defl:" + "NXFS"[(info.flag_bits >> 1) & 3]
+    return {zipfile.ZIP_BZIP2: "BZip2", zipfile.ZIP_LZMA: "LZMA"}.get(info.compress_type, "Unk:%03d" % info.compress_type)
+
+
+def zip_listing(zip_path: str) -> str:
+    """The ``unzip -v`` listing of the archive at ``zip_path``."""
+    with zipfile.ZipFile(zip_path) as zf:
+        infos = zf.infolist()
+    lines = ["Archive:  %s" % os.path.basename(zip_path),
+             " Length   Method    Size  Cmpr    Date    Time   CRC-32   Name",
+             "--------  ------  ------- ---- ---------- ----- --------  ----"]
+    for info in infos:
+        y, mo, d, h, mi, _ = info.date_time
+        lines.append("%8d  %-6s %8d %3d%% %02d-%02d-%04d %02d:%02d %08x  %s" % (
+            info.file_size, _method(info), info.compress_size, _ratio(info.file_size, info.compress_size),
+            mo, d, y, h, mi, info.CRC, info.filename))
+    size = sum(info.file_size for info in infos)
+    compressed = sum(info.compress_size for info in infos)
+    lines.append("--------          -------  ---                            -------")
+    lines.append("%8d         %8d %3d%%                            %d file%s" % (
+        size, compressed, _ratio(size, compressed), len(infos), "" if len(infos) == 1 else "s"))
+    return "\n".join(lines)
+
+
+def bibliography(stage_dir: str, manifest: str, repo_dir: str) -> str:
+    """The bibliographic section of a new manifest, from the stage's HTML page."""
+    stem = os.path.basename(manifest)[:-len(MANIFEST_SUFFIX)]
+    html_file = os.path.join(stage_dir, stem + ".html")
+    meta = document_metadata(open(html_file, encoding="utf-8").read()) if os.path.exists(html_file) else {}
+    rel = os.path.relpath(os.path.abspath(stage_dir), os.path.abspath(repo_dir)).replace(os.sep, "/")
+    if rel.startswith("../"):
+        # Stage outside the repository: take it as <spec>/<version>/<stage>.
+        rel = "/".join(os.path.abspath(stage_dir).replace(os.sep, "/").split("/")[-3:])
+    # docs.oasis-open.org/<tc>/<spec>/<version>/<stage>: the TC directory is the spec name in lower case.
+    base = "%s/%s/%s" % (RELEASE_HOST, rel.split("/")[0].lower(), rel)
+    lines = [
+        meta.get("title", ""),
+        meta.get("stage", ""),
+        meta.get("date", ""),
+        "Copyright (c) OASIS Open %s.  All Rights Reserved." % meta.get("year", datetime.date.today().year),
+        "Release URI:  %s/%s.zip" % (base, stem),
+        "Manifest URI: %s/%s" % (base, os.path.basename(manifest)),
+    ]
+    heading = "Essential bibliographic information"
+    rule = "=" * (len(heading) + 2)
+    return "%s\n%s\n%s\n\n%s\n\n" % (rule, heading, rule, "\n".join(line for line in lines if line))
+
+
+def digest_section(algorithm: str, files: List[str], digests: Dict[str, Dict[str, str]],
+                   sizes: Optional[Dict[str, int]] = None) -> str:
+    title = _SECTION_TITLES[algorithm]
+    rule = "=" * (len(title) + 1)
+    width = max((len(str(size)) for size in sizes.values()), default=1) if sizes else 0
+    lines = []
+    for rel in files:
+        size = "%*d  " % (width, sizes[rel]) if sizes else ""
+        lines.append("%s  %s%s" % (digests[rel][algorithm], size, rel))
+    return "%s\n%s\n%s\n\n%s\n" % (rule, title, rule, "\n".join(lines))
+
+
+# -------------------- manifest --------------------
+
+def build_manifest(stage_dir: str, cache: DigestCache, sha256: bool = False, sizes: bool = False,
+                   jobs: Optional[int] = None, repo_dir: str = ".", excludes: Iterable[str] = ()) -> str:
+    """The manifest text of ``stage_dir``; see the module docstring."""
+    manifest = manifest_path(stage_dir)
+    existing = None
+    if os.path.exists(manifest):
+        with open(manifest, "r", encoding="utf-8") as f:
+            existing = f.read()
+    generated = _GENERATED.search(existing) if existing else None
+    if generated:
+        preamble = existing[:generated.start()]
+    else:
+        preamble = PREAMBLE + bibliography(stage_dir, manifest, repo_dir)
+
+    files = release_files(stage_dir, manifest, excludes)
+    algorithms = [a for a in _ALGORITHMS if a != "sha256" or sha256]
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        results = pool.map(lambda rel: cache.digests(os.path.join(stage_dir, rel), algorithms), files)
+        digests = dict(zip(files, results))
+    file_sizes = {rel: os.path.getsize(os.path.join(stage_dir, rel)) for rel in files} if sizes else None
+
+    sections = []
+    zip_file = os.path.join(stage_dir, os.path.basename(manifest)[:-len(MANIFEST_SUFFIX)] + ".zip")
+    old_listing = _ZIP_SECTION.search(existing) if existing else None
+    if os.path.exists(zip_file):
+        heading = "ZIP archive contents"
+        rule = "=" * (len(heading) + 7)
+        sections.append("%s\n%s\n%s\n\n%s\n" % (rule, heading, rule, zip_listing(zip_file)))
+    elif old_listing:
+        # The package of an older stage is not always in the repository; keep its listing.
+        sections.append(old_listing.group(0).rstrip("\n") + "\n")
+    sections += [digest_section(a, files, digests, file_sizes) for a in algorithms]
+    return preamble + "\n".join(sections)
+
+
+def write_manifest(stage_dir: str, cache: DigestCache, **options) -> bool:
+    """Write the manifest of ``stage_dir`` if its text changed; returns True when written."""
+    manifest = manifest_path(stage_dir)
+    text = build_manifest(stage_dir, cache, **options)
+    try:
+        with open(manifest, "r", encoding="utf-8") as f:
+            if f.read() == text:
+                return False
+    except OSError:
+        pass
+    tmp = manifest + ".tmp"
+    with open(tmp, "w", encoding="utf-8", newline="\n") as f:
+        f.write(text)
+    os.replace(tmp, manifest)
+    return True
+
+
+def find_stages(paths: List[str]) -> List[str]:
+    """Stage directories among ``paths``: directories with a manifest are searched for below the others."""
+    stages = []
+    for path in paths:
+        if any(name.endswith(MANIFEST_SUFFIX) for name in os.listdir(path)) or not any(
+                os.path.isdir(os.path.join(path, name)) for name in os.listdir(path)):
+            stages.append(path)
+            continue
+        found = []
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames[:] = sorted(d for d in dirnames
+                                 if not d.startswith(".") and not os.path.islink(os.path.join(dirpath, d)))
+            if any(name.endswith(MANIFEST_SUFFIX) for name in filenames):
+                found.append(dirpath)
+        stages += found or [path]
+    return stages
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Write the Work Product manifest of stage directories")
+    parser.add_argument("paths", nargs="+",
+                        help="Stage directories; other directories are searched for stages that have a manifest")
+    parser.add_argument("--sha256", action="store_true", help="Add a SHA-256 digest section")
+    parser.add_argument("--sizes", action="store_true", help="Add a byte count column to the digest sections")
+    parser.add_argument("--exclude", action="append", default=[], metavar="GLOB",
+                        help="File names to leave out of the digest sections, e.g. '*-comment-resolution-log.*'")
+    parser.add_argument("--jobs", type=int, default=None, help="Hashing threads (default: CPU count)")
+    parser.add_argument("--repo", default=".", help="Repository root, for the release URIs of new manifests")
+    parser.add_argument("--build-cache",
+                        help="Directory of the digest cache (default: $BUILD_CACHE_DIR or <repo>/.build-cache)")
+    parser.add_argument("--no-cache", action="store_true", help="Hash every file, without the digest cache")
+    args = parser.parse_args()
+    for path in args.paths:
+        if not os.path.isdir(path):
+            parser.error("not a directory: %s" % path)
+
+    started = time.perf_counter()
+    cache_dir = args.build_cache or default_manifest_dir(os.path.abspath(args.repo))
+    cache = DigestCache(None if args.no_cache else os.path.join(cache_dir, "file-digests.json"))
+    try:
+        for stage in find_stages(args.paths):
+            written = write_manifest(stage, cache, sha256=args.sha256, sizes=args.sizes,
+                                     jobs=args.jobs or os.cpu_count(), repo_dir=args.repo, excludes=args.exclude)
+            print("%s: %s" % (manifest_path(stage), "written" if written else "unchanged"))
+    finally:
+        cache.save()
+    print("%d files hashed, %d digests from cache, %.2fs" % (
+        cache.stats["hashed"], cache.stats["cached"], time.perf_counter() - started))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s",
+                        stream=sys.stderr)
+    main()
@@ -4,24 +4,52 @@ Utilities for converting Markdown files to HTML.
 The module provides :class:`MarkdownToHtmlConverter`, a helper that formats and
 converts Markdown sources to HTML while downloading remote images and injecting
 metadata. It is used by CI workflows and is considered an entrypoint script.
+
+:meth:`MarkdownToHtmlConverter.render` is the library entry point: pandoc is
+piped through stdin/stdout, all options are per instance and nothing but the
+localized assets is written, so several converters can run in one process
+(threads, or an asyncio loop via ``asyncio.to_thread``).
 """
 
 from __future__ import annotations
 
 import argparse
+import hashlib
 import logging
 import os
+import posixpath
 import re
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
-from urllib.parse import urlparse
+from urllib.parse import unquote, urlparse
 
 import requests
 from bs4 import BeautifulSoup, Tag
+from requests.adapters import HTTPAdapter
 from requests.exceptions import RequestException
 
+from asset_cache import DEFAULT_MAX_BYTES, AssetCache, default_cache_dir
+from build_manifest import BuildManifest, default_manifest_dir, file_digest, sources_digest, tool_version
+from build_trace import NULL_TRACER, Tracer, add_trace_arguments, tracer_from_args
+from css_bundle import BundleUnsupported, bundle_css, format_stats, replace_stylesheets, stylesheet_elements
+from html_canonical import canonical_html, content_digest
+from html_visitor import VOID_ELEMENTS, HtmlVisitor, in_tree, normalize_text_runs, parse_html
+from md_scanner import MarkdownScan, scan_markdown, with_toc_title
+from pandoc_ast import AstPipeline, AstUnsupported
+from pandoc_shards import ShardedPandoc, ShardingError
+from pdf_outline import write_index as write_heading_index
+
 logger = logging.getLogger(__name__)
 
+# Source files whose content is the converter "version" recorded in build manifests.
+_SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+CONVERTER_SOURCES = [os.path.abspath(__file__)] + [
+    os.path.join(_SRC_DIR, name) for name in ("html_visitor.py", "asset_cache.py", "build_manifest.py", "pandoc_shards.py", "md_scanner.py",
+                                         "pandoc_ast.py", "build_trace.py", "css_bundle.py",
+                                         "html_canonical.py")
+]
+
 
 # -------------------- small helpers --------------------
 
@@ -59,26 +87,65 @@ class MarkdownToHtmlConverter:
     images_subdir = "images"    # for localized images next to the output HTML
     styles_subdir = "styles"    # for localized CSS next to the output HTML
 
+    # remote asset downloads share one keep-alive session and this many threads
+    download_workers = 8
+    download_timeout = 10
+
     def __init__(
         self,
         md_file: str,
         output_file: str,
         git_repo_basedir: Optional[str] = None,
         md_dir: Optional[str] = None,
+        html_parser: Optional[str] = None,
+        asset_cache: Optional[AssetCache] = None,
+        pandoc_shards: Optional[int] = None,
+        localize_css: Optional[bool] = None,
+        ast_pipeline: bool = False,
+        tracer: Optional[Tracer] = None,
+        css_bundle: bool = False,
+        canonical: bool = False,
     ) -> None:
         self.md_file = sanitize_file_path(md_file)
         self.output_file = sanitize_file_path(output_file)
         self.git_repo_basedir = sanitize_file_path(git_repo_basedir) if git_repo_basedir else None
         self.md_dir = sanitize_file_path(md_dir) if md_dir else None
+        # BeautifulSoup backend for post-processing; "lxml" is faster but only
+        # the default html.parser output is byte-stable with earlier builds.
+        self.html_parser = html_parser or "html.parser"
+        # Downloads go through a cache shared by every stage directory of the repo.
+        self.asset_cache = asset_cache or AssetCache(default_cache_dir(self.git_repo_basedir))
+        self.manifest_dir = default_manifest_dir(self.git_repo_basedir)
+        self.localized_assets: list = []
+        # Worker count for section-sharded pandoc; None runs pandoc once on the whole file.
+        self.pandoc_shards = pandoc_shards
+        # Link one stylesheet trimmed to the rules the page uses (see css_bundle);
+        # the stylesheets must be local, so remote ones are downloaded by default.
+        self.css_bundle = css_bundle
+        # Also download remote stylesheets; defaults to the HTML_LOCALIZE_CSS environment variable.
+        if localize_css is None:
+            localize_css = css_bundle or os.getenv("HTML_LOCALIZE_CSS", "").lower() in {"1", "true", "yes"}
+        self.localize_css = localize_css
+        # Apply the structural fixes to pandoc's JSON AST instead of re-parsing its HTML.
+        self.ast_pipeline = ast_pipeline
+        # Stage spans for --trace; the default records nothing.
+        self.tracer = tracer or NULL_TRACER
+        # Write the page in the byte-stable form of html_canonical.
+        self.canonical = canonical
+        # SHA-256 of the last rendered page, for stages that only run when it changed.
+        self.content_digest: Optional[str] = None
 
         logger.info("Initialized MarkdownToHtmlConverter with:")
         logger.info("  Markdown File: %s", self.md_file)
         logger.info("  Output File: %s", self.output_file)
         logger.info("  Git Repo Base Dir: %s", self.git_repo_basedir)
         logger.info("  Markdown Directory: %s", self.md_dir)
+        logger.info("  Asset Cache: %s%s", self.asset_cache.root, " (offline)" if self.asset_cache.offline else "")
 
-        self.meta_description = self._extract_meta_description(step=1)
-        self.html_title = self._extract_html_title(step=2)
+        # One memory-mapped scan provides both; see md_scanner.
+        scan = self._scan_markdown()
+        self.meta_description = self._extract_meta_description(step=1, scan=scan)
+        self.html_title = self._extract_html_title(step=2, scan=scan)
 
         out_dir = os.path.dirname(self.output_file)
         self.styles_dir = os.path.join(out_dir, self.styles_subdir)
@@ -87,47 +154,44 @@ class MarkdownToHtmlConverter:
 
         local_styles_css = os.path.join(self.styles_dir, "styles.css")
         if os.path.exists(local_styles_css):
-            self.css_ref_for_pandoc = os.path.join(self.styles_subdir, "styles.css")
+            self.css_ref_for_pandoc = posixpath.join(self.styles_subdir, "styles.css")
         else:
-            self.css_ref_for_pandoc = os.path.join(self.base_url, self.css_file_name)
+            self.css_ref_for_pandoc = posixpath.join(self.base_url, self.css_file_name)
 
         self.base_href_remote = self._construct_abs_doc_url(self.git_repo_basedir, self.md_dir)
         self._abs_doc_parsed = urlparse(self.base_href_remote)
         self._abs_doc_dir = (self._abs_doc_parsed.path.rsplit("/", 1)[0] + "/") if self._abs_doc_parsed.path else "/"
 
-    def _extract_meta_description(self, step: int) -> str:
-        logger.info("Step %s: Extracting meta description from: %s", step, self.md_file)
+    def _scan_markdown(self) -> Optional[MarkdownScan]:
         try:
-            with open(self.md_file, "r", encoding="utf-8") as f:
-                for line in f:
-                    # Look for meta description in markdown comments or front matter
-                    if line.strip().startswith("<!--") and "description:" in line.lower():
-                        # Extract description from HTML comment
-                        desc_start = line.lower().find("description:") + len("description:")
-                        desc_end = line.find("-->")
-                        if desc_end > desc_start:
-                            return line[desc_start:desc_end].strip()
-                    elif line.strip().startswith("description:"):
-                        # Extract from YAML front matter style
-                        return line.split(":", 1)[1].strip().strip('"\'')
-            logger.warning("Step %s: No meta description found.", step)
-            return "-"
+            with self.tracer.span("metadata scan", profile=True) as span:
+                span["bytes_in"] = os.path.getsize(self.md_file)
+                return scan_markdown(self.md_file)
         except Exception:
-            logger.error("Step %s: Error extracting meta description", step, exc_info=True)
+            logger.error("Error scanning %s", self.md_file, exc_info=True)
+            return None
+
+    def _extract_meta_description(self, step: int, scan: Optional[MarkdownScan] = None) -> str:
+        # Look for meta description in markdown comments or front matter
+        logger.info("Step %s: Extracting meta description from: %s", step, self.md_file)
+        scan = scan or self._scan_markdown()
+        if scan is None:
+            return "-"
+        if scan.description is None:
+            logger.warning("Step %s: No meta description found.", step)
             return "-"
+        return scan.description
 
-    def _extract_html_title(self, step: int) -> str:
+    def _extract_html_title(self, step: int, scan: Optional[MarkdownScan] = None) -> str:
+        # First line starting with "# "
         logger.info("Step %s: Extracting HTML title from: %s", step, self.md_file)
-        try:
-            with open(self.md_file, "r", encoding="utf-8") as f:
-                for line in f:
-                    if line.startswith("# "):  # first H1
-                        return line.strip("# ").strip()
-            logger.warning("Step %s: No HTML title found.", step)
+        scan = scan or self._scan_markdown()
+        if scan is None:
             return "-"
-        except Exception:
-            logger.error("Step %s: Error extracting HTML title", step, exc_info=True)
+        if scan.title is None:
+            logger.warning("Step %s: No HTML title found.", step)
             return "-"
+        return scan.title
 
     def _read_file(self, file_path: str) -> str:
         try:
@@ -139,7 +203,7 @@ class MarkdownToHtmlConverter:
 
     def _write_file(self, file_path: str, content: str) -> None:
         try:
-            with open(file_path, "w", encoding="utf-8") as f:
+            with open(file_path, "w", encoding="utf-8", newline="\n") as f:
                 f.write(content)
         except OSError:
             logger.error("Failed to write %s", file_path, exc_info=True)
@@ -156,76 +220,124 @@ class MarkdownToHtmlConverter:
             return f"{self.base_url}/{relative_md_dir}/{os.path.basename(self.output_file)}"
         return f"{self.base_url}/{os.path.basename(self.output_file)}"
 
-    def _run_pandoc(self, step: int) -> None:
-        logger.info("Step %s: Running pandoc.", step)
-        cmd = [
-            "pandoc",
-            self.md_file,
-            "-f", "markdown+autolink_bare_uris+hard_line_breaks",
+    pandoc_reader = "markdown+autolink_bare_uris+hard_line_breaks"
+
+    def _pandoc_page_args(self) -> list:
+        return [
             "-c", self.css_ref_for_pandoc,
             "-s",
-            "-o", "temp_output.html",
             "--metadata", f"title={self.html_title}",
             "--toc"  # ### FIX ###: Explicitly tell Pandoc to create the Table of Contents
         ]
+
+    def _run_pandoc(self, step: int, markdown: str) -> str:
+        """Convert ``markdown`` to the standalone pandoc page, through stdin and stdout."""
+        if self.pandoc_shards:
+            html_content = self._run_pandoc_sharded(step, markdown)
+            if html_content is not None:
+                return html_content
+        logger.info("Step %s: Running pandoc.", step)
+        cmd = ["pandoc", "-f", self.pandoc_reader, "-t", "html"] + self._pandoc_page_args()
         logger.debug("Pandoc command: %s", " ".join(cmd))
         try:
-            subprocess.run(cmd, check=True)
-            logger.info("Step %s: pandoc OK.", step)
-        except subprocess.CalledProcessError:
-            logger.error("Step %s: pandoc failed", step, exc_info=True)
+            with self.tracer.span("pandoc", profile=True, bytes_in=markdown) as span:
+                result = subprocess.run(cmd, input=markdown, capture_output=True, text=True, encoding="utf-8", check=True)
+                span["bytes_out"] = result.stdout
+        except subprocess.CalledProcessError as e:
+            logger.error("Step %s: pandoc failed: %s", step, e.stderr, exc_info=True)
             raise
+        if result.stderr:
+            logger.warning("Step %s: pandoc: %s", step, result.stderr.strip())
+        logger.info("Step %s: pandoc OK.", step)
+        return result.stdout
+
+    def _run_pandoc_sharded(self, step: int, markdown: str) -> Optional[str]:
+        """Run pandoc per top-level section; returns None when the whole file must be converted at once."""
+        logger.info("Step %s: Running pandoc on sections with %s workers.", step, self.pandoc_shards)
+        sharded = ShardedPandoc(
+            self.pandoc_reader,
+            self._pandoc_page_args(),
+            cache_dir=os.path.join(self.manifest_dir, "pandoc"),
+            workers=self.pandoc_shards,
+        )
+        try:
+            with self.tracer.span("pandoc (sections)", profile=True, bytes_in=markdown) as span:
+                html_content = sharded.convert(markdown)
+                span.update(sharded.stats, bytes_out=html_content)
+        except (ShardingError, subprocess.CalledProcessError) as e:
+            logger.warning("Step %s: sectioned conversion not possible (%s); converting the whole file.", step, e)
+            return None
+        finally:
+            sharded.prune_cache()
+        logger.info("Step %s: pandoc OK (%s runs, %s reused from cache).",
+                    step, sharded.stats["rendered"], sharded.stats["cached"])
+        return html_content
 
-    def _convert_plain_urls_to_links(self, html: str) -> str:
-        soup = BeautifulSoup(html, "html.parser")
-        url_re = re.compile(r"(https?://[^\s<]+)")
-        for p in soup.find_all("p"):
-            if p.find(True):
-                continue  # already has tags
-            text = p.get_text()
-            if "http" not in text:
-                continue
-            new_html = url_re.sub(lambda m: f'<a href="{m.group(1)}">{m.group(1)}</a>', text)
+    _url_re = re.compile(r"(https?://[^\s<]+)")
+
+    def _convert_plain_urls_to_links(self, soup: BeautifulSoup, p: Tag) -> list:
+        """
+        Autolink bare URLs in a tag-free paragraph. Returns the tags that were created.
+        """
+        if p.find(True):
+            return []  # already has tags
+        text = p.get_text()
+        if "http" not in text:
+            return []
+        if any(ch in text for ch in "<>&\""):
+            # The replacement text is parsed as markup; keep that behaviour for
+            # paragraphs whose text could turn into tags or entities.
+            new_html = self._url_re.sub(lambda m: f'<a href="{m.group(1)}">{m.group(1)}</a>', text)
             p.clear()
             p.append(BeautifulSoup(new_html, "html.parser"))
-        return str(soup)
-
-    def _normalize_same_doc_anchors_for_web(self, soup: BeautifulSoup, output_basename: str) -> None:
+            return p.find_all(True)
+        created = []
+        p.clear()
+        for i, part in enumerate(self._url_re.split(text)):
+            if i % 2:
+                a = soup.new_tag("a", href=part)
+                a.string = part
+                p.append(a)
+                created.append(a)
+            elif part:
+                p.append(part)
+        return created
+
+    def _normalize_same_doc_anchor_for_web(self, a: Tag, output_basename: str) -> None:
         """
-        ### FIX ###: This function is now the primary method for fixing TOC and internal links.
+        ### FIX ###: This rule is now the primary method for fixing TOC and internal links.
         It robustly finds any link pointing to the same document and rewrites it
         to be a simple fragment-only link (e.g., "#section-1").
         """
-        for a in soup.find_all("a", href=True):
-            href = (a["href"] or "").strip()
-            if not href:
-                continue
-            # If it's already a clean fragment link, we're good.
-            if href.startswith("#"):
-                a.attrs.pop("target", None)
-                continue
+        href = (a["href"] or "").strip()
+        if not href:
+            return
+        # If it's already a clean fragment link, we're good.
+        if href.startswith("#"):
+            a.attrs.pop("target", None)
+            return
 
-            p = urlparse(href)
-            # We only care about links that have a fragment identifier.
-            if not p.fragment:
-                continue
+        p = urlparse(href)
+        # We only care about links that have a fragment identifier.
+        if not p.fragment:
+            return
 
-            same_doc = False
-            # Case 1: Relative link like "my-doc.html#section" or just "#section"
-            if not p.scheme and not p.netloc:
-                if (p.path == "") or (os.path.basename(p.path) == output_basename):
-                    same_doc = True
-            # Case 2: Absolute link back to this exact same document
-            else:
-                if os.path.basename(p.path) == output_basename:
-                    same_doc = True
-            
-            # If it's a same-document link, rewrite href to be just the fragment.
-            if same_doc:
-                new_href = f"#{p.fragment}"
-                logger.debug(f"Normalizing same-document anchor: '{href}' -> '{new_href}'")
-                a["href"] = new_href
-                a.attrs.pop("target", None)
+        same_doc = False
+        # Case 1: Relative link like "my-doc.html#section" or just "#section"
+        if not p.scheme and not p.netloc:
+            if (p.path == "") or (os.path.basename(p.path) == output_basename):
+                same_doc = True
+        # Case 2: Absolute link back to this exact same document
+        else:
+            if os.path.basename(p.path) == output_basename:
+                same_doc = True
+
+        # If it's a same-document link, rewrite href to be just the fragment.
+        if same_doc:
+            new_href = f"#{p.fragment}"
+            logger.debug(f"Normalizing same-document anchor: '{href}' -> '{new_href}'")
+            a["href"] = new_href
+            a.attrs.pop("target", None)
 
     def _is_same_site_same_scope(self, url: str) -> Optional[str]:
         try:
@@ -240,39 +352,31 @@ class MarkdownToHtmlConverter:
             return None
         return p.path[len(self._abs_doc_dir):]
 
-    def _relativize_same_scope_links(self, soup: BeautifulSoup) -> None:
-        # This function remains as it was in the original script.
-        for a in soup.find_all("a", href=True):
-            href = a["href"].strip()
-            if href.startswith("#"):
-                continue
-            tail = self._is_same_site_same_scope(href)
-            if not tail:
-                continue
-            from urllib.parse import urlparse as _p
-            pp = _p(href)
-            if os.path.basename(pp.path) == os.path.basename(self.output_file):
-                if pp.fragment:
-                    a["href"] = f"#{pp.fragment}"
-                else:
-                    a["href"] = os.path.basename(pp.path)
-                a.attrs.pop("target", None)
-            else:
-                a["href"] = tail.lstrip("/")
-        # ... (rest of the original function is preserved)
-        for link in soup.find_all("link", href=True):
-            tail = self._is_same_site_same_scope(link["href"].strip())
-            if tail:
-                link["href"] = tail.lstrip("/")
-        for s in soup.find_all("script", src=True):
-            tail = self._is_same_site_same_scope(s["src"].strip())
-            if tail:
-                s["src"] = tail.lstrip("/")
-        for img in soup.find_all("img", src=True):
-            tail = self._is_same_site_same_scope(img["src"].strip())
+    def _relativize_same_scope_link(self, tag: Tag) -> None:
+        """Rewrite an a/link/script/img URL under this document's directory to a relative one."""
+        attr = "src" if tag.name in ("script", "img") else "href"
+        if not tag.has_attr(attr):
+            return
+        url = tag[attr].strip()
+        if tag.name != "a":
+            tail = self._is_same_site_same_scope(url)
             if tail:
-                img["src"] = tail.lstrip("/")
-
+                tag[attr] = tail.lstrip("/")
+            return
+        if url.startswith("#"):
+            return
+        tail = self._is_same_site_same_scope(url)
+        if not tail:
+            return
+        pp = urlparse(url)
+        if os.path.basename(pp.path) == os.path.basename(self.output_file):
+            if pp.fragment:
+                tag["href"] = f"#{pp.fragment}"
+            else:
+                tag["href"] = os.path.basename(pp.path)
+            tag.attrs.pop("target", None)
+        else:
+            tag["href"] = tail.lstrip("/")
 
     def _first_tag_child(self, parent: Tag) -> Tag | None:
         for c in parent.children:
@@ -294,69 +398,70 @@ class MarkdownToHtmlConverter:
         if not (parent and parent.name == "p" and parent.parent is body): return False
         return parent is self._first_tag_child(body)
 
-    def _enforce_single_oasis_logo(self, soup: BeautifulSoup) -> None:
-        # This function is preserved from your original script.
-        body = soup.body or soup
-        for img in list(soup.find_all("img")):
-            src = (img.get("src") or "")
-            alt = (img.get("alt") or "")
-            if ("OASISLogo" in src) or (alt.strip() == "OASIS Logo"):
-                if not self._is_canonical_logo_img(img, body):
-                    p = img.parent
-                    if p and p.name == "p" and all((isinstance(x, Tag) and x.name == "img") or str(x).strip() == "" for x in p.contents):
-                        p.decompose()
-                    else:
-                        img.decompose()
+    def _drop_stray_logo_img(self, img: Tag, body: Tag) -> bool:
+        """Remove a logo image that is not the canonical top-of-body logo. True when removed."""
+        src = (img.get("src") or "")
+        alt = (img.get("alt") or "")
+        if not (("OASISLogo" in src) or (alt.strip() == "OASIS Logo")):
+            return False
+        if self._is_canonical_logo_img(img, body):
+            return False
+        p = img.parent
+        if p and p.name == "p" and all((isinstance(x, Tag) and x.name == "img") or str(x).strip() == "" for x in p.contents):
+            p.decompose()
+        else:
+            img.decompose()
+        return True
+
+    def _ensure_canonical_logo(self, soup: BeautifulSoup, body: Tag) -> bool:
+        """
+        Make sure the canonical logo paragraph is the first element of the body.
+        Expects stray logos to have been dropped already. True when the tree changed.
+        """
         first_el = self._first_tag_child(body)
-        current_good = None
         if first_el and first_el.name == "p":
             maybe_img = first_el.find("img", recursive=False) or first_el.find("img")
             if maybe_img and self._is_canonical_logo_img(maybe_img, body):
-                current_good = first_el
-        if not current_good:
-            existing_good_img = None
-            for img in soup.find_all("img"):
-                src = (img.get("src") or "")
-                alt = (img.get("alt") or "")
-                if self._looks_like_logo_src(src) and alt == "OASIS Logo":
-                    existing_good_img = img
-                    break
-            if existing_good_img:
-                container = existing_good_img.parent if (existing_good_img.parent and existing_good_img.parent.name == "p") else None
-                if not container:
-                    container = soup.new_tag("p")
-                    existing_good_img.replace_with(container)
-                    container.append(existing_good_img)
-                first_tag = self._first_tag_child(body)
-                if first_tag:
-                    first_tag.insert_before(container)
-                else:
-                    body.insert(0, container)
-            else:
-                p = soup.new_tag("p")
-                img = soup.new_tag("img", src=self.logo_canonical_remote, alt="OASIS Logo")
-                p.append(img)
-                first_tag = self._first_tag_child(body)
-                if first_tag:
-                    first_tag.insert_before(p)
-                else:
-                    body.insert(0, p)
-        for img in list(soup.find_all("img")):
+                return False
+        existing_good_img = None
+        for img in soup.find_all("img"):
             src = (img.get("src") or "")
             alt = (img.get("alt") or "")
-            if ("OASISLogo" in src) or (alt.strip() == "OASIS Logo"):
-                if not self._is_canonical_logo_img(img, body):
-                    p = img.parent
-                    if p and p.name == "p" and all((isinstance(x, Tag) and x.name == "img") or str(x).strip() == "" for x in p.contents):
-                        p.decompose()
-                    else:
-                        img.decompose()
+            if self._looks_like_logo_src(src) and alt == "OASIS Logo":
+                existing_good_img = img
+                break
+        if existing_good_img:
+            container = existing_good_img.parent if (existing_good_img.parent and existing_good_img.parent.name == "p") else None
+            if not container:
+                container = soup.new_tag("p")
+                existing_good_img.replace_with(container)
+                container.append(existing_good_img)
+            first_tag = self._first_tag_child(body)
+            if first_tag:
+                first_tag.insert_before(container)
+            else:
+                body.insert(0, container)
+        else:
+            p = soup.new_tag("p")
+            img = soup.new_tag("img", src=self.logo_canonical_remote, alt="OASIS Logo")
+            p.append(img)
+            first_tag = self._first_tag_child(body)
+            if first_tag:
+                first_tag.insert_before(p)
+            else:
+                body.insert(0, p)
+        # Moving the logo can demote images that were canonical before.
+        for img in list(soup.find_all("img")):
+            self._drop_stray_logo_img(img, body)
+        return True
 
     def _fix_top_banner_block(self, soup: BeautifulSoup) -> None:
         # This function is preserved from your original script.
         body = soup.body or soup
         logo_p = None
-        for p_tag in body.find_all("p", recursive=False):
+        for p_tag in body.children:
+            if not (_is_tag(p_tag) and p_tag.name == "p"):
+                continue
             img = p_tag.find("img", recursive=False)
             if img and self._is_canonical_logo_img(img, body):
                 logo_p = p_tag
@@ -365,7 +470,7 @@ class MarkdownToHtmlConverter:
             logger.warning("Could not find the canonical OASIS logo paragraph. Skipping banner fix.")
             return
         first_heading = None
-        for sibling in logo_p.find_next_siblings():
+        for sibling in logo_p.next_siblings:
             if _is_tag(sibling) and sibling.name in ("h1", "h1big", "h2", "h3", "h4", "h5", "h6"):
                 first_heading = sibling
                 break
@@ -393,147 +498,498 @@ class MarkdownToHtmlConverter:
             logger.debug("Upgrading first <h1> to <h1big> to prevent premature page break.")
             first_heading.name = "h1big"
 
-    def _remove_duplicate_heading_anchors(self, soup: BeautifulSoup) -> None:
+    def _remove_duplicate_heading_anchors(self, heading: Tag) -> list:
         """
-        ### FIX ###: Remove duplicate anchor tags inside headings that have the same ID.
+        ### FIX ###: Remove duplicate anchor tags inside a heading that have the same ID.
         This fixes the internal linking issue where TOC links don't work due to duplicate IDs.
+        Returns the elements an anchor was removed from.
+        """
+        touched = []
+        heading_id = heading.get("id")
+        if heading_id:
+            # Find any anchor tags inside this heading with the same ID
+            duplicate_anchors = heading.find_all("a", id=heading_id)
+            for anchor in duplicate_anchors:
+                logger.debug(f"Removing duplicate anchor with id='{heading_id}' from heading")
+                touched.append(anchor.parent)
+                # Remove the anchor tag but keep its text content
+                if anchor.string:
+                    anchor.replace_with(anchor.string)
+                else:
+                    anchor.decompose()
+        return touched
+
+    def _plan_stylesheets(self, links: list) -> list:
+        """Return ``(link, url, file_name)`` for remote stylesheets."""
+        planned = []
+        for link in links:
+            if not link.has_attr("rel"): continue
+            if (link.get("rel") or [""])[0].lower() != "stylesheet": continue
+            href = link["href"].strip()
+            pr = urlparse(href)
+            if pr.scheme in {"http", "https"}:
+                planned.append((link, href, os.path.basename(pr.path) or "style.css"))
+        return planned
+
+    def _plan_images(self, imgs: list) -> list:
+        """Return ``(img, url, file_name)`` for remote images."""
+        planned = []
+        for img in imgs:
+            src = img["src"].strip()
+            pr = urlparse(src)
+            if pr.scheme in {"http", "https"}:
+                planned.append((img, src, os.path.basename(pr.path) or "image"))
+        return planned
+
+    @staticmethod
+    def _unique_asset_name(url: str, file_name: str, taken: dict) -> str:
         """
-        for heading in soup.find_all(["h1", "h1big", "h2", "h3", "h4", "h5", "h6"]):
-            heading_id = heading.get("id")
-            if heading_id:
-                # Find any anchor tags inside this heading with the same ID
-                duplicate_anchors = heading.find_all("a", id=heading_id)
-                for anchor in duplicate_anchors:
-                    logger.debug(f"Removing duplicate anchor with id='{heading_id}' from heading")
-                    # Remove the anchor tag but keep its text content
-                    if anchor.string:
-                        anchor.replace_with(anchor.string)
-                    else:
-                        anchor.decompose()
+        Return the local file name for ``url``, given ``taken`` = ``{file_name: url}``.
+
+        The first URL in document order keeps the plain file name; a different URL
+        with the same name gets a short hash of the URL appended to its stem.
+        """
+        if taken.setdefault(file_name, url) == url:
+            return file_name
+        stem, ext = os.path.splitext(file_name)
+        file_name = "%s-%s%s" % (stem, hashlib.sha256(url.encode("utf-8")).hexdigest()[:8], ext)
+        taken.setdefault(file_name, url)
+        return file_name
+
+    def _new_http_session(self) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.download_workers, pool_maxsize=self.download_workers)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def _download_assets(self, targets: dict) -> set:
+        """
+        Materialize ``{local_path: url}`` from the asset cache, fetching concurrently.
+
+        Cached URLs are revalidated (or, offline, served as-is) and every file is
+        hardlinked or copied from the cache, so stale local copies are refreshed.
+        When an asset cannot be obtained an existing local file is kept. Returns
+        the local paths that are available once every download has finished.
+        """
+        if not targets:
+            return set()
+
+        def fetch(path: str, url: str) -> Optional[str]:
+            kind = "CSS" if os.path.dirname(path) == self.styles_dir else "image"
+            with self.tracer.span("asset fetch", cat="asset", url=url) as span:
+                try:
+                    logger.info("Localizing %s %s -> %s", kind, url, path)
+                    blob = self.asset_cache.get(url, session, timeout=self.download_timeout)
+                except RequestException:
+                    logger.error("Failed to download %s %s", kind, url, exc_info=True)
+                    blob = None
+                if blob is None:
+                    span["status"] = "unavailable"
+                    return path if os.path.exists(path) else None
+                self.asset_cache.materialize(blob, path)
+                span["bytes_out"] = os.path.getsize(path)
+                return path
+
+        available = set()
+        with self._new_http_session() as session:
+            with ThreadPoolExecutor(max_workers=min(self.download_workers, len(targets))) as pool:
+                for path in pool.map(lambda item: fetch(*item), targets.items()):
+                    if path:
+                        available.add(path)
+        logger.info("Asset cache: %s", ", ".join("%s=%d" % kv for kv in self.asset_cache.stats.items()))
+        self.tracer.counter("asset cache", **self.asset_cache.stats)
+        self.asset_cache.evict()
+        return available
+
+    def _localize_assets(self, links: list, imgs: list) -> None:
+        """
+        Fetch remote stylesheets and images, then point the page at the local copies.
+
+        Identical URLs are fetched once and all downloads run before any element is
+        rewritten. A stylesheet that could not be fetched keeps its remote href; an
+        image that could not be fetched is removed.
+        """
+        planned = []
+        if links is not None:
+            _mkdirp(self.styles_dir)
+            planned += [(el, url, name, self.styles_dir, self.styles_subdir)
+                        for el, url, name in self._plan_stylesheets(links)]
+        planned += [(el, url, name, self.images_dir, self.images_subdir)
+                    for el, url, name in self._plan_images(imgs)]
+
+        taken: dict = {}
+        targets: dict = {}
+        resolved = []
+        for el, url, name, local_dir, subdir in planned:
+            name = self._unique_asset_name(url, name, taken.setdefault(local_dir, {}))
+            local_path = os.path.join(local_dir, name)
+            targets[local_path] = url
+            resolved.append((el, local_path, posixpath.join(subdir, name)))
+        available = self._download_assets(targets)
+        self.localized_assets = sorted(available)
+
+        for el, local_path, new_ref in resolved:
+            if el.name == "link":
+                if local_path in available:
+                    el["href"] = new_ref
+                continue
+            if local_path not in available:
+                el.decompose()
+                continue
+            el["src"] = new_ref
+            if el.has_attr("srcset"):
+                del el["srcset"]
 
     def _post_process_html(self, html: str, step: int) -> str:
+        """
+        Apply all HTML fixes with one parse, one tree walk and one serialization.
+
+        Every fix is a rule registered on :class:`HtmlVisitor` for the tags it
+        touches. Rules that need the whole document (logo placement, banner) run
+        once after the walk, and the remote asset downloads run last so that only
+        images and stylesheets that survived the fixes are fetched.
+        """
         logger.info("Step %s: Post-processing HTML.", step)
-        soup = BeautifulSoup(html, "html.parser")
+        with self.tracer.span("post-process", profile=True, bytes_in=html) as span:
+            final = self._post_process_tree(html)
+            span["bytes_out"] = final
+        logger.info("Step %s: Post-processing complete.", step)
+        return final
 
-        if soup.header:
-            soup.header.decompose()
+    def _post_process_tree(self, html: str) -> str:
+        """The work of :meth:`_post_process_html`, one trace span per phase."""
+        tracer = self.tracer
+        with tracer.span("parse", cat="post-process", parser=self.html_parser):
+            soup = parse_html(html, self.html_parser)
+        body = soup.body or soup
+        output_basename = os.path.basename(self.output_file)
 
         meta_tag = soup.new_tag("meta", attrs={"name": "description", "content": self.meta_description})
         soup.head.insert(0, meta_tag)
-        
-        # ### FIX ###: Remove or fix base href to prevent TOC fragment links from breaking.
-        # The base href causes fragment-only links (#section) to resolve incorrectly.
-        base_tag = soup.find("base")
-        if base_tag:
-            # Remove the base tag entirely to fix fragment link navigation
-            base_tag.decompose()
-            logger.debug("Removed base tag to fix internal fragment links")
-
-        for fig in list(soup.find_all("figure")):
+
+        # Only the first <header>, the first <base> and the first <nav> that
+        # survive earlier removals are dropped; claim them if they disappear
+        # inside another removed block.
+        claimed = {"header": False, "base": False, "nav": False}
+        links: list = []
+        imgs: list = []
+        # Elements whose children were removed or replaced before the point where
+        # the old implementation re-parsed the document; see normalize_text_runs.
+        touched: list = []
+        open_void_elements = []
+
+        def claim_inside(tag: Tag, names: tuple) -> None:
+            for name in names:
+                if not claimed[name] and tag.find(name):
+                    claimed[name] = True
+
+        def drop_first(tag: Tag) -> None:
+            if claimed[tag.name]:
+                return
+            claimed[tag.name] = True
+            if tag.name == "nav":
+                # Kill stray TOC <nav> blocks; our own TOC logic is handled differently.
+                claim_inside(tag, ("header", "base"))
+            elif tag.name == "base":
+                # ### FIX ###: The base href causes fragment-only links (#section) to
+                # resolve incorrectly, so remove the base tag entirely.
+                logger.debug("Removed base tag to fix internal fragment links")
+            touched.append(tag.parent)
+            tag.decompose()
+
+        def drop_logo_figure(fig: Tag) -> None:
             img = fig.find("img")
             if img and self._looks_like_logo_src(img.get("src", "")):
+                claim_inside(fig, ("header", "base"))
+                touched.append(fig.parent)
                 fig.decompose()
 
-        # Kill stray TOC <nav> blocks; our own TOC logic is handled differently.
-        if soup.nav:
-            soup.nav.decompose()
-
-        self._enforce_single_oasis_logo(soup)
-        self._fix_top_banner_block(soup)
-        self._remove_duplicate_heading_anchors(soup)  # ### FIX ###: Remove duplicate anchor IDs
-        self._normalize_same_doc_anchors_for_web(soup, output_basename=os.path.basename(self.output_file))
-        
-        soup_str = self._convert_plain_urls_to_links(str(soup))
-        soup = BeautifulSoup(soup_str, "html.parser")
-
-        if os.getenv("HTML_LOCALIZE_CSS", "").lower() in {"1", "true", "yes"}:
-            _mkdirp(self.styles_dir)
-            for link in list(soup.find_all("link", rel=True, href=True)):
-                if (link.get("rel") or [""])[0].lower() != "stylesheet": continue
-                href = link["href"].strip()
-                pr = urlparse(href)
-                if pr.scheme in {"http", "https"}:
-                    css_name = os.path.basename(pr.path) or "style.css"
-                    local_css = os.path.join(self.styles_dir, css_name)
-                    if not os.path.exists(local_css):
-                        try:
-                            logger.info("Downloading CSS %s -> %s", href, local_css)
-                            r = requests.get(href, timeout=10)
-                            r.raise_for_status()
-                            with open(local_css, "wb") as f: f.write(r.content)
-                        except RequestException:
-                            logger.error("Failed to download CSS: %s", href, exc_info=True)
-                            continue
-                    link["href"] = os.path.join(self.styles_subdir, css_name)
-        
-        for img in list(soup.find_all("img", src=True)):
-            src = img["src"].strip()
-            pr = urlparse(src)
-            if pr.scheme in {"http", "https"}:
-                image_filename = os.path.basename(pr.path) or "image"
-                local_image_path = os.path.join(self.images_dir, image_filename)
-                if not os.path.exists(local_image_path):
-                    try:
-                        logger.info("Downloading image %s -> %s", src, local_image_path)
-                        r = requests.get(src, timeout=10)
-                        r.raise_for_status()
-                        with open(local_image_path, "wb") as f: f.write(r.content)
-                    except RequestException:
-                        logger.error("Failed to download image %s", src, exc_info=True)
-                        img.decompose()
-                        continue
-                img["src"] = os.path.join(self.images_subdir, image_filename)
-                if img.has_attr("srcset"):
-                    del img["srcset"]
-
-        self._relativize_same_scope_links(soup)
-        
-        final = str(soup)
-        logger.info("Step %s: Post-processing complete.", step)
+        def visit_img(img: Tag) -> None:
+            parent = img.parent
+            if self._drop_stray_logo_img(img, body):
+                touched.extend((parent, parent.parent))
+            elif img.has_attr("src"):
+                imgs.append(img)
+
+        def visit_a(a: Tag) -> None:
+            if a.has_attr("href"):
+                self._normalize_same_doc_anchor_for_web(a, output_basename)
+                self._relativize_same_scope_link(a)
+
+        def visit_link(link: Tag) -> None:
+            if link.has_attr("href"):
+                links.append(link)
+
+        def late_rules(tag: Tag) -> None:
+            # Tags created by autolinking only get the rules that used to run
+            # after the old re-parse: asset localization and relativization.
+            if tag.name == "img" and tag.has_attr("src"):
+                imgs.append(tag)
+            elif tag.name == "link" and tag.has_attr("href"):
+                links.append(tag)
+            elif tag.name in ("a", "script"):
+                self._relativize_same_scope_link(tag)
+
+        def autolink(p: Tag) -> None:
+            created = self._convert_plain_urls_to_links(soup, p)
+            if created:
+                touched.append(p)
+            for tag in created:
+                late_rules(tag)
+
+        def note_open_void(tag: Tag) -> None:
+            if tag.contents:
+                open_void_elements.append(tag)
+
+        def dedupe_heading_anchors(heading: Tag) -> None:
+            touched.extend(self._remove_duplicate_heading_anchors(heading))
+
+        visitor = HtmlVisitor(timings={} if tracer.enabled else None)
+        visitor.on_enter(("header", "base", "nav"), drop_first)
+        visitor.on_enter("figure", drop_logo_figure)
+        visitor.on_enter("img", visit_img)
+        visitor.on_enter("a", visit_a)
+        visitor.on_enter("script", self._relativize_same_scope_link)
+        visitor.on_enter("link", visit_link)
+        visitor.on_exit(("h1", "h1big", "h2", "h3", "h4", "h5", "h6"), dedupe_heading_anchors)  # ### FIX ###: Remove duplicate anchor IDs
+        visitor.on_exit("p", autolink)
+        visitor.on_enter(VOID_ELEMENTS, note_open_void)
+        with tracer.span("rules", cat="post-process") as span:
+            visitor.walk(soup)
+            if visitor.timings is not None:
+                span["rules_ms"] = {name: {"calls": calls, "ms": round(seconds * 1000, 3)}
+                                    for name, (calls, seconds) in visitor.timings.items()}
+
+        with tracer.span("logo and banner", cat="post-process"):
+            if self._ensure_canonical_logo(soup, body):
+                imgs = soup.find_all("img", src=True)
+                touched = [soup] + soup.find_all(True)
+            self._fix_top_banner_block(soup)
+        with tracer.span("normalize whitespace", cat="post-process"):
+            touched.append(body)
+            seen = set()
+            for tag in touched:
+                if tag is not None and id(tag) not in seen and in_tree(tag, soup):
+                    seen.add(id(tag))
+                    normalize_text_runs(tag)
+
+        if open_void_elements:
+            # html.parser leaves a void element open (holding the following content)
+            # when a document mixes <br> and <br />. The old pipeline re-parsed the
+            # page twice, which closed them again; repeat that for such documents.
+            logger.debug("Re-parsing HTML to close %d void elements with content", len(open_void_elements))
+            for _ in range(2):
+                soup = parse_html(str(soup), self.html_parser)
+            links = soup.find_all("link", href=True)
+            imgs = soup.find_all("img", src=True)
+
+        imgs = [img for img in imgs if in_tree(img, soup)]
+        with tracer.span("localize assets", cat="post-process"):
+            self._localize_assets([link for link in links if in_tree(link, soup)] if self.localize_css else None, imgs)
+
+        for tag in links:
+            if in_tree(tag, soup):
+                self._relativize_same_scope_link(tag)
+        for tag in imgs:
+            if in_tree(tag, soup):
+                self._relativize_same_scope_link(tag)
+
+        with tracer.span("serialize", cat="post-process") as span:
+            final = str(soup)
+            span["bytes_out"] = final
         return final
 
     def run_prettier(self) -> None:
         logger.info("Running Prettier on Markdown.")
         try:
-            subprocess.run(["prettier", "--write", self.md_file.strip()], check=True)
+            with self.tracer.span("prettier", profile=True) as span:
+                span["bytes_in"] = os.path.getsize(self.md_file)
+                subprocess.run(["prettier", "--write", self.md_file.strip()], check=True)
+                span["bytes_out"] = os.path.getsize(self.md_file)
         except subprocess.CalledProcessError:
             logger.error("Prettier failed", exc_info=True)
             raise
 
+    @staticmethod
+    def _with_toc_title(content: str) -> Optional[str]:
+        """``content`` with a "Table of Contents" heading before a bullet-link TOC that lacks one, else None."""
+        updated = with_toc_title(content.encode("utf-8"))
+        return updated.decode("utf-8") if updated is not None else None
+
     def ensure_toc_title(self) -> None:
         logger.info("Ensuring TOC title exists.")
         try:
-            with open(self.md_file, "r", encoding="utf-8") as f: content = f.read()
-            toc_found = re.search(r"(- \[.*\]\(.*\))", content)
-            toc_title_present = re.search(r"^\s*#+\s*Table of Contents\s*$", content, re.IGNORECASE | re.MULTILINE)
-            if toc_found and not toc_title_present:
-                lines = content.split("\n")
-                toc_indices = [i for i, line in enumerate(lines) if re.match(r"- \[.*\]\(.*\)", line)]
-                if toc_indices:
-                    lines.insert(toc_indices[0], "\n# Table of Contents")
-                    with open(self.md_file, "w", encoding="utf-8") as f2: f2.write("\n".join(lines))
-                    logger.info("Inserted TOC title.")
+            scan = scan_markdown(self.md_file)
+            if scan.needs_toc_title:
+                with open(self.md_file, "rb") as f: content = f.read()
+                with open(self.md_file, "wb") as f2: f2.write(with_toc_title(content, scan))
+                logger.info("Inserted TOC title.")
         except Exception:
             logger.error("Error ensuring TOC title", exc_info=True)
 
-    def convert(self) -> None:
-        temp_output = "temp_output.html"
+    def _build_inputs(self) -> dict:
+        """Everything that determines the output of :meth:`convert`."""
+        return {
+            "converter": sources_digest(CONVERTER_SOURCES),
+            "markdown": file_digest(self.md_file),
+            "css_ref": self.css_ref_for_pandoc,
+            "git_repo_basedir": self.git_repo_basedir,
+            "md_dir": self.md_dir,
+            "output_file": self.output_file,
+            "html_parser": self.html_parser,
+            "localize_css": self.localize_css,
+            "ast_pipeline": self.ast_pipeline,
+            "css_bundle": self.css_bundle,
+            "stylesheets": self._stylesheet_digests(),
+            "canonical": self.canonical,
+            "pandoc": tool_version("pandoc", "--version"),
+            "prettier": tool_version("prettier", "--version"),
+        }
+
+    def _stylesheet_digests(self) -> Optional[dict]:
+        """
+        Digests of the local stylesheets a CSS bundle is built from, by name;
+        None without :attr:`css_bundle`, when the page only links them.
+        """
+        if not self.css_bundle:
+            return None
+        try:
+            names = os.listdir(self.styles_dir)
+        except OSError:
+            return {}
+        return {name: file_digest(os.path.join(self.styles_dir, name)) for name in sorted(names)
+                if name.endswith(".css") and not name.endswith(".bundle.css")}
+
+    def render(self, step: int = 3) -> str:
+        """
+        Return the post-processed HTML for the Markdown file without writing it.
+
+        The Markdown is read once (with a missing TOC title added in memory, the
+        source file is left alone) and piped through pandoc, so no file is
+        created in the working directory. Localized images and stylesheets are
+        still placed next to :attr:`output_file`.
+
+        With :attr:`ast_pipeline` the fixes are applied to pandoc's JSON AST
+        (see :mod:`pandoc_ast`); documents it cannot handle take the
+        BeautifulSoup path. With :attr:`canonical` the page is returned in the
+        form of :func:`html_canonical.canonical_html`. :attr:`content_digest`
+        is set to the digest of the result.
+        """
+        markdown = self._read_file(self.md_file)
+        markdown = self._with_toc_title(markdown) or markdown
+        final_html = None
+        if self.ast_pipeline:
+            try:
+                final_html = AstPipeline(self).render(markdown, step)
+            except AstUnsupported as e:
+                logger.info("Step %s: AST pipeline not applicable (%s); post-processing the HTML instead.", step, e)
+        if final_html is None:
+            html_content = self._run_pandoc(step, markdown)
+            final_html = self._post_process_html(html_content, step=step + 1)
+        if self.css_bundle:
+            final_html = self._bundle_stylesheets(final_html)
+        if self.canonical:
+            with self.tracer.span("canonicalize", bytes_in=final_html) as span:
+                final_html = canonical_html(final_html, self.html_parser)
+                span["bytes_out"] = final_html
+        self.content_digest = content_digest(final_html)
+        return final_html
+
+    def _bundle_stylesheets(self, html: str) -> str:
+        """
+        Replace the page's stylesheets by a link to one minified stylesheet
+        holding only the rules the page uses, ``styles/<page>.bundle.css``.
+
+        The ``<style>`` blocks and the stylesheets in :attr:`styles_dir` are
+        bundled; a page that still links another stylesheet (a remote one that
+        could not be downloaded) is returned unchanged.
+        """
+        with self.tracer.span("css bundle", bytes_in=html) as span:
+            soup = parse_html(html, self.html_parser)
+            elements = stylesheet_elements(soup)
+            sources = []
+            for tag in elements:
+                if tag.name == "style":
+                    text = tag.string or ""
+                    if "url(" in text or "@import" in text:
+                        # Relative references would resolve against styles/ instead of the page.
+                        logger.info("Stylesheets not bundled: a <style> block has url() or @import references")
+                        return html
+                    sources.append((text, tag.get("media")))
+                    continue
+                href = tag.get("href", "")
+                path = os.path.normpath(os.path.join(os.path.dirname(self.output_file), unquote(href)))
+                if urlparse(href).scheme or os.path.dirname(path) != os.path.normpath(self.styles_dir) \
+                        or not os.path.isfile(path):
+                    logger.info("Stylesheets not bundled: %s is not a local stylesheet", href)
+                    return html
+                sources.append((self._read_file(path), tag.get("media")))
+            if not sources:
+                return html
+            try:
+                css, stats = bundle_css(sources, soup)
+            except BundleUnsupported as e:
+                logger.info("Stylesheets not bundled: %s", e)
+                return html
+            span.update(stats)
+            logger.info(format_stats(stats))
+
+            name = os.path.splitext(os.path.basename(self.output_file))[0] + ".bundle.css"
+            path = os.path.join(self.styles_dir, name)
+            _mkdirp(self.styles_dir)
+            self._write_file(path, css)
+            self.localized_assets = sorted(set(self.localized_assets) | {path})
+            replace_stylesheets(soup, elements, soup.new_tag(
+                "link", attrs={"rel": "stylesheet", "href": posixpath.join(self.styles_subdir, name)}))
+            final = str(soup)
+            span["bytes_out"] = final
+        return final
+
+    def convert(self, force: bool = False) -> bool:
+        """
+        Convert the Markdown file to HTML unless the last build is still current.
+
+        The build manifest fingerprints the Markdown, CSS reference (and, with
+        :attr:`css_bundle`, the local stylesheets), converter sources, arguments
+        and tool versions; when none of them changed and the
+        recorded output files are intact the build is skipped. Returns True when
+        the HTML was regenerated. A regenerated page with the bytes of the
+        existing file is not written again, so its modification time is kept.
+        """
         try:
             step = 3
             logger.info("Step %s: Begin conversion.", step)
             self.ensure_toc_title(); step += 1
-            self._run_pandoc(step=step); step += 1
-            html_content = self._read_file(temp_output)
-            final_html = self._post_process_html(html_content, step=step); step += 1
-            self._write_file(self.output_file, final_html)
+            manifest = BuildManifest(self.manifest_dir, self.output_file)
+            with self.tracer.span("build manifest check") as span:
+                inputs = self._build_inputs()
+                up_to_date, reason = manifest.check(inputs)
+                span["up_to_date"] = up_to_date
+            if up_to_date and not force:
+                logger.info("Step %s: Build cache hit for %s (%s); skipping conversion.", step, self.output_file, reason)
+                self.content_digest = file_digest(self.output_file)
+                return False
+            logger.info("Step %s: Build cache %s for %s (%s).", step,
+                        "bypassed" if force else "miss", self.output_file, reason)
+            manifest.invalidate()
+            final_html = self.render(step=step); step += 2
+            unchanged = file_digest(self.output_file) == self.content_digest
+            with self.tracer.span("write html", bytes_out=final_html, unchanged=unchanged):
+                if unchanged:
+                    logger.info("Step %s: %s is unchanged (sha256 %s).", step, self.output_file, self.content_digest)
+                else:
+                    self._write_file(self.output_file, final_html)
+            # Heading index for the PDF bookmarks, keyed by the page's digest.
+            write_heading_index(self.manifest_dir, final_html)
+            # Stylesheets downloaded by this build are inputs of the next one.
+            inputs["stylesheets"] = self._stylesheet_digests()
+            manifest.record(inputs, [self.output_file] + self.localized_assets)
             logger.info("Step %s: Conversion done.", step)
+            return True
         except Exception:
             logger.error("Conversion error", exc_info=True)
             raise
-        finally:
-            if os.path.exists(temp_output):
-                os.remove(temp_output)
-                logger.debug("Removed %s", temp_output)
 
 
 # -------------------- CLI --------------------
@@ -546,7 +1002,26 @@ def main() -> None:
     parser.add_argument("--test", action="store_true", help="Run in test mode")
     parser.add_argument("--md-format", action="store_true", help="Run Prettier to format the markdown file")
     parser.add_argument("--md-to-html", action="store_true", help="Convert markdown file to HTML")
+    parser.add_argument("--html-parser", choices=["html.parser", "lxml"], default="html.parser",
+                        help="BeautifulSoup parser used for post-processing (lxml must be installed)")
+    parser.add_argument("--asset-cache", type=str, default=None,
+                        help="Asset cache directory (default: $ASSET_CACHE_DIR or <git_repo_basedir>/.asset-cache)")
+    parser.add_argument("--asset-cache-max-mb", type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024),
+                        help="Evict least recently used cached assets above this size")
+    parser.add_argument("--offline", action="store_true", help="Serve images and CSS only from the asset cache")
+    parser.add_argument("--force", action="store_true", help="Regenerate the HTML even if the build manifest is current")
+    parser.add_argument("--pandoc-shards", type=int, nargs="?", const=os.cpu_count() or 1, default=None,
+                        metavar="WORKERS",
+                        help="Convert top-level sections in parallel and reuse unchanged ones (default workers: CPU count)")
+    parser.add_argument("--ast-pipeline", action="store_true",
+                        help="Apply the structural fixes to the pandoc JSON AST instead of re-parsing the HTML")
+    parser.add_argument("--css-bundle", action="store_true",
+                        help="Link one minified stylesheet per page holding only the rules it uses (downloads remote stylesheets)")
+    parser.add_argument("--canonical-html", action="store_true",
+                        help="Write byte-stable HTML: sorted attributes, normalized whitespace (see html_canonical.py)")
+    add_trace_arguments(parser)
     args = parser.parse_args()
+    tracer = tracer_from_args(parser, args)
 
     if args.test:
         git_repo_basedir = "/github/workspace"
@@ -559,15 +1034,28 @@ def main() -> None:
         md_file = sanitize_file_path(args.md_file)
         output_file = os.path.join(md_dir, os.path.basename(md_file).replace(".md", ".html"))
 
-    converter = MarkdownToHtmlConverter(md_file, output_file, git_repo_basedir, md_dir)
-
-    if args.md_format:
-        converter.run_prettier()
-        logger.info("Markdown formatting completed.")
+    asset_cache = AssetCache(
+        args.asset_cache or default_cache_dir(git_repo_basedir),
+        max_bytes=args.asset_cache_max_mb * 1024 * 1024,
+        offline=args.offline,
+    )
+    converter = MarkdownToHtmlConverter(
+        md_file, output_file, git_repo_basedir, md_dir, html_parser=args.html_parser, asset_cache=asset_cache,
+        pandoc_shards=args.pandoc_shards, ast_pipeline=args.ast_pipeline, tracer=tracer, css_bundle=args.css_bundle,
+        canonical=args.canonical_html,
+    )
 
-    if args.md_to_html:
-        converter.convert()
-        logger.info("Markdown to HTML conversion completed.")
+    try:
+        if args.md_format:
+            converter.run_prettier()
+            logger.info("Markdown formatting completed.")
+
+        if args.md_to_html:
+            converter.convert(force=args.force)
+            logger.info("Markdown to HTML conversion completed.")
+    finally:
+        if tracer is not None:
+            tracer.write(args.trace)
 
 
 if __name__ == "__main__":
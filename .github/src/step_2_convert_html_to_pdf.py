@@ -5,13 +5,15 @@ HTML to PDF Converter with Enhanced Code Block Formatting
 This module converts HTML files to PDF while ensuring proper monospace formatting
 for code blocks. The converter preserves the original document styling (such as
 OASIS CSS) while applying targeted improvements to code elements for optimal
-PDF rendering using wkhtmltopdf.
+PDF rendering using wkhtmltopdf or another backend (see pdf_backends).
 
 Key Features:
 - Preserves original CSS styling and anchor links
 - Applies targeted monospace formatting to code elements only
 - Configurable page layout with portrait orientation and custom margins
 - Professional headers and footers with document metadata
+- Pluggable render backends: wkhtmltopdf or the WeasyPrint paged-media engine
+- Optionally one stylesheet trimmed to the rules the page uses (see css_bundle)
 - Robust error handling and logging
 """
 
@@ -22,15 +24,41 @@ import logging
 import os
 import re
 import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional
+from typing import Callable, Optional
 from urllib.parse import urljoin, urlparse
 
 import subprocess
 from bs4 import BeautifulSoup, Tag
 
+import css_bundle
+import pdf_backends
+import pdf_batch
+import pdf_chapters
+import pdf_optimize
+import pdf_outline
+import pdf_stamp
+from asset_cache import AssetCache, default_cache_dir
+from build_manifest import default_manifest_dir, repo_basedir, stylesheet_digests, tool_version
+from build_trace import NULL_TRACER, Tracer, add_trace_arguments, tracer_from_args
+from pdf_render_cache import DEFAULT_MAX_BYTES as RENDER_CACHE_MAX_BYTES, RenderCache
+from pdf_resources import ResourcePreloader
+
 logger = logging.getLogger(__name__)
 
+# Pages at least this large are rendered chapter by chapter in parallel.
+DEFAULT_PARALLEL_THRESHOLD = 512 * 1024
+
+# Page-number footer; rendered in a separate pass when chapters are rendered in parallel.
+FOOTER_PAGE_NUMBERS = '[date] - Page [page] of [topage]'
+
+# Proxy for preloaded renders: nothing listens on the discard port, so any
+# request wkhtmltopdf still makes fails immediately instead of stalling.
+OFFLINE_PROXY = 'http://127.0.0.1:9'
+
 
 class PDFConverter:
     """
@@ -41,10 +69,53 @@ class PDFConverter:
     correctly in the PDF output.
     """
     
-    def __init__(self, html_file: str, output_pdf: str, base_dir: Optional[str] = None):
+    def __init__(self, html_file: str, output_pdf: str, base_dir: Optional[str] = None,
+                 tracer: Optional[Tracer] = None, workers: Optional[int] = None,
+                 parallel_threshold: Optional[int] = DEFAULT_PARALLEL_THRESHOLD,
+                 asset_cache: Optional[AssetCache] = None, preload_resources: bool = True,
+                 outline_levels: int = pdf_outline.DEFAULT_OUTLINE_LEVELS, build_cache_dir: Optional[str] = None,
+                 stamp_headers: bool = False, optimize: bool = False,
+                 target_dpi: int = pdf_optimize.DEFAULT_TARGET_DPI,
+                 backend: str = pdf_backends.DEFAULT_BACKEND, render_cache: bool = False,
+                 render_cache_bytes: int = RENDER_CACHE_MAX_BYTES, bundle_css: bool = False):
         self.html_file = Path(html_file).resolve()
         self.output_pdf = Path(output_pdf).resolve()
         self.base_dir = Path(base_dir).resolve() if base_dir else self.html_file.parent
+        # Stage spans for --trace; the default records nothing.
+        self.tracer = tracer or NULL_TRACER
+        # wkhtmltopdf processes for chapter-parallel rendering; 1 always renders in one process.
+        self.workers = workers or os.cpu_count() or 1
+        # HTML size (bytes) from which chapters are rendered in parallel; None never does.
+        self.parallel_threshold = parallel_threshold
+        # Resolve stylesheets and images from the asset cache before rendering,
+        # and render without network access.
+        self.preload_resources = preload_resources
+        # By default the caches the HTML stage filled for the same repository.
+        repo = repo_basedir(str(self.html_file))
+        self.asset_cache = asset_cache or AssetCache(default_cache_dir(repo))
+        self.unresolved_resources: list = []
+        # Bookmark the headings down to this level (0: none), placed from the
+        # heading index that the HTML stage stores in the build cache.
+        self.outline_levels = outline_levels
+        self.build_cache_dir = build_cache_dir or default_manifest_dir(repo)
+        self.headings: list = []
+        # Reuse the PDFs of unchanged chapters from the build cache (see pdf_render_cache).
+        self.render_cache = (RenderCache(os.path.join(self.build_cache_dir, "pdf-parts"), render_cache_bytes)
+                             if render_cache else None)
+        # Render only the body and stamp headers and footers onto the PDF afterwards.
+        self.stamp_headers = stamp_headers
+        # Title, stage, date and copyright year of the page, for headers and footers.
+        self.metadata: dict = pdf_stamp.document_metadata('')
+        # Shrink the finished PDF (see pdf_optimize), downsampling images to target_dpi.
+        self.optimize = optimize
+        self.target_dpi = target_dpi
+        # Replace the page's stylesheets by one trimmed to the rules it uses (see css_bundle).
+        self.bundle_css = bundle_css
+        self.css_bundle_stats: Optional[dict] = None
+        # Engine that writes the PDF (see pdf_backends).
+        self.backend = pdf_backends.get_backend(backend)
+        # Mode and timings of the last conversion.
+        self.report: dict = {}
         
         if not self.html_file.exists():
             raise FileNotFoundError(f"HTML file not found: {self.html_file}")
@@ -54,7 +125,8 @@ class PDFConverter:
         logger.info(f"  PDF Output: {self.output_pdf}")
         logger.info(f"  Base Directory: {self.base_dir}")
 
-    def _get_perfect_code_css(self) -> str:
+    @staticmethod
+    def _get_perfect_code_css() -> str:
         """
         Generate targeted CSS for enhanced code block formatting.
         
@@ -186,20 +258,69 @@ class PDFConverter:
         }
         """
 
-    def _preprocess_html(self, html_content: str) -> str:
+    def _preprocess_html(self, html_content: str, base_href: Optional[str] = None) -> str:
         """
         Preprocess HTML content to optimize for PDF rendering.
         
-        This method ensures proper HTML structure for code blocks and adds
-        necessary CSS classes to improve PDF output quality.
+        This method embeds the code block CSS, ensures proper HTML structure
+        for code blocks and adds necessary CSS classes to improve PDF output
+        quality, in one parse of the page.
         
         Args:
             html_content (str): Raw HTML content to preprocess
+            base_href (str, optional): URL that relative references resolve
+                against; set when the page is piped to wkhtmltopdf
             
         Returns:
             str: Preprocessed HTML content ready for PDF conversion
         """
-        soup = BeautifulSoup(html_content, 'html.parser')
+        with self.tracer.span("pdf preprocess", profile=True, bytes_in=html_content) as span:
+            html_content = self._preprocess_tree(html_content, base_href)
+            span["bytes_out"] = html_content
+        return html_content
+
+    def _preprocess_tree(self, html_content: str, base_href: Optional[str]) -> str:
+        """Parse, fix and serialize the page for :meth:`_preprocess_html`."""
+        with self.tracer.span("parse", cat="pdf preprocess"):
+            soup = BeautifulSoup(html_content, 'html.parser')
+        
+        # Ensure document has a proper head section
+        if not soup.head:
+            head = soup.new_tag('head')
+            if soup.html:
+                soup.html.insert(0, head)
+            else:
+                soup.insert(0, head)
+        
+        # A page read from stdin has no location of its own
+        if base_href and not soup.head.find('base'):
+            soup.head.insert(0, soup.new_tag('base', href=base_href))
+        
+        # Point stylesheets, images and CSS url()s at local files
+        if base_href and self.preload_resources:
+            with self.tracer.span("preload resources", cat="pdf preprocess") as span:
+                preloader = ResourcePreloader(self.asset_cache, base_href)
+                preloader.preload(soup)
+                span["resolved"], span["unresolved"] = preloader.resolved, len(preloader.unresolved)
+            self.unresolved_resources = preloader.unresolved
+            for ref in preloader.unresolved:
+                logger.warning(f"Resource could not be preloaded; it will be missing from the PDF: {ref}")
+        
+        self.metadata = pdf_stamp.document_metadata(html_content)
+        
+        # Named anchors for the bookmarks added after rendering
+        self.headings = []
+        if base_href and self.outline_levels and pdf_chapters.available():
+            with self.tracer.span("mark headings", cat="pdf preprocess") as span:
+                self.headings = [h for h in pdf_outline.heading_index(self.build_cache_dir, html_content)
+                                 if h["level"] <= self.outline_levels]
+                span["headings"] = pdf_outline.mark_headings(soup, self.headings)
+        
+        # Add targeted CSS for code formatting
+        # Note: Appending rather than prepending to preserve existing CSS precedence
+        style_tag = soup.new_tag('style')
+        style_tag.string = self._get_perfect_code_css()
+        soup.head.append(style_tag)
         
         # Ensure all code blocks have proper classes
         for pre in soup.find_all('pre'):
@@ -226,63 +347,248 @@ class PDFConverter:
             classes = heading.get('class', [])
             classes.append('no-page-break')
             heading['class'] = classes
+        
+        # Last, so that the classes added above are matched too
+        if self.bundle_css:
+            with self.tracer.span("css bundle", cat="pdf preprocess") as span:
+                try:
+                    self.css_bundle_stats = css_bundle.inline_bundle(soup)
+                except css_bundle.BundleUnsupported as e:
+                    logger.warning(f"Stylesheets not bundled: {e}")
+                    self.css_bundle_stats = None
+                if self.css_bundle_stats:
+                    span.update(self.css_bundle_stats)
+                    logger.info(css_bundle.format_stats(self.css_bundle_stats))
             
-        return str(soup)
+        with self.tracer.span("serialize", cat="pdf preprocess"):
+            return str(soup)
         
-    def _convert_to_pdf(self, html_file_path: str) -> None:
+    def _page_args(self) -> list:
+        """Page size and margins shared by every wkhtmltopdf run."""
+        return [
+            '--page-size', 'A4',
+            '--orientation', 'Portrait',
+            '--margin-top', '25mm',
+            '--margin-right', '20mm',
+            '--margin-bottom', '25mm',
+            '--margin-left', '20mm',
+        ]
+
+    def _footer_page_numbers(self) -> str:
+        """The right footer, in wkhtmltopdf's [page]/[topage] notation."""
+        date = self.metadata.get('date')
+        return f"{date} - Page [page] of [topage]" if date else FOOTER_PAGE_NUMBERS
+
+    def _stamp(self) -> Optional[pdf_stamp.Stamp]:
+        """The header and footer drawn after rendering, in ``stamp_headers`` mode."""
+        if not self.stamp_headers:
+            return None
+        return pdf_stamp.stamp_from_metadata(self.metadata, self.html_file.name)
+
+    def _wkhtmltopdf_cmd(self, source: str, output_pdf: str, page_numbers: bool = True) -> list:
+        """
+        The document render of ``source`` (``-`` for stdin); ``page_numbers=False``
+        leaves out the right footer, and ``stamp_headers`` mode all headers and footers.
+        """
+        cmd = ['wkhtmltopdf'] + self._page_args()
+        if not self.stamp_headers:
+            cmd += [
+                '--header-spacing', '6',
+                '--header-font-size', '10',
+                '--header-center', self.metadata['title'],
+                '--footer-line',
+                '--footer-spacing', '4',
+                '--footer-left', str(self.html_file.name),
+                '--footer-center', f"Copyright © OASIS Open {self.metadata['year']}. All Rights Reserved.",
+            ]
+            if page_numbers:
+                cmd += ['--footer-right', self._footer_page_numbers()]
+            cmd += [
+                '--footer-font-size', '8',
+                '--footer-font-name', 'Times',
+            ]
+        return cmd + [
+            '--no-outline',
+            '--print-media-type',
+            '--enable-local-file-access',
+            '--load-error-handling', 'ignore',
+            '--load-media-error-handling', 'ignore',
+        ] + self._network_args() + [
+            source,
+            output_pdf,
+        ]
+
+    def _network_args(self) -> list:
+        """Disable network access for renders whose resources were preloaded."""
+        return ['--proxy', OFFLINE_PROXY] if self.preload_resources else []
+
+    def _page_number_cmd(self, source: str, output_pdf: str) -> list:
+        """Render only the page-number footer, on a transparent page."""
+        return ['wkhtmltopdf'] + self._page_args() + [
+            '--footer-spacing', '4',
+            '--footer-right', self._footer_page_numbers(),
+            '--footer-font-size', '8',
+            '--footer-font-name', 'Times',
+            '--no-outline',
+            '--no-background',
+        ] + self._network_args() + [
+            source,
+            output_pdf,
+        ]
+
+    def _run_wkhtmltopdf(self, cmd: list, html: str, span_name: str = "wkhtmltopdf") -> None:
+        """Run ``cmd``, whose source is ``-``, with ``html`` on its stdin."""
+        logger.debug(f"Command: {' '.join(cmd)}")
+        with self.tracer.span(span_name, profile=True, bytes_in=html) as span:
+            result = subprocess.run(cmd, input=html, check=True, capture_output=True, encoding='utf-8',
+                                    errors='replace', cwd=self.base_dir)
+            span["bytes_out"] = os.path.getsize(cmd[-1]) if os.path.exists(cmd[-1]) else 0
+        if result.stderr:
+            logger.debug(f"wkhtmltopdf output: {result.stderr}")
+
+    def _cmd_options(self, cmd: list) -> list:
+        """Render cache options of a wkhtmltopdf ``cmd``: its version and arguments, output left out."""
+        return [tool_version(cmd[0], '--version') or ''] + cmd[:-1]
+
+    def _cached_render(self, html: str, output_pdf: str, options: Callable[[], list],
+                       render: Callable[[], None]) -> None:
+        """Copy the cached PDF of ``html`` rendered with ``options()`` to ``output_pdf``, or ``render()`` it."""
+        if self.render_cache is None:
+            render()
+            return
+        key = self.render_cache.key(html, options() + stylesheet_digests(html, str(self.base_dir)))
+        if self.render_cache.get(key, output_pdf):
+            return
+        render()
+        self.render_cache.put(key, output_pdf)
+
+    def _document_info(self) -> dict:
+        """PDF document information from the page's metadata."""
+        info = {'/Title': self.metadata['title'], '/Subject': self.metadata['stage']}
+        return {key: value for key, value in info.items() if value}
+
+    def _use_chapters(self, html: str) -> bool:
+        """Whether to render by chapters: several workers or a render cache, a large page and pypdf."""
+        if (self.workers < 2 and self.render_cache is None) or self.parallel_threshold is None:
+            return False
+        if len(html.encode('utf-8')) < self.parallel_threshold:
+            return False
+        if not pdf_chapters.available():
+            logger.info("pypdf is not installed; rendering the PDF in one wkhtmltopdf process")
+            return False
+        return True
+
+    def _convert_chapters(self, html: str) -> bool:
+        """
+        Render the chapters of the prepared page in parallel and merge them; see
+        :mod:`pdf_chapters`. With a render cache, every chapter is a part and
+        only the parts that are not in the cache are rendered.
+
+        Returns False, without rendering anything, when the page has fewer than
+        two chapters.
         """
-        Convert HTML file to PDF using wkhtmltopdf.
+        with self.tracer.span("split chapters", bytes_in=html) as span:
+            parts = pdf_chapters.split_document(html, None if self.render_cache else self.workers)
+            span["parts"] = len(parts)
+        if len(parts) < 2:
+            return False
+
+        # Each part keeps the <head> of the page, <base> included, and is piped
+        # to its own process; only the part PDFs touch the disk.
+        with tempfile.TemporaryDirectory(prefix="pdf-parts-") as work:
+            pdfs = [os.path.join(work, f"part{n:02d}.pdf") for n in range(len(parts))]
+
+            def render(n: int) -> float:
+                started = time.perf_counter()
+                cmd = self._wkhtmltopdf_cmd('-', pdfs[n], page_numbers=False)
+                self._cached_render(parts[n], pdfs[n], lambda: self._cmd_options(cmd),
+                                    lambda: self._run_wkhtmltopdf(cmd, parts[n], f"wkhtmltopdf part {n + 1}/{len(parts)}"))
+                return time.perf_counter() - started
+
+            logger.info(f"Rendering {len(parts)} chapter groups with {min(self.workers, len(parts))} wkhtmltopdf processes")
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(parts))) as pool:
+                part_seconds = list(pool.map(render, range(len(parts))))
+            parallel_seconds = time.perf_counter() - started
+
+            stamp, stamp_pdf = self._stamp(), None
+            if stamp is None:
+                pages = sum(pdf_chapters.page_count(pdf) for pdf in pdfs)
+                stamp_pdf = os.path.join(work, "page-numbers.pdf")
+                cmd, numbers = self._page_number_cmd('-', stamp_pdf), pdf_chapters.stamp_document(pages)
+                self._cached_render(numbers, stamp_pdf, lambda: self._cmd_options(cmd),
+                                    lambda: self._run_wkhtmltopdf(cmd, numbers, "wkhtmltopdf page numbers"))
+            with self.tracer.span("merge chapters"):
+                merged = pdf_chapters.merge_parts(pdfs, stamp_pdf, str(self.output_pdf), self.headings, stamp,
+                                                  self._document_info())
+
+        self.report = {
+            "mode": "chapters",
+            "backend": self.backend.name,
+            "parts": len(parts),
+            "part_seconds": part_seconds,
+            "parallel_seconds": parallel_seconds,
+            **merged,
+        }
+        logger.info(f"Rendered {len(parts)} chapter groups in {parallel_seconds:.1f}s "
+                    f"(one process would need about {sum(part_seconds):.1f}s, "
+                    f"{sum(part_seconds) / parallel_seconds:.1f}x); {merged['pages']} pages, "
+                    f"{merged['links']} cross-chapter links")
+        return True
+
+    def _convert_to_pdf(self, html: str) -> None:
+        """
+        Convert the prepared page to PDF with the configured backend.
         
-        This method configures wkhtmltopdf with appropriate settings for
-        document layout, headers, footers, and error handling to produce
-        a professional PDF output.
+        The backend lays out the document, headers and footers (see
+        :mod:`pdf_backends`). With wkhtmltopdf, pages of at least
+        ``parallel_threshold`` bytes are rendered chapter by chapter in
+        parallel; when pypdf is missing, a part fails to render or the parts
+        cannot be merged (:class:`pdf_chapters.ChapterError`) the page is
+        rendered in one process. Other errors are raised.
         
         Args:
-            html_file_path (str): Path to the HTML file to convert
+            html (str): Page from :meth:`prepare_html`, handed to the backend
             
         Raises:
             subprocess.CalledProcessError: If wkhtmltopdf execution fails
             Exception: For other conversion errors
         """
-        logger.info("Converting HTML to PDF with wkhtmltopdf...")
+        logger.info(f"Converting HTML to PDF with {self.backend.name}...")
+        
+        if self.backend.supports_chapters and self._use_chapters(html):
+            try:
+                if self._convert_chapters(html):
+                    logger.info("PDF conversion completed successfully")
+                    return
+                logger.info("Document has fewer than two chapters; rendering it in one process")
+            except (ImportError, pdf_chapters.ChapterError, subprocess.CalledProcessError) as e:
+                logger.warning(f"Chapter rendering not possible ({e}); rendering in one process")
         
         try:
-            # Configure wkhtmltopdf command with document-specific settings
-            cmd = [
-                'wkhtmltopdf',
-                '--page-size', 'A4',
-                '--orientation', 'Portrait',
-                '--margin-top', '25mm',
-                '--margin-right', '20mm', 
-                '--margin-bottom', '25mm',
-                '--margin-left', '20mm',
-                '--header-spacing', '6',
-                '--header-font-size', '10',
-                '--header-center', 'Common Security Advisory Framework Version 2.1',
-                '--footer-line',
-                '--footer-spacing', '4', 
-                '--footer-left', str(self.html_file.name),
-                '--footer-center', 'Copyright © OASIS Open 2025. All Rights Reserved.',
-                '--footer-right', '[date] - Page [page] of [topage]',
-                '--footer-font-size', '8',
-                '--footer-font-name', 'Times',
-                '--no-outline',
-                '--print-media-type',
-                '--enable-local-file-access',
-                '--load-error-handling', 'ignore',
-                '--load-media-error-handling', 'ignore',
-                html_file_path,
-                str(self.output_pdf)
-            ]
-            
-            logger.info("Executing PDF conversion with wkhtmltopdf")
-            logger.debug(f"Command: {' '.join(cmd)}")
+            stamp = self._stamp()
+            post_process = bool(self.headings) or stamp is not None
             
-            # Execute wkhtmltopdf conversion
-            result = subprocess.run(cmd, check=True, capture_output=True, text=True)
-            
-            if result.stderr:
-                logger.debug(f"wkhtmltopdf output: {result.stderr}")
+            with tempfile.TemporaryDirectory(prefix="pdf-render-") as work:
+                # Render next to the output only when nothing follows
+                rendered = os.path.join(work, "body.pdf") if post_process else str(self.output_pdf)
+                
+                logger.info(f"Executing PDF conversion with {self.backend.name}")
+                
+                started = time.perf_counter()
+                self._cached_render(html, rendered, lambda: self.backend.options(self),
+                                    lambda: self.backend.render(self, html, rendered))
+                self.report = {"mode": "single", "backend": self.backend.name,
+                               "parallel_seconds": time.perf_counter() - started}
+                
+                # Bookmarks and stamped headers/footers in one pass over the PDF
+                if post_process:
+                    with self.tracer.span("pdf post-process", headings=len(self.headings),
+                                          stamp=stamp is not None):
+                        self.report.update(pdf_chapters.merge_parts([rendered], None, str(self.output_pdf),
+                                                                    self.headings, stamp, self._document_info()))
+                    logger.info(f"Added {self.report['bookmarks']} bookmarks"
+                                + (" and stamped headers and footers" if stamp else ""))
             
             logger.info("PDF conversion completed successfully")
             
@@ -295,6 +601,19 @@ class PDFConverter:
             logger.error(f"PDF conversion failed: {str(e)}")
             raise
 
+    def prepare_html(self, base_href: Optional[str] = None) -> str:
+        """
+        Read the HTML file and return it prepared for wkhtmltopdf.
+        
+        Args:
+            base_href (str, optional): ``<base href>`` for the page; use
+                ``self.base_dir`` as a ``file://`` URL when piping it
+        
+        Returns:
+            str: The page with code block CSS and classes applied
+        """
+        return self._preprocess_html(self.html_file.read_text(encoding='utf-8'), base_href)
+
     def convert(self) -> None:
         """
         Execute the complete HTML to PDF conversion process.
@@ -310,8 +629,26 @@ class PDFConverter:
             logger.info("Starting HTML to PDF conversion process")
             logger.info(f"Source HTML: {self.html_file}")
             
-            # Execute PDF conversion
-            self._convert_to_pdf(str(self.html_file))
+            if self.stamp_headers and not pdf_chapters.available():
+                logger.warning("pypdf is not installed; wkhtmltopdf renders the headers and footers instead")
+                self.stamp_headers = False
+            if not self.backend.available():
+                raise RuntimeError(f"PDF backend {self.backend.name} is not installed")
+            if self.optimize and not pdf_chapters.available():
+                logger.warning("pypdf is not installed; the PDF is not optimized")
+                self.optimize = False
+            
+            # Prepare the page in memory and pipe it to wkhtmltopdf; relative
+            # references resolve against the base directory
+            self._convert_to_pdf(self.prepare_html(self.base_dir.as_uri() + '/'))
+            if self.preload_resources:
+                self.report["unresolved_resources"] = self.unresolved_resources
+            if self.css_bundle_stats:
+                self.report["css_bundle"] = self.css_bundle_stats
+            if self.render_cache is not None:
+                self.render_cache.evict()
+                self.report["render_cache"] = dict(self.render_cache.stats)
+                logger.info(self.render_cache.summary())
             
             # Verify successful conversion
             if self.output_pdf.exists():
@@ -319,12 +656,63 @@ class PDFConverter:
                 logger.info(f"PDF generated successfully: {self.output_pdf} ({size:,} bytes)")
             else:
                 raise RuntimeError("PDF file was not created successfully")
+            
+            if self.optimize:
+                with self.tracer.span("pdf optimize", profile=True, bytes_in=size) as span:
+                    optimized = pdf_optimize.optimize_pdf(str(self.output_pdf), target_dpi=self.target_dpi)
+                    span["bytes_out"] = optimized["after"]
+                self.report["optimize"] = optimized
+                logger.info(f"PDF optimized: {optimized['before']:,} -> {optimized['after']:,} bytes "
+                            f"({optimized['images']} images downsampled, {optimized['duplicates']} duplicate streams"
+                            f"{', linearized' if optimized['linearized'] else ''})")
                 
         except Exception as e:
             logger.error(f"Conversion failed: {str(e)}")
             raise
 
 
+def _converter_options(args: argparse.Namespace) -> dict:
+    """PDFConverter keyword arguments from the command line, shared by single and batch runs."""
+    return {
+        "base_dir": args.base_dir,
+        "parallel_threshold": args.parallel_threshold_kb * 1024,
+        "preload_resources": not args.no_preload,
+        "outline_levels": args.outline_levels,
+        "build_cache_dir": args.build_cache,
+        "stamp_headers": args.stamp_headers,
+        "optimize": args.optimize,
+        "target_dpi": args.target_dpi,
+        "backend": args.backend,
+        "render_cache": args.render_cache,
+        "render_cache_bytes": args.render_cache_mb * 1024 * 1024,
+        "bundle_css": args.css_bundle,
+    }
+
+
+def _convert_batch(args: argparse.Namespace) -> None:
+    """Convert every page named on the command line concurrently; see :mod:`pdf_batch`."""
+    html_files = pdf_batch.discover_html(args.html_file)
+    if not html_files:
+        print(f"No HTML files found in {', '.join(args.html_file)}")
+        sys.exit(1)
+    
+    options = {
+        **_converter_options(args),
+        # The jobs already keep the CPUs busy; one wkhtmltopdf process per page unless asked for more
+        "workers": args.workers or 1,
+        "asset_cache_dir": args.asset_cache,
+        "offline": args.offline,
+    }
+    budget = args.memory_budget_mb * 1024 * 1024 if args.memory_budget_mb else None
+    logger.info(f"Converting {len(html_files)} HTML files to PDF")
+    started = time.perf_counter()
+    results = pdf_batch.run_pdf_batch(html_files, options, max_jobs=args.jobs, memory_budget=budget,
+                                      timeout=args.timeout)
+    print(pdf_batch.format_summary(results, time.perf_counter() - started))
+    if any(r["status"] != "ok" for r in results):
+        sys.exit(1)
+
+
 def main() -> None:
     """Command-line interface for HTML to PDF conversion."""
     parser = argparse.ArgumentParser(
@@ -334,7 +722,8 @@ def main() -> None:
     
     parser.add_argument(
         "html_file",
-        help="Path to the HTML file to convert"
+        nargs="+",
+        help="Path to the HTML file to convert; several files or directories are converted concurrently"
     )
     
     parser.add_argument(
@@ -353,7 +742,122 @@ def main() -> None:
         help="Enable verbose logging"
     )
     
+    parser.add_argument(
+        "--backend",
+        choices=sorted(pdf_backends.BACKENDS),
+        default=pdf_backends.DEFAULT_BACKEND,
+        help="Engine that renders the PDF (default: %(default)s)"
+    )
+    
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="wkhtmltopdf processes for rendering chapters, split at top-level <hr> page breaks, in parallel (default: CPU count; 1 disables)"
+    )
+    
+    parser.add_argument(
+        "--parallel-threshold-kb",
+        type=int,
+        default=DEFAULT_PARALLEL_THRESHOLD // 1024,
+        help="Render chapters in parallel only for HTML of at least this size (default: %(default)s)"
+    )
+    
+    parser.add_argument(
+        "--asset-cache",
+        help="Asset cache for remote stylesheets and images (default: $ASSET_CACHE_DIR or <repo>/.asset-cache, as in the HTML stage)"
+    )
+    
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="Serve remote stylesheets and images only from the asset cache"
+    )
+    
+    parser.add_argument(
+        "--no-preload",
+        action="store_true",
+        help="Let wkhtmltopdf fetch stylesheets and images itself, with network access"
+    )
+    
+    parser.add_argument(
+        "--outline-levels",
+        type=int,
+        default=pdf_outline.DEFAULT_OUTLINE_LEVELS,
+        help="Add PDF bookmarks for headings down to this level; 0 disables (default: %(default)s; needs pypdf)"
+    )
+    
+    parser.add_argument(
+        "--stamp-headers",
+        action="store_true",
+        help="Render only the page body and stamp headers and footers onto the PDF afterwards (needs pypdf)"
+    )
+    
+    parser.add_argument(
+        "--optimize",
+        action="store_true",
+        help="Shrink the PDF afterwards: downsample images, store identical streams once, compress, linearize (needs pypdf)"
+    )
+    
+    parser.add_argument(
+        "--target-dpi",
+        type=int,
+        default=pdf_optimize.DEFAULT_TARGET_DPI,
+        help="Image resolution kept by --optimize (default: %(default)s)"
+    )
+    
+    parser.add_argument(
+        "--render-cache",
+        action="store_true",
+        help="Render by chapter and reuse unchanged chapters from the build cache"
+    )
+    
+    parser.add_argument(
+        "--render-cache-mb",
+        type=int,
+        default=RENDER_CACHE_MAX_BYTES // (1024 * 1024),
+        help="Evict least recently used chapters beyond this size (default: %(default)s)"
+    )
+    
+    parser.add_argument(
+        "--css-bundle",
+        action="store_true",
+        help="Replace the page's stylesheets by one minified stylesheet holding only the rules the page uses"
+    )
+    
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=None,
+        help="Pages converted at the same time when converting several (default: CPU count)"
+    )
+    
+    parser.add_argument(
+        "--memory-budget-mb",
+        type=int,
+        default=None,
+        help="Start no page whose estimated memory would exceed this budget (default: available memory)"
+    )
+    
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=None,
+        help="Kill a page's conversion after this many seconds when converting several"
+    )
+    
+    parser.add_argument(
+        "--build-cache",
+        help="Build cache holding the heading index written by the HTML stage (default: $BUILD_CACHE_DIR or <repo>/.build-cache)"
+    )
+    
+    add_trace_arguments(parser)
+    
     args = parser.parse_args()
+    batch = len(args.html_file) > 1 or os.path.isdir(args.html_file[0])
+    if batch and (args.output or args.trace):
+        parser.error("-o/--output and --trace take a single HTML file")
+    tracer = tracer_from_args(parser, args)
     
     # Setup logging
     log_level = logging.DEBUG if args.verbose else logging.INFO
@@ -366,25 +870,41 @@ def main() -> None:
         ]
     )
     
+    if batch:
+        _convert_batch(args)
+        return
+    
     # Determine output file
+    html_file = args.html_file[0]
     if args.output:
         output_pdf = args.output
     else:
-        html_path = Path(args.html_file)
+        html_path = Path(html_file)
         output_pdf = html_path.with_suffix('.pdf')
     
     try:
         # Create converter and run
         converter = PDFConverter(
-            html_file=args.html_file,
+            html_file=html_file,
             output_pdf=output_pdf,
-            base_dir=args.base_dir
+            tracer=tracer,
+            workers=args.workers,
+            asset_cache=AssetCache(args.asset_cache or default_cache_dir(repo_basedir(html_file)), offline=args.offline),
+            **_converter_options(args)
         )
         
-        converter.convert()
+        try:
+            converter.convert()
+        finally:
+            if tracer is not None:
+                tracer.write(args.trace)
         
         print("PDF conversion completed successfully")
         print(f"Output: {output_pdf}")
+        if converter.render_cache is not None:
+            print(converter.render_cache.summary())
+        if "optimize" in converter.report:
+            print(pdf_optimize.format_report([converter.report["optimize"]]))
         
     except Exception as e:
         print(f"PDF conversion failed: {str(e)}")
@@ -0,0 +1,128 @@
+"""
+Stands in for wkhtmltopdf in tests that need real PDFs: ``fake_wkhtmltopdf.py [options] <source> <output>``.
+
+The page is laid out in lines of fixed height, one per block element, on A4
+pages. A new page starts at every ``<hr>`` (the stylesheets break pages
+there), at ``page-break-before: always`` and when a page is full. Like
+wkhtmltopdf, the PDF has a named destination for every ``id``, a ``GoTo``
+link for every ``#id`` link, a URI link for every other link, and the
+``--footer-right`` text on every page with ``[page]`` and ``[topage]``
+filled in. Headings are drawn as text.
+
+:func:`install` puts it on ``PATH`` as ``wkhtmltopdf``.
+"""
+
+import sys
+from pathlib import Path
+
+from bs4 import BeautifulSoup, Tag
+
+WIDTH, HEIGHT = 595.0, 842.0
+TOP, BOTTOM, LINE = 800.0, 80.0, 20.0
+BLOCKS = {"h1", "h2", "h3", "h4", "h5", "h6", "p", "div", "li", "pre", "tr", "nav"}
+
+
+def install(bin_dir: Path) -> Path:
+    """Write a ``wkhtmltopdf`` executable running this script into ``bin_dir``."""
+    fake = bin_dir / "wkhtmltopdf"
+    fake.write_text("#!%s\n%s" % (sys.executable, Path(__file__).read_text(encoding="utf-8")), encoding="utf-8")
+    fake.chmod(0o755)
+    return fake
+
+
+def _breaks_page(el: Tag) -> bool:
+    style = (el.get("style") or "").replace(" ", "")
+    return el.name == "hr" or "page-break-before:always" in style
+
+
+def layout(html: str):
+    """
+    Pages of (y, kind, value) items: ``("block", tag)`` for every line,
+    ``("text", heading)``, ``("id", name)`` and ``("link", href)``.
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    pages, y = [[]], TOP
+    for el in (soup.body or soup).find_all(True):
+        if _breaks_page(el) and pages[-1]:
+            pages.append([])
+            y = TOP
+        if el.name in BLOCKS or el.name == "hr":
+            y -= LINE
+            if y < BOTTOM:
+                pages.append([])
+                y = TOP - LINE
+            pages[-1].append((y, "block", el.name))
+        for key in ("id", "name") if el.name == "a" else ("id",):
+            if el.get(key):
+                pages[-1].append((y, "id", el[key]))
+        if el.name == "a" and el.get("href"):
+            pages[-1].append((y, "link", el["href"]))
+        if el.name in ("h1", "h2", "h3", "h4", "h5", "h6"):
+            pages[-1].append((y, "text", el.get_text(" ", strip=True)))
+    return pages
+
+
+def _text(x: float, y: float, text: str) -> str:
+    text = text.encode("latin-1", "replace").decode("latin-1")
+    text = text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+    return "BT /F1 10 Tf %.1f %.1f Td (%s) Tj ET\n" % (x, y, text)
+
+
+def write_pdf(pages, footer_right: str, output: str) -> None:
+    from pypdf import PdfWriter
+    from pypdf.annotations import Link
+    from pypdf.generic import ContentStream, Destination, DictionaryObject, Fit, NameObject
+
+    writer = PdfWriter()
+    ids = {}
+    for number, items in enumerate(pages):
+        for y, kind, value in items:
+            if kind == "id":
+                ids.setdefault(value, (number, y + LINE))
+    font = DictionaryObject({NameObject("/Type"): NameObject("/Font"), NameObject("/Subtype"): NameObject("/Type1"),
+                             NameObject("/BaseFont"): NameObject("/Helvetica")})
+    for number, items in enumerate(pages):
+        page = writer.add_blank_page(WIDTH, HEIGHT)
+        content = "".join(_text(72, y, value) for y, kind, value in items if kind == "text")
+        if footer_right:
+            content += _text(400, 30, footer_right.replace("[page]", str(number + 1))
+                             .replace("[topage]", str(len(pages))))
+        stream = ContentStream(None, None)
+        stream.set_data(content.encode("latin-1"))
+        page[NameObject("/Resources")] = DictionaryObject(
+            {NameObject("/Font"): DictionaryObject({NameObject("/F1"): font})})
+        page.replace_contents(stream)
+    for number, items in enumerate(pages):
+        for y, kind, value in items:
+            if kind != "link":
+                continue
+            rect = (72, y, 300, y + LINE)
+            if value.startswith("#"):
+                if value[1:] in ids:
+                    target, top = ids[value[1:]]
+                    writer.add_annotation(number, Link(rect=rect, target_page_index=target, fit=Fit.xyz(72, top)))
+            else:
+                writer.add_annotation(number, Link(rect=rect, url=value))
+    for name, (number, top) in ids.items():
+        writer.add_named_destination_object(Destination(name, writer.pages[number].indirect_reference,
+                                                        Fit.xyz(72, top)))
+    with open(output, "wb") as f:
+        writer.write(f)
+
+
+def main(argv) -> None:
+    if argv == ["--version"]:
+        print("wkhtmltopdf 0.12.6 (fake)")
+        return
+    source, output = argv[-2], argv[-1]
+    footer_right = argv[argv.index("--footer-right") + 1] if "--footer-right" in argv else ""
+    if source == "-":
+        html = sys.stdin.read()
+    else:
+        with open(source, encoding="utf-8") as f:
+            html = f.read()
+    write_pdf(layout(html), footer_right, output)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,58 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import batch_build  # noqa: E402
+
+
+class TestBatchBuild(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.repo = self.tmp.name
+        for rel in ("csaf/v2.0/cs01/csaf-v2.0-cs01.md", "csaf/v2.0/csd01/csaf-v2.0-csd01.md",
+                    "csaf/v2.0/csd01/csaf-v2.0-csd01-comment-resolution-log.md", ".github/src/test/x.md", "README.md"):
+            path = os.path.join(self.repo, rel)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            Path(path).write_text("# Spec\n\n## One\n\ntext\n", encoding="utf-8")
+        os.symlink("cs01/csaf-v2.0-cs01.md", os.path.join(self.repo, "csaf/v2.0/csaf-v2.0.md"))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_discovers_specifications_but_not_aliases_or_logs(self):
+        jobs = batch_build.discover_stages(self.repo)
+        self.assertEqual([job["name"] for job in jobs],
+                         ["csaf/v2.0/cs01/csaf-v2.0-cs01.md", "csaf/v2.0/csd01/csaf-v2.0-csd01.md"])
+        self.assertEqual(jobs[0]["output_file"], os.path.join(self.repo, "csaf/v2.0/cs01/csaf-v2.0-cs01.html"))
+        self.assertEqual(len(batch_build.discover_stages(self.repo, ["csaf/v2.0/csd01"], excludes=())), 2)
+
+    def test_pool_is_bounded_by_jobs_and_memory(self):
+        self.assertEqual(batch_build.pool_size(1, max_workers=8), 1)
+        with patch.object(batch_build, "available_memory", return_value=3 * 1024):
+            self.assertEqual(batch_build.pool_size(10, job_memory=1024, max_workers=8), 3)
+            self.assertEqual(batch_build.pool_size(10, job_memory=1 << 20, max_workers=8), 1)
+
+    @unittest.skipUnless(shutil.which("pandoc"), "pandoc is not installed")
+    def test_batch_reports_each_stage(self):
+        jobs = batch_build.discover_stages(self.repo)
+        jobs.append({"name": "missing.md", "md_file": os.path.join(self.repo, "missing.md"), "md_dir": self.repo,
+                     "output_file": os.path.join(self.repo, "missing.html")})
+        results = batch_build.run_batch(jobs, self.repo, {"offline": True}, workers=2)
+        self.assertEqual([r["status"] for r in results], ["ok", "ok", "failed"])
+        self.assertTrue(os.path.exists(jobs[0]["output_file"]))
+        results = batch_build.run_batch(jobs[:2], self.repo, {"offline": True}, workers=2)
+        self.assertEqual([r["status"] for r in results], ["up to date", "up to date"])
+        table = batch_build.format_table(results, 1.0).splitlines()
+        self.assertEqual(table[0].split(), ["Document", "Status", "html", "total"])
+        self.assertEqual(table[-1], "2 documents, 0 failed, wall time 1.00s")
+
+
+if __name__ == "__main__":
+    unittest.main()
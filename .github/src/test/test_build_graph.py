@@ -0,0 +1,133 @@
+import datetime
+import hashlib
+import os
+import sys
+import tempfile
+import unittest
+import zipfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import build_graph  # noqa: E402
+from build_manifest import build_node, pdf_node  # noqa: E402
+
+
+class TestBuildGraph(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmp.name)
+        self.runs = []
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def copy_node(self, name, source, target, deps=()):
+        """A node that writes the upper-cased content of ``source`` to ``target``."""
+        def run():
+            self.runs.append(name)
+            if "fail" in (self.dir / source).read_text(encoding="utf-8"):
+                raise RuntimeError("bad input")
+            (self.dir / target).write_text((self.dir / source).read_text(encoding="utf-8").upper(), encoding="utf-8")
+        return build_graph.Node(name, "copy", [str(self.dir / target)],
+                                lambda: {source: hashlib.sha256((self.dir / source).read_bytes()).hexdigest()},
+                                run, list(deps))
+
+    def run_graph(self, **kwargs):
+        graph = build_graph.BuildGraph(str(self.dir / ".build-cache"), workers=4)
+        for n in (1, 2):
+            graph.add(self.copy_node("html%d" % n, "page%d.md" % n, "page%d.html" % n))
+            graph.add(self.copy_node("pdf%d" % n, "page%d.html" % n, "page%d.pdf" % n, ["html%d" % n]))
+        self.runs = []
+        return {r["node"]: (r["status"], r["reason"]) for r in graph.run(**kwargs)}
+
+    def test_freshness_follows_content_not_times(self):
+        for n in (1, 2):
+            (self.dir / ("page%d.md" % n)).write_text("text %d" % n, encoding="utf-8")
+        self.assertEqual(set(self.run_graph().values()), {("ran", "no manifest")})
+        self.assertEqual(set(self.run_graph().values()), {("up to date", "inputs and outputs unchanged")})
+
+        os.utime(self.dir / "page1.md", (0, 0))
+        os.utime(self.dir / "page1.html", (0, 0))
+        self.assertEqual(self.run_graph()["html1"][0], "up to date")
+
+        # A changed source that gives the same page does not reach the PDF.
+        (self.dir / "page1.md").write_text("TEXT 1", encoding="utf-8")
+        results = self.run_graph()
+        self.assertEqual(results["html1"], ("ran", "changed: page1.md"))
+        self.assertEqual(results["pdf1"][0], "up to date")
+        self.assertEqual(self.runs, ["html1"])
+
+        (self.dir / "page2.html").write_text("edited", encoding="utf-8")
+        self.assertTrue(self.run_graph()["html2"][1].startswith("output missing or modified: "))
+        self.assertEqual(self.run_graph(force=True)["pdf2"], ("ran", "forced"))
+
+    def test_failures_block_dependents_and_dry_run_reports(self):
+        (self.dir / "page1.md").write_text("fail", encoding="utf-8")
+        (self.dir / "page2.md").write_text("ok", encoding="utf-8")
+        results = self.run_graph(dry_run=True)
+        self.assertEqual(results["html1"], ("would run", "no manifest"))
+        self.assertEqual(results["pdf1"], ("pending", "html1 would run"))
+        self.assertEqual(self.runs, [])
+
+        results = self.run_graph()
+        self.assertEqual(results["html1"], ("failed", "RuntimeError: bad input"))
+        self.assertEqual(results["pdf1"], ("blocked", "html1 failed"))
+        self.assertEqual(results["pdf2"][0], "ran")
+
+        graph = build_graph.BuildGraph(str(self.dir))
+        graph.add(build_graph.Node("a", "x", ["a"], dict, list, ["b"]))
+        graph.add(build_graph.Node("b", "x", ["b"], dict, list, ["a"]))
+        with self.assertRaisesRegex(ValueError, "dependency cycle: a -> b -> a"):
+            graph.order()
+
+    def test_batch_and_graph_options_give_the_same_pdf_fingerprint(self):
+        html, pdf = self.dir / "spec.html", self.dir / "spec.pdf"
+        html.write_text("<html><body><p>a</p></body></html>", encoding="utf-8")
+        cache = str(self.dir / ".build-cache")
+        graph = build_graph.BuildGraph(cache)
+
+        def render():
+            pdf.write_bytes(b"%PDF-1.4\n")
+
+        def node(options):
+            return pdf_node("spec.pdf", str(html), str(pdf), options, render)
+
+        # What batch_build checks its PDFs with ...
+        batch_options = {"pdf": True, "optimize_pdf": False, "pdf_backend": "wkhtmltopdf",
+                         "pdf_render_cache": False, "css_bundle": False, "canonical_html": True}
+        self.assertEqual(build_node(node(batch_options), cache)["status"], "ran")
+        # ... is what the graph finds up to date.
+        self.assertEqual(graph.build(node({"canonical_html": True, "pdf_backend": "wkhtmltopdf"}))["status"],
+                         "up to date")
+
+    def test_stage_package_and_manifest_nodes(self):
+        stage = self.dir / "csaf" / "v2.1" / "csd01"
+        stage.mkdir(parents=True)
+        (stage / "csaf-v2.1-csd01.html").write_text("<title>Spec</title><p>spec</p>", encoding="utf-8")
+        (stage / "csaf-v2.1-csd01.pdf").write_bytes(b"%PDF-1.4 one")
+        options = {"steps": ["zip", "manifest"], "date": datetime.date(2024, 10, 10)}
+
+        def run():
+            graph = build_graph.BuildGraph(str(self.dir / ".build-cache"))
+            build_graph.add_stage_nodes(graph, str(self.dir), str(stage), [], options)
+            return [(r["node"], r["status"], r["reason"]) for r in graph.run()]
+
+        self.assertEqual(run(), [("csaf/v2.1/csd01/csaf-v2.1-csd01.zip", "ran", "no manifest"),
+                                 ("csaf/v2.1/csd01/csaf-v2.1-csd01-manifest.txt", "ran", "no manifest")])
+        with zipfile.ZipFile(stage / "csaf-v2.1-csd01.zip") as zf:
+            self.assertEqual(zf.namelist(), ["csaf-v2.1-csd01.html", "csaf-v2.1-csd01.pdf"])
+        for path in stage.iterdir():
+            os.utime(path, (0, 0))
+        self.assertEqual([status for _, status, _ in run()], ["up to date", "up to date"])
+
+        (stage / "csaf-v2.1-csd01.pdf").write_bytes(b"%PDF-1.4 two")
+        self.assertEqual([(status, reason) for _, status, reason in run()],
+                         [("ran", "changed: content"), ("ran", "changed: files")])
+        self.assertIn(hashlib.md5(b"%PDF-1.4 two").hexdigest(),
+                      (stage / "csaf-v2.1-csd01-manifest.txt").read_text(encoding="utf-8"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+import json
+import os
+import pstats
+import sys
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import build_trace  # noqa: E402
+from build_trace import Tracer  # noqa: E402
+
+
+class TestBuildTrace(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_spans_are_written_as_chrome_trace_events(self):
+        tracer = Tracer()
+        with tracer.span("outer") as span:
+            with tracer.span("inner", cat="detail", bytes_in="h\u00e9llo"):
+                time.sleep(0.01)
+            span["bytes_out"] = b"abc"
+        path = os.path.join(self.tmp.name, "trace.json")
+        tracer.write(path)
+        events = json.loads(Path(path).read_text(encoding="utf-8"))["traceEvents"]
+        spans = {e["name"]: e for e in events if e["ph"] == "X"}
+        self.assertEqual(spans["inner"]["args"]["bytes_in"], 6)
+        self.assertEqual(spans["outer"]["args"]["bytes_out"], 3)
+        self.assertGreaterEqual(spans["outer"]["dur"], spans["inner"]["dur"])
+        self.assertLessEqual(spans["outer"]["ts"], spans["inner"]["ts"])
+        self.assertIn("cpu_ms", spans["inner"]["args"])
+        self.assertIn("thread_name", [e["name"] for e in events if e["ph"] == "M"])
+
+    def test_cpu_profile_is_written_once_per_outermost_stage(self):
+        tracer = Tracer("cpu", self.tmp.name)
+        with tracer.span("post-process", profile=True):
+            with tracer.span("pandoc", profile=True):
+                sum(range(1000))
+        spans = {e["name"]: e for e in tracer.events if e["ph"] == "X"}
+        self.assertNotIn("cprofile", spans["pandoc"]["args"])
+        stats = pstats.Stats(spans["post-process"]["args"]["cprofile"])
+        self.assertTrue(stats.total_calls > 0)
+
+    def test_peak_rss_is_reported_only_by_spans_that_raised_it(self):
+        tracer = Tracer()
+        # (children CPU, own peak, child peak) at the start and the end of each span.
+        usage = [(0.0, 500, 50), (0.0, 500, 80), (0.0, 500, 80), (0.0, 700, 80)]
+        with patch.object(build_trace, "_rusage", side_effect=usage):
+            with tracer.span("pandoc"):
+                pass
+            with tracer.span("post-process"):
+                pass
+        spans = {e["name"]: e["args"] for e in tracer.events if e["ph"] == "X"}
+        self.assertNotIn("peak_rss_kb", spans["pandoc"])
+        self.assertEqual(spans["pandoc"]["child_peak_rss_kb"], 80)
+        self.assertEqual(spans["post-process"]["peak_rss_kb"], 700)
+        self.assertNotIn("child_peak_rss_kb", spans["post-process"])
+
+
+if __name__ == "__main__":
+    unittest.main()
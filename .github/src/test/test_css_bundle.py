@@ -0,0 +1,43 @@
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from bs4 import BeautifulSoup  # noqa: E402
+
+import css_bundle  # noqa: E402
+
+
+class TestCssBundle(unittest.TestCase):
+
+    PAGE = BeautifulSoup('<html><head></head><body><h1 id="t">T</h1><p><a href="#t"><code class="json">x</code>'
+                         '</a></p><table><tr><td>1</td></tr></table></body></html>', "html.parser")
+
+    def test_unused_selectors_are_pruned(self):
+        css, stats = css_bundle.bundle_css([(
+            "/* c */ .json, .xml, .yaml { padding: 8pt }\n"
+            "table code, td, #t, #missing { border: 0 }\n"
+            "a:hover, a.visited:hover, p::before { color: red }\n"
+            "@media print { .sourceCode { color: black } }\n"
+            "@page { size: A4 portrait; margin: 2cm }\n"
+            "p:has(a > code), [data-x] { margin: 0 }\n", None)], self.PAGE)
+        self.assertEqual(css, ".json{padding:8pt}td,#t{border:0}a:hover,p::before{color:red}"
+                              "@page{size:A4 portrait;margin:2cm}p:has(a>code){margin:0}")
+        self.assertEqual((stats["rules_in"], stats["rules_out"]), (5, 4))
+        self.assertEqual((stats["selectors_in"], stats["selectors_out"]), (13, 6))
+
+    def test_duplicates_are_merged_without_changing_the_cascade(self):
+        css, _ = css_bundle.bundle_css([
+            ("h1 { color: red } td { color: blue } h1 { color: red; color: red }", None),
+            ("code { margin: 0 } a { margin: 0 } td { color: blue !important }", "print"),
+        ], self.PAGE)
+        self.assertEqual(css, "td{color:blue}h1{color:red}@media print{code,a{margin:0}td{color:blue!important}}")
+
+    def test_import_after_other_rules_is_not_bundled(self):
+        with self.assertRaises(css_bundle.BundleUnsupported):
+            css_bundle.bundle_css([("td { color: blue }", None), ('@import "x.css";', None)], self.PAGE)
+
+
+if __name__ == "__main__":
+    unittest.main()
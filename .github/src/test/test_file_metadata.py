@@ -0,0 +1,70 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import file_metadata  # noqa: E402
+
+
+class TestFileMetadata(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name).resolve()
+        (self.root / "docs").mkdir()
+        (self.root / "docs" / "a b.md").write_text("a", encoding="utf-8")
+        (self.root / "spec.html").write_text("html", encoding="utf-8")
+        (self.root / ".gitignore").write_text("*.log\n", encoding="utf-8")
+        self.git("init", "-q")
+        self.git("add", ".")
+        self.git("-c", "user.name=t", "-c", "user.email=t@example.org", "commit", "-q", "-m", "init")
+        os.utime(self.root / "docs" / "a b.md", (1700000000, 1700000000))
+        os.utime(self.root / "spec.html", (1600000000, 1600000000))
+        os.utime(self.root / ".gitignore", (1500000000, 1500000000))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def git(self, *args):
+        subprocess.run(["git", *args], cwd=self.root, check=True)
+
+    def metadata(self):
+        return (self.root / ".file-metadata").read_text(encoding="utf-8")
+
+    def test_record_writes_only_changes(self):
+        self.assertTrue(file_metadata.record(str(self.root)))
+        self.assertEqual(self.metadata(), "1500000000 .gitignore\n1700000000 docs/a b.md\n1600000000 spec.html\n")
+        self.git("add", ".file-metadata")
+        self.assertTrue(file_metadata.record(str(self.root)))
+        self.assertIn(" .file-metadata\n", self.metadata())
+        mtime = os.stat(self.root / ".file-metadata").st_mtime_ns
+        self.assertFalse(file_metadata.record(str(self.root)))
+        self.assertEqual(os.stat(self.root / ".file-metadata").st_mtime_ns, mtime)
+
+        os.utime(self.root / "spec.html", (1600000001, 1600000001))
+        self.assertTrue(file_metadata.record(str(self.root)))
+        self.assertIn("1600000001 spec.html\n", self.metadata())
+
+    def test_restore_sets_times_and_drops_stale_entries(self):
+        (self.root / "build.log").write_text("log", encoding="utf-8")
+        (self.root / ".file-metadata").write_text(
+            "1234567890 docs/a b.md\n1234567891 spec.html\n1234567892 build.log\n1234567893 gone.md\n",
+            encoding="utf-8")
+        stats = file_metadata.restore(str(self.root))
+        self.assertEqual(stats, {"kept": 2, "dropped": 2, "touched": 2})
+        self.assertEqual(int(os.stat(self.root / "docs" / "a b.md").st_mtime), 1234567890)
+        self.assertEqual(int(os.stat(self.root / "spec.html").st_mtime), 1234567891)
+        self.assertNotEqual(int(os.stat(self.root / "build.log").st_mtime), 1234567892)
+        self.assertEqual(self.metadata(), "1234567890 docs/a b.md\n1234567891 spec.html\n")
+
+        mtime = os.stat(self.root / ".file-metadata").st_mtime_ns
+        self.assertEqual(file_metadata.restore(str(self.root)), {"kept": 2, "dropped": 0, "touched": 0})
+        self.assertEqual(os.stat(self.root / ".file-metadata").st_mtime_ns, mtime)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,27 @@
+import hashlib
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from html_canonical import canonical_html, content_digest  # noqa: E402
+
+
+class TestHtmlCanonical(unittest.TestCase):
+
+    def test_canonical_form_is_a_fixed_point(self):
+        html = ('<!DOCTYPE html>\r\n<html><head><meta charset="utf-8">\n<meta name="a" content="b" />\n'
+                '<link rel="stylesheet" href="s.css"></head>\n<body>\n\n  <p id="x" class="c">one  \n   two</p>'
+                '<pre class="z" id="y">keep  \n   this</pre><!-- a  \n  comment --></body></html>\n\n')
+        canonical = canonical_html(html)
+        self.assertEqual(canonical, (
+            '<!DOCTYPE html>\n\n<html><head><meta charset="utf-8"/>\n<meta content="b" name="a"/>\n'
+            '<link href="s.css" rel="stylesheet"/></head>\n<body>\n<p class="c" id="x">one\ntwo</p>'
+            '<pre class="z" id="y">keep  \n   this</pre><!-- a  \n  comment --></body></html>\n'))
+        self.assertEqual(canonical_html(canonical), canonical)
+        self.assertEqual(content_digest(canonical), hashlib.sha256(canonical.encode("utf-8")).hexdigest())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,277 @@
+import os
+import re
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from bs4 import BeautifulSoup  # noqa: E402
+
+import fake_wkhtmltopdf  # noqa: E402
+import pdf_backends  # noqa: E402
+import pdf_chapters  # noqa: E402
+import pdf_stamp  # noqa: E402
+from pdf_render_cache import RenderCache  # noqa: E402
+from step_2_convert_html_to_pdf import PDFConverter  # noqa: E402
+
+
+class TestPdfConverter(unittest.TestCase):
+    # Stands in for wkhtmltopdf: copies the page it reads on stdin to the output file.
+    # That output is HTML, not a PDF, so the pypdf post-processing is switched off.
+    FAKE_WKHTMLTOPDF = (
+        "#!%s\n"
+        "import sys\n"
+        "assert sys.argv[-2] == '-'\n"
+        "open(sys.argv[-1], 'w', encoding='utf-8').write(sys.stdin.read())\n"
+    )
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmp.name, "csd01")
+        self.dir.mkdir()
+        self.html = self.dir / "spec.html"
+        self.html.write_text('<html><head><link rel="stylesheet" href="styles/markdown-styles-v1.7.3a.css" />'
+                             '</head><body><h1 id="a">A</h1><p><code>x</code></p><pre>y</pre></body></html>',
+                             encoding="utf-8")
+        bin_dir = Path(self.tmp.name, "bin")
+        bin_dir.mkdir()
+        fake = bin_dir / "wkhtmltopdf"
+        fake.write_text(self.FAKE_WKHTMLTOPDF % sys.executable, encoding="utf-8")
+        fake.chmod(0o755)
+        self.path = patch.dict(os.environ, {"PATH": "%s%s%s" % (bin_dir, os.pathsep, os.environ["PATH"])})
+        self.path.start()
+        self.no_pypdf = patch("pdf_chapters.available", return_value=False)
+        self.no_pypdf.start()
+
+    def tearDown(self):
+        self.no_pypdf.stop()
+        self.path.stop()
+        self.tmp.cleanup()
+
+    def test_prepared_page_is_piped_without_intermediate_files(self):
+        pdf = self.dir / "spec.pdf"
+        PDFConverter(str(self.html), str(pdf), workers=1).convert()
+        self.assertEqual(sorted(p.name for p in self.dir.iterdir()), ["spec.html", "spec.pdf"])
+        soup = BeautifulSoup(pdf.read_text(encoding="utf-8"), "html.parser")
+        self.assertEqual(soup.head.contents[0].name, "base")
+        self.assertEqual(soup.head.base["href"], self.dir.resolve().as_uri() + "/")
+        self.assertEqual(soup.head.contents[-1].name, "style")
+        self.assertEqual(soup.find("code")["class"], ["inline-code"])
+        self.assertEqual(soup.find("pre")["class"], ["code-block"])
+        self.assertIn("no-page-break", soup.find("h1")["class"])
+
+    def test_header_and_footer_texts_come_from_the_page(self):
+        self.html.write_text('<html><head><title>Spec Version 2.0</title></head><body>'
+                             '<h1big id="t">Spec Version 2.0</h1big><h2 id="s">OASIS Standard</h2>'
+                             '<h2 id="d">18 November 2022</h2><h1 id="a">A</h1></body></html>', encoding="utf-8")
+        converter = PDFConverter(str(self.html), str(self.dir / "spec.pdf"))
+        converter.prepare_html()
+        self.assertEqual(converter.metadata, {"title": "Spec Version 2.0", "stage": "OASIS Standard",
+                                              "date": "18 November 2022", "year": "2022"})
+        cmd = converter._wkhtmltopdf_cmd("-", "out.pdf")
+        self.assertEqual(cmd[cmd.index("--header-center") + 1], "Spec Version 2.0")
+        self.assertEqual(cmd[cmd.index("--footer-center") + 1], "Copyright © OASIS Open 2022. All Rights Reserved.")
+        self.assertEqual(cmd[cmd.index("--footer-right") + 1], "18 November 2022 - Page [page] of [topage]")
+
+        converter.stamp_headers = True
+        cmd = converter._wkhtmltopdf_cmd("-", "out.pdf")
+        self.assertFalse([arg for arg in cmd if arg.startswith(("--header", "--footer"))])
+        stamp = converter._stamp()
+        content = stamp._static_content(595.28, 841.89)
+        self.assertIn("(Spec Version 2.0) Tj", content)
+        self.assertIn("(Copyright \xa9 OASIS Open 2022. All Rights Reserved.) Tj", content)
+        self.assertEqual(stamp.footer_right.format(page=3, pages=9), "18 November 2022 - Page 3 of 9")
+        # Centered text: equal space on both sides of the header.
+        x = float(re.search(r"Tf ([0-9.]+) [0-9.]+ Td \(Spec", content).group(1))
+        self.assertAlmostEqual(2 * x + pdf_stamp.text_width("Spec Version 2.0", 10), 595.28, places=1)
+
+    def test_css_bundle_keeps_only_the_rules_the_page_uses(self):
+        pdf = self.dir / "spec.pdf"
+        converter = PDFConverter(str(self.html), str(pdf), workers=1, bundle_css=True, preload_resources=False)
+        self.html.write_text('<html><head><style>h1 { color: red } .table-striped td { color: blue }</style></head>'
+                             '<body><h1 id="a">A</h1><p><code>x</code></p></body></html>', encoding="utf-8")
+        converter.convert()
+        soup = BeautifulSoup(pdf.read_text(encoding="utf-8"), "html.parser")
+        self.assertEqual(len(soup.find_all("style")), 1)
+        css = soup.style.string
+        self.assertTrue(css.startswith("h1{color:red}code{font-family:"))
+        self.assertNotIn(".json", css)
+        self.assertNotIn(".table-striped", css)
+        self.assertIn(".no-page-break{page-break-inside:avoid!important}", css)
+        stats = converter.report["css_bundle"]
+        self.assertLess(stats["rules_out"], stats["rules_in"])
+
+    def test_backends_are_chosen_by_name(self):
+        rendered = []
+
+        class Recorder(pdf_backends.PdfBackend):
+            name = "recorder"
+
+            def available(self):
+                return True
+
+            def render(self, converter, html, output_pdf):
+                rendered.append(html)
+                Path(output_pdf).write_bytes(b"%PDF-1.4\n")
+
+        with self.assertRaises(TypeError):
+            type("NoRender", (pdf_backends.PdfBackend,), {"available": lambda self: True})()
+        with patch("importlib.util.find_spec", return_value=None):
+            self.assertFalse(pdf_backends.WeasyPrintBackend().available())
+        with self.assertRaises(ValueError):
+            PDFConverter(str(self.html), str(self.dir / "spec.pdf"), backend="recorder")
+        with patch.dict(pdf_backends.BACKENDS, {"recorder": Recorder}):
+            converter = PDFConverter(str(self.html), str(self.dir / "spec.pdf"), backend="recorder")
+            converter.convert()
+        self.assertEqual(converter.report["backend"], "recorder")
+        self.assertEqual(len(rendered), 1)
+        self.assertIn('class="code-block"', rendered[0])
+
+        converter.metadata = {"title": 'A "B"', "stage": "", "date": "1 May 2025", "year": "2025"}
+        css = pdf_backends.page_css(converter)
+        self.assertIn('@top-center { content: "A \\"B\\"";', css)
+        self.assertIn('content: "1 May 2025 - Page " counter(page) " of " counter(pages);', css)
+        converter.stamp_headers = True
+        self.assertEqual(pdf_backends.page_css(converter).count("content: none;"), 4)
+
+    def test_unchanged_pages_are_served_from_the_render_cache(self):
+        cache_dir = Path(self.tmp.name, "build-cache")
+
+        def build():
+            converter = PDFConverter(str(self.html), str(self.dir / "spec.pdf"), build_cache_dir=str(cache_dir),
+                                     render_cache=True)
+            converter.convert()
+            return converter.report["render_cache"]
+
+        self.assertEqual(build(), {"hits": 0, "misses": 1, "evicted": 0})
+        first = (self.dir / "spec.pdf").read_bytes()
+        (self.dir / "spec.pdf").unlink()
+        self.assertEqual(build(), {"hits": 1, "misses": 0, "evicted": 0})
+        self.assertEqual((self.dir / "spec.pdf").read_bytes(), first)
+        # An edited page is rendered again.
+        self.html.write_text(self.html.read_text(encoding="utf-8").replace(">A<", ">B<"), encoding="utf-8")
+        self.assertEqual(build(), {"hits": 0, "misses": 1, "evicted": 0})
+
+    def test_render_cache_evicts_least_recently_used_parts(self):
+        cache = RenderCache(os.path.join(self.tmp.name, "parts"), max_bytes=250)
+        part = Path(self.tmp.name, "part.pdf")
+        for n, key in enumerate(("a" * 64, "b" * 64, "c" * 64)):
+            part.write_bytes(b"x" * 100)
+            cache.put(key, part)
+            os.utime(cache._path(key), (1000 + n, 1000 + n))
+        self.assertTrue(cache.get("a" * 64, str(part)))
+        self.assertEqual(cache.evict(), 100)
+        self.assertFalse(cache.get("b" * 64, str(part)))
+        self.assertTrue(cache.get("c" * 64, str(part)))
+        self.assertIn("2 of 3 parts from cache", cache.summary())
+
+    def test_only_expected_chapter_failures_fall_back_to_one_process(self):
+        pdf = self.dir / "spec.pdf"
+        converter = PDFConverter(str(self.html), str(pdf), workers=2)
+        html = converter.prepare_html()
+        with patch.object(converter, "_use_chapters", return_value=True):
+            with patch.object(converter, "_convert_chapters", side_effect=pdf_chapters.ChapterError("pages")):
+                with self.assertLogs("step_2_convert_html_to_pdf", "WARNING") as logs:
+                    converter._convert_to_pdf(html)
+            self.assertIn("Chapter rendering not possible (pages)", logs.output[0])
+            self.assertEqual(converter.report["mode"], "single")
+            self.assertTrue(pdf.exists())
+            with patch.object(converter, "_convert_chapters", side_effect=KeyError("bug")):
+                with self.assertRaises(KeyError):
+                    converter._convert_to_pdf(html)
+
+    def test_fix_html_for_pdf_writes_the_same_preparation(self):
+        import fix_html_for_pdf
+        fixed = self.dir / "spec_fixed.html"
+        fix_html_for_pdf.preprocess_html_for_pdf(self.html, fixed)
+        converter = PDFConverter(str(self.html), str(self.dir / "spec.pdf"))
+        self.assertEqual(fixed.read_text(encoding="utf-8"), converter.prepare_html())
+        self.assertNotIn("<base", fixed.read_text(encoding="utf-8"))
+
+
+@unittest.skipUnless(pdf_chapters.available(), "pypdf is not installed")
+class TestChapterRendering(unittest.TestCase):
+    """Chapter rendering with real PDFs, from the wkhtmltopdf stand-in in fake_wkhtmltopdf.py."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmp.name, "csd01")
+        self.dir.mkdir()
+        self.html = self.dir / "spec.html"
+        self.html.write_text(
+            '<html><head><title>Spec</title></head><body><h1big id="title">Spec</h1big>'
+            '<nav id="TOC"><a href="#two">Two</a> <a href="#two-a">Two A</a></nav>'
+            '<hr/><h1 id="one">1 One</h1><p>one</p><h1 id="also">2 Also</h1>' + "<p>also</p>" * 40 +
+            '<hr/><h1 id="two">3 Two</h1><h2 id="two-a">3.1 Two A</h2><p>two <a href="#one">back</a></p>'
+            '<hr/><h1 id="three">4 Three</h1><p>three</p></body></html>', encoding="utf-8")
+        bin_dir = Path(self.tmp.name, "bin")
+        bin_dir.mkdir()
+        fake_wkhtmltopdf.install(bin_dir)
+        self.path = patch.dict(os.environ, {"PATH": "%s%s%s" % (bin_dir, os.pathsep, os.environ["PATH"])})
+        self.path.start()
+
+    def tearDown(self):
+        self.path.stop()
+        self.tmp.cleanup()
+
+    def convert(self, **options) -> PDFConverter:
+        converter = PDFConverter(str(self.html), str(self.dir / "spec.pdf"), parallel_threshold=0,
+                                 preload_resources=False, build_cache_dir=str(Path(self.tmp.name, "build-cache")),
+                                 **options)
+        converter.convert()
+        return converter
+
+    def footers(self) -> list:
+        from pypdf import PdfReader
+        return [re.search(r"Page (\d+) of (\d+)", page.extract_text()).groups()
+                for page in PdfReader(str(self.dir / "spec.pdf")).pages]
+
+    def test_edited_chapter_is_the_only_render_cache_miss(self):
+        converter = self.convert(render_cache=True)
+        self.assertEqual((converter.report["mode"], converter.report["parts"]), ("chapters", 3))
+        # Three parts (the title page goes with the first chapter) and the page-number document.
+        self.assertEqual(converter.report["render_cache"], {"hits": 0, "misses": 4, "evicted": 0})
+        # Title page, "One" and "Also" over two pages, "Two", "Three".
+        self.assertEqual(self.footers(), [(str(n), "5") for n in range(1, 6)])
+
+        self.html.write_text(self.html.read_text(encoding="utf-8").replace("<p>two ", "<p>2 "), encoding="utf-8")
+        converter = self.convert(render_cache=True)
+        self.assertEqual(converter.report["render_cache"], {"hits": 3, "misses": 1, "evicted": 0})
+        self.assertEqual(self.footers(), [(str(n), "5") for n in range(1, 6)])
+
+    def outline(self) -> list:
+        from pypdf import PdfReader
+        reader = PdfReader(str(self.dir / "spec.pdf"))
+
+        def walk(items, depth):
+            for item in items:
+                if isinstance(item, list):
+                    yield from walk(item, depth + 1)
+                else:
+                    yield depth, item.title, reader.get_destination_page_number(item)
+        return list(walk(reader.outline, 0))
+
+    def test_bookmarks_are_placed_on_the_merged_pages(self):
+        expected = [(0, "Spec", 0), (0, "1 One", 1), (0, "2 Also", 1), (0, "3 Two", 3), (1, "3.1 Two A", 3),
+                    (0, "4 Three", 4)]
+        converter = self.convert(workers=2)
+        self.assertEqual((converter.report["mode"], converter.report["bookmarks"]), ("chapters", 6))
+        self.assertEqual(self.outline(), expected)
+        # The same bookmarks when the page is rendered in one process.
+        converter = self.convert(workers=1)
+        self.assertEqual((converter.report["mode"], converter.report["bookmarks"]), ("single", 6))
+        self.assertEqual(self.outline(), expected)
+
+    def test_stamped_and_optimized_chapters_keep_their_footers(self):
+        converter = self.convert(workers=2, stamp_headers=True, optimize=True)
+        self.assertEqual(converter.report["mode"], "chapters")
+        self.assertEqual(self.footers(), [(str(n), "5") for n in range(1, 6)])
+        self.assertTrue(converter.report["optimize"]["replaced"])
+        self.assertEqual(len(self.outline()), 6)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,34 @@
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from bs4 import BeautifulSoup  # noqa: E402
+
+from html_visitor import HtmlVisitor, normalize_text_runs  # noqa: E402
+
+
+class TestHtmlVisitor(unittest.TestCase):
+
+    def test_walk_visits_in_document_order_and_skips_removed_subtrees(self):
+        soup = BeautifulSoup("<div><nav><p>a</p></nav><p>b</p><section><p>c</p></section></div>", "html.parser")
+        seen = []
+        visitor = HtmlVisitor()
+        visitor.on_enter("nav", lambda tag: tag.decompose())
+        visitor.on_enter("p", lambda tag: seen.append(tag.get_text()))
+        visitor.on_exit("section", lambda tag: seen.append("/section"))
+        visitor.walk(soup)
+        self.assertEqual(seen, ["b", "c", "/section"])
+
+    def test_normalize_text_runs_collapses_whitespace_left_by_removals(self):
+        soup = BeautifulSoup("<body>\n<header>x</header>\n<p>a</p> <pre>\n<b>y</b>\n</pre></body>", "html.parser")
+        soup.header.decompose()
+        soup.pre.b.decompose()
+        normalize_text_runs(soup.body)
+        normalize_text_runs(soup.pre)
+        self.assertEqual(str(soup), "<body>\n<p>a</p> <pre>\n\n</pre></body>")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,388 @@
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest.mock import patch
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import requests  # noqa: E402
+from bs4 import BeautifulSoup  # noqa: E402
+
+import pdf_outline  # noqa: E402
+from asset_cache import AssetCache  # noqa: E402
+from build_trace import Tracer  # noqa: E402
+from step_1_markdown_to_html_converter_V3_0 import MarkdownToHtmlConverter  # noqa: E402
+
+
+PANDOC_HTML = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8" />
+<title>Spec</title>
+<link rel="stylesheet" href="styles/styles.css" />
+</head>
+<body>
+<header id="title-block-header">
+<h1 class="title">Spec</h1>
+</header>
+<nav id="TOC" role="doc-toc">
+<ul><li><a href="#intro">Intro</a></li></ul>
+</nav>
+<p><img src="https://docs.oasis-open.org/templates/OASISLogo-v3.0.png" alt="OASIS Logo" /></p>
+<hr />
+<h1 id="spec">Spec</h1>
+<h2 id="intro"><a id="intro"></a>Intro</h2>
+<p>See https://docs.oasis-open.org/csaf/v2.1/csd01/spec.html#intro and https://example.com/x</p>
+<p><a href="https://docs.oasis-open.org/csaf/v2.1/csd01/spec.html#intro" target="_blank">self</a></p>
+</body>
+</html>
+"""
+
+
+class TestPostProcessHtml(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        base = self.tmp.name
+        md_dir = os.path.join(base, "csaf", "v2.1", "csd01")
+        os.makedirs(md_dir)
+        md_file = os.path.join(md_dir, "spec.md")
+        Path(md_file).write_text("# Spec\n", encoding="utf-8")
+        cache = AssetCache(os.path.join(base, ".asset-cache"), offline=True)
+        self.converter = MarkdownToHtmlConverter(
+            md_file, os.path.join(md_dir, "spec.html"), base, md_dir, asset_cache=cache
+        )
+        Path(self.converter.images_dir, "OASISLogo-v3.0.png").write_bytes(b"png")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_post_process_applies_all_rules(self):
+        with patch("requests.get") as get:
+            html = self.converter._post_process_html(PANDOC_HTML, step=5)
+        get.assert_not_called()
+        soup = BeautifulSoup(html, "html.parser")
+        self.assertIsNone(soup.header)
+        self.assertIsNone(soup.nav)
+        self.assertEqual(soup.head.contents[0]["name"], "description")
+        self.assertEqual(soup.body.p.img["src"], os.path.join("images", "OASISLogo-v3.0.png"))
+        self.assertEqual(soup.find("h1big")["id"], "spec")
+        self.assertIsNone(soup.find("hr"))
+        self.assertEqual(soup.find("h2").decode_contents(), "Intro")
+        hrefs = [a["href"] for a in soup.find_all("a")]
+        self.assertEqual(hrefs, ["#intro", "https://example.com/x", "#intro"])
+        self.assertNotIn("target", soup.find_all("a")[-1].attrs)
+        self.assertIn("<body>\n<p><img", html)
+
+    def test_traced_post_process_matches_and_records_each_phase(self):
+        plain = self.converter._post_process_html(PANDOC_HTML, step=5)
+        self.converter.tracer = Tracer()
+        self.assertEqual(self.converter._post_process_html(PANDOC_HTML, step=5), plain)
+        spans = {e["name"]: e for e in self.converter.tracer.events if e["ph"] == "X"}
+        for name in ("post-process", "parse", "rules", "logo and banner", "localize assets", "serialize"):
+            self.assertIn(name, spans)
+        self.assertEqual(spans["post-process"]["args"]["bytes_in"], len(PANDOC_HTML.encode("utf-8")))
+        self.assertEqual(spans["serialize"]["args"]["bytes_out"], len(plain.encode("utf-8")))
+        self.assertIn("visit_a", spans["rules"]["args"]["rules_ms"])
+        self.assertIn("asset fetch", spans)
+
+
+class TestIncrementalBuild(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+        md_dir = os.path.join(self.tmp.name, "csaf", "v2.1", "csd01")
+        os.makedirs(md_dir)
+        self.md_file = os.path.join(md_dir, "spec.md")
+        Path(self.md_file).write_text("# Spec\n\ntext\n", encoding="utf-8")
+        self.output_file = os.path.join(md_dir, "spec.html")
+        self.pandoc_runs = 0
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def _convert(self, force: bool = False) -> bool:
+        def fake_pandoc(step, markdown):
+            self.pandoc_runs += 1
+            return PANDOC_HTML
+
+        cache = AssetCache(os.path.join(self.tmp.name, ".asset-cache"), offline=True)
+        converter = MarkdownToHtmlConverter(self.md_file, self.output_file, self.tmp.name,
+                                            os.path.dirname(self.md_file), asset_cache=cache)
+        with patch.object(converter, "_run_pandoc", side_effect=fake_pandoc):
+            return converter.convert(force=force)
+
+    def test_unchanged_inputs_skip_pandoc_and_post_processing(self):
+        self.assertTrue(self._convert())
+        self.assertFalse(self._convert())
+        self.assertEqual(self.pandoc_runs, 1)
+
+        self.assertTrue(self._convert(force=True))
+        self.assertEqual(self.pandoc_runs, 2)
+
+        Path(self.md_file).write_text("# Spec\n\nnew text\n", encoding="utf-8")
+        self.assertTrue(self._convert())
+        self.assertFalse(self._convert())
+
+        Path(self.output_file).write_text("edited", encoding="utf-8")
+        self.assertTrue(self._convert())
+        self.assertEqual(self.pandoc_runs, 4)
+
+    def test_conversion_stores_the_heading_index_for_the_pdf_stage(self):
+        self._convert()
+        html = Path(self.output_file).read_text(encoding="utf-8")
+        stored = pdf_outline.heading_index(os.path.join(self.tmp.name, ".build-cache"), html)
+        self.assertEqual(stored, pdf_outline.extract_headings(html))
+        self.assertEqual([(h["level"], h["id"]) for h in stored], [(1, "spec"), (2, "intro")])
+
+    def test_css_bundle_is_linked_in_place_of_the_stylesheets(self):
+        styles = os.path.join(os.path.dirname(self.md_file), "styles")
+        os.makedirs(styles)
+        Path(styles, "styles.css").write_text("h2 { color: blue } .unused, h1big { margin: 0 }", encoding="utf-8")
+        cache = AssetCache(os.path.join(self.tmp.name, ".asset-cache"), offline=True)
+
+        def convert():
+            converter = MarkdownToHtmlConverter(self.md_file, self.output_file, self.tmp.name,
+                                                os.path.dirname(self.md_file), asset_cache=cache, css_bundle=True)
+            with patch.object(converter, "_run_pandoc", return_value=PANDOC_HTML):
+                return converter.convert()
+
+        self.assertTrue(convert())
+        soup = BeautifulSoup(Path(self.output_file).read_text(encoding="utf-8"), "html.parser")
+        self.assertEqual([link["href"] for link in soup.find_all("link")], ["styles/spec.bundle.css"])
+        self.assertEqual(Path(styles, "spec.bundle.css").read_text(encoding="utf-8"), "h2{color:blue}h1big{margin:0}")
+        self.assertFalse(convert())
+        # The bundle is built from the stylesheet's content, so editing it is a change.
+        Path(styles, "styles.css").write_text("h2 { color: red }", encoding="utf-8")
+        self.assertTrue(convert())
+        self.assertEqual(Path(styles, "spec.bundle.css").read_text(encoding="utf-8"), "h2{color:red}")
+
+    def test_canonical_output_is_not_rewritten_when_unchanged(self):
+        cache = AssetCache(os.path.join(self.tmp.name, ".asset-cache"), offline=True)
+        reordered = PANDOC_HTML.replace('<link rel="stylesheet" href="styles/styles.css" />',
+                                        '<link href="styles/styles.css" rel="stylesheet"/>\r\n  ')
+        digests = []
+        for n, pandoc_html in enumerate((PANDOC_HTML, reordered)):
+            converter = MarkdownToHtmlConverter(self.md_file, self.output_file, self.tmp.name,
+                                                os.path.dirname(self.md_file), asset_cache=cache, canonical=True)
+            with patch.object(converter, "_run_pandoc", return_value=pandoc_html):
+                self.assertTrue(converter.convert(force=True))
+            if n == 0:
+                os.utime(self.output_file, (1700000000, 1700000000))
+            digests.append(converter.content_digest)
+        self.assertEqual(digests[0], digests[1])
+        self.assertEqual(os.stat(self.output_file).st_mtime, 1700000000)
+        self.assertEqual(digests[0], hashlib.sha256(Path(self.output_file).read_bytes()).hexdigest())
+
+        converter = MarkdownToHtmlConverter(self.md_file, self.output_file, self.tmp.name,
+                                            os.path.dirname(self.md_file), asset_cache=cache, canonical=True)
+        self.assertFalse(converter.convert())
+        self.assertEqual(converter.content_digest, digests[0])
+
+    def test_environment_setting_is_a_per_converter_default(self):
+        cache = AssetCache(os.path.join(self.tmp.name, ".asset-cache"), offline=True)
+        with patch.dict(os.environ, {"HTML_LOCALIZE_CSS": "true"}):
+            from_env = MarkdownToHtmlConverter(self.md_file, self.output_file, asset_cache=cache)
+            explicit = MarkdownToHtmlConverter(self.md_file, self.output_file, asset_cache=cache, localize_css=False)
+        self.assertTrue(from_env.localize_css)
+        self.assertFalse(explicit.localize_css)
+        self.assertFalse(explicit._build_inputs()["localize_css"])
+
+
+@unittest.skipUnless(shutil.which("pandoc"), "pandoc is not installed")
+class TestRender(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def _converter(self, stage: str) -> MarkdownToHtmlConverter:
+        md_dir = os.path.join(self.tmp.name, stage)
+        os.makedirs(md_dir)
+        md_file = os.path.join(md_dir, "spec.md")
+        Path(md_file).write_text(f"# Spec {stage}\n\n- [Intro](#intro)\n\n## Intro\n\n{stage} text\n", encoding="utf-8")
+        return MarkdownToHtmlConverter(md_file, os.path.join(md_dir, "spec.html"), self.tmp.name, md_dir,
+                                       asset_cache=AssetCache(os.path.join(self.tmp.name, ".asset-cache"), offline=True),
+                                       localize_css=False)
+
+    def test_concurrent_renders_stay_in_memory(self):
+        converters = [self._converter(f"cs0{n}") for n in range(1, 7)]
+        sources = [Path(c.md_file).read_text(encoding="utf-8") for c in converters]
+        with ThreadPoolExecutor(max_workers=6) as pool:
+            pages = list(pool.map(lambda c: c.render(), converters))
+        for n, page in enumerate(pages, start=1):
+            self.assertIn(f"<title>Spec cs0{n}</title>", page)
+            self.assertIn(f"cs0{n} text", page)
+            self.assertIn("Table of Contents", page)
+        self.assertEqual([Path(c.md_file).read_text(encoding="utf-8") for c in converters], sources)
+        self.assertFalse(os.path.exists("temp_output.html"))
+        self.assertFalse(any(os.path.exists(c.output_file) for c in converters))
+
+
+class _SlowAssetHandler(BaseHTTPRequestHandler):
+    """
+    Serves every path after DELAY seconds; paths containing 'missing' return 404.
+
+    The body is the path prefixed with VERSION; its ETag answers If-None-Match with 304.
+    """
+
+    DELAY = 0.4
+    VERSION = ""
+    hits: Counter = Counter()
+    not_modified: Counter = Counter()
+
+    def do_GET(self):
+        type(self).hits[self.path] += 1
+        time.sleep(self.DELAY)
+        if "missing" in self.path:
+            self.send_error(404)
+            return
+        body = (self.VERSION + self.path).encode()
+        etag = '"%d"' % hash(body)
+        if self.headers.get("If-None-Match") == etag:
+            type(self).not_modified[self.path] += 1
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestAssetLocalization(unittest.TestCase):
+
+    def setUp(self):
+        _SlowAssetHandler.hits = Counter()
+        _SlowAssetHandler.not_modified = Counter()
+        _SlowAssetHandler.VERSION = ""
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _SlowAssetHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.tmp.name, ".asset-cache")
+        self.converter = self._converter("cs01")
+
+    def _converter(self, stage: str, offline: bool = False) -> MarkdownToHtmlConverter:
+        md_dir = os.path.join(self.tmp.name, stage)
+        os.makedirs(md_dir, exist_ok=True)
+        md_file = os.path.join(md_dir, "spec.md")
+        Path(md_file).write_text("# Spec\n", encoding="utf-8")
+        return MarkdownToHtmlConverter(
+            md_file, os.path.join(md_dir, "spec.html"), asset_cache=AssetCache(self.cache_dir, offline=offline)
+        )
+
+    def _localize(self, converter: MarkdownToHtmlConverter, html: str) -> BeautifulSoup:
+        soup = BeautifulSoup(html, "html.parser")
+        converter._localize_assets(soup.find_all("link"), soup.find_all("img"))
+        return soup
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp.cleanup()
+
+    def test_downloads_run_concurrently_and_keep_failure_rules(self):
+        html = (
+            f'<html><head><link rel="stylesheet" href="{self.base}/a.css"/>'
+            f'<link rel="stylesheet" href="{self.base}/missing.css"/></head><body>'
+            f'<p><img src="{self.base}/one.png"/><img src="{self.base}/two.png"/>'
+            f'<img src="{self.base}/one.png"/><img src="{self.base}/three.png"/>'
+            f'<img src="{self.base}/missing.png"/></p></body></html>'
+        )
+        soup = BeautifulSoup(html, "html.parser")
+        start = time.perf_counter()
+        self.converter._localize_assets(soup.find_all("link"), soup.find_all("img"))
+        elapsed = time.perf_counter() - start
+
+        # Six distinct URLs at DELAY each: about one DELAY in parallel, not six.
+        self.assertLess(elapsed, 3 * _SlowAssetHandler.DELAY)
+        self.assertEqual(_SlowAssetHandler.hits["/one.png"], 1)
+        self.assertEqual(len(_SlowAssetHandler.hits), 6)
+        self.assertEqual([link["href"] for link in soup.find_all("link")],
+                         [os.path.join("styles", "a.css"), f"{self.base}/missing.css"])
+        self.assertEqual([img["src"] for img in soup.find_all("img")],
+                         [os.path.join("images", name) for name in ("one.png", "two.png", "one.png", "three.png")])
+        self.assertEqual(Path(self.converter.images_dir, "two.png").read_bytes(), b"/two.png")
+
+    def test_cache_is_shared_across_stages_and_revalidated(self):
+        html = f'<p><img src="{self.base}/logo.png"/></p>'
+        self._localize(self.converter, html)
+        os.remove(Path(self.converter.images_dir, "logo.png"))
+        Path(self.converter.images_dir, "logo.png").write_bytes(b"stale")
+
+        cs02 = self._converter("cs02")
+        self._localize(cs02, html)
+        self._localize(self.converter, html)
+        self.assertEqual(_SlowAssetHandler.hits["/logo.png"], 3)
+        self.assertEqual(_SlowAssetHandler.not_modified["/logo.png"], 2)
+        self.assertEqual(Path(self.converter.images_dir, "logo.png").read_bytes(), b"/logo.png")
+        self.assertTrue(os.path.samefile(Path(self.converter.images_dir, "logo.png"),
+                                         Path(cs02.images_dir, "logo.png")))
+
+        _SlowAssetHandler.VERSION = "v2"
+        self._localize(cs02, html)
+        self.assertEqual(Path(cs02.images_dir, "logo.png").read_bytes(), b"v2/logo.png")
+
+    def test_modified_hardlink_does_not_poison_the_cache(self):
+        html = f'<p><img src="{self.base}/logo.png"/></p>'
+        self._localize(self.converter, html)
+        Path(self.converter.images_dir, "logo.png").write_bytes(b"edited in place")
+        cs02 = self._converter("cs02")
+        self._localize(cs02, html)
+        self.assertEqual(Path(cs02.images_dir, "logo.png").read_bytes(), b"/logo.png")
+        self.assertEqual(_SlowAssetHandler.not_modified["/logo.png"], 0)
+
+    def test_same_file_name_from_different_urls_does_not_collide(self):
+        soup = self._localize(self.converter, f'<img src="{self.base}/a/logo.png"/><img src="{self.base}/b/logo.png"/>')
+        first, second = [img["src"] for img in soup.find_all("img")]
+        self.assertEqual(first, os.path.join("images", "logo.png"))
+        self.assertRegex(second, r"^images/logo-[0-9a-f]{8}\.png$")
+        self.assertEqual(Path(self.converter.images_dir, "logo.png").read_bytes(), b"/a/logo.png")
+        self.assertEqual(Path(self.converter.images_dir, os.path.basename(second)).read_bytes(), b"/b/logo.png")
+
+    def test_offline_mode_serves_only_cached_assets(self):
+        self._localize(self.converter, f'<img src="{self.base}/one.png"/>')
+        _SlowAssetHandler.hits.clear()
+        soup = self._localize(self._converter("os", offline=True),
+                              f'<img src="{self.base}/one.png"/><img src="{self.base}/two.png"/>')
+        self.assertEqual(len(_SlowAssetHandler.hits), 0)
+        self.assertEqual([img["src"] for img in soup.find_all("img")], [os.path.join("images", "one.png")])
+
+    def test_evict_drops_least_recently_used_blobs(self):
+        cache = AssetCache(self.cache_dir, max_bytes=len(b"/one.png") + len(b"/three.png"))
+        self._localize(self._converter("cs01"), f'<img src="{self.base}/one.png"/><img src="{self.base}/two.png"/>')
+        time.sleep(0.01)
+        self._localize(self._converter("cs02"), f'<img src="{self.base}/one.png"/>')
+        self._localize(self._converter("cs03"), f'<img src="{self.base}/three.png"/>')
+        cache.evict()
+        cache.offline = True
+        with requests.Session() as session:
+            self.assertIsNotNone(cache.get(f"{self.base}/one.png", session))
+            self.assertIsNone(cache.get(f"{self.base}/two.png", session))
+            self.assertIsNotNone(cache.get(f"{self.base}/three.png", session))
+
+
+if __name__ == "__main__":
+    unittest.main()
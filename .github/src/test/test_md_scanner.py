@@ -0,0 +1,52 @@
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from md_scanner import scan_markdown, with_toc_title  # noqa: E402
+
+
+class TestMarkdownScanner(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _scan(self, text: str):
+        path = os.path.join(self.tmp.name, "spec.md")
+        Path(path).write_bytes(text.encode("utf-8"))
+        return scan_markdown(path)
+
+    def test_fields_match_the_line_by_line_rules(self):
+        scan = self._scan("intro\n<!-- Description: unterminated\n# Spec Title #\n"
+                          "<!-- DESCRIPTION: From comment -->\n\n- [One](#one)\n- [Two](#two)\n"
+                          "```\n# not a heading\n```\n## One\n")
+        self.assertEqual(scan.description, "From comment")
+        self.assertEqual(scan.title, "Spec Title #")
+        self.assertEqual(scan.toc_line, 5)
+        self.assertTrue(scan.needs_toc_title)
+        self.assertIsNone(scan._headings)
+        self.assertEqual(scan.headings, [(2, 1, "Spec Title"), (10, 2, "One")])
+
+        scan = self._scan("# A\r\n\n## One ##\n~~~~\n# x\n```\n~~~~\n####### seven\n#tag\n###\n")
+        self.assertEqual(scan.headings, [(0, 1, "A"), (2, 2, "One"), (9, 3, "")])
+
+        scan = self._scan("description: 'yaml style'\n")
+        self.assertEqual((scan.description, scan.title, scan.toc_line), ("yaml style", None, None))
+        self.assertIsNone(self._scan("").title)
+        self.assertEqual(self._scan("").headings, [])
+
+    def test_toc_title_is_inserted_once_before_the_first_entry(self):
+        text = b"# Spec\n\n- [One](#one)\n"
+        updated = with_toc_title(text)
+        self.assertEqual(updated, b"# Spec\n\n\n# Table of Contents\n- [One](#one)\n")
+        self.assertIsNone(with_toc_title(updated))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from bs4 import BeautifulSoup  # noqa: E402
+
+from asset_cache import AssetCache  # noqa: E402
+from step_1_markdown_to_html_converter_V3_0 import MarkdownToHtmlConverter  # noqa: E402
+
+
+AST_MD = """![OASIS Logo](https://example.org/OASISLogo-v3.0.png)
+
+---
+
+# Spec Title
+
+- [Intro](#intro)
+- [Details](spec.html#details)
+
+# <a id='intro'></a>Intro
+
+See https://docs.oasis-open.org/csaf/csaf/v2.1/csaf-v2.1.html for the text, [details](spec.html#details)
+and <a href="#intro">the intro</a>.
+
+![diagram](images/diagram.png)
+
+## <a id="details"></a>Details {#details}
+
+Last paragraph.
+"""
+
+
+@unittest.skipUnless(shutil.which("pandoc"), "pandoc is not installed")
+class TestAstPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.md_file = os.path.join(self.tmp.name, "spec.md")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _facts(self, markdown: str, ast_pipeline: bool) -> dict:
+        Path(self.md_file).write_text(markdown, encoding="utf-8")
+        converter = MarkdownToHtmlConverter(
+            self.md_file, os.path.join(self.tmp.name, "spec.html"), self.tmp.name, self.tmp.name,
+            asset_cache=AssetCache(os.path.join(self.tmp.name, ".asset-cache"), offline=True),
+            localize_css=False, ast_pipeline=ast_pipeline,
+        )
+        soup = BeautifulSoup(converter.render(), "html.parser")
+        return {
+            "title": soup.title.get_text(),
+            "headings": [(h.name, h.get("id"), h.get_text()) for h in soup.find_all(["h1big", "h1", "h2"])],
+            "links": [(a.get("href"), a.get_text()) for a in soup.find_all("a") if a.has_attr("href")],
+            "images": [img.get("src") for img in soup.find_all("img")],
+            "anchors": len(soup.select("h1 a[id], h2 a[id]")),
+            "nav": len(soup.find_all(["nav", "header"])),
+            "rules": [hr.get("style") for hr in soup.find_all("hr")],
+        }
+
+    def test_ast_fixes_match_the_beautifulsoup_pipeline(self):
+        expected = self._facts(AST_MD, ast_pipeline=False)
+        actual = self._facts(AST_MD, ast_pipeline=True)
+        self.assertEqual(actual, expected)
+        self.assertEqual(actual["anchors"], 0)
+        self.assertIn(("#details", "details"), actual["links"])
+        self.assertEqual(actual["headings"][0][0], "h1big")
+
+    def test_long_titles_are_not_wrapped(self):
+        title = "Common Security Advisory Framework Version 2.0 Errata 01 Plus Several More Words"
+        markdown = AST_MD.replace("# Spec Title", "# " + title)
+        actual = self._facts(markdown, ast_pipeline=True)
+        self.assertEqual(actual["title"], title)
+        self.assertEqual(actual, self._facts(markdown, ast_pipeline=False))
+
+    def test_unsupported_raw_html_falls_back(self):
+        markdown = AST_MD.replace("Last paragraph.", "<p>Raw https://example.org paragraph</p>")
+        with self.assertLogs("step_1_markdown_to_html_converter_V3_0", level="INFO") as logs:
+            actual = self._facts(markdown, ast_pipeline=True)
+        self.assertTrue(any("AST pipeline not applicable" in line for line in logs.output))
+        self.assertEqual(actual, self._facts(markdown, ast_pipeline=False))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from pandoc_shards import ShardedPandoc, ShardingError  # noqa: E402
+
+
+SHARDED_MD = """---
+title: Spec
+---
+
+# Introduction
+
+Intro text with a note[^a] and a [link][ref].
+
+## Terminology
+
+See [Terminology] and [the second section](#overview).
+
+```json
+{"document": {}}
+```
+
+[^a]: First note.
+
+# Overview
+
+Repeated note[^a], another[^b] and ^[an inline note].
+
+## Terminology
+
+```python
+print("hello")
+```
+
+[ref]: https://docs.oasis-open.org/csaf "CSAF"
+
+# Appendix
+
+Last section[^b].
+
+[^b]: Second note
+    with a continuation line.
+"""
+
+
+@unittest.skipUnless(shutil.which("pandoc"), "pandoc is not installed")
+class TestShardedPandoc(unittest.TestCase):
+
+    ARGS = ["-c", "styles/styles.css", "-s", "--metadata", "title=Spec", "--toc"]
+    READER = "markdown+autolink_bare_uris+hard_line_breaks"
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.tmp.name, "pandoc")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _monolithic(self, markdown: str) -> str:
+        return subprocess.run(["pandoc", "-f", self.READER, "-t", "html"] + self.ARGS,
+                              input=markdown, capture_output=True, text=True, check=True).stdout
+
+    def _sharded(self) -> ShardedPandoc:
+        return ShardedPandoc(self.READER, self.ARGS, cache_dir=self.cache_dir, workers=2)
+
+    def test_output_matches_a_single_pandoc_run(self):
+        self.assertEqual(self._sharded().convert(SHARDED_MD), self._monolithic(SHARDED_MD))
+
+    def test_editing_one_section_renders_only_that_shard(self):
+        self._sharded().convert(SHARDED_MD)
+        edited = SHARDED_MD.replace("Last section", "Final section")
+        sharded = self._sharded()
+        self.assertEqual(sharded.convert(edited), self._monolithic(edited))
+        # Only the edited shard; the headings, other shards and page template are cached.
+        self.assertEqual(sharded.stats["rendered"], 1)
+
+    def test_single_section_documents_are_not_sharded(self):
+        with self.assertRaises(ShardingError):
+            self._sharded().convert("# Only\n\ntext\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
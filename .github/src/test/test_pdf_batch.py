@@ -0,0 +1,82 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import pdf_batch  # noqa: E402
+
+
+class TestPdfBatch(unittest.TestCase):
+    # wkhtmltopdf stand-in that logs when it starts and ends, and hangs on pages saying SLEEP.
+    FAKE_WKHTMLTOPDF = (
+        "#!%s\n"
+        "import os, sys, time\n"
+        "html = sys.stdin.read()\n"
+        "log = lambda event: open(os.environ['FAKE_LOG'], 'a').write(event + ' ' + sys.argv[-1] + '\\n')\n"
+        "log('start')\n"
+        "time.sleep(30 if 'SLEEP' in html else 0.2)\n"
+        "open(sys.argv[-1], 'w', encoding='utf-8').write(html)\n"
+        "log('end')\n"
+    )
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        bin_dir = self.root / "bin"
+        bin_dir.mkdir()
+        fake = bin_dir / "wkhtmltopdf"
+        fake.write_text(self.FAKE_WKHTMLTOPDF % sys.executable, encoding="utf-8")
+        fake.chmod(0o755)
+        self.log = self.root / "render.log"
+        self.env = patch.dict(os.environ, {"PATH": "%s%s%s" % (bin_dir, os.pathsep, os.environ["PATH"]),
+                                           "FAKE_LOG": str(self.log)})
+        self.env.start()
+        self.options = {"workers": 1, "preload_resources": False, "outline_levels": 0,
+                        "build_cache_dir": str(self.root / "build-cache"), "asset_cache_dir": str(self.root / "assets")}
+        self.pages = self.root / "pages"
+        for stage, size in (("cs01", 10), ("csd01", 3000), ("os", 200)):
+            (self.pages / stage).mkdir(parents=True)
+            (self.pages / stage / ("spec-%s.html" % stage)).write_text(
+                "<html><body><p>%s</p></body></html>" % ("x" * size), encoding="utf-8")
+        (self.pages / "os" / "spec-os-public-review-metadata.html").write_text("<p>meta</p>", encoding="utf-8")
+
+    def tearDown(self):
+        self.env.stop()
+        self.tmp.cleanup()
+
+    def test_pages_are_found_below_directories(self):
+        pages = [os.path.relpath(p, self.pages) for p in pdf_batch.discover_html([str(self.pages)])]
+        self.assertEqual(pages, ["cs01/spec-cs01.html", "csd01/spec-csd01.html", "os/spec-os.html"])
+
+    def test_largest_pages_start_first_within_the_memory_budget(self):
+        pages = pdf_batch.discover_html([str(self.pages)])
+        # The budget holds a single job, so the renders cannot overlap.
+        results = pdf_batch.run_pdf_batch(pages, self.options, max_jobs=3,
+                                          memory_budget=pdf_batch.estimate_memory(5000))
+        self.assertEqual([r["status"] for r in results], ["ok", "ok", "ok"])
+        self.assertEqual([r["name"] for r in results], pages)
+        events = [line.split()[0] + " " + Path(line.split()[1]).stem for line in self.log.read_text().splitlines()]
+        self.assertEqual(events, ["start spec-csd01", "end spec-csd01", "start spec-os", "end spec-os",
+                                  "start spec-cs01", "end spec-cs01"])
+        self.assertTrue(all(r["pdf_bytes"] > 0 for r in results))
+        summary = pdf_batch.format_summary(results, 1.0)
+        self.assertIn("3 documents, 0 failed", summary)
+
+    def test_jobs_past_the_timeout_are_killed(self):
+        slow = self.pages / "cs01" / "spec-cs01.html"
+        slow.write_text("<html><body><p>SLEEP</p></body></html>", encoding="utf-8")
+        started = time.perf_counter()
+        results = pdf_batch.run_pdf_batch([str(slow), str(self.pages / "os" / "spec-os.html"),
+                                           str(self.pages / "missing.html")], self.options, max_jobs=2, timeout=2)
+        self.assertLess(time.perf_counter() - started, 20)
+        self.assertEqual([r["status"] for r in results], ["timeout", "ok", "failed"])
+        self.assertFalse(os.path.exists(self.pages / "cs01" / "spec-cs01.pdf"))
+
+
+if __name__ == "__main__":
+    unittest.main()
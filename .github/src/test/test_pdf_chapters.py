@@ -0,0 +1,114 @@
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from bs4 import BeautifulSoup  # noqa: E402
+
+import fake_wkhtmltopdf  # noqa: E402
+import pdf_chapters  # noqa: E402
+import pdf_outline  # noqa: E402
+
+
+class TestPdfChapters(unittest.TestCase):
+    PAGE = (
+        '<!DOCTYPE html>\n<html lang="en"><head><title>T</title></head><body>'
+        '<p><img src="logo.png"/></p><nav id="TOC"><a href="#two">Two</a></nav>'
+        '<hr/><h1 id="one">One</h1><p>' + "a" * 400 + ' <a href="#three">to three</a> <a href="#one">self</a></p>'
+        '<hr/><h1 id="two">Two</h1><p>' + "b" * 400 + '</p>'
+        '<hr/><hr/><h1 id="three">Three</h1><p id="para">' + "c" * 400 + ' <a href="#one">back</a></p>'
+        '</body></html>\n'
+    )
+
+    def test_partition_keeps_order_and_balances_sizes(self):
+        self.assertEqual(pdf_chapters._partition([5, 5, 5, 5], 2), [(0, 2), (2, 4)])
+        self.assertEqual(pdf_chapters._partition([9, 1, 1, 1], 3), [(0, 1), (1, 2), (2, 4)])
+        self.assertEqual(pdf_chapters._partition([1, 1], 4), [(0, 1), (1, 2)])
+
+    def test_split_rewrites_only_cross_part_links(self):
+        parts = pdf_chapters.split_document(self.PAGE, 3)
+        self.assertEqual(len(parts), 3)
+        soups = [BeautifulSoup(part, "html.parser") for part in parts]
+        for soup in soups:
+            self.assertEqual(soup.title.get_text(), "T")
+            self.assertEqual(soup.html["lang"], "en")
+        # Front matter (logo, TOC) stays with the first chapter.
+        self.assertIsNotNone(soups[0].find("nav"))
+        self.assertEqual([h["id"] for soup in soups for h in soup.find_all("h1")], ["one", "two", "three"])
+        hrefs = [a["href"] for a in soups[0].find_all("a", href=True) if a.get("style") is None]
+        self.assertEqual(hrefs, [pdf_chapters.XREF_URL + "two", pdf_chapters.XREF_URL + "three", "#one"])
+        self.assertEqual(soups[2].find("a", href=pdf_chapters.XREF_URL + "one").get_text(), "back")
+        anchors = {a["href"] for soup in soups for a in soup.find_all("a", style=True)}
+        self.assertEqual(anchors, {pdf_outline.ANCHOR_URL + name for name in ("one", "two", "three")})
+        self.assertIsNotNone(soups[1].find("h1", id="two").find("a", href=pdf_outline.ANCHOR_URL + "two"))
+
+    def test_chapters_start_at_page_breaks_only(self):
+        # "Two" has no <hr> before it: it continues the page of "One" and stays in its part.
+        page = self.PAGE.replace('<hr/><h1 id="two">', '<h1 id="two">')
+        parts = pdf_chapters.split_document(page, None)
+        self.assertEqual([[h["id"] for h in BeautifulSoup(part, "html.parser").find_all("h1")] for part in parts],
+                         [["one", "two"], ["three"]])
+        # A run of page breaks starts one part.
+        self.assertEqual(BeautifulSoup(parts[1], "html.parser").body.decode_contents().count("<hr/>"), 2)
+
+    def test_pages_without_chapters_are_not_split(self):
+        page = "<html><head></head><body><h1>Only</h1><p>text</p><h1>Other</h1></body></html>"
+        self.assertEqual(pdf_chapters.split_document(page, 4), [page])
+        self.assertEqual(pdf_chapters.split_document(self.PAGE, 1), [self.PAGE])
+
+    @unittest.skipUnless(pdf_chapters.available(), "pypdf is not installed")
+    def test_merged_parts_get_continuous_footers_and_internal_links(self):
+        from pypdf import PdfReader
+
+        # The second chapter runs over two pages.
+        page = self.PAGE.replace("<p>" + "b" * 400 + "</p>", "<p>b</p>" * 40)
+        headings = pdf_outline.extract_headings(page)
+        parts = pdf_chapters.split_document(page, 3)
+        with tempfile.TemporaryDirectory() as tmp:
+            pdfs = [os.path.join(tmp, "part%d.pdf" % n) for n in range(len(parts))]
+            for part, pdf in zip(parts, pdfs):
+                fake_wkhtmltopdf.write_pdf(fake_wkhtmltopdf.layout(part), "", pdf)
+            # Front matter and the second <hr> each end a page, as in a render of the whole page.
+            self.assertEqual([pdf_chapters.page_count(pdf) for pdf in pdfs], [2, 2, 2])
+            self.assertEqual(len(fake_wkhtmltopdf.layout(page)), 6)
+            stamp_pdf = os.path.join(tmp, "page-numbers.pdf")
+            fake_wkhtmltopdf.write_pdf(fake_wkhtmltopdf.layout(pdf_chapters.stamp_document(6)),
+                                       "Page [page] of [topage]", stamp_pdf)
+            output = os.path.join(tmp, "merged.pdf")
+            report = pdf_chapters.merge_parts(pdfs, stamp_pdf, output, headings, info={"/Title": "T"})
+            self.assertEqual(report, {"pages": 6, "links": 3, "unresolved": 0, "bookmarks": 3})
+
+            reader = PdfReader(output)
+            self.assertEqual(reader.metadata.title, "T")
+            texts = [p.extract_text() for p in reader.pages]
+            for number, text in enumerate(texts, 1):
+                self.assertIn("Page %d of 6" % number, text)
+            self.assertIn("Three", texts[5])
+            self.assertEqual([(item.title, reader.get_destination_page_number(item)) for item in reader.outline],
+                             [("One", 1), ("Two", 2), ("Three", 5)])
+            # TOC -> two, one -> three and three -> one are GoTo links now; no marker URL is left.
+            gotos, uris = [], []
+            for number, p in enumerate(reader.pages):
+                for annot in (a.get_object() for a in p.get("/Annots", [])):
+                    if "/Dest" in annot:
+                        gotos.append((number, reader.get_page_number(annot["/Dest"][0].get_object())))
+                    else:
+                        uris.append(annot["/A"]["/URI"])
+            self.assertEqual(sorted(gotos), [(0, 2), (1, 1), (1, 5), (5, 1)])
+            self.assertFalse([uri for uri in uris if uri.startswith((pdf_chapters.XREF_URL, pdf_outline.ANCHOR_URL))])
+
+    @unittest.skipUnless(pdf_chapters.available(), "pypdf is not installed")
+    def test_footer_pages_must_match_the_merged_pages(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            part, stamp_pdf = os.path.join(tmp, "part.pdf"), os.path.join(tmp, "page-numbers.pdf")
+            fake_wkhtmltopdf.write_pdf(fake_wkhtmltopdf.layout(self.PAGE), "", part)
+            fake_wkhtmltopdf.write_pdf(fake_wkhtmltopdf.layout(pdf_chapters.stamp_document(2)), "[page]", stamp_pdf)
+            with self.assertRaises(pdf_chapters.ChapterError):
+                pdf_chapters.merge_parts([part], stamp_pdf, os.path.join(tmp, "merged.pdf"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import pdf_chapters  # noqa: E402
+import pdf_optimize  # noqa: E402
+
+
+class TestPdfOptimize(unittest.TestCase):
+    A4 = (595.0, 842.0)
+
+    def test_images_keep_the_target_resolution_at_full_page_size(self):
+        # 2480 px across A4 is 300 dpi when the image spans the page.
+        self.assertAlmostEqual(pdf_optimize.scale_factor((2480, 100), self.A4, 150), 0.5, places=2)
+        # Tall images are bounded by the page height instead.
+        self.assertAlmostEqual(pdf_optimize.scale_factor((100, 3508), self.A4, 150), 0.5, places=2)
+        self.assertEqual(pdf_optimize.scale_factor((800, 600), self.A4, 150), 1.0)
+
+    @unittest.skipUnless(pdf_chapters.available(), "pypdf is not installed")
+    def test_identical_images_are_stored_once(self):
+        from pypdf import PdfReader, PdfWriter
+        from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject, NumberObject
+
+        writer = PdfWriter()
+        for _ in range(2):
+            page = writer.add_blank_page(*self.A4)
+            image = DecodedStreamObject()
+            image.set_data(bytes(range(256)) * 48)
+            image.update({NameObject("/Type"): NameObject("/XObject"), NameObject("/Subtype"): NameObject("/Image"),
+                          NameObject("/Width"): NumberObject(64), NameObject("/Height"): NumberObject(64),
+                          NameObject("/ColorSpace"): NameObject("/DeviceRGB"),
+                          NameObject("/BitsPerComponent"): NumberObject(8)})
+            page[NameObject("/Resources")] = DictionaryObject({NameObject("/XObject"): DictionaryObject(
+                {NameObject("/Im0"): writer._add_object(image)})})
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "doc.pdf")
+            with open(path, "wb") as f:
+                writer.write(f)
+            report = pdf_optimize.optimize_pdf(path)
+            self.assertEqual(report["duplicates"], 1)
+            self.assertLess(report["after"], report["before"])
+            self.assertEqual(os.path.getsize(path), report["after"])
+            pages = PdfReader(path).pages
+            self.assertEqual(pages[0]["/Resources"]["/XObject"].raw_get("/Im0"),
+                             pages[1]["/Resources"]["/XObject"].raw_get("/Im0"))
+
+    def test_report_lists_each_file_and_the_total(self):
+        reports = [{"file": name, "before": 2000, "after": 1500, "images": 1, "duplicates": 2}
+                   for name in ("a.pdf", "b.pdf")]
+        lines = pdf_optimize.format_report(reports).splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertIn("25.0%", lines[1])
+        self.assertTrue(lines[3].endswith("total (2 files)"))
+        self.assertIn("3,000", lines[3])
+
+
+if __name__ == "__main__":
+    unittest.main()
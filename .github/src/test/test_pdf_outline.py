@@ -0,0 +1,65 @@
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from bs4 import BeautifulSoup  # noqa: E402
+
+import fake_wkhtmltopdf  # noqa: E402
+import pdf_chapters  # noqa: E402
+import pdf_outline  # noqa: E402
+
+
+class TestPdfOutline(unittest.TestCase):
+    PAGE = ('<html><body><h1big id="doc">The <em>Spec</em></h1big><h2 id="cover">Draft</h2>'
+            '<h1 id="one">1 One</h1><h2 id="one-a">1.1 A &amp; B</h2><h3>no id</h3>'
+            '<h4 id="deep">1.1.1.1 Deep</h4></body></html>')
+
+    def test_index_lists_headings_with_ids_in_order(self):
+        headings = pdf_outline.extract_headings(self.PAGE)
+        self.assertEqual([(h["order"], h["level"], h["id"]) for h in headings],
+                         [(0, 1, "doc"), (1, 2, "cover"), (2, 1, "one"), (3, 2, "one-a"), (4, 4, "deep")])
+        self.assertEqual([h["title"] for h in headings], ["The Spec", "Draft", "1 One", "1.1 A & B", "1.1.1.1 Deep"])
+
+    def test_headings_get_one_named_anchor_each(self):
+        soup = BeautifulSoup(self.PAGE, "html.parser")
+        headings = [h for h in pdf_outline.extract_headings(self.PAGE) if h["level"] <= 3]
+        self.assertEqual(pdf_outline.mark_headings(soup, headings), 4)
+        self.assertEqual(pdf_outline.mark_headings(soup, headings), 4)
+        markers = [a["href"] for a in soup.find_all("a")]
+        self.assertEqual(markers, [pdf_outline.ANCHOR_URL + name for name in ("doc", "cover", "one", "one-a")])
+        self.assertEqual(soup.find("h1")["id"], "one")
+
+    @unittest.skipUnless(pdf_chapters.available(), "pypdf is not installed")
+    def test_headings_without_anchors_are_placed_at_their_named_destinations(self):
+        from pypdf import PdfReader
+
+        parts = ['<html><body><h1 id="one">1 One</h1>' + '<p>x</p>' * 40 + '<h2 id="one-a">1.1 A</h2></body></html>',
+                 '<html><body><h1 id="two">2 Two</h1><h2 id="two-a">2.1 A</h2></body></html>']
+        headings = [h for part in parts for h in pdf_outline.extract_headings(part)]
+        for order, heading in enumerate(headings):
+            heading["order"] = order
+        with tempfile.TemporaryDirectory() as tmp:
+            pdfs = [os.path.join(tmp, "part%d.pdf" % n) for n in range(len(parts))]
+            for part, pdf in zip(parts, pdfs):
+                fake_wkhtmltopdf.write_pdf(fake_wkhtmltopdf.layout(part), "", pdf)
+            reader = PdfReader(pdfs[0])
+            self.assertEqual(pdf_outline.named_destinations(reader),
+                             {"one": (0, 72.0, 800.0), "one-a": (1, 72.0, 700.0)})
+
+            output = os.path.join(tmp, "merged.pdf")
+            report = pdf_chapters.merge_parts(pdfs, None, output, headings)
+            self.assertEqual(report["bookmarks"], 4)
+            reader = PdfReader(output)
+            one, one_children, two, two_children = reader.outline
+            self.assertEqual([(item.title, reader.get_destination_page_number(item))
+                              for item in (one, one_children[0], two, two_children[0])],
+                             [("1 One", 0), ("1.1 A", 1), ("2 Two", 2), ("2.1 A", 2)])
+            self.assertEqual((float(two_children[0].left), float(two_children[0].top)), (72.0, 780.0))
+
+
+if __name__ == "__main__":
+    unittest.main()
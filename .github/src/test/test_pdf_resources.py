@@ -0,0 +1,113 @@
+import os
+import re
+import sys
+import tempfile
+import threading
+import unittest
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest.mock import patch
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from bs4 import BeautifulSoup  # noqa: E402
+
+from asset_cache import AssetCache  # noqa: E402
+from pdf_resources import ResourcePreloader  # noqa: E402
+from step_2_convert_html_to_pdf import PDFConverter  # noqa: E402
+
+
+class _StylesheetHandler(BaseHTTPRequestHandler):
+    """Serves BODIES by path; anything else is a 404."""
+
+    BODIES = {
+        "/css/main.css": b'@charset "utf-8";\n@import url("print.css") print;\n'
+                         b'body { background: url(../img/bg.png); }\n.x { background: url("missing.png"); }\n',
+        "/css/print.css": b"@font-face { src: url('fonts/mono.woff'); }\n",
+        "/img/bg.png": b"bg",
+        "/css/fonts/mono.woff": b"woff",
+        "/logo.png": b"logo",
+    }
+    hits: Counter = Counter()
+
+    def do_GET(self):
+        type(self).hits[self.path] += 1
+        body = self.BODIES.get(self.path)
+        if body is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestPdfResourcePreloader(unittest.TestCase):
+
+    def setUp(self):
+        _StylesheetHandler.hits = Counter()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _StylesheetHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.remote = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmp.name, "csd01")
+        Path(self.dir, "images").mkdir(parents=True)
+        Path(self.dir, "images", "local.png").write_bytes(b"local")
+        self.cache_dir = os.path.join(self.tmp.name, ".asset-cache")
+        self.page = (f'<html><head><link rel="stylesheet" href="{self.remote}/css/main.css" /></head><body>'
+                     f'<img src="{self.remote}/logo.png"/><img src="images/local.png"/><img src="images/gone.png"/>'
+                     '<p style="background: url(images/local.png)">x</p></body></html>')
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp.cleanup()
+
+    def _preload(self, offline: bool = False) -> tuple:
+        soup = BeautifulSoup(self.page, "html.parser")
+        preloader = ResourcePreloader(AssetCache(self.cache_dir, offline=offline), self.dir.as_uri() + "/")
+        preloader.preload(soup)
+        return soup, preloader
+
+    def test_stylesheets_are_inlined_and_references_made_local(self):
+        soup, preloader = self._preload()
+        self.assertIsNone(soup.find("link"))
+        css = soup.style.string
+        self.assertNotIn("@charset", css)
+        self.assertIn("@media print {\n@font-face { src: url(\"file://", css)
+        urls = re.findall(r'url\("([^"]+)"\)', css)
+        self.assertEqual([url.startswith("file://") for url in urls], [True, True, False])
+        self.assertEqual(urls[-1], f"{self.remote}/css/missing.png")
+        srcs = [img["src"] for img in soup.find_all("img")]
+        self.assertEqual(Path(srcs[0][len("file://"):]).read_bytes(), b"logo")
+        self.assertEqual(srcs[1], Path(self.dir, "images", "local.png").resolve().as_uri())
+        self.assertEqual(srcs[2], "images/gone.png")
+        self.assertIn("file://", soup.p["style"])
+        self.assertEqual(preloader.unresolved, [f"{self.remote}/css/missing.png",
+                                                Path(self.dir, "images", "gone.png").as_uri()])
+
+    def test_offline_preload_uses_only_the_cache(self):
+        self._preload()
+        _StylesheetHandler.hits.clear()
+        soup, preloader = self._preload(offline=True)
+        self.assertEqual(len(_StylesheetHandler.hits), 0)
+        self.assertIsNone(soup.find("link"))
+        self.assertEqual(len(preloader.unresolved), 2)
+
+    def test_converter_defaults_to_the_caches_of_the_html_stage(self):
+        Path(self.tmp.name, ".git").mkdir()
+        Path(self.dir, "spec.html").write_text(self.page, encoding="utf-8")
+        with patch.dict(os.environ):
+            os.environ.pop("ASSET_CACHE_DIR", None)
+            os.environ.pop("BUILD_CACHE_DIR", None)
+            converter = PDFConverter(str(self.dir / "spec.html"), str(self.dir / "spec.pdf"))
+        self.assertEqual(converter.asset_cache.root, self.cache_dir)
+        self.assertEqual(converter.build_cache_dir, os.path.join(self.tmp.name, ".build-cache"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import datetime
+import hashlib
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import stage_manifest  # noqa: E402
+import zip_package  # noqa: E402
+
+
+class TestStageManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.stage = Path(self.tmp.name, "csaf", "v2.1", "csd01")
+        (self.stage / "schemas").mkdir(parents=True)
+        (self.stage / "csaf-v2.1-csd01.html").write_text(
+            "<html><head><title>Common Security Advisory Framework Version 2.1</title></head>"
+            "<body><p>spec</p></body></html>", encoding="utf-8")
+        (self.stage / "csaf-v2.1-csd01.pdf").write_bytes(b"%PDF-1.4 " * 1000)
+        (self.stage / "schemas" / "Aggregator.json").write_text("{}", encoding="utf-8")
+        zip_package.package_stage(str(self.stage), datetime.date(2024, 10, 10))
+        self.cache = stage_manifest.DigestCache(str(Path(self.tmp.name, "cache", "file-digests.json")))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_manifest_lists_package_and_digests(self):
+        self.assertTrue(stage_manifest.write_manifest(str(self.stage), self.cache, sha256=True, sizes=True,
+                                                      repo_dir=self.tmp.name))
+        manifest = self.stage / "csaf-v2.1-csd01-manifest.txt"
+        text = manifest.read_text(encoding="utf-8")
+        self.assertTrue(text.startswith("Work Product Manifest File\n"))
+        self.assertIn("Archive:  csaf-v2.1-csd01.zip\n", text)
+        self.assertIn("     111  Defl:N       93  16% 10-10-2024 17:00 e2bdb6f4  csaf-v2.1-csd01.html\n", text)
+        self.assertIn("Manifest URI: https://docs.oasis-open.org/csaf/csaf/v2.1/csd01/csaf-v2.1-csd01-manifest.txt",
+                      text)
+
+        sha256 = text.split("SHA-256 digest/hash values")[1].split("\n\n", 1)[1].splitlines()
+        names = [line.split()[-1] for line in sha256]
+        self.assertEqual(names, ["csaf-v2.1-csd01.html", "csaf-v2.1-csd01.pdf", "csaf-v2.1-csd01.zip",
+                                 "schemas/Aggregator.json"])
+        digest, size, _ = sha256[1].split()
+        pdf = (self.stage / "csaf-v2.1-csd01.pdf").read_bytes()
+        self.assertEqual(digest, hashlib.sha256(pdf).hexdigest())
+        self.assertEqual(int(size), len(pdf))
+        self.assertEqual(stage_manifest.hash_file(str(self.stage / "csaf-v2.1-csd01.pdf"), ["md5"]),
+                         {"md5": hashlib.md5(pdf).hexdigest()})
+
+    def test_unchanged_files_are_not_hashed_again(self):
+        stage_manifest.write_manifest(str(self.stage), self.cache)
+        self.cache.save()
+        manifest = self.stage / "csaf-v2.1-csd01-manifest.txt"
+        # Hand edits of the header survive regeneration.
+        text = manifest.read_text(encoding="utf-8").replace("Work Product Manifest File", "Edited header")
+        manifest.write_text(text, encoding="utf-8")
+
+        cache = stage_manifest.DigestCache(self.cache.path)
+        self.assertFalse(stage_manifest.write_manifest(str(self.stage), cache, jobs=2))
+        self.assertEqual(cache.stats, {"cached": 4, "hashed": 0})
+
+        (self.stage / "schemas" / "Aggregator.json").write_text('{"a": 1}', encoding="utf-8")
+        self.assertTrue(stage_manifest.write_manifest(str(self.stage), cache))
+        self.assertEqual(cache.stats["hashed"], 1)
+        self.assertTrue(manifest.read_text(encoding="utf-8").startswith("Edited header\n"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import datetime
+import os
+import sys
+import tempfile
+import unittest
+import zipfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import zip_package  # noqa: E402
+
+
+class TestZipPackage(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.stage = Path(self.tmp.name, "csaf", "v2.1", "csd01")
+        (self.stage / "images").mkdir(parents=True)
+        (self.stage / "csaf-v2.1-csd01.html").write_text("<p>spec</p>" * 1000, encoding="utf-8")
+        (self.stage / "csaf-v2.1-csd01.pdf").write_bytes(b"%PDF-1.4 " * 1000)
+        (self.stage / "images" / "logo.png").write_bytes(b"\x89PNG" * 10)
+        (self.stage / "old-package.zip").write_bytes(b"PK")
+        (self.stage / ".DS_Store").write_bytes(b"x")
+        self.date = datetime.date(2024, 10, 10)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_archive_is_reproducible(self):
+        first = zip_package.package_stage(str(self.stage), self.date, jobs=4)
+        self.assertEqual(first["path"], str(self.stage / "csaf-v2.1-csd01.zip"))
+        data = Path(first["path"]).read_bytes()
+        os.utime(self.stage / "csaf-v2.1-csd01.html", (0, 0))
+        zip_package.package_stage(str(self.stage), self.date, jobs=1, force=True)
+        self.assertEqual(Path(first["path"]).read_bytes(), data)
+
+        with zipfile.ZipFile(first["path"]) as zf:
+            self.assertIsNone(zf.testzip())
+            infos = {info.filename: info for info in zf.infolist()}
+        self.assertEqual(list(infos), ["csaf-v2.1-csd01.html", "csaf-v2.1-csd01.pdf", "images/", "images/logo.png"])
+        self.assertEqual(infos["csaf-v2.1-csd01.html"].compress_type, zipfile.ZIP_DEFLATED)
+        self.assertEqual(infos["csaf-v2.1-csd01.pdf"].compress_type, zipfile.ZIP_STORED)
+        self.assertEqual({info.date_time for info in infos.values()}, {(2024, 10, 10, 17, 0, 0)})
+
+    def test_unchanged_content_is_not_repackaged(self):
+        zip_package.package_stage(str(self.stage), self.date)
+        self.assertTrue(zip_package.package_stage(str(self.stage), self.date)["skipped"])
+        (self.stage / "csaf-v2.1-csd01.html").write_text("<p>changed</p>", encoding="utf-8")
+        self.assertFalse(zip_package.package_stage(str(self.stage), self.date)["skipped"])
+        self.assertFalse(zip_package.package_stage(str(self.stage), datetime.date(2024, 10, 11))["skipped"])
+
+
+if __name__ == "__main__":
+    unittest.main()
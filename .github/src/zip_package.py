@@ -0,0 +1,240 @@
+"""
+Reproducible ZIP package of a specification stage directory.
+
+Step 3 of the workflow zips a stage (e.g. ``csaf/v2.1/csd01``) into
+``<spec>-<version>-<stage>.zip`` inside that directory. :func:`package_stage`
+builds the archive so that the same files always give the same bytes:
+
+- entries are sorted by path; every entry gets the modification date of the
+  package (17:00 on ``--date``, as the workflow stamped it before) and fixed
+  permissions (0644, 0755 for executables and directories);
+- archives already in the directory (``*.zip``, the previous package
+  included), the stage's manifest (``*-manifest.txt``, which lists the
+  package) and hidden files are left out;
+- files are compressed in parallel by a thread pool (zlib releases the GIL).
+  Formats that are already compressed (PDF, PNG, JPEG, ZIP, ...) are stored
+  as they are, as is anything that deflate does not make smaller.
+
+The archive comment holds a digest of the entries' paths, modes and contents
+and of the package date. When the existing archive carries the digest of the
+current content, it is left untouched and nothing is compressed.
+
+    python3 .github/src/zip_package.py csaf/v2.1/csd01 --date 2024-10-10
+"""
+
+from __future__ import annotations
+
+import argparse
+import datetime
+import hashlib
+import logging
+import os
+import stat
+import struct
+import sys
+import tempfile
+import time
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+from build_manifest import file_digest
+
+logger = logging.getLogger(__name__)
+
+# Extensions stored without compression: deflate gains (almost) nothing on them.
+STORED_EXTENSIONS = {".pdf", ".png", ".jpg", ".jpeg", ".gif", ".webp", ".zip", ".gz", ".bz2", ".xz",
+                     ".7z", ".woff", ".woff2", ".mp4"}
+
+DEFLATE_LEVEL = 9
+
+# Part of the content digest; bump when the archive layout changes.
+FORMAT_VERSION = "2"
+_DIGEST_PREFIX = b"content-sha256:"
+
+# The Work Product manifest of a stage (see stage_manifest) is published next to the package, not in it.
+MANIFEST_SUFFIX = "-manifest.txt"
+
+# Time of day that the workflow has always stamped on packaged files.
+PACKAGE_TIME = datetime.time(17, 0)
+
+
+def package_name(stage_dir: str) -> str:
+    """``<spec>-<version>-<stage>.zip`` for ``<spec>/<version>/<stage>``, as the workflow names it."""
+    stage = os.path.abspath(stage_dir)
+    version = os.path.dirname(stage)
+    return "%s-%s-%s.zip" % (os.path.basename(os.path.dirname(version)), os.path.basename(version),
+                             os.path.basename(stage))
+
+
+def collect_entries(stage_dir: str) -> List[Tuple[str, str, int]]:
+    """Sorted ``(archive name, path, mode)`` of the directories and files to package."""
+    entries = []
+    for dirpath, dirnames, filenames in os.walk(stage_dir):
+        dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+        rel = os.path.relpath(dirpath, stage_dir)
+        prefix = "" if rel == "." else rel.replace(os.sep, "/") + "/"
+        if prefix:
+            entries.append((prefix, dirpath, 0o40755))
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            if (name.startswith(".") or name.lower().endswith(".zip") or name.endswith(MANIFEST_SUFFIX)
+                    or not os.path.isfile(path)):
+                continue
+            executable = os.stat(path).st_mode & 0o111
+            entries.append((prefix + name, path, 0o100755 if executable else 0o100644))
+    return sorted(entries)
+
+
+def content_digest(entries: List[Tuple[str, str, int]], date: datetime.date, jobs: Optional[int] = None) -> str:
+    """Digest of the entries' names, modes and contents and of the package date."""
+    files = [path for name, path, _ in entries if not name.endswith("/")]
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        digests = dict(zip(files, pool.map(file_digest, files)))
+    h = hashlib.sha256(("%s\0%s\0" % (FORMAT_VERSION, date.isoformat())).encode("ascii"))
+    for name, path, mode in entries:
+        h.update(("%s\0%o\0%s\0" % (name, mode, digests.get(path, ""))).encode("utf-8"))
+    return h.hexdigest()
+
+
+def recorded_digest(zip_path: str) -> Optional[str]:
+    """The content digest in the comment of the archive at ``zip_path``, if it has one."""
+    try:
+        with zipfile.ZipFile(zip_path) as zf:
+            comment = zf.comment
+    except (OSError, zipfile.BadZipFile):
+        return None
+    if comment.startswith(_DIGEST_PREFIX):
+        return comment[len(_DIGEST_PREFIX):].decode("ascii", "replace")
+    return None
+
+
+def _compress(name: str, path: str) -> Tuple[int, int, bytes, int]:
+    """``(method, crc32, data, uncompressed size)`` of one file."""
+    with open(path, "rb") as f:
+        raw = f.read()
+    crc = zlib.crc32(raw)
+    if os.path.splitext(name)[1].lower() not in STORED_EXTENSIONS and raw:
+        compressor = zlib.compressobj(DEFLATE_LEVEL, zlib.DEFLATED, -15)
+        deflated = compressor.compress(raw) + compressor.flush()
+        if len(deflated) < len(raw):
+            return zipfile.ZIP_DEFLATED, crc, deflated, len(raw)
+    return zipfile.ZIP_STORED, crc, raw, len(raw)
+
+
+def _dos_datetime(date: datetime.date) -> Tuple[int, int]:
+    return ((PACKAGE_TIME.hour << 11) | (PACKAGE_TIME.minute << 5),
+            ((date.year - 1980) << 9) | (date.month << 5) | date.day)
+
+
+def write_zip(out, entries: List[Tuple[str, str, int]], date: datetime.date, comment: bytes,
+              jobs: Optional[int] = None) -> dict:
+    """
+    Write the archive of ``entries`` to the binary file ``out``; files are
+    compressed by ``jobs`` threads and written in entry order.
+
+    Returns the number of entries and the uncompressed and compressed sizes.
+    """
+    dos_time, dos_date = _dos_datetime(date)
+    central = []
+    offset = 0
+    stats = {"entries": len(entries), "stored": 0, "deflated": 0, "bytes_in": 0, "bytes_out": 0}
+
+    def work(entry):
+        name, path, _ = entry
+        return (zipfile.ZIP_STORED, 0, b"", 0) if name.endswith("/") else _compress(name, path)
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        for (name, _, mode), (method, crc, data, size) in zip(entries, pool.map(work, entries)):
+            encoded = name.encode("utf-8")
+            flags = 0 if encoded.isascii() else 0x800  # UTF-8 file name
+            if len(data) > 0xFFFFFFFF or size > 0xFFFFFFFF or offset > 0xFFFFFFFF:
+                raise ValueError("%s: ZIP64 archives are not supported" % name)
+            out.write(struct.pack("<IHHHHHIIIHH", 0x04034B50, 20, flags, method, dos_time, dos_date,
+                                  crc, len(data), size, len(encoded), 0))
+            out.write(encoded)
+            out.write(data)
+            external = (mode << 16) | (0x10 if stat.S_ISDIR(mode) else 0)
+            central.append(struct.pack("<IHHHHHHIIIHHHHHII", 0x02014B50, (3 << 8) | 20, 20, flags, method,
+                                       dos_time, dos_date, crc, len(data), size, len(encoded), 0, 0, 0, 0,
+                                       external, offset) + encoded)
+            offset += 30 + len(encoded) + len(data)
+            if not name.endswith("/"):
+                stats["stored" if method == zipfile.ZIP_STORED else "deflated"] += 1
+                stats["bytes_in"] += size
+                stats["bytes_out"] += len(data)
+
+    if len(central) > 0xFFFF:
+        raise ValueError("more than 65535 entries: ZIP64 archives are not supported")
+    directory = b"".join(central)
+    out.write(directory)
+    out.write(struct.pack("<IHHHHIIH", 0x06054B50, 0, 0, len(central), len(central), len(directory), offset,
+                          len(comment)))
+    out.write(comment)
+    return stats
+
+
+def package_stage(stage_dir: str, date: datetime.date, zip_path: Optional[str] = None,
+                  jobs: Optional[int] = None, force: bool = False) -> dict:
+    """
+    Write the package of ``stage_dir`` unless the existing one is current; see
+    the module docstring.
+
+    ``zip_path`` defaults to :func:`package_name` inside the stage. Returns a
+    report with ``"path"``, ``"skipped"`` and, when written, the statistics of
+    :func:`write_zip`.
+    """
+    zip_path = zip_path or os.path.join(stage_dir, package_name(stage_dir))
+    entries = collect_entries(stage_dir)
+    digest = content_digest(entries, date, jobs)
+    report = {"path": zip_path, "digest": digest, "entries": len(entries), "skipped": False}
+    if not force and recorded_digest(zip_path) == digest:
+        logger.info("%s is up to date", zip_path)
+        report["skipped"] = True
+        return report
+
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(zip_path)), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            report.update(write_zip(out, entries, date, _DIGEST_PREFIX + digest.encode("ascii"), jobs))
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, zip_path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    stamp = datetime.datetime.combine(date, PACKAGE_TIME).timestamp()
+    os.utime(zip_path, (stamp, stamp))
+    logger.info("Wrote %s: %d entries, %s -> %s bytes", zip_path, report["entries"],
+                "{:,}".format(report["bytes_in"]), "{:,}".format(report["bytes_out"]))
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Create the reproducible ZIP package of a stage directory")
+    parser.add_argument("stage_dir", help="Stage directory, e.g. csaf/v2.1/csd01")
+    parser.add_argument("--date", required=True, type=datetime.date.fromisoformat,
+                        help="Modification date of the packaged files, yyyy-mm-dd")
+    parser.add_argument("-o", "--output", help="Archive path (default: <spec>-<version>-<stage>.zip in the stage)")
+    parser.add_argument("--jobs", type=int, default=None, help="Compression threads (default: CPU count)")
+    parser.add_argument("--force", action="store_true", help="Rewrite the archive even if its content is current")
+    args = parser.parse_args()
+    if not os.path.isdir(args.stage_dir):
+        parser.error("not a directory: %s" % args.stage_dir)
+
+    started = time.perf_counter()
+    report = package_stage(args.stage_dir, args.date, args.output, args.jobs or os.cpu_count(), args.force)
+    if report["skipped"]:
+        print("%s is up to date (%d entries)" % (report["path"], report["entries"]))
+    else:
+        print("%s: %d entries (%d deflated, %d stored), %s -> %s bytes in %.1fs" % (
+            report["path"], report["entries"], report["deflated"], report["stored"],
+            "{:,}".format(report["bytes_in"]), "{:,}".format(report["bytes_out"]),
+            time.perf_counter() - started))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s",
+                        stream=sys.stderr)
+    main()